@@ -1,22 +1,41 @@
+import os
+import time
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
 from pint import UnitRegistry
+from eeu_loader import eeu_loader
 ureg = UnitRegistry()
 
+##Conversions of whole tables are planned once per table from column_metadata and applied as numpy multiplies over column blocks.
+##The column lists are kept for COLUMN_METADATA_CACHE_TTL seconds per supabase client.
+
+COLUMN_METADATA_CACHE_TTL = float(os.getenv('COLUMN_METADATA_CACHE_TTL', '600'))
+
+MBTU_TO_KWH = 293.071
+SF_TO_M2 = 0.092903
+KBTU_PER_FT2_TO_KWH_PER_M2 = 0.293071 / 0.092903
+MBTU_TO_GJ = 1.0550558526
+GJ_TO_MBTU_DF = 0.9478171203
+
 
 def convert_kbtu_per_ft2_to_kwh_per_m2(value):
-    return value * (0.293071 / 0.092903)
+    return value * KBTU_PER_FT2_TO_KWH_PER_M2
 
 def convert_mbtu_to_kwh(value):
     #convert mbtu to kwh
-    return value * 293.071
+    return value * MBTU_TO_KWH
 
 def convert_sf_to_m2(value):
-    return value * 0.092903
+    return value * SF_TO_M2
 
 def convert_gj_to_mbtu(value):
     return value * 0.947817
 
 def convert_mbtu_to_gj(value):
-    return value * 1.0550558526
+    return value * MBTU_TO_GJ
 
 def convert_mbtu_to_kbtu(value):
     #convert mbtu to kbtu
@@ -28,12 +47,9 @@ def check_units_eeu_field(eeu_id,supabase,value,current_units=None):
         energy_units = current_units
         print(f"Using current display units: {energy_units}, input value: {value}")
     else:
-        query = supabase.table('eeu_data')\
-                        .select('energy_units')\
-                        .eq('id', eeu_id)
-        data, count = query.execute()
-        if data[1]:
-            energy_units = data[1][0]['energy_units']
+        row = eeu_loader(supabase).load(eeu_id, ['energy_units'])
+        if row:
+            energy_units = row['energy_units']
             print(f"Using project stored units: {energy_units}, input value: {value}")
         else:
             # Fallback if no energy units found
@@ -90,57 +106,119 @@ def get_columns_for_conversion(table_name,supabase):
 
 
 
+class UnitConverter:
+    """
+    Converts table data between unit systems using the column lists from column_metadata
+
+    Each conversion is a list of (columns, multiplier, divisor) blocks applied in order, the same order
+    the per-record conversions used, so a column listed under several unit types converts the same way.
+
+    Args:
+        client: supabase client used to read column_metadata
+        ttl: seconds before a table's column lists are read again
+    """
+
+    def __init__(self, client, ttl=COLUMN_METADATA_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def columns(self, table_name):
+        """(eui_list, energy_list, area_list) of a table, empty lists when it has no converted columns"""
+        cached = self._columns.get(table_name)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        with self._lock:
+            cached = self._columns.get(table_name)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+            columns = get_columns_for_conversion(table_name, self.client) or ([], [], [])
+            self._columns[table_name] = (time.monotonic(), columns)
+            return columns
+
+    def invalidate(self):
+        with self._lock:
+            self._columns.clear()
+
+    def plan(self, table_name, conversion_type=None, conditioned_area_value=None):
+        """Blocks for convert_units_in_table"""
+        eui_list, energy_list, area_list = self.columns(table_name)
+        if conversion_type == 'mbtu_to_kbtu/sf':
+            return [(eui_list, 1000, conditioned_area_value)]
+        return [(energy_list, MBTU_TO_KWH, None),
+                (area_list, SF_TO_M2, None),
+                (eui_list, KBTU_PER_FT2_TO_KWH_PER_M2, None)]
+
+    @staticmethod
+    def _apply(values, multiplier, divisor):
+        values = values * multiplier
+        if divisor is not None:
+            values = values / divisor
+        return values
+
+    def convert_records(self, records, blocks):
+        """Converts list-of-dict rows in place, column block by column block. None and missing fields are left alone"""
+        for columns, multiplier, divisor in blocks:
+            columns = list(dict.fromkeys(columns))
+            if not columns or not records:
+                continue
+            cells = [[record.get(column) for column in columns] for record in records]
+            present = np.array([[column in record and value is not None for column, value in zip(columns, row)]
+                                for record, row in zip(records, cells)], dtype=bool)
+            if not present.any():
+                continue
+            values = np.array([[value if value is not None else np.nan for value in row] for row in cells], dtype=float)
+            converted = self._apply(values, multiplier, divisor).tolist()
+            for record, row, mask in zip(records, converted, present.tolist()):
+                for column, value, has_value in zip(columns, row, mask):
+                    if has_value:
+                        record[column] = value
+        return records
+
+    def convert_frame(self, df, table_name, multiplier, divisor=None):
+        """Converts the energy columns of a DataFrame in place with one multiply over the block"""
+        energy_list = set(self.columns(table_name)[1])
+        columns = [column for column in df.columns if column in energy_list]
+        if columns:
+            original = df[columns]
+            converted = self._apply(original.astype(float), multiplier, divisor)
+            # None cells of object columns stay None (null in JSON) as the per-cell conversion left them, not NaN
+            for column in columns:
+                if original[column].dtype == object and original[column].isna().any():
+                    converted[column] = converted[column].astype(object).where(pd.notna(original[column]), None)
+            df[columns] = converted
+        return df
+
+
+_converters = weakref.WeakKeyDictionary()
+_converters_lock = threading.Lock()
+
+
+def get_unit_converter(supabase):
+    """The UnitConverter of a supabase client, created on first use"""
+    with _converters_lock:
+        converter = _converters.get(supabase)
+        if converter is None:
+            converter = _converters[supabase] = UnitConverter(supabase)
+        return converter
+
+
 def convert_units_in_table(data,table_name,output_measurement_system,supabase,**kwargs):
     conversion_type = kwargs.get('conversion_type', None)
     conditioned_area_value = kwargs.get('conditioned_area_value', None)
 
-    eui_list, energy_list,area_list = get_columns_for_conversion(table_name,supabase)
-    
-    for record in data:
-        for field in energy_list:
-            if conversion_type != 'mbtu_to_kbtu/sf' and field in record and record[field] is not None :
-                record[field] = convert_mbtu_to_kwh(float(record[field]))
-        for field in area_list:
-            if field in record and record[field] is not None and conversion_type != 'mbtu_to_kbtu/sf':
-                record[field] = convert_sf_to_m2(float(record[field]))
-        for field in eui_list:
-            if field in record and record[field] is not None:
-                if conversion_type == 'mbtu_to_kbtu/sf':
-                    record[field] = float(record[field]) * 1000 / conditioned_area_value
-                else:
-                    record[field] = convert_kbtu_per_ft2_to_kwh_per_m2(float(record[field]))
-    return data
+    converter = get_unit_converter(supabase)
+    return converter.convert_records(data, converter.plan(table_name, conversion_type, conditioned_area_value))
 
 def convert_mbtu_to_kbtu_per_sf(df, use_type_total_area, supabase):
-    eui_list, energy_list, area_list = get_columns_for_conversion('eeu_data', supabase)
-    for column_label, series in df.items():
-        for field in energy_list:
-            if field == column_label:
-                df[column_label] = df[column_label].apply(lambda x: float(x) * 1000 / use_type_total_area if x is not None else x)
-    return df
+    return get_unit_converter(supabase).convert_frame(df, 'eeu_data', 1000, use_type_total_area)
 
 def convert_mbtu_to_kbtu_df(df, supabase):
-    eui_list, energy_list, area_list = get_columns_for_conversion('eeu_data', supabase)
-    for column_label, series in df.items():
-        for field in energy_list:
-            if field == column_label:
-                df[column_label] = df[column_label].apply(lambda x: float(x) * 1000 if x is not None else x)
-    return df
+    return get_unit_converter(supabase).convert_frame(df, 'eeu_data', 1000)
 
 def convert_mbtu_to_gj_df(df, supabase):
-    eui_list, energy_list, area_list = get_columns_for_conversion('eeu_data', supabase)
-    for column_label, series in df.items():
-        for field in energy_list:
-            if field == column_label:
-                df[column_label] = df[column_label].apply(lambda x: float(x) * 1.0550558526 if x is not None else x)
-    return df
+    return get_unit_converter(supabase).convert_frame(df, 'eeu_data', MBTU_TO_GJ)
 
 def convert_gj_to_mbtu(df,supabase,table_name):
-    eui_list, energy_list, area_list = get_columns_for_conversion(table_name,supabase)
-    for column_label, series in df.items():
-        for field in energy_list:
-            if field == column_label:
-                df[column_label] = df[column_label].apply(lambda x: float(x) * 0.9478171203 if x is not None else x)
-    return df
-
-
+    return get_unit_converter(supabase).convert_frame(df, table_name, GJ_TO_MBTU_DF)
@@ -0,0 +1,163 @@
+import threading
+import contextvars
+from contextlib import contextmanager
+from types import MappingProxyType
+
+from utils import supabase
+
+##Request-scoped loader of eeu_data rows
+##Consumers load rows by id with the columns they use. Loads select the union of every column asked for so far
+##(the columns of prime() calls included), and every consumer of an id gets the same read-only row for the rest of the request.
+##main.py opens one loader per HTTP request; outside a request eeu_loader() returns a new loader, so scripts and
+##upload jobs read the database as before. Code that writes to eeu_data calls forget() so later reads see the new values.
+
+# ids per in_() filter, keeps the request URL short
+EEU_LOADER_CHUNK_SIZE = 200
+ALL_COLUMNS = '*'
+
+_current_loader = contextvars.ContextVar('eeu_row_loader', default=None)
+
+
+def _id_key(eeu_id):
+    """Ids arrive as ints, numpy ints or strings; rows are kept by int id"""
+    try:
+        return int(eeu_id)
+    except (TypeError, ValueError):
+        return eeu_id
+
+
+def _column_set(columns):
+    """'*', a comma separated string or a list of columns -> ALL_COLUMNS or a frozenset"""
+    if columns is None or columns == ALL_COLUMNS:
+        return ALL_COLUMNS
+    if isinstance(columns, str):
+        columns = columns.split(',')
+    columns = frozenset(column.strip() for column in columns if column and column.strip())
+    return ALL_COLUMNS if ALL_COLUMNS in columns else columns
+
+
+def _union(first, second):
+    if first is None or second is None:
+        return second if first is None else first
+    if first == ALL_COLUMNS or second == ALL_COLUMNS:
+        return ALL_COLUMNS
+    return first | second
+
+
+def _covers(fetched, wanted):
+    if fetched is None:
+        return False
+    return fetched == ALL_COLUMNS or (wanted != ALL_COLUMNS and wanted <= fetched)
+
+
+class EEURowLoader:
+    """
+    Batches and dedupes eeu_data reads by id
+
+    Args:
+        client: supabase client, defaults to the app client
+        chunk_size: ids per in_() query
+    """
+
+    def __init__(self, client=None, chunk_size=EEU_LOADER_CHUNK_SIZE):
+        self.client = client if client is not None else supabase
+        self.chunk_size = chunk_size
+        self._rows = {}
+        # id -> columns already read (ALL_COLUMNS or a frozenset), also set for ids that have no row
+        self._fetched = {}
+        # id -> columns announced with prime() and not read yet
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.queries = 0
+
+    def prime(self, eeu_ids, columns=ALL_COLUMNS):
+        """Announce ids and columns that will be loaded, so the next load of any of the ids reads them as well"""
+        columns = _column_set(columns)
+        with self._lock:
+            for eeu_id in eeu_ids:
+                if eeu_id is not None:
+                    key = _id_key(eeu_id)
+                    self._pending[key] = _union(self._pending.get(key), columns)
+        return self
+
+    def load(self, eeu_id, columns=ALL_COLUMNS):
+        """The row of eeu_id with at least the given columns, None if there is no such row"""
+        if eeu_id is None:
+            return None
+        return self.load_many([eeu_id], columns).get(_id_key(eeu_id))
+
+    def load_many(self, eeu_ids, columns=ALL_COLUMNS):
+        """
+        Rows of the ids with at least the given columns
+
+        Returns:
+            dict: int id -> read-only row, ids without a row are left out
+        """
+        columns = _column_set(columns)
+        keys = list(dict.fromkeys(_id_key(eeu_id) for eeu_id in eeu_ids if eeu_id is not None))
+        with self._lock:
+            wanted = {}
+            for key in keys:
+                if not _covers(self._fetched.get(key), columns):
+                    wanted[key] = _union(_union(self._pending.pop(key, None), columns), self._fetched.get(key))
+            # primed ids are read along with the first load that has to query anyway
+            if wanted:
+                for key in list(self._pending):
+                    if key not in wanted:
+                        wanted[key] = _union(self._pending.pop(key), self._fetched.get(key))
+
+        if wanted:
+            self._read(wanted)
+
+        with self._lock:
+            return {key: self._rows[key] for key in keys if key in self._rows}
+
+    def _read(self, wanted):
+        # one select of the union of the columns wanted, so primed ids share the query of the load that triggered it
+        columns = None
+        for key_columns in wanted.values():
+            columns = _union(columns, key_columns)
+        select = ALL_COLUMNS if columns == ALL_COLUMNS else ','.join(sorted(columns | {'id'}))
+        keys = list(wanted)
+        for start in range(0, len(keys), self.chunk_size):
+            chunk = keys[start:start + self.chunk_size]
+            query = self.client.table('eeu_data').select(select)
+            query = query.eq('id', chunk[0]) if len(chunk) == 1 else query.in_('id', chunk)
+            data, count = query.execute()
+            self.queries += 1
+            rows = data[1] or []
+            with self._lock:
+                for row in rows:
+                    key = _id_key(row.get('id', chunk[0] if len(chunk) == 1 else None))
+                    merged = dict(self._rows.get(key) or {})
+                    merged.update(row)
+                    self._rows[key] = MappingProxyType(merged)
+                for key in chunk:
+                    self._fetched[key] = _union(self._fetched.get(key), columns)
+
+    def forget(self, eeu_id):
+        """Drop a row after writing to it, the next load reads it again"""
+        key = _id_key(eeu_id)
+        with self._lock:
+            self._rows.pop(key, None)
+            self._fetched.pop(key, None)
+
+
+def eeu_loader(client=None):
+    """The loader of the current request when it reads through client, otherwise a new loader"""
+    client = client if client is not None else supabase
+    loader = _current_loader.get()
+    if loader is not None and loader.client is client:
+        return loader
+    return EEURowLoader(client)
+
+
+@contextmanager
+def eeu_loader_scope(client=None):
+    """Makes one loader current for the code run inside the block, e.g. one HTTP request"""
+    loader = EEURowLoader(client)
+    token = _current_loader.set(loader)
+    try:
+        yield loader
+    finally:
+        _current_loader.reset(token)
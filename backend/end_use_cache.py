@@ -0,0 +1,113 @@
+import os
+import copy
+import threading
+
+import pandas as pd
+from cachetools import TTLCache
+
+##Cache of computed energy end-use pivots, keyed by (project_id, baseline_design, output_units)
+##Results are stored as plain lists/dicts and rebuilt into fresh DataFrames on every hit, so callers may modify what they get back.
+##The write paths invalidate by project or by eeu_id; END_USE_CACHE_TTL bounds staleness from writes made by other instances.
+
+END_USE_CACHE_TTL = float(os.getenv('END_USE_CACHE_TTL', '60'))
+END_USE_CACHE_SIZE = int(os.getenv('END_USE_CACHE_SIZE', '256'))
+
+
+def _freeze_frame(df):
+    return {
+        'index': df.index.tolist(),
+        'index_name': df.index.name,
+        'columns': df.columns.tolist(),
+        'columns_name': df.columns.name,
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+        'data': copy.deepcopy(df.values.tolist()),
+    }
+
+
+def _thaw_frame(frozen):
+    df = pd.DataFrame(copy.deepcopy(frozen['data']),
+                      index=pd.Index(frozen['index'], name=frozen['index_name']),
+                      columns=pd.Index(frozen['columns'], name=frozen['columns_name']))
+    if frozen['columns']:
+        df = df.astype(dict(zip(frozen['columns'], frozen['dtypes'])))
+    return df
+
+
+def freeze_result(result):
+    """Copy of a get_energy_end_uses_data result with every DataFrame replaced by plain data"""
+    return {key: ('frame', _freeze_frame(value)) if isinstance(value, pd.DataFrame) else ('value', copy.deepcopy(value))
+            for key, value in result.items()}
+
+
+def thaw_result(frozen):
+    return {key: _thaw_frame(value) if kind == 'frame' else copy.deepcopy(value)
+            for key, (kind, value) in frozen.items()}
+
+
+class EndUseCache:
+    """
+    TTL/LRU cache of end-use results with hit/miss counters
+
+    Args:
+        ttl: seconds an entry is served before it is recomputed
+        maxsize: entries kept, least recently used are dropped first
+    """
+
+    def __init__(self, ttl=END_USE_CACHE_TTL, maxsize=END_USE_CACHE_SIZE):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, project_id, baseline_design, output_units):
+        """A fresh copy of the cached result, or None"""
+        with self._lock:
+            entry = self._entries.get((str(project_id), baseline_design, output_units))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return thaw_result(entry['result'])
+
+    def set(self, project_id, baseline_design, output_units, result):
+        entry = {'eeu_id': result.get('eeu_id'), 'result': freeze_result(result)}
+        with self._lock:
+            self._entries[(str(project_id), baseline_design, output_units)] = entry
+
+    def _drop(self, matches):
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if matches(key, entry)]
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def invalidate_project(self, project_id):
+        """Drop every cached result of a project. Returns the number of entries dropped"""
+        project_id = str(project_id)
+        return self._drop(lambda key, entry: key[0] == project_id)
+
+    def invalidate_eeu(self, eeu_id):
+        """Drop the results computed from an eeu_data row, for writes that only know the row id"""
+        if eeu_id is None:
+            return 0
+        eeu_id = str(eeu_id)
+        return self._drop(lambda key, entry: str(entry['eeu_id']) == eeu_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self._entries.maxsize,
+                'ttl': self._entries.ttl,
+            }
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+
+import logging_start
+
+##In-process cache of the enum_* lookup tables
+##All tables are loaded together with the get_enum_tables() database function (one round-trip) and kept for ENUM_CACHE_TTL seconds.
+##Lookups by id or name are dictionary hits; call invalidate() after changing an enum table from this process.
+
+ENUM_CACHE_TTL = float(os.getenv('ENUM_CACHE_TTL', '600'))
+
+
+def _id_key(value):
+    """Ids arrive as ints from the API and as strings from event_history, normalize both to int"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return None
+
+
+class EnumTable:
+    """Rows of one enum table, in 'order', indexed by id and by name"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_id = {_id_key(row.get('id')): row for row in rows}
+        self.by_name = {row.get('name'): row for row in rows}
+        self.name_set = frozenset(row['name'] for row in rows if row.get('name'))
+
+
+class EnumCache:
+    """
+    Loads every enum table in one round-trip and serves id/name lookups from memory
+
+    Args:
+        client: supabase client
+        list_names: enum list names (the table name without the enum_ prefix)
+        ttl: seconds before the tables are loaded again, 0 reloads on every lookup
+    """
+
+    def __init__(self, client, list_names, ttl=ENUM_CACHE_TTL):
+        self.client = client
+        self.list_names = list(list_names)
+        self.ttl = ttl
+        self._tables = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        try:
+            response = self.client.rpc('get_enum_tables').execute()
+            if isinstance(response.data, dict):
+                return {name: response.data.get(name) or [] for name in self.list_names}
+            logging_start.logger.warning(f"get_enum_tables returned {type(response.data).__name__}, loading enum tables one by one")
+        except Exception as e:
+            logging_start.logger.warning(f"get_enum_tables failed, loading enum tables one by one: {str(e)}")
+        #fallback for databases without the function
+        return {name: self.client.table('enum_' + name).select('*').order('order').execute().data or []
+                for name in self.list_names}
+
+    def _get_tables(self):
+        tables = self._tables
+        if tables is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return tables
+        with self._lock:
+            #another thread may have reloaded while this one waited for the lock
+            if self._tables is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._tables
+            try:
+                fetched = self._fetch()
+            except Exception as e:
+                if self._tables is None:
+                    raise
+                #keep serving the previous tables rather than failing every lookup
+                logging_start.logger.error(f"Error reloading enum tables, using cached values: {str(e)}")
+                self._loaded_at = time.monotonic()
+                return self._tables
+            self._tables = {name: EnumTable(rows) for name, rows in fetched.items()}
+            self._loaded_at = time.monotonic()
+            return self._tables
+
+    def _table(self, list_name):
+        if list_name not in self.list_names:
+            return None
+        return self._get_tables().get(list_name)
+
+    def invalidate(self):
+        """Drop the cached tables so the next lookup reloads them"""
+        with self._lock:
+            self._tables = None
+            self._loaded_at = 0.0
+
+    def rows(self, list_name):
+        """All rows of an enum table in 'order'. Returns copies, so callers may modify them"""
+        table = self._table(list_name)
+        return [dict(row) for row in table.rows] if table else []
+
+    def names(self, list_name):
+        table = self._table(list_name)
+        return [row['name'] for row in table.rows if row.get('name')] if table else []
+
+    def name_set(self, list_name):
+        """The names of an enum table as a set, for membership checks of many values"""
+        table = self._table(list_name)
+        return table.name_set if table else frozenset()
+
+    def row_by_id(self, list_name, enum_id):
+        table = self._table(list_name)
+        row = table.by_id.get(_id_key(enum_id)) if table else None
+        return dict(row) if row else None
+
+    def row_by_name(self, list_name, name):
+        table = self._table(list_name)
+        row = table.by_name.get(name) if table else None
+        return dict(row) if row else None
+
+    def name_for_id(self, list_name, enum_id):
+        """Name of the enum with this id, None if the list or id is unknown"""
+        table = self._table(list_name)
+        row = table.by_id.get(_id_key(enum_id)) if table else None
+        return row.get('name') if row else None
+
+    def id_for_name(self, list_name, name):
+        """Id of the enum with this name, None if the list or name is unknown"""
+        table = self._table(list_name)
+        row = table.by_name.get(name) if table else None
+        return row.get('id') if row else None
@@ -2,6 +2,9 @@ import requests
 import sys
 import os
 import json
+import hashlib
+import threading
+from requests.adapters import HTTPAdapter
 from cryptography.fernet import Fernet
 import base64
 from cryptography.hazmat.primitives import hashes
@@ -14,10 +17,30 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import logging_start
 import models
 from project_details import get_latest_eeu_data, get_uploads_for_project, get_upload_data, get_project_energy_summary_data
-from utils import return_enum_vals, supabase
+from utils import enum_cache, supabase
 ddx_api_base_url = os.getenv("DDX_API_BASE_URL")
 from weather_location import get_location_data
 
+# connections to the DDX API kept open for reuse, shared by every export on this instance
+DDX_POOL_SIZE = int(os.getenv('DDX_POOL_SIZE', '8'))
+# seconds a single DDX API call may take
+DDX_REQUEST_TIMEOUT = float(os.getenv('DDX_REQUEST_TIMEOUT', '60'))
+
+_session = None
+_session_lock = threading.Lock()
+
+def ddx_session():
+    """requests session with a pool of DDX_POOL_SIZE connections, created on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DDX_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
 def authenticate(firm_key,user_key):
     url = f"{ddx_api_base_url}/api/v1/authenticate"
     headers = {
@@ -27,18 +50,26 @@ def authenticate(firm_key,user_key):
         "firm_key": firm_key,
         "user_key": user_key
     }
-    response = requests.post(url, json=data, headers=headers)
+    response = ddx_session().post(url, json=data, headers=headers, timeout=DDX_REQUEST_TIMEOUT)
     return response.json()
 
-def import_project(project: models.DDXImportProject):
+def idempotency_key(project_id, outbound_request):
+    """Same key for the same project and payload, recorded in integrations_sync with every attempt"""
+    digest = hashlib.sha256(json.dumps(outbound_request, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{project_id}:{digest[:32]}"
+
+def import_project(project: models.DDXImportProject, idempotency_key: str = None):
     url = f"{ddx_api_base_url}/api/v1/import_project"
     headers = {
         'Content-Type': 'application/json'
     }
+    # the same key is sent with every retry of one export so DDX can drop duplicates
+    if idempotency_key:
+        headers['Idempotency-Key'] = idempotency_key
     data = project.model_dump()
 
 
-    response = requests.post(url, json=data, headers=headers)
+    response = ddx_session().post(url, json=data, headers=headers, timeout=DDX_REQUEST_TIMEOUT)
 
 
 
@@ -81,7 +112,41 @@ def get_ddx_value_by_id(ddx_id: int, ddx_table: str, value_column: str) -> str |
     except Exception as e:
         return None
 
-def get_ddx_mapping_from_enum_id(enum_table: str, enum_id: int, ddx_id_column: str, ddx_table: str, ddx_value_column: str) -> str | None:
+class DDXMappings:
+    """Rows of the DDX lookup tables by id, read once so a batch export does not query them per project"""
+
+    TABLES = ['ddx_use_types', 'ddx_phase_types', 'ddx_energy_codes']
+
+    def __init__(self, tables: dict):
+        # table name -> {id: row}
+        self.tables = tables
+
+    @classmethod
+    def load(cls):
+        tables = {}
+        for table in cls.TABLES:
+            data, count = supabase.table(table).select('*').execute()
+            tables[table] = {row['id']: row for row in data[1]}
+        return cls(tables)
+
+    def value(self, ddx_id: int, ddx_table: str, value_column: str) -> str | None:
+        """Same result as get_ddx_value_by_id"""
+        if not ddx_id:
+            return None
+        row = self.tables.get(ddx_table, {}).get(ddx_id)
+        return row.get(value_column) if row else None
+
+    def baseline_eui(self, use_type_id: int) -> float:
+        """Same result as calculate_baseline_eui"""
+        try:
+            enum_row = enum_cache.row_by_id('project_use_types', use_type_id)
+            ddx_use_type = self.tables['ddx_use_types'][enum_row['ddx_use_type_id']]
+            return round(ddx_use_type.get('baseline_eui', 0))
+        except Exception as e:
+            return 0
+
+def get_ddx_mapping_from_enum_id(enum_table: str, enum_id: int, ddx_id_column: str, ddx_table: str, ddx_value_column: str,
+                                 mappings: DDXMappings = None) -> str | None:
     """Get DDX value by first getting the DDX ID from an enum table, then looking up the value.
     
     Args:
@@ -90,6 +155,7 @@ def get_ddx_mapping_from_enum_id(enum_table: str, enum_id: int, ddx_id_column: s
         ddx_id_column: The column name containing the DDX table ID (e.g., 'ddx_use_type_id')
         ddx_table: The DDX table name (e.g., 'ddx_use_types')
         ddx_value_column: The column with the DDX value (e.g., 'ddx_use_type')
+        mappings: prefetched DDX tables to read the value from instead of the database
         
     Returns:
         The DDX value or None if not found
@@ -99,20 +165,17 @@ def get_ddx_mapping_from_enum_id(enum_table: str, enum_id: int, ddx_id_column: s
         
     try:
         
-        # First get the DDX ID from the enum table
-        query = supabase.table(enum_table)\
-            .select(ddx_id_column)\
-            .eq('id', enum_id)\
-            .single()
-        data, count = query.execute()
-        
+        # First get the DDX ID from the cached enum row
+        enum_row = enum_cache.row_by_id(enum_table.removeprefix('enum_'), enum_id)
         
-        if not data[1] or not data[1].get(ddx_id_column):
+        if not enum_row or not enum_row.get(ddx_id_column):
             return None
             
-        ddx_id = data[1][ddx_id_column]
+        ddx_id = enum_row[ddx_id_column]
         
         # Then get the DDX value using the DDX ID
+        if mappings is not None:
+            return mappings.value(ddx_id, ddx_table, ddx_value_column)
         ddx_value = get_ddx_value_by_id(ddx_id, ddx_table, ddx_value_column)
         
         return ddx_value
@@ -125,23 +188,19 @@ def map_enum_to_ddx_value(value, enum_list_name, ddx_field_name, **kwargs):
     
     # Special handling for project phases
     if enum_list_name == 'project_phases':
-        # Query to get the phase with its DDX type
-        query = supabase.table('enum_project_phases')\
-            .select('*, ddx_phase_types(ddx_phase_type)')\
-            .eq('name', value)\
-            .single()
-        try:
-            data, count = query.execute()
-            if data[1] and data[1].get('ddx_phase_types'):
-                return data[1]['ddx_phase_types']['ddx_phase_type']
-            return None
-        except Exception as e:
+        # The phase row links to ddx_phase_types by id
+        phase = enum_cache.row_by_name('project_phases', value)
+        if not phase:
             return None
+        return get_ddx_value_by_id(phase.get('ddx_phase_type_id'), 'ddx_phase_types', 'ddx_phase_type')
     
     # Regular handling for other enums
     try:
+        if d3p_field_name == 'name':
+            row = enum_cache.row_by_name(enum_list_name, value)
+            return row.get(ddx_field_name) if row else None
         # Create a mapping dictionary from the enum values
-        ddx_field_mapping = {rt[d3p_field_name]: rt[ddx_field_name] for rt in return_enum_vals(enum_list_name)}
+        ddx_field_mapping = {rt[d3p_field_name]: rt[ddx_field_name] for rt in enum_cache.rows(enum_list_name)}
         # Direct dictionary lookup
         return ddx_field_mapping.get(value)
     except Exception as e:
@@ -149,7 +208,7 @@ def map_enum_to_ddx_value(value, enum_list_name, ddx_field_name, **kwargs):
 
 
 def map_climate_zone_to_ddx_value(value):
-    climate_zones = return_enum_vals('climate_zones')
+    climate_zones = enum_cache.rows('climate_zones')
     # Create a new list with modified names
     climate_zones = [
         {**zone, 'name': f"{zone['name']} - {zone['description']}"} 
@@ -193,7 +252,7 @@ def convert_mbtu_to_therms(mbtu_value: float) -> float:
     """Convert MBtu to therms"""
     return mbtu_value * 1000 * 0.01000238767
 
-def get_data_for_ddx(project_id):
+def get_data_for_ddx(project_id, mappings: DDXMappings = None):
     latest_eeu_data = get_latest_eeu_data(project_id)
     
     if latest_eeu_data['latest_design']:
@@ -219,7 +278,8 @@ def get_data_for_ddx(project_id):
         upload_data['project_phase_id'], 
         'ddx_phase_type_id', 
         'ddx_phase_types', 
-        'ddx_phase_type'
+        'ddx_phase_type',
+        mappings=mappings
     )
     if not ddx_phase:
         project_upload_data['projectPhase'] = "ERROR: Missing phase mapping"
@@ -260,7 +320,8 @@ def get_data_for_ddx(project_id):
         upload_data['project_use_type_id'], 
         'ddx_use_type_id', 
         'ddx_use_types', 
-        'ddx_use_type'
+        'ddx_use_type',
+        mappings=mappings
     )
     if not ddx_use_type:
         project_upload_data['useType1'] = "ERROR: Missing use type mapping"
@@ -279,7 +340,8 @@ def get_data_for_ddx(project_id):
         upload_data['energy_code_id'], 
         'ddx_energy_code_id', 
         'ddx_energy_codes', 
-        'ddx_energy_code'
+        'ddx_energy_code',
+        mappings=mappings
     )
     if not ddx_energy_code:
         project_upload_data['designEnergyCode'] = "ERROR: Missing energy code mapping"
@@ -292,7 +354,10 @@ def get_data_for_ddx(project_id):
 
     try:
         # Calculate baselineEUI using the utility function
-        baseline_eui = calculate_baseline_eui(upload_data['project_use_type_id'])
+        if mappings is not None:
+            baseline_eui = mappings.baseline_eui(upload_data['project_use_type_id'])
+        else:
+            baseline_eui = calculate_baseline_eui(upload_data['project_use_type_id'])
         project_upload_data['baselineEUI'] = str(baseline_eui)
     except Exception as e:
         project_upload_data['baselineEUI'] = "0"  # Set a default value
@@ -386,7 +451,7 @@ def get_data_for_ddx(project_id):
 
     return {"status": "success", "data": project_upload_data}
 
-def insert_api_call_db(project_id, response_code, response, outbound_request=None):
+def insert_api_call_db(project_id, response_code, response, outbound_request=None, idempotency_key=None, external_id=None):
 
     def ddx_id_extract(response):
             try:
@@ -394,19 +459,37 @@ def insert_api_call_db(project_id, response_code, response, outbound_request=Non
             except:
                 return None
     
-    insert_data = {
+    query = supabase.table('integrations_sync').insert([api_call_record(project_id, response_code, response, outbound_request,
+                                                                        idempotency_key=idempotency_key, external_id=external_id)])
+    data, count = query.execute()
+    return data
+
+def api_call_record(project_id, response_code, response, outbound_request=None, idempotency_key=None, external_id=None):
+    """
+    integrations_sync row of one DDX API call
+
+    Every row has the same keys, missing values are None: PostgREST rejects a bulk insert whose rows have different keys.
+    """
+    return {
         'project_id': project_id,
         'response_code': response_code,
-        'response': response
+        'response': response,
+        'idempotency_key': idempotency_key or None,
+        'external_id': external_id or None,
+        # serialized as a JSON string
+        'outbound_request': json.dumps(outbound_request) if outbound_request else None
     }
-    
-    # Add outbound_request if provided (serialize as JSON string)
-    if outbound_request:
-        insert_data['outbound_request'] = json.dumps(outbound_request)
-            
-    query = supabase.table('integrations_sync').insert([insert_data])
-    data, count = query.execute()
-    return data
+
+# integrations_sync rows per insert call of insert_api_calls_db
+INTEGRATIONS_SYNC_CHUNK_SIZE = 500
+
+def insert_api_calls_db(records):
+    """Insert many api_call_record rows with one insert call per INTEGRATIONS_SYNC_CHUNK_SIZE rows"""
+    inserted = []
+    for start in range(0, len(records), INTEGRATIONS_SYNC_CHUNK_SIZE):
+        data, count = supabase.table('integrations_sync').insert(records[start:start + INTEGRATIONS_SYNC_CHUNK_SIZE]).execute()
+        inserted.extend(data[1] or [])
+    return inserted
  
     
 def clean_field_names(data):
@@ -501,6 +584,74 @@ def get_keys(user_id: str) -> dict:
     logging_start.logger.error("Keys not found for user_id: %s", user_id)
     return None
 
+def apply_ddx_edits(data, edited_values, mappings: DDXMappings = None):
+    """Apply the values edited on the export page, keyed by display name, to the DDX data of a project"""
+    # Convert display names back to API field names
+    field_mappings = {
+        field.json_schema_extra.get('display_name', field_name): field_name
+        for field_name, field in models.DDXImportProject.model_fields.items()
+        if field_name != 'authToken'
+    }
+
+    # Update data with edited values, converting display names back to API field names
+    for display_name, value in edited_values.items():
+        api_field_name = field_mappings.get(display_name)
+        if api_field_name:
+            # Special handling for Use Type - map ID to DDX text value
+            if api_field_name == 'useType1' and isinstance(value, (str, int)):
+                try:
+                    use_type_id = int(value)
+
+                    ddx_use_type = get_ddx_mapping_from_enum_id(
+                        'enum_project_use_types', 
+                        use_type_id, 
+                        'ddx_use_type_id', 
+                        'ddx_use_types', 
+                        'ddx_use_type',
+                        mappings=mappings
+                    )
+                    if ddx_use_type:
+                        data[api_field_name] = ddx_use_type
+
+                    else:
+                        print(f"ERROR: Failed to map use type ID {use_type_id}, keeping original value")
+                except (ValueError, TypeError):
+                    print(f"ERROR: Invalid use type ID value: {value}, keeping original value")
+            # Special handling for Energy Code - map ID to DDX text value  
+            elif api_field_name == 'designEnergyCode' and isinstance(value, (str, int)):
+                try:
+                    energy_code_id = int(value)
+                    ddx_energy_code = get_ddx_mapping_from_enum_id(
+                        'enum_energy_codes', 
+                        energy_code_id, 
+                        'ddx_energy_code_id', 
+                        'ddx_energy_codes', 
+                        'ddx_energy_code',
+                        mappings=mappings
+                    )
+                    if ddx_energy_code:
+                        data[api_field_name] = ddx_energy_code
+
+                    else:
+                        print(f"ERROR: Failed to map energy code ID {energy_code_id}, keeping original value")
+                except (ValueError, TypeError):
+                    print(f"ERROR: Invalid energy code ID value: {value}, keeping original value")
+            # Special handling for Reporting Year and Occupancy Year
+            elif api_field_name in ['reportingYear', 'estimatedOccupancyYear'] and isinstance(value, (str, int)):
+                try:
+                    year_value = int(value)
+                    data[api_field_name] = str(year_value)
+                except (ValueError, TypeError):
+                    print(f"ERROR: Invalid year value: {value}, keeping original value")
+            else:
+                # Remove any formatting (commas and units) before saving
+                if isinstance(value, str):
+                    value = value.replace(',', '').replace('kBtu/SF', '').strip()
+                data[api_field_name] = value
+
+# numeric fields sent to DDX as strings
+DDX_STRING_FIELDS = ['useType1Area', 'baselineEUI', 'predictedEUI', 'reportingYear', 'estimatedOccupancyYear']
+
 def compile_data_for_ddx(project_id, user_id, edited_values=None):
     response = get_data_for_ddx(project_id)
 
@@ -510,69 +661,10 @@ def compile_data_for_ddx(project_id, user_id, edited_values=None):
         
         # Apply any edited values from the frontend
         if edited_values:
-            # Convert display names back to API field names
-            field_mappings = {
-                field.json_schema_extra.get('display_name', field_name): field_name
-                for field_name, field in models.DDXImportProject.model_fields.items()
-                if field_name != 'authToken'
-            }
-            
-            # Update data with edited values, converting display names back to API field names
-            for display_name, value in edited_values.items():
-                api_field_name = field_mappings.get(display_name)
-                if api_field_name:
-                    # Special handling for Use Type - map ID to DDX text value
-                    if api_field_name == 'useType1' and isinstance(value, (str, int)):
-                        try:
-                            use_type_id = int(value)
-
-                            ddx_use_type = get_ddx_mapping_from_enum_id(
-                                'enum_project_use_types', 
-                                use_type_id, 
-                                'ddx_use_type_id', 
-                                'ddx_use_types', 
-                                'ddx_use_type'
-                            )
-                            if ddx_use_type:
-                                data[api_field_name] = ddx_use_type
-                   
-                            else:
-                                print(f"ERROR: Failed to map use type ID {use_type_id}, keeping original value")
-                        except (ValueError, TypeError):
-                            print(f"ERROR: Invalid use type ID value: {value}, keeping original value")
-                    # Special handling for Energy Code - map ID to DDX text value  
-                    elif api_field_name == 'designEnergyCode' and isinstance(value, (str, int)):
-                        try:
-                            energy_code_id = int(value)
-                            ddx_energy_code = get_ddx_mapping_from_enum_id(
-                                'enum_energy_codes', 
-                                energy_code_id, 
-                                'ddx_energy_code_id', 
-                                'ddx_energy_codes', 
-                                'ddx_energy_code'
-                            )
-                            if ddx_energy_code:
-                                data[api_field_name] = ddx_energy_code
-                                
-                            else:
-                                print(f"ERROR: Failed to map energy code ID {energy_code_id}, keeping original value")
-                        except (ValueError, TypeError):
-                            print(f"ERROR: Invalid energy code ID value: {value}, keeping original value")
-                    # Special handling for Reporting Year and Occupancy Year
-                    elif api_field_name in ['reportingYear', 'estimatedOccupancyYear'] and isinstance(value, (str, int)):
-                        try:
-                            year_value = int(value)
-                            data[api_field_name] = str(year_value)
-                        except (ValueError, TypeError):
-                            print(f"ERROR: Invalid year value: {value}, keeping original value")
-                    else:
-                        # Remove any formatting (commas and units) before saving
-                        if isinstance(value, str):
-                            value = value.replace(',', '').replace('kBtu/SF', '').strip()
-                        data[api_field_name] = value
+            apply_ddx_edits(data, edited_values)
 
         # Convert numeric fields to strings after applying edits
-        for field in ['useType1Area', 'baselineEUI', 'predictedEUI', 'reportingYear', 'estimatedOccupancyYear']:
+        for field in DDX_STRING_FIELDS:
             data[field] = str(data[field])
         
         
@@ -590,14 +682,17 @@ def compile_data_for_ddx(project_id, user_id, edited_values=None):
         # Remove the auth token before storing
         outbound_request_data.pop('authToken', None)
         
-        project_response = import_project(project)
+        key = idempotency_key(project_id, outbound_request_data)
+        project_response = import_project(project, idempotency_key=key)
         if project_response['status'] == 'success':
             # Insert successful upload into integrations_sync table with complete outbound request
-            insert_api_call_db(project_id, "200", project_response['response'], outbound_request_data)
+            insert_api_call_db(project_id, "200", project_response['response'], outbound_request_data, idempotency_key=key,
+                               external_id=project_response['response'].get('id'))
             logging_start.logger.info(f"Project imported successfully: {project_response['response']['id']}")
             return {"status": "success", "message": "Project imported successfully","ddx_project_id": project_response['response']['id']}
         else:
-            insert_api_call_db(project_id, project_response['response_code'], project_response['message'], outbound_request_data)
+            insert_api_call_db(project_id, project_response['response_code'], project_response['message'], outbound_request_data,
+                               idempotency_key=key)
             logging_start.logger.error(f"Error importing project: {project_response}")
             return {"status": "error", "message": project_response['message']}
     except requests.exceptions.RequestException as e:
@@ -0,0 +1,231 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from pydantic import ValidationError
+
+# Add the parent directory to sys.path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logging_start
+import models
+from utils import supabase
+from external.ddx_api import (DDXMappings, DDX_STRING_FIELDS, get_data_for_ddx, apply_ddx_edits, get_keys, authenticate,
+                              import_project, idempotency_key, api_call_record, insert_api_calls_db)
+
+##Export of many projects to DDX in one request
+##The DDX lookup tables are read once and the user authenticates once for the whole batch. Payloads are compiled
+##DDX_COMPILE_WORKERS at a time and sent DDX_EXPORT_WORKERS at a time over the pooled DDX session (ddx_session).
+##Every attempt is recorded in integrations_sync with the idempotency key of its project and payload, as soon as a few
+##projects are done. A payload that already has a successful attempt under its key is not sent again.
+##Only failures where DDX cannot have created the project are retried, with exponential backoff: connection errors
+##before the request was sent and RETRY_STATUS_CODES responses. A read timeout is not retried, DDX may have the project.
+
+DDX_COMPILE_WORKERS = int(os.getenv('DDX_COMPILE_WORKERS', '8'))
+# keep at or below DDX_POOL_SIZE so every send has a pooled connection
+DDX_EXPORT_WORKERS = int(os.getenv('DDX_EXPORT_WORKERS', '4'))
+# retries after the first attempt of one project
+DDX_EXPORT_RETRIES = int(os.getenv('DDX_EXPORT_RETRIES', '3'))
+# seconds before the first retry, doubled for each retry after it
+DDX_RETRY_BACKOFF = float(os.getenv('DDX_RETRY_BACKOFF', '0.5'))
+DDX_EXPORT_MAX_PROJECTS = int(os.getenv('DDX_EXPORT_MAX_PROJECTS', '200'))
+# finished projects whose attempts are written to integrations_sync together
+DDX_SYNC_FLUSH_PROJECTS = int(os.getenv('DDX_SYNC_FLUSH_PROJECTS', '4'))
+# ids per in_() filter of the project and integrations_sync lookups
+LOOKUP_CHUNK_SIZE = 100
+
+# rate limited or unavailable: DDX did not process the request
+RETRY_STATUS_CODES = {429, 503}
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def company_project_ids(project_ids, company_id):
+    """The ids among project_ids of projects that belong to company_id"""
+    owned = set()
+    for chunk in _chunks(project_ids):
+        data, count = supabase.table('projects').select('id').eq('company_id', company_id).in_('id', chunk).execute()
+        owned.update(str(row['id']) for row in data[1] or [])
+    return owned
+
+
+def exported_keys(keys):
+    """idempotency key -> DDX project id of the keys that already have a successful attempt"""
+    exported = {}
+    for chunk in _chunks(keys):
+        data, count = supabase.table('integrations_sync')\
+            .select('idempotency_key, external_id')\
+            .in_('idempotency_key', chunk)\
+            .eq('response_code', '200')\
+            .execute()
+        for row in data[1] or []:
+            exported[row['idempotency_key']] = row.get('external_id')
+    return exported
+
+
+def compile_ddx_payload(project_id, edited_values=None, mappings=None):
+    """The DDX data of one project with its edits applied, as compile_data_for_ddx builds it"""
+    try:
+        response = get_data_for_ddx(project_id, mappings=mappings)
+        if response['status'] != 'success':
+            return response
+        data = response['data']
+        if edited_values:
+            apply_ddx_edits(data, edited_values, mappings)
+        for field in DDX_STRING_FIELDS:
+            data[field] = str(data[field])
+        return {"status": "success", "data": data}
+    except Exception as e:
+        logging_start.logger.error(f"Error compiling DDX data for project {project_id}: {str(e)}")
+        return {"status": "error", "message": f"Could not compile DDX data: {str(e)}"}
+
+
+def submit_with_retries(project_id, project, outbound_request, key, retries=None, backoff=None, sleep=time.sleep):
+    """
+    Send one project to DDX, retrying only the failures where DDX cannot have created it
+
+    Returns:
+        (result, records): the export result of the project and the integrations_sync rows of its attempts
+    """
+    retries = DDX_EXPORT_RETRIES if retries is None else retries
+    backoff = DDX_RETRY_BACKOFF if backoff is None else backoff
+    records = []
+    for attempt in range(retries + 1):
+        retryable = False
+        try:
+            response = import_project(project, idempotency_key=key)
+            retryable = response['status'] != 'success' and response['response_code'] in RETRY_STATUS_CODES
+        except requests.exceptions.ReadTimeout as e:
+            # the request reached DDX, retrying could create the project twice
+            response = {"status": "error", "response_code": None, "message": f"An error occurred: {e}"}
+        except requests.exceptions.ConnectionError as e:
+            response = {"status": "error", "response_code": None, "message": f"An error occurred: {e}"}
+            retryable = True
+        except requests.exceptions.RequestException as e:
+            response = {"status": "error", "response_code": None, "message": f"An error occurred: {e}"}
+
+        if response['status'] == 'success':
+            ddx_project_id = response['response'].get('id')
+            records.append(api_call_record(project_id, "200", response['response'], outbound_request,
+                                           idempotency_key=key, external_id=ddx_project_id))
+            return {"project_id": project_id, "status": "success", "message": "Project imported successfully",
+                    "ddx_project_id": ddx_project_id, "attempts": attempt + 1}, records
+
+        records.append(api_call_record(project_id, response['response_code'], response['message'], outbound_request,
+                                       idempotency_key=key))
+        if not retryable or attempt == retries:
+            break
+        sleep(backoff * 2 ** attempt)
+
+    logging_start.logger.error(f"Error importing project {project_id} to DDX: {response}")
+    return {"project_id": project_id, "status": "error", "message": response['message'], "attempts": attempt + 1}, records
+
+
+def _record_attempts(records):
+    try:
+        insert_api_calls_db(records)
+    except Exception as e:
+        logging_start.logger.error(f"Error recording DDX export attempts: {str(e)}")
+
+
+def export_projects_to_ddx(project_ids, user_id, edited_values=None, company_id=None):
+    """
+    Export many projects to DDX
+
+    Args:
+        project_ids: projects to export, repeats are exported once
+        user_id: user whose DDX keys are used
+        edited_values: project id -> values edited on the export page, as compile_data_for_ddx takes them
+        company_id: when given, only that company's projects are exported
+
+    Returns:
+        dict with the counts and one result per project in the order of project_ids
+    """
+    project_ids = list(dict.fromkeys(project_ids))
+    edited_values = edited_values or {}
+    if not project_ids:
+        return {"status": "error", "message": "No projects to export"}
+    if len(project_ids) > DDX_EXPORT_MAX_PROJECTS:
+        return {"status": "error", "message": f"At most {DDX_EXPORT_MAX_PROJECTS} projects can be exported at once"}
+
+    results = [None] * len(project_ids)
+    if company_id is not None:
+        owned = company_project_ids(project_ids, company_id)
+        for index, project_id in enumerate(project_ids):
+            if project_id not in owned:
+                results[index] = {"project_id": project_id, "status": "error", "message": "Project not found", "attempts": 0}
+    pending = [index for index, result in enumerate(results) if result is None]
+
+    if pending:
+        keys = get_keys(user_id)
+        if not keys:
+            return {"status": "error", "message": "DDX API keys not found. Please add them on the Settings Page"}
+        try:
+            auth_token = authenticate(keys['firm_key'], keys['user_key'])
+        except requests.exceptions.RequestException as e:
+            logging_start.logger.error(f"An error occurred: {e}")
+            return {"status": "error", "message": f"An error occurred: {e}"}
+        if 'authToken' not in auth_token:
+            return {"status": "error", "message": "Invalid DDX credentials. Please update them on the Settings page."}
+
+        try:
+            mappings = DDXMappings.load()
+        except Exception as e:
+            # every project looks its mappings up on its own, as a single export does
+            logging_start.logger.warning(f"Could not prefetch DDX mappings: {str(e)}")
+            mappings = None
+
+        with ThreadPoolExecutor(max_workers=min(DDX_COMPILE_WORKERS, len(pending))) as executor:
+            payloads = list(executor.map(
+                lambda index: compile_ddx_payload(project_ids[index], edited_values.get(project_ids[index]), mappings), pending))
+
+        to_send = []
+        for index, payload in zip(pending, payloads):
+            project_id = project_ids[index]
+            if payload['status'] != 'success':
+                results[index] = {"project_id": project_id, "status": "error", "message": payload.get('message'), "attempts": 0}
+                continue
+            try:
+                project = models.DDXImportProject(authToken=auth_token['authToken'], **payload['data'])
+            except ValidationError as e:
+                results[index] = {"project_id": project_id, "status": "error", "message": str(e), "attempts": 0}
+                continue
+            outbound_request = project.model_dump()
+            outbound_request.pop('authToken', None)
+            to_send.append((index, project_id, project, outbound_request, idempotency_key(project_id, outbound_request)))
+
+        # the same payload was already exported, by an earlier batch or a single export
+        already_exported = exported_keys([key for *_, key in to_send]) if to_send else {}
+        for index, project_id, _, _, key in to_send:
+            if key in already_exported:
+                results[index] = {"project_id": project_id, "status": "success", "message": "Project already exported",
+                                  "ddx_project_id": already_exported[key], "attempts": 0}
+        to_send = [item for item in to_send if item[4] not in already_exported]
+
+        if to_send:
+            with ThreadPoolExecutor(max_workers=min(DDX_EXPORT_WORKERS, len(to_send))) as executor:
+                futures = {executor.submit(submit_with_retries, project_id, project, outbound_request, key): index
+                           for index, project_id, project, outbound_request, key in to_send}
+                # attempts are written while the batch runs, so a batch that dies part way leaves its exports recorded
+                records, finished = [], 0
+                for future in as_completed(futures):
+                    results[futures[future]], project_records = future.result()
+                    records.extend(project_records)
+                    finished += 1
+                    if finished % DDX_SYNC_FLUSH_PROJECTS == 0:
+                        _record_attempts(records)
+                        records = []
+                if records:
+                    _record_attempts(records)
+
+    exported = sum(1 for result in results if result['status'] == 'success')
+    return {
+        "status": "success" if exported else "error",
+        "exported": exported,
+        "failed": len(results) - exported,
+        "results": results
+    }
@@ -1,10 +1,12 @@
-from fastapi import FastAPI, File, UploadFile, Form, Depends, Request
-from typing import Optional, Dict, Union
+from fastapi import FastAPI, File, UploadFile, Form, Depends, Request, Query
+from typing import Optional, Dict, Union, List
 import os
 from supabase import create_client, Client
 from fastapi import HTTPException
 from fastapi.security import HTTPBearer
-from fastapi.responses import StreamingResponse, RedirectResponse
+from fastapi.responses import StreamingResponse, RedirectResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 import secrets
 import io
 from datetime import datetime
@@ -17,16 +19,19 @@ from conversions import convert_units_in_table
 import models
 from update_routes import router as update_router
 from upload_routes import router as upload_router
-from project_details import return_project_details, get_signed_url_from_project_id, get_energy_end_uses_chart_data, combine_end_uses_data, get_change_history
+from project_details import return_project_details, get_signed_url_from_project_id, get_energy_end_uses_chart_data, combine_end_uses_data, fetch_end_uses_sides, get_change_history, end_use_cache
+from project_summary import SUMMARY_SOURCES, read_project_summaries, iter_project_summaries, refresh_project_summaries, rebuild_project_summaries, parse_columns, search_filter
 from operational_data import operational_carbon_data, operational_energy_data
 from weather_location import get_climate_zone_by_zip
 from external.ddx_api import get_data_for_ddx, clean_field_names, compile_data_for_ddx, update_user_keys, get_key_status, authenticate, get_keys
+from external.ddx_batch_export import export_projects_to_ddx
 from external.ddx_pre_validation import validate_ddx_data, create_validation_summary_response, DDXPreValidator, ValidationRule, ValidationSeverity
 
 
 
 
-from utils import return_enum_vals, get_enum_id, add_event_history, verify_token, supabase, create_app, url
+from utils import return_enum_vals, get_enum_id, enum_cache, add_event_history, verify_token, supabase, create_app, url, json_etag, etag_matches
+from eeu_loader import eeu_loader_scope
 import logging
 
 # Set up logger for auth events
@@ -157,11 +162,13 @@ async def log_requests(request: Request, call_next):
     body = await request.body()
 
 
-    response = await call_next(request)
+    # one eeu_data loader per request, shared by the handler and the helpers it calls
+    with eeu_loader_scope():
+        response = await call_next(request)
     return response
 
 @app.post("/submit_project/")
-async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def submit_project(item: models.SubmitProject, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
 
     if authorized['is_authorized']:
@@ -198,6 +205,8 @@ async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union
         except Exception as e:
             print(e)
             return "error upload table"
+        # the new upload may now hold the project's latest eeu_data
+        end_use_cache.invalidate_project(item_data['project_id'])
         
         if extract_dict.get('baseline_eeu_id') is not None:
             eeu_data_dict  = dict()
@@ -211,6 +220,7 @@ async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union
             eeu_data_dict['id'] = extract_dict['design_eeu_id']
             eeu_data_dict['upload_id'] = data[1][0]['id']
             update_eeu_record(eeu_data_dict, eeu_data_dict['id'])
+        refresh_project_summaries([item_data['project_id']])
 
         return "success"
 
@@ -218,7 +228,7 @@ async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union
         return "not authorized"
     
 @app.post("/create_company/")
-async def create_company(item: models.CreateCompany, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def create_company(item: models.CreateCompany, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized'] and authorized['role'] == 'superadmin':
         # Convert the item to a dictionary
         item_data = item.model_dump()
@@ -236,7 +246,7 @@ async def create_company(item: models.CreateCompany, authorized: Dict[str, Union
         return "not authorized"
     
 @app.post("/invite_user/")
-async def invite_user(item: models.InviteUser,
+def invite_user(item: models.InviteUser,
                       authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
     if authorized['is_authorized']:
@@ -289,7 +299,7 @@ async def invite_user(item: models.InviteUser,
 
 
 @app.post("/create_project/")
-async def create_project(item: models.CreateProject, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def create_project(item: models.CreateProject, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
 
     if authorized['is_authorized']:
         item_data = item.model_dump()
@@ -308,7 +318,7 @@ async def create_project(item: models.CreateProject, authorized: Dict[str, Union
 
 
 @app.get("/enums/{enum_name}/")
-async def get_simple_enum(enum_name: str, 
+def get_simple_enum(enum_name: str, 
                           use_type_id: Optional[int] = None, 
                           authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
@@ -316,13 +326,58 @@ async def get_simple_enum(enum_name: str,
         #print(additional_fields)
         args = {'use_type_id': use_type_id} if use_type_id is not None else {}
         return return_enum_vals(enum_name, **args)
+
+
+@app.post("/enums/refresh/")
+def refresh_enums(authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    #enum tables are cached for ENUM_CACHE_TTL seconds, this reloads them after an edit
+    if authorized['is_authorized'] and authorized['role'] == 'superadmin':
+        enum_cache.invalidate()
+        return {'status': 'success'}
+    else:
+        return "not authorized"
+
+
+@app.post("/project_summaries/refresh/")
+def refresh_project_summary_store(authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    #writes refresh their own projects, this rebuilds every stored summary (e.g. after editing an enum table)
+    if authorized['is_authorized'] and authorized['role'] == 'superadmin':
+        rebuild_project_summaries()
+        return {'status': 'success'}
+    else:
+        return "not authorized"
+
+
+@app.get("/cache_metrics/")
+async def get_cache_metrics(authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    if authorized['is_authorized'] and authorized['role'] == 'superadmin':
+        return {'end_uses': end_use_cache.metrics()}
+    else:
+        return "not authorized"
     
 @app.get("/projects/")
-async def get_projects(company_id: Optional[str] = None, 
+def get_projects(request: Request,
+                       company_id: Optional[str] = None, 
                        project_id: Optional[str] = None, 
                        basic_info: Optional[bool] = False, 
                        measurement_system: Optional[str] = 'imperial',
+                       limit: Optional[int] = Query(None, ge=1),
+                       cursor: Optional[str] = None,
+                       fields: Optional[str] = None,
+                       sort: Optional[str] = None,
+                       search: Optional[str] = None,
+                       project_phase: Optional[List[str]] = Query(None),
+                       project_use_type: Optional[List[str]] = Query(None),
+                       climate_zone: Optional[List[str]] = Query(None),
                        authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    """
+    Project summaries of a company.
+    Without limit every matching project is returned as a list. With limit the response is
+    {rows, next_cursor}; pass next_cursor back as cursor (with the same filters and sort) for the next page.
+    fields= selects columns, sort= orders by a column ('-' prefix for descending), search= matches like the
+    dashboard search and the phase, use type and climate zone filters take one or more values.
+    Responses carry an ETag, a matching If-None-Match gets 304.
+    """
     
     if authorized['is_authorized']:
         try:
@@ -343,34 +398,45 @@ async def get_projects(company_id: Optional[str] = None,
                 else:
                     return None
                 
-            else:
-                query = supabase.table('project_energy_summary')\
-                    .select('*')
-            
             ## if the user is a superadmin, then the passed company_id is used
             if authorized['role'] == 'superadmin':
                 company_id = company_id
             else:
                 company_id = authorized['company_id']
 
-            if company_id is not None:
-                query = query.eq('company_id', company_id)
-            
-            if project_id is not None:
-                query = query.eq('project_id', project_id)
-            
-            data, count = query.execute()
+            # rows come from the materialized summary, read in keyset pages
+            columns = parse_columns(fields)
+            filters = {'company_id': company_id, 'project_id': project_id, 'project_phase': project_phase,
+                       'project_use_type': project_use_type, 'climate_zone': climate_zone}
+            if limit is None:
+                rows = list(iter_project_summaries('projects', columns, sort=sort, search=search, **filters))
+                page = None
+                offset = 0
+            else:
+                page = read_project_summaries('projects', columns, limit, cursor, sort=sort, search=search, **filters)
+                rows = page['rows']
+                offset = page['offset']
             
-            if data[1] != []:
+            if rows != []:
                 if measurement_system == 'Imperial':
-                    data_output = data[1]
+                    data_output = rows
                     #data_output = add_operational_carbon_calcs(data_output)
                 else:
-                    data_output = convert_units_in_table(data[1],'project_energy_summary','metric',supabase)
-                data_with_id = [{'id': i, **d} for i, d in enumerate(data_output, start=1)]
-                return data_with_id
+                    data_output = convert_units_in_table(rows,'project_energy_summary','metric',supabase)
+                # ids keep counting across pages
+                data_with_id = [{'id': i, **d} for i, d in enumerate(data_output, start=offset + 1)]
+                payload = data_with_id
             else:
-                return None
+                payload = None
+            if page is not None:
+                payload = {'rows': payload or [], 'next_cursor': page['next_cursor']}
+
+            etag = json_etag(payload)
+            if etag_matches(request.headers.get('if-none-match'), etag):
+                return Response(status_code=304, headers={'ETag': etag})
+            return JSONResponse(jsonable_encoder(payload), headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             print(e)
             return "error"
@@ -384,7 +450,9 @@ async def get_projects(project_id: str = None,
                        authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
     if authorized['is_authorized']:
-        return combine_end_uses_data(project_id, output_units)
+        # baseline and design are read at the same time, the rest of the work stays off the event loop
+        sides = await fetch_end_uses_sides(project_id, output_units=output_units)
+        return await run_in_threadpool(combine_end_uses_data, project_id, output_units, sides)
     else:
         return "not authorized"
 
@@ -394,14 +462,15 @@ async def get_projects(project_id: str = None, measurement_system: Optional[str]
                        authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
     if authorized['is_authorized']:
-        chart_data = get_energy_end_uses_chart_data(project_id)
+        sides = await fetch_end_uses_sides(project_id)
+        chart_data = await run_in_threadpool(get_energy_end_uses_chart_data, project_id, sides)
         return chart_data
     else:
         return "not authorized"
     
 
 @app.get("/report_download_url/")
-async def get_projects(project_id: str = None, 
+def get_projects(project_id: str = None, 
                        baseline_design: str = None,
                        authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
@@ -415,7 +484,7 @@ async def get_projects(project_id: str = None,
 
 
 @app.get("/uploads/")
-async def get_uploads(project_id: int,authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_uploads(project_id: int,authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
         query = supabase.table('uploads')\
             .select('*,\
@@ -433,7 +502,7 @@ async def get_uploads(project_id: int,authorized: Dict[str, Union[bool, Optional
     
 
 @app.get("/companies/")
-async def get_companies(authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_companies(authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized'] and authorized['role'] == 'superadmin':
         query = supabase.table('companies')\
             .select('id,company_name')\
@@ -448,7 +517,7 @@ async def get_companies(authorized: Dict[str, Union[bool, Optional[str]]] = Depe
         return "not authorized" 
     
 @app.get("/companies/{company_id}")
-async def get_company(company_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_company(company_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     print("=== GET COMPANY ENDPOINT DEBUG ===")
     print(f"Received company_id: {company_id}")
     print(f"Authorized: {authorized['is_authorized']}")
@@ -473,7 +542,7 @@ async def get_company(company_id: str, authorized: Dict[str, Union[bool, Optiona
         return {"error": "not authorized"} 
     
 @app.get("/company_users/")
-async def get_uploads(company_id: str,authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_uploads(company_id: str,authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized'] and authorized['role'] == 'superadmin':
         print(f"=== GET COMPANY USERS DEBUG ===")
         print(f"Requested company_id: {company_id}")
@@ -495,7 +564,7 @@ async def get_uploads(company_id: str,authorized: Dict[str, Union[bool, Optional
         return {"error": "not authorized"} 
 
 @app.get("/operational_data/")
-async def get_projects(project_id: str = None,
+def get_projects(project_id: str = None,
                        authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
     if authorized['is_authorized']:
@@ -512,16 +581,23 @@ async def get_projects(project_id: str = None,
 
 
 @app.get("/project_change_history/")
-async def get_change_history_api(project_id: str, 
+def get_change_history_api(project_id: str,
+                                 limit: Optional[int] = Query(None, ge=1),
+                                 cursor: Optional[str] = None,
+                                 since: Optional[datetime] = None,
                                  authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
-        return get_change_history(project_id)
+        try:
+            return get_change_history(project_id, limit=limit, cursor=cursor,
+                                      since=since.isoformat() if since else None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     else:
         return "not authorized"
     
 
 @app.get("/ddx_data/")
-async def get_ddx_data(project_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_ddx_data(project_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
 
         response = get_data_for_ddx(project_id)
@@ -535,17 +611,26 @@ async def get_ddx_data(project_id: str, authorized: Dict[str, Union[bool, Option
     
 
 @app.post("/export_project_to_ddx/")
-async def export_project_to_ddx(item: models.ExportProjectToDDX, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def export_project_to_ddx(item: models.ExportProjectToDDX, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
         user_id = authorized['user_id']
         return compile_data_for_ddx(item.project_id, user_id, item.edited_values)
     else:
         return "not authorized"
+
+@app.post("/export_projects_to_ddx/")
+def export_projects_to_ddx_batch(item: models.ExportProjectsToDDX, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    if authorized['is_authorized']:
+        # superadmins may export any company's projects, everyone else only their own
+        company_id = None if authorized['role'] == 'superadmin' else authorized['company_id']
+        return export_projects_to_ddx(item.project_ids, authorized['user_id'], item.edited_values, company_id=company_id)
+    else:
+        return "not authorized"
     
 
 
 @app.get("/ddx_keys/status/{user_id}")
-async def get_key_status_endpoint(user_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_key_status_endpoint(user_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
         result = get_key_status(user_id)
         if "status" in result and result["status"] == "error":
@@ -555,7 +640,7 @@ async def get_key_status_endpoint(user_id: str, authorized: Dict[str, Union[bool
         raise HTTPException(status_code=401, detail="Not authorized")
 
 @app.post("/ddx_keys/update/{user_id}")
-async def update_keys(
+def update_keys(
     user_id: str, 
     keys: Dict[str, str], 
     authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token),
@@ -580,7 +665,7 @@ async def update_keys(
         raise HTTPException(status_code=500, detail=result["message"])
 
 @app.get("/ddx_keys/authenticate/{user_id}")
-async def authenticate_ddx_user(user_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def authenticate_ddx_user(user_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if not authorized['is_authorized'] or authorized['user_id'] != user_id:
         raise HTTPException(status_code=401, detail="Not authorized")
     
@@ -600,7 +685,7 @@ async def authenticate_ddx_user(user_id: str, authorized: Dict[str, Union[bool,
         return {"status": "error", "message": repr(e)}
 
 @app.get("/ddx_integration_status/{project_id}")
-async def get_ddx_integration_status(project_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def get_ddx_integration_status(project_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
         try:
             query = supabase.table('integrations_sync')\
@@ -634,7 +719,7 @@ async def get_ddx_integration_status(project_id: str, authorized: Dict[str, Unio
         return {"status": "error", "message": "not authorized"}
 
 @app.post("/ddx_integration_status_batch/")
-async def get_ddx_integration_status_batch(
+def get_ddx_integration_status_batch(
     project_ids: models.ProjectIdsList, 
     authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)
 ):
@@ -683,7 +768,7 @@ async def get_ddx_integration_status_batch(
         return {"status": "error", "message": "not authorized"}
 
 @app.post("/ddx_pre_validation/")
-async def run_ddx_pre_validation(
+def run_ddx_pre_validation(
     item: models.ExportProjectToDDX, 
     authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)
 ):
@@ -743,7 +828,7 @@ async def run_ddx_pre_validation(
 
 
 @app.post("/export_projects_csv/")
-async def export_projects_csv(
+def export_projects_csv(
     request_body: models.ExportProjectsCSVRequest,
     authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)
 ):
@@ -751,6 +836,7 @@ async def export_projects_csv(
     Export project data in the same format as the multi-project Excel template.
     Can export either a single project (project_id) or all projects for a company (company_id).
     Respects measurement system preference (Imperial/Metric).
+    format selects csv (default), parquet or xlsx. The file is streamed while projects are still being resolved.
     """
     if not authorized['is_authorized']:
         return "not authorized"
@@ -761,25 +847,16 @@ async def export_projects_csv(
         project_id = request_body.project_id
         search_term = request_body.search_term
         measurement_system = request_body.measurement_system or 'imperial'
-        from project_details import get_latest_eeu_data, get_uploads_for_project, get_upload_data
-        from weather_location import get_location_data
-        from conversions import convert_sf_to_m2, convert_gj_to_mbtu
+        export_format = (request_body.format or 'csv').lower()
+        from project_export import EXPORT_FORMATS, exportable_rows, iter_export_frames
         from datetime import datetime
         
-        # Define energy fields matching the template
-        eeu_energy_fields = [
-            'Heating_Electricity', 'Heating_NaturalGas', 'Heating_DistrictHeating', 'Heating_Other',
-            'Cooling_Electricity', 'Cooling_DistrictHeating', 'Cooling_Other',
-            'DHW_Electricity', 'DHW_NaturalGas', 'DHW_DistrictHeating', 'DHW_Other',
-            'Interior Lighting_Electricity', 'Exterior Lighting_Electricity', 'Plug Loads_Electricity',
-            'Process Refrigeration_Electricity', 'Fans_Electricity', 'Pumps_Electricity', 'Pumps_NaturalGas',
-            'Heat Rejection_Electricity', 'Humidification_Electricity', 'HeatRecovery_Electricity', 'HeatRecovery_Other',
-            'ExteriorUsage_Electricity', 'ExteriorUsage_NaturalGas', 'OtherEndUse_Electricity', 'OtherEndUse_NaturalGas', 'OtherEndUse_Other',
-            'SolarDHW_On-SiteRenewables', 'SolarPV_On-SiteRenewables', 'Wind_On-SiteRenewables', 'Other_On-SiteRenewables'
-        ]
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported export format: {request_body.format}")
+        media_type, extension, encoder = EXPORT_FORMATS[export_format]
         
-        # Build query for project_energy_summary
-        query = supabase.table('project_energy_summary').select('*')
+        # Build query for the materialized project_energy_summary
+        query = supabase.table(SUMMARY_SOURCES['projects']['table']).select('*')
         
         # Handle company_id authorization
         if authorized['role'] == 'superadmin':
@@ -793,11 +870,9 @@ async def export_projects_csv(
         if project_id is not None:
             query = query.eq('project_id', project_id)
         # Filter by search_term if provided (search-based export from dashboard)
-        elif search_term and search_term.strip():
-            # Search across relevant text fields in project_energy_summary
-            search_term_clean = f'%{search_term.strip()}%'
-            # Use or_() with multiple conditions
-            query = query.or_(f'project_name.ilike.{search_term_clean},project_use_type.ilike.{search_term_clean},project_phase.ilike.{search_term_clean},climate_zone.ilike.{search_term_clean}')
+        elif search_filter(search_term):
+            # Search across relevant text fields in project_energy_summary, the same match as /projects/?search=
+            query = query.or_(search_filter(search_term))
         
         data, count = query.execute()
         
@@ -808,237 +883,10 @@ async def export_projects_csv(
         measurement_system_lower = measurement_system.lower() if measurement_system else 'imperial'
         is_metric = measurement_system_lower == 'metric'
         
-        # Process each project to match template format
-        export_rows = []
-        
-        for project_summary in data[1]:
-            try:
-                proj_id = project_summary.get('project_id')
-                if not proj_id:
-                    continue
-                
-                # Get latest eeu_data for baseline and design
-                try:
-                    latest_eeu = get_latest_eeu_data(proj_id)
-                    if not isinstance(latest_eeu, dict):
-                        latest_eeu = {}
-                    baseline_id = latest_eeu.get('latest_baseline')
-                    design_id = latest_eeu.get('latest_design')
-                except Exception as e:
-                    print(f"Error getting latest eeu_data for project {proj_id}: {e}")
-                    baseline_id = None
-                    design_id = None
-                
-                # Fetch baseline and design eeu_data
-                baseline_data = {}
-                design_data = {}
-                location_data = {}
-                upload_data = {}
-                
-                if baseline_id:
-                    try:
-                        eeu_query = supabase.table('eeu_data').select('*').eq('id', baseline_id).limit(1)
-                        eeu_resp, _ = eeu_query.execute()
-                        if eeu_resp and len(eeu_resp) > 1 and eeu_resp[1]:
-                            baseline_data = eeu_resp[1][0]
-                    except Exception as e:
-                        print(f"Error fetching baseline eeu_data for project {proj_id}: {e}")
-                        baseline_data = {}
-                
-                if design_id:
-                    try:
-                        eeu_query = supabase.table('eeu_data').select('*').eq('id', design_id).limit(1)
-                        eeu_resp, _ = eeu_query.execute()
-                        if eeu_resp and len(eeu_resp) > 1 and eeu_resp[1]:
-                            design_data = eeu_resp[1][0]
-                    except Exception as e:
-                        print(f"Error fetching design eeu_data for project {proj_id}: {e}")
-                        design_data = {}
-                
-                # Get location data (prefer design, fallback to baseline)
-                location_id = design_id or baseline_id
-                if location_id:
-                    try:
-                        location_data = get_location_data(location_id)
-                        if not isinstance(location_data, dict):
-                            location_data = {}
-                    except Exception as e:
-                        print(f"Error getting location data for project {proj_id}: {e}")
-                        location_data = {}
-                
-                # Get upload data for additional fields
-                try:
-                    uploads = get_uploads_for_project(proj_id)
-                    if uploads and len(uploads) > 0:
-                        upload_id = uploads[-1]['id']
-                        upload_data = get_upload_data(upload_id)
-                        if not isinstance(upload_data, dict):
-                            upload_data = {}
-                except Exception as e:
-                    print(f"Error getting upload data for project {proj_id}: {e}")
-                    upload_data = {}
-                
-                # Build row matching template format
-                row = {}
-                
-                # Project ID - use custom_project_id if available, otherwise use project_id (same as DDX export)
-                custom_id = upload_data.get('custom_project_id') if isinstance(upload_data, dict) else None
-                row['project_id'] = str(custom_id) if custom_id else str(proj_id)
-                
-                # Shared fields (non-energy)
-                row['project_name'] = project_summary.get('project_name', '')
-                
-                # Handle area - convert if metric
-                conditioned_area = project_summary.get('conditioned_area')
-                if conditioned_area is not None:
-                    try:
-                        if is_metric:
-                            row['conditioned_area_sf'] = convert_sf_to_m2(float(conditioned_area))
-                        else:
-                            row['conditioned_area_sf'] = float(conditioned_area)
-                    except (ValueError, TypeError):
-                        row['conditioned_area_sf'] = ''
-                else:
-                    row['conditioned_area_sf'] = ''
-                
-                # Get zip_code, city, state from location_data (DDX-style)
-                row['zip_code'] = str(location_data.get('zip_code', '')) if location_data.get('zip_code') else ''
-                row['city'] = str(location_data.get('city', '')) if location_data.get('city') else ''
-                row['state'] = str(location_data.get('state', '')) if location_data.get('state') else ''
-                row['country'] = 'United States'  # Default as per DDX export
-                
-                row['project_use_type'] = project_summary.get('project_use_type', '')
-                row['project_construction_category'] = project_summary.get('project_construction_category_name', '')
-                row['project_phase'] = project_summary.get('project_phase', '')
-                row['energy_code'] = project_summary.get('energy_code_name', '')
-                row['report_type'] = project_summary.get('report_type_name', '')
-                
-                # Reporting year - from upload_data
-                if upload_data.get('reporting_year'):
-                    row['reporting_year'] = str(upload_data.get('reporting_year'))
-                elif upload_data.get('year'):
-                    row['reporting_year'] = str(upload_data.get('year'))
-                else:
-                    row['reporting_year'] = str(datetime.now().year)
-                
-                # Estimated occupancy year (DDX field)
-                if upload_data.get('year'):
-                    row['estimated_occupancy_year'] = str(upload_data.get('year'))
-                else:
-                    row['estimated_occupancy_year'] = str(datetime.now().year)
-                
-                # Area units
-                row['area_units'] = 'sm' if is_metric else 'sf'
-                
-                # Climate zone - extract just the code (before ' - ')
-                climate_zone_full = project_summary.get('climate_zone')
-                if climate_zone_full and isinstance(climate_zone_full, str):
-                    if ' - ' in climate_zone_full:
-                        row['climate_zone'] = climate_zone_full.split(' - ')[0]
-                    else:
-                        row['climate_zone'] = climate_zone_full
-                else:
-                    row['climate_zone'] = ''
-                
-                # Energy units - from eeu_data, default to mbtu
-                energy_units = 'mbtu'
-                if isinstance(design_data, dict) and design_data.get('energy_units'):
-                    energy_units = design_data.get('energy_units')
-                elif isinstance(baseline_data, dict) and baseline_data.get('energy_units'):
-                    energy_units = baseline_data.get('energy_units')
-                row['energy_units'] = energy_units
-                
-                # DDX additional fields
-                # Baseline EUI
-                baseline_eui = project_summary.get('total_energy_per_unit_area_baseline')
-                if baseline_eui is not None:
-                    row['baseline_eui'] = float(baseline_eui)
-                else:
-                    row['baseline_eui'] = ''
-                
-                # Predicted/Design EUI
-                design_eui = project_summary.get('total_energy_per_unit_area_design')
-                if design_eui is not None:
-                    row['predicted_eui'] = float(design_eui)
-                else:
-                    row['predicted_eui'] = ''
-                
-                # Add all energy fields with baseline and design suffixes
-                for energy_field in eeu_energy_fields:
-                    # Baseline value
-                    baseline_value = baseline_data.get(energy_field) if isinstance(baseline_data, dict) else None
-                    if baseline_value is not None:
-                        try:
-                            # Convert to MBTU if needed
-                            if energy_units == 'gj':
-                                row[f'{energy_field}_baseline'] = convert_gj_to_mbtu(float(baseline_value))
-                            elif energy_units == 'kbtu' or energy_units == 'kbtu/sf':
-                                row[f'{energy_field}_baseline'] = float(baseline_value) / 1000.0  # Convert kBtu to MBtu
-                            else:
-                                row[f'{energy_field}_baseline'] = float(baseline_value)
-                        except (ValueError, TypeError):
-                            row[f'{energy_field}_baseline'] = 0.0
-                    else:
-                        row[f'{energy_field}_baseline'] = 0.0
-                    
-                    # Design value
-                    design_value = design_data.get(energy_field) if isinstance(design_data, dict) else None
-                    if design_value is not None:
-                        try:
-                            # Convert to MBTU if needed
-                            if energy_units == 'gj':
-                                row[f'{energy_field}_design'] = convert_gj_to_mbtu(float(design_value))
-                            elif energy_units == 'kbtu' or energy_units == 'kbtu/sf':
-                                row[f'{energy_field}_design'] = float(design_value) / 1000.0  # Convert kBtu to MBtu
-                            else:
-                                row[f'{energy_field}_design'] = float(design_value)
-                        except (ValueError, TypeError):
-                            row[f'{energy_field}_design'] = 0.0
-                    else:
-                        row[f'{energy_field}_design'] = 0.0
-                
-                export_rows.append(row)
-            except Exception as e:
-                print(f"Error processing project {project_summary.get('project_id', 'unknown')}: {e}")
-                import traceback
-                traceback.print_exc()
-                # Continue with next project instead of failing entirely
-                continue
-        
-        if not export_rows:
+        summary_rows = exportable_rows(data[1])
+        if not summary_rows:
             raise HTTPException(status_code=404, detail="No project data could be exported")
         
-        # Create DataFrame with proper column order matching template
-        shared_fields = [
-            'project_id', 'project_name', 'conditioned_area_sf', 'zip_code', 'city', 'state', 'country',
-            'project_use_type', 'project_construction_category', 'project_phase', 'energy_code', 'report_type',
-            'reporting_year', 'estimated_occupancy_year', 'area_units', 'climate_zone', 'energy_units',
-            'baseline_eui', 'predicted_eui'
-        ]
-        
-        # Build column order: shared fields, then baseline energy fields, then design energy fields
-        column_order = shared_fields.copy()
-        for field in eeu_energy_fields:
-            column_order.append(f'{field}_baseline')
-        for field in eeu_energy_fields:
-            column_order.append(f'{field}_design')
-        
-        # Create DataFrame
-        df = pd.DataFrame(export_rows)
-        
-        # Ensure all columns exist (fill missing with empty/0)
-        for col in column_order:
-            if col not in df.columns:
-                df[col] = 0.0 if col.endswith('_baseline') or col.endswith('_design') else ''
-        
-        # Reorder columns to match template
-        df = df[column_order]
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        df.to_csv(output, index=False)
-        csv_content = output.getvalue()
-        
         # Determine filename
         if project_id:
             try:
@@ -1046,19 +894,19 @@ async def export_projects_csv(
                 project_data, _ = project_query.execute()
                 project_name = project_data[1][0]['project_name'] if project_data[1] else 'project'
                 project_name = "".join(c for c in project_name if c.isalnum() or c in (' ', '-', '_')).strip().replace(' ', '-')
-                filename = f"d3p-project-{project_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+                filename = f"d3p-project-{project_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
             except:
-                filename = f"d3p-project-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+                filename = f"d3p-project-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
         else:
-            filename = f"d3p-portfolio-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+            filename = f"d3p-portfolio-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
         
-        # Create StreamingResponse
+        # Rows are built batch by batch with chunked queries as the client reads the response
         return StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8')),
-            media_type='text/csv',
+            encoder(iter_export_frames(summary_rows, is_metric)),
+            media_type=media_type,
             headers={
                 'Content-Disposition': f'attachment; filename="{filename}"',
-                'Content-Type': 'text/csv; charset=utf-8'
+                'Content-Type': media_type
             }
         )
         
@@ -1071,7 +919,7 @@ async def export_projects_csv(
         raise HTTPException(status_code=500, detail=f"Error exporting data: {str(e)}")
 
 @app.delete("/projects/{project_id}/")
-async def delete_project(project_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def delete_project(project_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if not authorized['is_authorized'] or authorized.get('role') != 'superadmin':
         return "not authorized"
 
@@ -1116,6 +964,8 @@ async def delete_project(project_id: str, authorized: Dict[str, Union[bool, Opti
             .delete()\
             .eq('id', project_id)\
             .execute()
+        end_use_cache.invalidate_project(project_id)
+        refresh_project_summaries([project_id])
 
         return { 'status': 'success' }
     except Exception as e:
@@ -38,6 +38,11 @@ class ExportProjectToDDX(BaseModel):
     project_id: str
     edited_values: Optional[Dict[str, Union[str, int, float]]] = None
 
+class ExportProjectsToDDX(BaseModel):
+    project_ids: List[str]
+    # project id -> values edited on the export page of that project
+    edited_values: Optional[Dict[str, Dict[str, Union[str, int, float]]]] = None
+
 class ProjectIdsList(BaseModel):
     project_ids: List[str]
 
@@ -46,6 +51,7 @@ class ExportProjectsCSVRequest(BaseModel):
     project_id: Optional[str] = None
     search_term: Optional[str] = None
     measurement_system: Optional[str] = 'imperial'
+    format: Optional[str] = 'csv'
 
 @dataclass
 class ReportUpload:
@@ -55,6 +61,8 @@ class ReportUpload:
     area_units: Optional[str] = Form(None)
     file: UploadFile = Form(...)
     company_id: str = Form(...)
+    # UUID chosen by the uploader so it can poll /upload_jobs/{job_id} for progress while the upload request is open
+    job_id: Optional[str] = Form(None)
 
 class CreateProject(BaseModel):
     company_id: str
@@ -1,31 +1,94 @@
+import os
+import time
 import uuid
-from typing import Dict, List, Any, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Any, Tuple, Optional
 from supabase import Client
+from postgrest.exceptions import APIError
 from parse_reports.parse_multi_project_xlsx import MultiProjectExcelParser
 import logging_start
+from utils import enum_cache
 from conversions import convert_mbtu_to_kbtu, convert_mbtu_to_gj
+from project_summary import refresh_project_summaries
+from project_details import end_use_cache
+
+# spreadsheet rows written per ingest_multi_project_rows call
+INGEST_BATCH_SIZE = int(os.getenv('MULTI_PROJECT_INGEST_BATCH_SIZE', '100'))
+# project names per in_() filter of the existing project lookup, keeps the request URL short
+PROJECT_NAME_CHUNK_SIZE = 100
+# batches of one import written at the same time, 1 writes them one after another
+IMPORT_WORKERS = int(os.getenv('MULTI_PROJECT_IMPORT_WORKERS', '4'))
+# ingest_multi_project_rows calls per second allowed for one company across all of its running imports, 0 for no limit
+COMPANY_WRITE_RATE = float(os.getenv('MULTI_PROJECT_COMPANY_WRITE_RATE', '10'))
+
+
+class CompanyRateLimiter:
+    """
+    Token bucket per company, shared by the threads of every import running on this instance
+
+    Args:
+        rate: calls per second for each company, 0 or None for no limit
+        burst: calls a company may make at once before it is held to rate, defaults to rate
+    """
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 0)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # company id -> (tokens, time they were counted)
+        self._buckets = {}
+
+    def acquire(self, company_id: str) -> None:
+        """Wait until company_id may make one more call"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = self._clock()
+            tokens, counted_at = self._buckets.get(company_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - counted_at) * self.rate) - 1
+            self._buckets[company_id] = (tokens, now)
+        # a negative balance is a reservation: callers queue up behind each other instead of retrying
+        if tokens < 0:
+            self._sleep(-tokens / self.rate)
+
+
+company_write_limiter = CompanyRateLimiter(COMPANY_WRITE_RATE)
+
 
 class MultiProjectService:
     """Service for handling multi-project Excel uploads"""
     
-    def __init__(self, supabase_client: Client):
+    def __init__(self, supabase_client: Client, max_workers: Optional[int] = None,
+                 rate_limiter: Optional[CompanyRateLimiter] = None):
         self.supabase = supabase_client
         self.parser = MultiProjectExcelParser()
+        self.max_workers = IMPORT_WORKERS if max_workers is None else max_workers
+        self.rate_limiter = rate_limiter or company_write_limiter
+        # zip code -> weather info, filled in one batch before projects are created
+        self._weather_cache = {}
     
-    def process_multi_project_excel(self, file_url: str, company_id: str) -> Dict[str, Any]:
+    def process_multi_project_excel(self, file_url: str, company_id: str,
+                                    parse_result: Optional[Dict[str, Any]] = None,
+                                    progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
         """
         Process multi-project Excel file and create projects/uploads
         
         Args:
             file_url: URL to the Excel file
             company_id: ID of the company
+            parse_result: parse_multi_project_excel result for the file, if it has already been parsed
+            progress: called with (rows written, rows to write) as the import goes on
             
         Returns:
             Dictionary with processing results
         """
         try:
-            # Parse the Excel file
-            parse_result = self.parser.parse_multi_project_excel(file_url)
+            # Parse the Excel file, unless the upload worker already did
+            if parse_result is None:
+                parse_result = self.parser.parse_multi_project_excel(file_url)
             
             if parse_result['status'] == 'error':
                 return {
@@ -43,48 +106,35 @@ class MultiProjectService:
             
             # Validate against database enums
             validated_projects, db_validation_errors = self.parser.validate_against_database_enums(
-                projects, self.supabase
+                projects, enum_cache
             )
             validation_errors.extend(db_validation_errors)
             
-            # Validate allowed energy_units for each project before creation
-            allowed_units = {'mbtu', 'gj'}
-            projects_after_unit_validation = []
-            for project in validated_projects:
-                raw_units = project.get('energy_units')
-                input_units = (raw_units if raw_units is not None else 'mbtu')
-                input_units_lower = str(input_units).lower().strip()
-                if input_units_lower not in allowed_units:
-                    project_name = project.get('project_name', 'Unknown')
-                    validation_errors.append(
-                        f"Project '{project_name}': Invalid energy_units: '{input_units}'. Allowed: mbtu, gj"
-                    )
-                    continue
-                projects_after_unit_validation.append(project)
-            validated_projects = projects_after_unit_validation
+            # Validate allowed energy_units for every project before creation
+            validated_projects, unit_validation_errors = self.parser.validate_energy_units(validated_projects)
+            validation_errors.extend(unit_validation_errors)
             
-            # Process each validated project
-            created_project_ids = []
-            created_projects = []
-            failed_projects = []
+            # Look up the weather stations for every zip code at once
+            self._prefetch_weather_info(validated_projects)
             
-            for project in validated_projects:
-                try:
-                    project_id = self._create_project_and_upload(project, company_id, file_url)
-                    if project_id:
-                        created_project_ids.append(project_id)
-                        created_projects.append({
-                            'project_id': project_id,
-                            'project_name': project.get('project_name', 'Unknown')
-                        })
-                    else:
-                        failed_projects.append(project.get('project_name', 'Unknown'))
-                except Exception as e:
-                    error_msg = f"Failed to create project {project.get('project_name', 'Unknown')}: {str(e)}"
+            # Create the projects, uploads and eeu_data rows in bulk
+            created, failed = self._ingest_projects(validated_projects, company_id, file_url, progress=progress)
+            created_project_ids = [project_id for project_id, _ in created]
+            created_projects = [{'project_id': project_id, 'project_name': project.get('project_name', 'Unknown')}
+                                for project_id, project in created]
+            failed_projects = []
+            for project, error in failed:
+                failed_projects.append(project.get('project_name', 'Unknown'))
+                if error:
+                    error_msg = f"Failed to create project {project.get('project_name', 'Unknown')}: {error}"
                     logging_start.logger.error(error_msg)
-                    failed_projects.append(project.get('project_name', 'Unknown'))
                     validation_errors.append(error_msg)
             
+            refresh_project_summaries(created_project_ids, client=self.supabase)
+            # existing projects got new uploads, drop their cached end-use pivots
+            for project_id in dict.fromkeys(created_project_ids):
+                end_use_cache.invalidate_project(project_id)
+            
             # Calculate failed projects: projects that failed validation + projects that failed creation
             total_failed = len(projects) - len(validated_projects) + len(failed_projects)
             
@@ -110,6 +160,182 @@ class MultiProjectService:
                 'created_project_ids': []
             }
     
+    def _ingest_projects(self, projects: List[Dict[str, Any]], company_id: str, file_url: str,
+                         progress: Optional[Callable[[int, int], None]] = None
+                         ) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[Tuple[Dict[str, Any], Optional[str]]]]:
+        """
+        Create or update the projects of validated spreadsheet rows with their uploads and eeu_data
+
+        Existing projects are looked up in one pass and every record is built in memory, then each batch of
+        INGEST_BATCH_SIZE rows is written by one ingest_multi_project_rows call. Up to max_workers batches are
+        written at once, each call waiting on the company's rate limit. A row is written completely or not at all;
+        rows that fail are reported and do not stop the others.
+
+        Args:
+            progress: called in this thread with (rows done, len(projects)) at the start and after each batch
+
+        Returns:
+            (created, failed): (project_id, project) and (project, error message), both in spreadsheet order
+        """
+        existing = self._get_existing_project_ids([project.get('project_name') for project in projects], company_id)
+
+        # row index -> (project_id, error)
+        outcomes = {}
+        rows = []
+        for index, project in enumerate(projects):
+            try:
+                row = self._build_ingest_row(project, company_id, file_url, existing)
+            except Exception as e:
+                outcomes[index] = (None, str(e))
+                continue
+            row['row'] = index
+            rows.append(row)
+
+        batches = self._plan_ingest_batches(rows)
+        if progress:
+            progress(len(outcomes), len(projects))
+
+        def write(batch):
+            return zip([row['row'] for row in batch], self._write_ingest_batch(batch, projects, company_id, file_url))
+
+        if self.max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                for future in as_completed([executor.submit(write, batch) for batch in batches]):
+                    outcomes.update(future.result())
+                    if progress:
+                        progress(len(outcomes), len(projects))
+        else:
+            for batch in batches:
+                outcomes.update(write(batch))
+                if progress:
+                    progress(len(outcomes), len(projects))
+
+        created, failed = [], []
+        for index, project in enumerate(projects):
+            project_id, error = outcomes[index]
+            if project_id and error is None:
+                created.append((project_id, project))
+            else:
+                failed.append((project, error))
+        return created, failed
+
+    def _plan_ingest_batches(self, rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Split ingest rows into batches of about INGEST_BATCH_SIZE that can be written at the same time
+
+        Rows of the same project always share a batch, so they are written in spreadsheet order by one call
+        and two calls never race to create the same project.
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['project']['id'], []).append(row)
+        batches, batch = [], []
+        for group in groups.values():
+            if batch and len(batch) + len(group) > INGEST_BATCH_SIZE:
+                batches.append(batch)
+                batch = []
+            batch.extend(group)
+        if batch:
+            batches.append(batch)
+        return [sorted(batch, key=lambda row: row['row']) for batch in batches]
+
+    def _get_existing_project_ids(self, project_names: List[Optional[str]], company_id: str) -> Dict[str, str]:
+        """Project name -> id of the company's most recently created project with that name"""
+        names = list(dict.fromkeys(name for name in project_names if name))
+        existing = {}
+        for start in range(0, len(names), PROJECT_NAME_CHUNK_SIZE):
+            try:
+                result = (
+                    self.supabase
+                        .table('projects')
+                        .select('id, project_name, created_at')
+                        .eq('company_id', company_id)
+                        .in_('project_name', names[start:start + PROJECT_NAME_CHUNK_SIZE])
+                        .order('created_at', desc=True)
+                        .execute()
+                )
+            except Exception as e:
+                logging_start.logger.warning(f"Error checking for existing projects: {str(e)}")
+                continue
+            for project in getattr(result, 'data', None) or []:
+                existing.setdefault(project['project_name'], project['id'])
+        return existing
+
+    def _build_ingest_row(self, project_data: Dict[str, Any], company_id: str, file_url: str,
+                          existing: Dict[str, str]) -> Dict[str, Any]:
+        """
+        The project, upload and eeu_data records of one spreadsheet row
+
+        A name seen earlier in the file reuses that row's project, as the row-by-row import did.
+        """
+        enum_mappings = self._get_enum_mappings(project_data)
+        project_name = project_data.get('project_name')
+        project_id = existing.get(project_name)
+        if project_id is None:
+            project_id = str(uuid.uuid4())
+            if project_name:
+                existing[project_name] = project_id
+
+        project_record = {
+            'id': project_id,
+            'project_name': project_name,
+            'conditioned_area_sf': project_data.get('conditioned_area_sf'),
+            'company_id': company_id,
+            'climate_zone_id': enum_mappings.get('climate_zone_id'),
+            'project_construction_category_id': enum_mappings.get('project_construction_category_id'),
+            'project_use_type_id': enum_mappings.get('project_use_type_id')
+        }
+        eeu_records = []
+        for baseline_design in ['baseline', 'design']:
+            energy_fields = self._extract_energy_fields(project_data, baseline_design)
+            if energy_fields:
+                # upload_id is filled in by ingest_multi_project_rows
+                eeu_records.append(self._create_eeu_record(project_data, None, energy_fields, baseline_design))
+        return {
+            'project': {k: v for k, v in project_record.items() if v is not None},
+            'upload': self._create_upload_record(project_data, project_id, company_id, enum_mappings, file_url),
+            'eeu_data': [{k: v for k, v in record.items() if k != 'upload_id'} for record in eeu_records]
+        }
+
+    def _write_ingest_batch(self, batch: List[Dict[str, Any]], projects: List[Dict[str, Any]],
+                            company_id: str, file_url: str) -> List[Tuple[Optional[str], Optional[str]]]:
+        """Write one batch of ingest rows, returns (project_id, error) per row, the error is None when it was written"""
+        try:
+            self.rate_limiter.acquire(company_id)
+            response = self.supabase.rpc('ingest_multi_project_rows', {'p_rows': batch}).execute()
+        except APIError as e:
+            if e.code != 'PGRST202':
+                logging_start.logger.error(f"Error writing multi-project rows: {str(e)}")
+                return [(None, str(e))] * len(batch)
+            # the function is not deployed yet, write the rows one at a time. These writes are not rate limited,
+            # the limit is sized for batch calls and would make this path slower than the row-by-row import it replaces
+            logging_start.logger.warning("ingest_multi_project_rows not found, creating projects one at a time")
+            outcomes = []
+            for row in batch:
+                # one failing row must not fail the rest of the batch
+                try:
+                    project_id = self._create_project_and_upload(projects[row['row']], company_id, file_url)
+                except Exception as e:
+                    outcomes.append((None, str(e)))
+                    continue
+                outcomes.append((project_id, None) if project_id else (None, 'project or upload could not be created'))
+            return outcomes
+        except Exception as e:
+            logging_start.logger.error(f"Error writing multi-project rows: {str(e)}")
+            return [(None, str(e))] * len(batch)
+
+        results = {result['row_index']: result for result in response.data or []}
+        outcomes = []
+        for row in batch:
+            result = results.get(row['row'])
+            if result is None:
+                outcomes.append((None, 'no result returned for row'))
+            elif result.get('error'):
+                outcomes.append((None, result['error']))
+            else:
+                outcomes.append((result.get('project_id') or row['project']['id'], None))
+        return outcomes
+
     def _create_project_and_upload(self, project_data: Dict[str, Any], company_id: str, file_url: str) -> Optional[str]:
         """
         Create a project and associated upload record
@@ -223,24 +449,21 @@ class MultiProjectService:
         """Get enum ID mappings for project data"""
         mappings = {}
         
-        enum_queries = {
-            'climate_zone_id': ('enum_climate_zones', project_data.get('climate_zone')),
-            'project_construction_category_id': ('enum_project_construction_categories', project_data.get('project_construction_category')),
-            'project_use_type_id': ('enum_project_use_types', project_data.get('project_use_type')),
-            'project_phase_id': ('enum_project_phases', project_data.get('project_phase')),
-            'energy_code_id': ('enum_energy_codes', project_data.get('energy_code')),
-            'report_type_id': ('enum_report_types', project_data.get('report_type'))
+        enum_lookups = {
+            'climate_zone_id': ('climate_zones', project_data.get('climate_zone')),
+            'project_construction_category_id': ('project_construction_categories', project_data.get('project_construction_category')),
+            'project_use_type_id': ('project_use_types', project_data.get('project_use_type')),
+            'project_phase_id': ('project_phases', project_data.get('project_phase')),
+            'energy_code_id': ('energy_codes', project_data.get('energy_code')),
+            'report_type_id': ('report_types', project_data.get('report_type'))
         }
         
-        for field, (table, value) in enum_queries.items():
+        for field, (list_name, value) in enum_lookups.items():
             if value:
                 try:
-                    result = self.supabase.table(table).select('id').eq('name', value).execute()
-                    if result.data:
-                        mappings[field] = result.data[0]['id']
-                    else:
+                    mappings[field] = enum_cache.id_for_name(list_name, value)
+                    if mappings[field] is None:
                         logging_start.logger.warning(f"No ID found for {field}: {value}")
-                        mappings[field] = None
                 except Exception as e:
                     logging_start.logger.error(f"Error getting ID for {field}: {str(e)}")
                     mappings[field] = None
@@ -362,10 +585,9 @@ class MultiProjectService:
         if not report_type_name:
             return None
         try:
-            result = self.supabase.table('enum_report_types').select('identifier_name').eq('name', report_type_name).execute()
-            if result and getattr(result, 'data', None):
-                identifier = result.data[0].get('identifier_name')
-                return identifier
+            report_type = enum_cache.row_by_name('report_types', report_type_name)
+            if report_type:
+                return report_type.get('identifier_name')
         except Exception as e:
             # Log and fall back to None so caller can decide default behavior
             import logging_start
@@ -417,6 +639,17 @@ class MultiProjectService:
         
         return totals
     
+    def _prefetch_weather_info(self, projects: List[Dict[str, Any]]) -> None:
+        """Batch the weather lookups for all projects so each project does not pay for its own"""
+        try:
+            from weather_location import weather_check_many
+            
+            zip_codes = [project.get('zip_code') for project in projects if project.get('zip_code')]
+            self._weather_cache = weather_check_many(zip_codes, 'generic_xlsx') if zip_codes else {}
+        except Exception as e:
+            logging_start.logger.error(f"Error prefetching weather info: {str(e)}")
+            self._weather_cache = {}
+    
     def _get_weather_info(self, project_data: Dict[str, Any]) -> Dict[str, str]:
         """Get weather information for a project based on zip code"""
         try:
@@ -424,6 +657,8 @@ class MultiProjectService:
             from weather_location import weather_check
             
             zip_code = project_data.get('zip_code', '')
+            if zip_code and zip_code in self._weather_cache:
+                return dict(self._weather_cache[zip_code])
             report_type = 'generic_xlsx'  # Use generic xlsx for multi-project files
             
             if not zip_code:
@@ -5,7 +5,7 @@ import requests
 from bs4 import BeautifulSoup
 import io
 
-def parse_report_eplus(url):
+def parse_report_eplus(url, content=None):
 
 
 
@@ -24,10 +24,14 @@ def parse_report_eplus(url):
     return value_within_brackets
 
   # Get the HTML file
-  response = requests.get(url)
+  if content is None:
+    response = requests.get(url)
+    html_text = response.text
+  else:
+    html_text = content.decode('utf-8', errors='replace')
 
   # Save the HTML data to a file-like object
-  html_file = io.StringIO(response.text)
+  html_file = io.StringIO(html_text)
 
   # Parse the HTML file with BeautifulSoup
   soup = BeautifulSoup(html_file, "html.parser")
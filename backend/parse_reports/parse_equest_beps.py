@@ -13,29 +13,25 @@ import logging_start
 import post_processing 
 import io
 import os
+from parse_reports.pdf_index import open_pdf_index
 
 # Get the directory where this file is located and go up one level to backend
 current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def parse_report_equest_beps(url):
+def parse_report_equest_beps(url, content=None, pdf_index=None):
   warnings = []
+  # an index built here is closed here, a shared one is closed by run_script_master
+  owns_index = pdf_index is None
 
   try:   
         #filename = Path('temp/report.pdf')
 
         #takes URL from Airatble and stores that PDF to the path, above
-        response = requests.get(url)
-        pdf_file = io.BytesIO(response.content)
-        with pdfplumber.open(pdf_file) as pdf:
-            pages = pdf.pages
-            for i,pg in enumerate(pages):
-                txt = pages[i].extract_text()
-                #look for REPORT- BEPS Building Energy Performance  text
-                found_text = txt.find("REPORT- BEPS Building Energy Performance")
-                if(found_text!=-1):
-                
-                    page_no_to_use=i
-                    print("page"+str(i))
+        pdf_index = open_pdf_index(url, content, pdf_index)
+        pdf = pdf_index.pdf
+        #look for REPORT- BEPS Building Energy Performance  text, the last matching page holds the summary
+        page_no_to_use = pdf_index.last_page_with("REPORT- BEPS Building Energy Performance")
+        print("page"+str(page_no_to_use))
 
         page_to_use = pdf.pages[page_no_to_use]
 
@@ -43,7 +39,7 @@ def parse_report_equest_beps(url):
         #im.reset().debug_tablefinder()
 
         #im.debug_tablefinder()
-        all_text = page_to_use.extract_text()
+        all_text = pdf_index.page_text(page_no_to_use)
 
 
 
@@ -236,4 +232,7 @@ def parse_report_equest_beps(url):
         return {'df':df_beps,
                 'warnings':warnings}
   except ValueError as err:
-    print("error")
\ No newline at end of file
+    print("error")
+  finally:
+    if owns_index and pdf_index is not None:
+      pdf_index.close()
@@ -17,6 +17,7 @@ from math import radians, cos, sin, asin, sqrt
 import logging_start
 import post_processing 
 import io
+from parse_reports.pdf_index import open_pdf_index
 
 
 def post_process_beps(df,sf,wf_str):
@@ -72,25 +73,17 @@ def post_process_beps(df,sf,wf_str):
                 }
 
 
-def parse_equest_beps_for_sim(url):
+def parse_equest_beps_for_sim(url, content=None, pdf_index=None):
+  # an index built here is closed here, a shared one is closed by run_script_master
+  owns_index = pdf_index is None
 
   try:   
-        response = requests.get(url)
-
-        # Save the PDF data to a file-like object
-        pdf_file = io.BytesIO(response.content)
-
-        # Open the PDF file
-        with pdfplumber.open(pdf_file) as pdf:
-            pages = pdf.pages
-            for i, pg in enumerate(pages):
-                txt = pages[i].extract_text()
-                # look for REPORT- BEPS Building Energy Performance  text
-                found_text = txt.find("REPORT- BEPS Building Energy Performance")
-                if found_text != -1:
-                    page_no_to_use = i
-                    print("page" + str(i))
-                    
+        # Open the PDF file (or reuse the index already built for this upload)
+        pdf_index = open_pdf_index(url, content, pdf_index)
+        pdf = pdf_index.pdf
+        # look for REPORT- BEPS Building Energy Performance  text, the last matching page holds the summary
+        page_no_to_use = pdf_index.last_page_with("REPORT- BEPS Building Energy Performance")
+        print("page" + str(page_no_to_use))
 
         page_to_use = pdf.pages[page_no_to_use]
 
@@ -98,7 +91,7 @@ def parse_equest_beps_for_sim(url):
         #im.reset().debug_tablefinder()
 
         #im.debug_tablefinder()
-        all_text = page_to_use.extract_text()
+        all_text = pdf_index.page_text(page_no_to_use)
 
 
 
@@ -232,3 +225,6 @@ def parse_equest_beps_for_sim(url):
         
   except ValueError as err:
     print("error")
+  finally:
+    if owns_index and pdf_index is not None:
+      pdf_index.close()
@@ -8,14 +8,15 @@ import io
 from tabula.io import read_pdf
 
 
-def parse_report_equest_standard(url,area,zip_code):
+def parse_report_equest_standard(url,area,zip_code,content=None):
 
 
   conditioned_space = area
 
   # Get the PDF file
-  response = requests.get(url)
-  pdf_file = io.BytesIO(response.content)
+  if content is None:
+    content = requests.get(url).content
+  pdf_file = io.BytesIO(content)
 
   try:
     # Read the PDF file into a DataFrame
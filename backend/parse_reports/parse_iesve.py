@@ -3,22 +3,22 @@ import pandas as pd
 import requests
 import pdfplumber
 import io
+from parse_reports.pdf_index import open_pdf_index
 ##Script 1 Parsing for IESVE Report
 
 
 #creates a function to parse the IESVE report
-def parse_report_iesve(url):
+def parse_report_iesve(url, content=None, pdf_index=None):
  
   #sets the path to save the file to
   #filename = Path('temp/report.pdf')
 
   #takes URL from Airatble and stores that PDF to the path, above
+  # an index built here is closed here, a shared one is closed by run_script_master
+  owns_index = pdf_index is None
   try:
-    response = requests.get(url)
-    pdf_file = io.BytesIO(response.content)
-
-
-    pdf = pdfplumber.open(pdf_file)
+    pdf_index = open_pdf_index(url, content, pdf_index)
+    pdf = pdf_index.pdf
     first_page = pdf.pages[0]
 
     #parameters for how to parse the PDF
@@ -86,6 +86,9 @@ def parse_report_iesve(url):
   except Exception as e:
     print(e)
     return {'status':'error - could not process report'}
+  finally:
+    if owns_index and pdf_index is not None:
+      pdf_index.close()
 
   return {'df':df,
                 'warnings':[] ## warnings to be configured
@@ -13,6 +13,7 @@ import time
 from math import radians, cos, sin, asin, sqrt
 import logging_start
 import io
+from parse_reports.pdf_index import open_pdf_index
 
 
 def printer(str):
@@ -83,80 +84,31 @@ def process_prm_table(df,prm_baseline_design):
             'warnings':[] #warnings have not been configured for this report yet
             }
 
-def parse_report_iesve_prm(url,baseline_design):
+def parse_report_iesve_prm(url,baseline_design,content=None,pdf_index=None):
 
- 
-    # Get the PDF file
-    response = requests.get(url)
+    # Open the PDF file (or reuse the index already built for this upload), an index built here is closed here
+    owns_index = pdf_index is None
+    pdf_index = open_pdf_index(url, content, pdf_index)
+    try:
+        pdf = pdf_index.pdf
 
-    # Save the PDF data to a file-like object
-    pdf_file = io.BytesIO(response.content)
+        ## find the page with the square footage values
+        page_no_to_use_sf = pdf_index.first_page_with("Space Summary", "Building Use")
 
-    # Open the PDF file
-    with pdfplumber.open(pdf_file) as pdf:
-        pages = pdf.pages
+        ##Find page with the table that contains the Design and Baseline values
+        page_no_to_use_main_table = pdf_index.first_page_with("Performance Rating Table - PRM Compliance")
 
-    
-    
-
-
-        page_no_to_use_sf=-999
-        page_no_to_use_main_table=-999
-        page_no_to_use_weather=-999
-
-
-
-
-        for i,pg in enumerate(pages):
-            txt = pages[i].extract_text()
-            ## find the page with the square footage values
-            found_text_1= txt.find("Space Summary")
-            found_text_2= txt.find("Building Use")
-            if(page_no_to_use_sf==-999 and found_text_1!=-1 and found_text_2!=-1):
-            
-                page_no_to_use_sf=i
-
-            ##Find page with the table that contains the Design and Baseline values
-            found_text_3 = txt.find("Performance Rating Table - PRM Compliance")
-            #found_text_4 = txt.find("Total Annual Energy Use")
-
-
-
-
-
-            if(found_text_3!=-1):
-            
-                page_no_to_use_main_table=i
-                ##  look in the page after the main table for the next section header, if it's not there, then it's a two page table
-                
-                txt_next_page = pages[i+1].extract_text()
-                found_text_6 = txt_next_page.find("Energy Cost & Consumption by energy Type")
-                if(found_text_6!=-1):
-                    double_page_table=False
-                else:
-                    page_no_to_use_main_table_2=i+1
-                    double_page_table=True
-                    page_to_use_main_table_2=pdf.pages[page_no_to_use_main_table_2] 
-
-
-            ##Find page with the table that contains the weather locaiton data
-            found_text_5 = txt.find("Weather file")
-            if(page_no_to_use_weather==-999 and found_text_5!=-1):
-                page_no_to_use_weather=i
-
-
-
-
-            
-
-            ## if all of the values have been found, break
-            if(page_no_to_use_sf!=-999 and page_no_to_use_main_table!=-999 and page_no_to_use_weather!=-999):
-                break
-
-            ## if all of the values have been found, including
-                
+        ##  look in the page after the main table for the next section header, if it's not there, then it's a two page table
+        txt_next_page = pdf_index.page_text(page_no_to_use_main_table+1)
+        if "Energy Cost & Consumption by energy Type" in txt_next_page:
+            double_page_table=False
+        else:
+            page_no_to_use_main_table_2=page_no_to_use_main_table+1
+            double_page_table=True
+            page_to_use_main_table_2=pdf.pages[page_no_to_use_main_table_2]
 
-            
+        ##Find page with the table that contains the weather locaiton data
+        page_no_to_use_weather = pdf_index.first_page_with("Weather file")
 
 
         #im=first_page.to_image()
@@ -209,7 +161,7 @@ def parse_report_iesve_prm(url,baseline_design):
             conditioned_space = data_sf[1]
         else:
             conditioned_space = data_sf[0]
-        
+    
         conditioned_space=float(conditioned_space.replace(',',''))
 
 
@@ -218,7 +170,7 @@ def parse_report_iesve_prm(url,baseline_design):
         try:
             weather_loc_text="Weather file"
             weather_loc= page_to_use_weather.search(weather_loc_text)
-            all_weather_text=page_to_use_weather.extract_text()
+            all_weather_text=pdf_index.page_text(page_no_to_use_weather)
             weather_bottom_text="zone:"
             weather_bottom_loc= page_to_use_weather.search(weather_bottom_text,x_tolerance=3, y_tolerance=3,case=False)
 
@@ -233,7 +185,7 @@ def parse_report_iesve_prm(url,baseline_design):
         weather_table = page_to_use_weather.crop((left_weather,top_weather,right_weather,bottom_weather),relative=True)
         data_weather=weather_table.extract_table(table_settings_weather)
         data_weather=data_weather[0][0]
-        
+    
 
         weather_string = data_weather[len(weather_loc_text):]
 
@@ -262,23 +214,23 @@ def parse_report_iesve_prm(url,baseline_design):
         right=page_width
 
 
-        
+    
         main_table = page_to_use_main_table.crop((left,top,right,page_height),relative=True)
         eeu_table=main_table.extract_table(table_settings_main_table)
-        
+    
         ##if it's a double page report, extract second page and add it to same dataframe
         df=pd.DataFrame(eeu_table)
         if(double_page_table):
             set_top= page_to_use_main_table_2.search('%')
             top=set_top[0].get('bottom')
-            
+        
             main_table2=page_to_use_main_table_2.crop((left,top,right,page_height),relative=True)
             eeu_table2=main_table2.extract_table(table_settings_main_table)
-        
+    
             df_2=pd.DataFrame(eeu_table2)
 
             df=pd.concat([df,df_2])
-        
+    
         df=df[[0,2,3,4,6,]]
 
         df = df.rename(columns={0:'energy_use',2:'energy_type',3:'check_row_type',4:'design_value',6:'baseline_value'})
@@ -287,7 +239,7 @@ def parse_report_iesve_prm(url,baseline_design):
         df['conditioned_area_sf']=conditioned_space
         df['weather_string']=weather_string
         df['report']='iesve_prm'
-        
+    
         try:
             output_prm = process_prm_table(df,baseline_design)
         except Exception as err:
@@ -296,5 +248,8 @@ def parse_report_iesve_prm(url,baseline_design):
             return "error parsing PRM table"
 
         return output_prm
+    finally:
+        if owns_index:
+            pdf_index.close()
 
 #parse_report_iesve_prm("1234","1234A")
\ No newline at end of file
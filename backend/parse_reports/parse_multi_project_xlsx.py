@@ -1,15 +1,63 @@
+import numpy as np
 import pandas as pd
-import requests
-import io
 import logging
 from typing import Dict, List, Any, Optional, Tuple
 
+from parse_reports.workbook_source import WorkbookSource, workbook_source
+
 # Create a simple printer function to avoid circular import
 def printer(message: str):
     print(message)
     logging.info(message)
 
 
+# columns that identify the header row of a multi-project sheet
+MULTI_PROJECT_HEADER_COLUMNS = ['project_name', 'conditioned_area_sf', 'project_use_type']
+
+# numeric project fields, the integer ones are truncated
+NUMERIC_FIELDS = ['conditioned_area_sf', 'year', 'reporting_year']
+INTEGER_FIELDS = ['year', 'reporting_year']
+
+
+def _stripped_text(series: pd.Series) -> np.ndarray:
+    """str(value).strip() of every cell"""
+    return series.map(str).str.strip().to_numpy(dtype=object)
+
+
+def _coerce_float(series: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    float(value) of every cell, column-wise
+
+    Returns:
+        (values, converted): float values (NaN where the conversion failed) and where float() succeeded
+    """
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float, na_value=np.nan), series.notna().to_numpy()
+    if series.dtype == object:
+        # copied, pandas can hand out read-only arrays
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan, copy=True)
+    else:
+        values = np.full(len(series), np.nan)
+    converted = ~np.isnan(values)
+    # text pd.to_numeric does not read but float() does, e.g. ' 12 ', '1_000' or 'nan'
+    for position in np.flatnonzero(~converted & series.notna().to_numpy()):
+        try:
+            value = float(series.iat[position])
+        except (ValueError, TypeError):
+            continue
+        values[position] = value
+        converted[position] = True
+    return values, converted
+
+
+def read_project_table(workbook: WorkbookSource) -> Optional[pd.DataFrame]:
+    """The project rows of a multi-project sheet without empty rows, None when no header row is found"""
+    header_row = workbook.find_header_row(MULTI_PROJECT_HEADER_COLUMNS)
+    if header_row is None:
+        return None
+    return workbook.frame(header_row).dropna(how='all').reset_index(drop=True)
+
+
 class MultiProjectExcelParser:
     """Parser for multi-project Excel files"""
     
@@ -46,37 +94,22 @@ class MultiProjectExcelParser:
             'report_type': ['IESVE', 'EnergyPlus Report', 'EQuest - SIM Report', 'Generic .XLSX', 'EQuest - BEPS Report', 'EQuest - Standard Report', 'Other', 'IESVE PRM']
         }
 
-    def parse_multi_project_excel(self, url: str) -> Dict[str, Any]:
+    def parse_multi_project_excel(self, url: str, content: Optional[bytes] = None,
+                                  workbook: Optional[WorkbookSource] = None) -> Dict[str, Any]:
         """
         Parse multi-project Excel file from URL
         
         Args:
             url: URL to the Excel file
+            content: Raw file bytes, if they have already been downloaded
+            workbook: WorkbookSource of the file, if it has already been opened
             
         Returns:
             Dictionary containing parsed projects and validation results
         """
         try:
-            # Download and read Excel file
-            if url.startswith('http'):
-                response = requests.get(url)
-                excel_file = io.BytesIO(response.content)
-            else:
-                excel_file = url
-            
-            # Try reading with different header positions to handle instruction rows
-            df = None
-            for header_row in [0, 1, 2, 3]:
-                try:
-                    df_test = pd.read_excel(excel_file, sheet_name=0, header=header_row)
-                    # Check if this looks like the right header row
-                    if ('project_name' in df_test.columns and 
-                        'conditioned_area_sf' in df_test.columns and 
-                        'project_use_type' in df_test.columns):
-                        df = df_test
-                        break
-                except:
-                    continue
+            # Header row is found among the instruction rows at the top of the sheet
+            df = read_project_table(workbook_source(url, content, workbook))
             
             if df is None:
                 return {
@@ -86,9 +119,6 @@ class MultiProjectExcelParser:
                     'validation_errors': []
                 }
             
-            # Remove any completely empty rows
-            df = df.dropna(how='all').reset_index(drop=True)
-            
             if len(df) == 0:
                 return {
                     'status': 'error',
@@ -97,20 +127,8 @@ class MultiProjectExcelParser:
                     'validation_errors': []
                 }
             
-            # Parse and validate each project
-            parsed_projects = []
-            validation_errors = []
-            
-            for index, row in df.iterrows():
-                project_result = self._parse_project_row(row, index + 1)
-                
-                if project_result['status'] == 'valid':
-                    parsed_projects.append(project_result['project'])
-                elif project_result['status'] == 'warning':
-                    parsed_projects.append(project_result['project'])
-                    validation_errors.extend(project_result['warnings'])
-                else:
-                    validation_errors.extend(project_result['errors'])
+            # Parse and validate each project, column by column
+            parsed_projects, validation_errors = self._parse_project_rows(df)
             
             return {
                 'status': 'success' if len(parsed_projects) > 0 else 'error',
@@ -129,103 +147,129 @@ class MultiProjectExcelParser:
                 'validation_errors': []
             }
 
-    def _parse_project_row(self, row: pd.Series, row_number: int) -> Dict[str, Any]:
+    def _parse_project_rows(self, df: pd.DataFrame) -> Tuple[List[Dict[str, Any]], List[str]]:
         """
-        Parse a single project row
-        
-        Args:
-            row: Pandas Series representing the row
-            row_number: Row number for error reporting
-            
+        Parse every project row of the sheet column by column
+
+        Rows are numbered from 1 in messages. Values are coerced per column and each row's dict is only assembled
+        once its row is known to be valid.
+
         Returns:
-            Dictionary with parsing results
+            Tuple of (projects of the valid rows, error messages in row order)
         """
-        project = {}
-        errors = []
-        warnings = []
-        
-        # Check required columns
+        row_count = len(df)
+        # row position -> error messages: required fields first, then numeric fields
+        errors: Dict[int, List[str]] = {}
+
+        def add_errors(positions, message):
+            for position in positions:
+                errors.setdefault(position, []).append(message(position))
+
+        # Required columns: stripped text, missing when absent, NA or blank
+        required = {}
         for col in self.required_columns:
-            if col not in row.index or pd.isna(row[col]) or str(row[col]).strip() == '':
-                errors.append(f"Row {row_number}: Missing required field '{col}'")
+            if col in df.columns:
+                text = _stripped_text(df[col])
+                missing = df[col].isna().to_numpy() | (text == '')
             else:
-                project[col] = str(row[col]).strip()
-        
-        # Add optional columns with defaults
+                text, missing = None, np.ones(row_count, dtype=bool)
+            add_errors(np.flatnonzero(missing), lambda position: f"Row {position + 1}: Missing required field '{col}'")
+            required[col] = text
+
+        # Optional columns: stripped text, the default when absent, NA or blank
+        optional = {}
         for col, default in self.optional_columns.items():
-            if col in row.index and not pd.isna(row[col]) and str(row[col]).strip() != '':
-                project[col] = str(row[col]).strip()
+            values = np.full(row_count, default, dtype=object)
+            if col in df.columns:
+                text = _stripped_text(df[col])
+                present = df[col].notna().to_numpy() & (text != '')
+                values[present] = text[present]
+            optional[col] = values
+
+        # Numeric fields, checked on the text of the required and optional columns
+        numeric = {}
+        for field in NUMERIC_FIELDS:
+            text = required[field] if field in required else optional.get(field)
+            if text is None:
+                continue
+            present = pd.notna(text) if field in optional else np.ones(row_count, dtype=bool)
+            if field in required:
+                present = present & (text != '') & df[field].notna().to_numpy()
+            values, converted = _coerce_float(pd.Series(text, dtype=object).where(present))
+            if field in INTEGER_FIELDS:
+                # int(nan) fails like any other invalid value
+                converted = converted & ~np.isnan(values)
+            invalid = present & ~converted
+            add_errors(np.flatnonzero(invalid),
+                       lambda position: f"Row {position + 1}: Invalid numeric value for field '{field}': {text[position]}")
+            if field in INTEGER_FIELDS:
+                numeric[field] = (converted, [int(value) if ok else None for value, ok in zip(values.tolist(), converted)])
             else:
-                project[col] = default
-        
-        # Add energy data columns (all other numeric columns)
-        energy_columns = []
-        baseline_energy_data = {}
-        design_energy_data = {}
-        
-        for col in row.index:
-            if col not in self.required_columns and col not in self.optional_columns:
-                if pd.notna(row[col]) and str(row[col]).strip() != '':
-                    try:
-                        # Try to convert to float for energy data
-                        energy_value = float(row[col])
-                        
-                        # Check if this is a baseline or design energy field
-                        if col.endswith('_baseline'):
-                            # Extract the base field name (remove _baseline suffix)
-                            base_field = col[:-9]  # Remove '_baseline'
-                            baseline_energy_data[base_field] = energy_value
-                            energy_columns.append(col)
-                        elif col.endswith('_design'):
-                            # Extract the base field name (remove _design suffix)
-                            base_field = col[:-7]  # Remove '_design'
-                            design_energy_data[base_field] = energy_value
-                            energy_columns.append(col)
-                        else:
-                            # Legacy format - store as is
-                            project[col] = energy_value
-                            energy_columns.append(col)
-                            
-                    except (ValueError, TypeError):
-                        # If not numeric, store as string
-                        project[col] = str(row[col]).strip()
-        
-        # Store baseline and design energy data separately
-        if baseline_energy_data:
-            project['baseline_energy_data'] = baseline_energy_data
-        if design_energy_data:
-            project['design_energy_data'] = design_energy_data
-        
-        # Note: Skip local enum validation to avoid duplicate messages.
-        # Enum validation is performed against database values later in the flow.
-        
-        # Validate numeric fields
-        numeric_fields = ['conditioned_area_sf', 'year', 'reporting_year']
-        for field in numeric_fields:
-            if field in project and project[field] is not None:
-                try:
-                    if field in ['year', 'reporting_year']:
-                        project[field] = int(float(project[field]))
+                numeric[field] = (converted, values.tolist())
+
+        projects: List[Optional[Dict[str, Any]]] = [None if position in errors else {} for position in range(row_count)]
+        valid_positions = [position for position in range(row_count) if projects[position] is not None]
+        for col in self.required_columns:
+            for position in valid_positions:
+                projects[position][col] = required[col][position]
+        for col, values in optional.items():
+            for position in valid_positions:
+                projects[position][col] = values[position]
+
+        # Energy data columns (all other columns): numbers by baseline/design suffix, other text as is
+        baseline_energy_data: Dict[int, Dict[str, float]] = {}
+        design_energy_data: Dict[int, Dict[str, float]] = {}
+        for col in df.columns:
+            if col in self.required_columns or col in self.optional_columns:
+                continue
+            series = df[col]
+            if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+                text = None
+                present = series.notna().to_numpy()
+            else:
+                text = _stripped_text(series)
+                present = series.notna().to_numpy() & (text != '')
+            values, converted = _coerce_float(series)
+            is_number = present & converted
+            if is_number.any():
+                if col.endswith('_baseline'):
+                    target, key = baseline_energy_data, col[:-9]
+                elif col.endswith('_design'):
+                    target, key = design_energy_data, col[:-7]
+                else:
+                    target, key = None, col
+                values = values.tolist()
+                for position in np.flatnonzero(is_number).tolist():
+                    if projects[position] is None:
+                        continue
+                    if target is None:
+                        projects[position][key] = values[position]
                     else:
-                        project[field] = float(project[field])
-                except (ValueError, TypeError):
-                    errors.append(f"Row {row_number}: Invalid numeric value for field '{field}': {project[field]}")
-        
-        # Determine status
-        if errors:
-            return {'status': 'error', 'errors': errors, 'project': None}
-        elif warnings:
-            return {'status': 'warning', 'warnings': warnings, 'project': project}
-        else:
-            return {'status': 'valid', 'project': project}
+                        target.setdefault(position, {})[key] = values[position]
+            if text is not None:
+                for position in np.flatnonzero(present & ~converted).tolist():
+                    if projects[position] is not None:
+                        projects[position][col] = text[position]
+
+        for position in valid_positions:
+            if position in baseline_energy_data:
+                projects[position]['baseline_energy_data'] = baseline_energy_data[position]
+            if position in design_energy_data:
+                projects[position]['design_energy_data'] = design_energy_data[position]
+            for field, (converted, values) in numeric.items():
+                if converted[position]:
+                    projects[position][field] = values[position]
 
-    def validate_against_database_enums(self, projects: List[Dict], supabase_client) -> Tuple[List[Dict], List[str]]:
+        validation_errors = [message for position in sorted(errors) for message in errors[position]]
+        return [projects[position] for position in valid_positions], validation_errors
+
+    def validate_against_database_enums(self, projects: List[Dict], enum_cache) -> Tuple[List[Dict], List[str]]:
         """
         Validate project enum values against actual database values
         
         Args:
             projects: List of parsed projects
-            supabase_client: Supabase client for database queries
+            enum_cache: EnumCache holding the database enum tables
             
         Returns:
             Tuple of (validated_projects, validation_errors)
@@ -235,29 +279,30 @@ class MultiProjectExcelParser:
         
         try:
             # Fetch enum values from database
-            db_enums = self._fetch_database_enums(supabase_client)
+            db_enums = self._fetch_database_enums(enum_cache)
+            
+            enum_mappings = {
+                'project_use_type': ('enum_project_use_types', 'name'),
+                'project_construction_category': ('enum_project_construction_categories', 'name'),
+                'project_phase': ('enum_project_phases', 'name'),
+                'energy_code': ('enum_energy_codes', 'name'),
+                'report_type': ('enum_report_types', 'name'),
+                'climate_zone': ('enum_climate_zones', 'name')
+            }
+            
+            # project index -> error messages, checked one enum field at a time
+            project_errors = {}
+            for field, (table, column) in enum_mappings.items():
+                values = pd.Series([project.get(field) for project in projects], dtype=object)
+                valid_values = db_enums.get(table, [])
+                invalid = values.map(bool).to_numpy(dtype=bool) & ~values.isin(self._enum_name_set(enum_cache, table, valid_values)).to_numpy()
+                options = f"{', '.join(valid_values[:10])}{'...' if len(valid_values) > 10 else ''}"
+                for i in np.flatnonzero(invalid).tolist():
+                    project_errors.setdefault(i, []).append(f"Invalid {field}: '{values.iat[i]}'. Valid options: {options}")
             
             for i, project in enumerate(projects):
-                project_errors = []
-                
-                # Validate each enum field
-                enum_mappings = {
-                    'project_use_type': ('enum_project_use_types', 'name'),
-                    'project_construction_category': ('enum_project_construction_categories', 'name'),
-                    'project_phase': ('enum_project_phases', 'name'),
-                    'energy_code': ('enum_energy_codes', 'name'),
-                    'report_type': ('enum_report_types', 'name'),
-                    'climate_zone': ('enum_climate_zones', 'name')
-                }
-                
-                for field, (table, column) in enum_mappings.items():
-                    if field in project and project[field]:
-                        valid_values = db_enums.get(table, [])
-                        if project[field] not in valid_values:
-                            project_errors.append(f"Invalid {field}: '{project[field]}'. Valid options: {', '.join(valid_values[:10])}{'...' if len(valid_values) > 10 else ''}")
-                
-                if project_errors:
-                    validation_errors.extend([f"Project '{project.get('project_name', f'Row {i+1}')}': {error}" for error in project_errors])
+                if i in project_errors:
+                    validation_errors.extend([f"Project '{project.get('project_name', f'Row {i+1}')}': {error}" for error in project_errors[i]])
                 else:
                     validated_projects.append(project)
             
@@ -268,8 +313,33 @@ class MultiProjectExcelParser:
         
         return validated_projects, validation_errors
 
-    def _fetch_database_enums(self, supabase_client) -> Dict[str, List[str]]:
-        """Fetch enum values from database"""
+    def validate_energy_units(self, projects: List[Dict]) -> Tuple[List[Dict], List[str]]:
+        """
+        Check every project's energy_units at once, a missing value counts as mbtu
+        
+        Returns:
+            Tuple of (projects with allowed units, validation_errors)
+        """
+        input_units = pd.Series([project.get('energy_units') for project in projects], dtype=object)
+        input_units = input_units.where(input_units.map(lambda units: units is not None), 'mbtu')
+        allowed = input_units.map(str).str.lower().str.strip().isin(set(self.valid_enums['energy_units'])).to_numpy()
+        
+        validation_errors = [
+            f"Project '{projects[i].get('project_name', 'Unknown')}': Invalid energy_units: '{input_units.iat[i]}'. Allowed: mbtu, gj"
+            for i in np.flatnonzero(~allowed).tolist()
+        ]
+        return [project for project, ok in zip(projects, allowed) if ok], validation_errors
+
+    @staticmethod
+    def _enum_name_set(enum_cache, table: str, valid_values: List[str]) -> frozenset:
+        """The enum cache's set of names of table, built from valid_values when the cache has none"""
+        try:
+            return enum_cache.name_set(table.removeprefix('enum_'))
+        except Exception:
+            return frozenset(valid_values)
+
+    def _fetch_database_enums(self, enum_cache) -> Dict[str, List[str]]:
+        """Fetch enum values from the enum cache"""
         enums = {}
         
         enum_tables = [
@@ -283,8 +353,7 @@ class MultiProjectExcelParser:
         
         for table in enum_tables:
             try:
-                response = supabase_client.table(table).select('name').execute()
-                enums[table] = [row['name'] for row in response.data]
+                enums[table] = enum_cache.names(table.removeprefix('enum_'))
             except Exception as e:
                 printer(f"Error fetching {table}: {str(e)}")
                 enums[table] = []
@@ -292,47 +361,26 @@ class MultiProjectExcelParser:
         return enums
 
 
-def is_multi_project_excel(url: str) -> bool:
+def is_multi_project_excel(url: str, content: Optional[bytes] = None, workbook: Optional[WorkbookSource] = None) -> bool:
     """
     Check if an Excel file is a multi-project file by looking for multiple project rows
     
     Args:
         url: URL to the Excel file
+        content: Raw file bytes, if they have already been downloaded
+        workbook: WorkbookSource of the file, if it has already been opened
         
     Returns:
         True if it's a multi-project Excel file, False otherwise
     """
     try:
-        if url.startswith('http'):
-            response = requests.get(url)
-            excel_file = io.BytesIO(response.content)
-        else:
-            # Handle local file paths
-            excel_file = url
-            
-        # Try reading with different header positions to handle instruction rows
-        df = None
-        for header_row in [0, 1, 2, 3]:
-            try:
-                df_test = pd.read_excel(excel_file, sheet_name=0, header=header_row)
-                # Check if this looks like the right header row
-                if ('project_name' in df_test.columns and 
-                    'conditioned_area_sf' in df_test.columns and 
-                    'project_use_type' in df_test.columns):
-                    df = df_test
-                    break
-            except:
-                continue
+        df = read_project_table(workbook_source(url, content, workbook))
         
         if df is None:
             return False
         
-        # Remove any completely empty rows
-        df = df.dropna(how='all').reset_index(drop=True)
-        
         # Check if we have the required multi-project columns
-        required_columns = ['project_name', 'conditioned_area_sf', 'project_use_type']
-        has_required_columns = all(col in df.columns for col in required_columns)
+        has_required_columns = all(col in df.columns for col in MULTI_PROJECT_HEADER_COLUMNS)
         
         # Check if we have multiple rows with project data
         has_multiple_projects = len(df) > 1
@@ -352,23 +400,28 @@ def is_multi_project_excel(url: str) -> bool:
         return False
 
 
-def parse_multi_project_excel_report(url: str) -> Dict[str, Any]:
+def parse_multi_project_excel_report(url: str, content: Optional[bytes] = None,
+                                     workbook: Optional[WorkbookSource] = None) -> Dict[str, Any]:
     """
     Main function to parse multi-project Excel report
     
     Args:
         url: URL to the Excel file
+        content: Raw file bytes, if they have already been downloaded
+        workbook: WorkbookSource of the file, if it has already been opened
         
     Returns:
         Dictionary containing parsing results
     """
+    workbook = workbook_source(url, content, workbook)
+    
     # First check if this is actually a multi-project Excel file
-    if not is_multi_project_excel(url):
+    if not is_multi_project_excel(url, workbook=workbook):
         # Raise exception to let the system try other parsers
         raise Exception("Not a multi-project Excel file")
     
     parser = MultiProjectExcelParser()
-    result = parser.parse_multi_project_excel(url)
+    result = parser.parse_multi_project_excel(url, workbook=workbook)
     
     # For multi-project Excel, we need to return a format that won't be processed by post_processing
     # Instead, we'll return a special format that signals to the upload handler to use multi-project service
@@ -389,7 +442,9 @@ def parse_multi_project_excel_report(url: str) -> Dict[str, Any]:
             'projects': result['projects'],
             'validation_errors': result['validation_errors'],
             'warnings': result.get('validation_errors', []),
-            'report_type': 9  # Use numeric report type
+            'report_type': 9,  # Use numeric report type
+            # handed to the multi-project service so it does not parse the file again
+            'parse_result': result
         }
     else:
         # If parsing failed, raise exception to let system try other parsers
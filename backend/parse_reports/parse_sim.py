@@ -5,15 +5,16 @@ from parse_reports.parse_equest_beps_for_sim import *
 import requests
 
 ###parse SIM file
-def parse_report_sim(url):
+def parse_report_sim(url, content=None):
     #this_file_path='temp/8002 Base - Baseline Design.sim'
 
     #filename = Path('temp/report.sim')
     
 
     #takes URL from Airatble and stores that PDF to the path, above
-    response = requests.get(url)
-    text_file = io.BytesIO(response.content)
+    if content is None:
+        content = requests.get(url).content
+    text_file = io.BytesIO(content)
 
     #filename='temp/20220623-Baseline-IO.SIM.pdf'
     #filename='temp/Skycenter_Building-PRM-Report_approved.pdf'
@@ -1,10 +1,12 @@
 import pandas as pd
 from post_processing import printer
+from parse_reports.workbook_source import workbook_source
 
 
-def parse_xlsx_report(url):
+def parse_xlsx_report(url, content=None, workbook=None):
     #attachment_url='temp/generic_upload_test.xlsx'
-    df=pd.read_excel(url)
+    #copy, the frame is shared through the workbook and is changed below
+    df=workbook_source(url, content, workbook).frame(0).copy()
 
     report_type='generic_xlsx'
     conditioned_area=df.iloc[0,df.columns.get_loc('conditioned_area')]
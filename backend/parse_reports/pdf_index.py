@@ -0,0 +1,124 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pdfplumber
+
+##Page text cache for PDF reports
+##Built once per upload and shared by report detection and the pdfplumber based parsers, so each
+##page's text is extracted at most once instead of once per marker search
+
+
+class PdfDocumentIndex:
+    """
+    Lazily extracted, cached page text for a PDF plus an inverted index of marker phrase -> page numbers
+
+    Args:
+        content: raw PDF bytes
+        max_workers: when set, extract_all() extracts page text in a thread pool of this size
+    """
+
+    def __init__(self, content, max_workers=None):
+        self.content = content
+        self.max_workers = max_workers
+        self.pdf = pdfplumber.open(io.BytesIO(content))
+        self.pages = self.pdf.pages
+        self._page_text = {}
+        self._marker_pages = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self.pdf.close()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def page(self, page_no):
+        return self.pages[page_no]
+
+    def page_text(self, page_no):
+        """Text of a single page, extracted on first use"""
+        text = self._page_text.get(page_no)
+        if text is None:
+            text = self.pages[page_no].extract_text() or ''
+            with self._lock:
+                self._page_text[page_no] = text
+        return text
+
+    def extract_all(self):
+        """Extract the text of every page not already cached, in a thread pool if max_workers is set"""
+        missing = [i for i in range(len(self.pages)) if i not in self._page_text]
+        if not missing:
+            return
+        if not self.max_workers or self.max_workers < 2 or len(missing) < 2:
+            for i in missing:
+                self.page_text(i)
+            return
+
+        #pdfplumber page objects are not thread safe, so each worker opens its own handle on the bytes
+        local = threading.local()
+        handles = []
+
+        def extract(page_no):
+            pdf = getattr(local, 'pdf', None)
+            if pdf is None:
+                pdf = pdfplumber.open(io.BytesIO(self.content))
+                local.pdf = pdf
+                with self._lock:
+                    handles.append(pdf)
+            return page_no, pdf.pages[page_no].extract_text() or ''
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for page_no, text in executor.map(extract, missing):
+                    with self._lock:
+                        self._page_text[page_no] = text
+        finally:
+            for pdf in handles:
+                pdf.close()
+
+    def pages_with(self, marker):
+        """All page numbers (ascending) whose text contains the marker"""
+        if marker not in self._marker_pages:
+            if self.max_workers:
+                self.extract_all()
+            self._marker_pages[marker] = [i for i in range(len(self.pages)) if marker in self.page_text(i)]
+        return self._marker_pages[marker]
+
+    def first_page_with(self, *markers, start=0):
+        """
+        First page number at or after start whose text contains all of the markers, or None
+
+        Pages are only extracted until a match is found.
+        """
+        if all(marker in self._marker_pages for marker in markers):
+            common = set(self._marker_pages[markers[0]]).intersection(*[self._marker_pages[m] for m in markers[1:]])
+            matches = sorted(i for i in common if i >= start)
+            return matches[0] if matches else None
+        for i in range(start, len(self.pages)):
+            txt = self.page_text(i)
+            if all(marker in txt for marker in markers):
+                return i
+        return None
+
+    def last_page_with(self, marker):
+        """Last page number whose text contains the marker, or None"""
+        pages = self.pages_with(marker)
+        return pages[-1] if pages else None
+
+
+def open_pdf_index(url=None, content=None, pdf_index=None, max_workers=None):
+    """Returns the shared index if one was passed in, otherwise builds one from the bytes (downloading them if needed)"""
+    if pdf_index is not None:
+        return pdf_index
+    if content is None:
+        #imported here because report_detection imports this module
+        from parse_reports.report_detection import fetch_report_bytes
+        content = fetch_report_bytes(url)
+    return PdfDocumentIndex(content, max_workers=max_workers)
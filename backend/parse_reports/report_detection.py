@@ -0,0 +1,117 @@
+import io
+import zipfile
+
+import requests
+
+from parse_reports.pdf_index import PdfDocumentIndex
+
+##Detects the report type of an uploaded file from its content so that run_script_master
+##only downloads the file once and hands the same bytes to exactly one parser
+
+PDF_MAGIC = b'%PDF'
+ZIP_MAGIC = b'PK\x03\x04'
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # legacy .xls
+
+#marker strings that identify each report, checked in order
+BEPS_MARKER = "REPORT- BEPS Building Energy Performance"
+PRM_MARKER = "Performance Rating Table - PRM Compliance"
+IESVE_MARKER = "Energy End Use"
+EPLUS_MARKERS = ["Environment: ", "EnergyPlus"]
+
+#parsers to fall back to (in order) when the container type is known but no marker matched
+FALLBACK_REPORT_TYPES = {
+    'pdf': [1, 5],
+    'html': [2],
+    'text': [3, 2],
+    'xlsx': [9, 4],
+}
+
+
+def fetch_report_bytes(url):
+    """Download the report once; local paths are read from disk."""
+    if url.startswith('http'):
+        response = requests.get(url)
+        response.raise_for_status()
+        return response.content
+    with open(url, 'rb') as f:
+        return f.read()
+
+
+def sniff_container(content):
+    """Returns 'pdf', 'xlsx', 'html', 'text' or None from the leading bytes of the file."""
+    if not content:
+        return None
+    head = content[:1024]
+    if head.startswith(PDF_MAGIC):
+        return 'pdf'
+    if head.startswith(ZIP_MAGIC) or head.startswith(OLE_MAGIC):
+        return 'xlsx'
+    head_text = head.decode('utf-8', errors='ignore').lstrip().lower()
+    if head_text.startswith('<!doctype html') or '<html' in head_text:
+        return 'html'
+    #binary files that are none of the above
+    if b'\x00' in head:
+        return None
+    return 'text'
+
+
+def _detect_pdf(pdf_index):
+    if len(pdf_index) == 0:
+        return None
+    first_page_text = pdf_index.page_text(0)
+    if PRM_MARKER in first_page_text:
+        return 8
+    if BEPS_MARKER in first_page_text:
+        return 5
+    if IESVE_MARKER in first_page_text:
+        return 1
+    #BEPS and PRM tables are usually a few pages in
+    if pdf_index.pages_with(PRM_MARKER):
+        return 8
+    if pdf_index.pages_with(BEPS_MARKER):
+        return 5
+    return None
+
+
+def _detect_xlsx(content, workbook=None):
+    #imported here to avoid a circular import with post_processing
+    from parse_reports.parse_multi_project_xlsx import is_multi_project_excel
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            if not any(name.startswith('xl/') for name in zf.namelist()):
+                return None
+    except zipfile.BadZipFile:
+        #legacy .xls (OLE) files are not zip archives
+        pass
+    if is_multi_project_excel('', content=content, workbook=workbook):
+        return 9
+    return 4
+
+
+def detect_report_type(content, pdf_index=None, workbook=None):
+    """
+    Fingerprint the report bytes and return the matching report type id.
+
+    Args:
+        content: raw bytes of the uploaded report
+        pdf_index: PdfDocumentIndex already built for these bytes, so the page text can be reused by the parser
+        workbook: WorkbookSource of these bytes, so the sheet read for detection is reused by the parser
+
+    Returns:
+        Tuple of (report_type id or None, container type or None)
+    """
+    container = sniff_container(content)
+    if container == 'pdf':
+        if pdf_index is None:
+            with PdfDocumentIndex(content) as pdf_index:
+                return _detect_pdf(pdf_index), container
+        return _detect_pdf(pdf_index), container
+    if container == 'xlsx':
+        return _detect_xlsx(content, workbook), container
+    if container in ('html', 'text'):
+        text = content.decode('utf-8', errors='ignore')
+        if BEPS_MARKER in text and container == 'text':
+            return 3, container
+        if any(marker in text for marker in EPLUS_MARKERS):
+            return 2, container
+    return None, container
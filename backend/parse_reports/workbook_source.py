@@ -0,0 +1,93 @@
+import io
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from parse_reports.report_detection import fetch_report_bytes
+
+##Excel workbook handle for uploads
+##Built once per upload and shared by multi-project detection, the multi-project parser and the generic xlsx parser,
+##so the file is downloaded once, opened once with openpyxl in read-only mode and each sheet layout parsed once.
+##Header rows are found by scanning the values of the first rows instead of reading the sheet with every candidate header.
+
+# rows scanned for a header row, e.g. the multi-project template has instruction rows above its header
+HEADER_SCAN_ROWS = 4
+
+
+class WorkbookSource:
+    """
+    Bytes of an Excel upload with its first sheet read lazily and cached
+
+    Args:
+        content: raw workbook bytes
+        url: where the bytes came from, for messages only
+    """
+
+    def __init__(self, content, url=None):
+        self.content = content
+        self.url = url
+        self._workbook = None
+        self._head_rows = None
+        self._frames = {}
+
+    @classmethod
+    def from_url(cls, url):
+        """Download the workbook once; local paths are read from disk"""
+        return cls(fetch_report_bytes(url), url)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+
+    def _open(self):
+        if self._workbook is None:
+            # the same options pandas uses when it opens a workbook itself
+            self._workbook = load_workbook(io.BytesIO(self.content), read_only=True, data_only=True, keep_links=False)
+        return self._workbook
+
+    def head_rows(self):
+        """Cell values of the first HEADER_SCAN_ROWS rows of the first sheet, rows are numbered like pd.read_excel's header"""
+        if self._head_rows is None:
+            sheet = self._open().worksheets[0]
+            # read-only sheets can report a used range that skips leading empty rows
+            sheet.reset_dimensions()
+            self._head_rows = [list(row) for row in sheet.iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True)]
+        return self._head_rows
+
+    def find_header_row(self, columns):
+        """Index of the first scanned row that holds every one of columns, None if there is none"""
+        for index, row in enumerate(self.head_rows()):
+            if all(column in row for column in columns):
+                return index
+        return None
+
+    def frame(self, header=0):
+        """
+        The first sheet as pd.read_excel(..., sheet_name=0, header=header) reads it, parsed once per header row
+
+        The DataFrame is shared by every caller: copy it before changing it in place.
+        """
+        if header not in self._frames:
+            workbook = self._open()
+            try:
+                self._frames[header] = pd.read_excel(workbook, engine='openpyxl', sheet_name=0, header=header)
+            finally:
+                # pandas closes the workbook it was given, the next read opens the bytes again
+                self._workbook = None
+        return self._frames[header]
+
+
+def workbook_source(url, content=None, workbook=None):
+    """The workbook handle of an upload: workbook if given, otherwise one built from content or downloaded from url"""
+    if workbook is not None:
+        return workbook
+    if content is not None:
+        return WorkbookSource(content, url)
+    return WorkbookSource.from_url(url)
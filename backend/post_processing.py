@@ -5,6 +5,7 @@ import pandas as pd
 import re
 import os
 import time
+from types import MappingProxyType
 
 import logging_start
 from parse_reports.parse_eplus import *
@@ -15,6 +16,9 @@ from parse_reports.parse_sim import *
 from parse_reports.parse_iesve import *
 from parse_reports.parse_equest_standard import *
 from parse_reports.parse_multi_project_xlsx import parse_multi_project_excel_report
+from parse_reports.report_detection import detect_report_type, fetch_report_bytes, sniff_container, FALLBACK_REPORT_TYPES
+from parse_reports.pdf_index import PdfDocumentIndex
+from parse_reports.workbook_source import WorkbookSource
 import traceback
 from weather_location import weather_check
 
@@ -23,6 +27,22 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 
 BUCKET_NAME = os.getenv('BUCKET_NAME')
 
+#threads used to extract PDF page text, unset extracts pages lazily on the request thread
+PDF_TEXT_WORKERS = int(os.getenv('PDF_TEXT_WORKERS', '0')) or None
+
+#report types whose parsers read the PDF through a shared PdfDocumentIndex
+PDF_INDEX_REPORT_TYPES = [1, 5, 8]
+
+#report types whose parsers read the workbook through a shared WorkbookSource
+WORKBOOK_REPORT_TYPES = [4, 9]
+
+#standard fields and the report field -> standard field mapping, loaded once at import
+FIELD_LIST = pd.read_csv(os.path.join(current_dir, 'dependencies/field_list.csv'))
+FIELD_NAMES = tuple(FIELD_LIST['field'])
+COLUMN_MAPPING = pd.read_csv(os.path.join(current_dir, 'dependencies/column_mapping.csv'))
+COLUMN_MAPPING_BY_REPORT = MappingProxyType({report: df_report.reset_index(drop=True) for report, df_report in COLUMN_MAPPING.groupby('report')})
+EMPTY_COLUMN_MAPPING = COLUMN_MAPPING.iloc[0:0]
+
 
 
 
@@ -31,18 +51,25 @@ def printer(str):
   print(str)
   logging_start.logger.info(str)
 
-def post_process(df_output):
-  #imports the list of standard fields
-  df_fields = pd.read_csv(os.path.join(current_dir, 'dependencies/field_list.csv'))
+def _field_totals(df_cm_output, conditioned_sf):
+  """
+  Sums every mapped report row into the standard fields in one groupby pass
 
-  column_fields=[]
-  df_cf=pd.Series(column_fields,dtype=object)
+  Returns a DataFrame indexed by field (in field_list order) with one column per output row:
+  'report_values' (only when the input had uncommon units), 'mbtu' and 'kbtu/sf'
+  """
+  value_columns = [col for col in ['energy_value', 'energy_value_report'] if col in df_cm_output.columns]
+  sums = df_cm_output.groupby('eeu_name')[value_columns].sum().reindex(FIELD_NAMES, fill_value=0.0)
 
-  for i in range(df_fields.shape[0]):
+  totals = pd.DataFrame(index=sums.index)
+  if 'energy_value_report' in sums.columns:
+    totals['report_values'] = sums['energy_value_report']
+  totals['mbtu'] = sums['energy_value']
+  totals['kbtu/sf'] = sums['energy_value']*1000/conditioned_sf
+  return totals
 
-    df_cf = pd.concat([df_cf,pd.Series([df_fields.iloc[i,0]])])
 
-  df_2_full=pd.DataFrame()
+def post_process(df_output):
   df_output = df_output.reset_index(drop=True)
   report_type = df_output.loc[0]['report']
 
@@ -81,8 +108,6 @@ def post_process(df_output):
     df_output['energy_units']='mbtu' 
     df_output['energy_units_report']="kbtu"
     uncommon_units=True
-  energy_units = df_output.loc[0]['energy_units']+'/sf'
-  df_cm = pd.read_csv(os.path.join(current_dir, 'dependencies/column_mapping.csv'))
   
   try:
     weather_string = str(df_output.loc[0]['weather_string'])
@@ -106,7 +131,7 @@ def post_process(df_output):
         'state': ''
     }
 
-  df_cm = df_cm[df_cm['report'] == report_type] 
+  df_cm = COLUMN_MAPPING_BY_REPORT.get(report_type, EMPTY_COLUMN_MAPPING)
   df_cm_output = pd.merge(df_output,df_cm,on="report_field",how='outer')
 
   ##figure out number of rows per output per report
@@ -115,96 +140,52 @@ def post_process(df_output):
 
   else:
     report_rows=['mbtu','kbtu/sf']
-  #creates a list of output records that is used to mark multiple records as invalid if an error comes up
-  output_records=[]
-  for k in range(len(report_rows)):
-    if(report_rows[k]=='report_values'):
-      energy_units = df_cm_output.loc[0]['energy_units_report']
-      energy_value_to_use='energy_value_report'
-      energy_multiplier=1
-      divide_by_val=1
-    elif(report_rows[k]=='mbtu'):
-      energy_units = 'mbtu'
-      energy_value_to_use='energy_value'
-      energy_multiplier=1
-      divide_by_val=1
-    elif(report_rows[k]=='kbtu/sf'):
-      energy_units = 'kbtu/sf'
-      energy_value_to_use='energy_value'
-      energy_multiplier=1000
-      divide_by_val=conditioned_sf
-    df_fields_list= pd.read_csv(os.path.join(current_dir, 'dependencies/field_list.csv'))
-
-    df_fields_list['total_val']=0
-    df_fields_list['units']=energy_units
-    column_fields=[]
-    df_cf=pd.DataFrame(column_fields,dtype=object)
-    for i in range(df_fields_list.shape[0]):
-      fieldname=df_fields_list.iloc[i, 0]
-
-      df_fields_list.iloc[i,df_fields_list.columns.get_loc('total_val')] = df_cm_output.loc[df_cm_output['eeu_name'] == fieldname, energy_value_to_use].sum()*energy_multiplier/divide_by_val
-
-      df_cf = pd.concat([df_cf,pd.Series([df_fields_list.iloc[i,0]])])
-      
-    df_cf = df_cf.reset_index(drop=True)
-
-    #create a list of the fuel sources within df_fields
-    fuel_sources=df_fields_list['fuel_source'].unique().tolist()
-    num_fuel_sources=len(fuel_sources)
-    total_energy=0
-
-    #run look for each of the fuel sources
-    for j in range(num_fuel_sources):
-      this_fuel_source = fuel_sources[j]
-
-      #sum up the total energy for each fuel source
-      fuel_source_total = df_fields_list.loc[df_fields_list['fuel_source'] == this_fuel_source, 'total_val'].sum()
-      total_energy=total_energy+fuel_source_total
-
-      #create a new row for the fuel source total which will be added to the main df
-      df_row_total_energy_fuel_source = {'field':'total_'+this_fuel_source,'fuel_source' : this_fuel_source,'total_val': fuel_source_total,'units': energy_units}
-
-      #add the new row to the main df
-      df_fields_list = pd.concat([df_fields_list,pd.DataFrame([df_row_total_energy_fuel_source])],ignore_index=True)
-
-    #create a row for the use_type_total_area
-    df_row_use_type_total_area={'field':'use_type_total_area','fuel_source' : 'na','total_val': conditioned_sf,'units': 'sf'}
-  
-    #add the new row to the main df
-    df_fields_list = pd.concat([df_fields_list,pd.DataFrame([df_row_use_type_total_area])])
-
-    #create a row for the total energy
-    df_row_total_energy={'field':'total_energy','fuel_source' : 'na','total_val': total_energy,'units': 'na'}
-
-    #add the new row to the main df
-    df_fields_list = pd.concat([df_fields_list,pd.DataFrame([df_row_total_energy])])
 
-    #create a new row to show the report type
-    df_row_report_type={'field':'report_type','fuel_source' : 'na','total_val': report_type,'units': 'na'}
-    #add the new row to the main df
-    df_fields_list = pd.concat([df_fields_list,pd.DataFrame([df_row_report_type])])
+  field_totals = _field_totals(df_cm_output, conditioned_sf)
 
-    #create a new row to show the project name
-    df_row_project_name={'field':'project_name','fuel_source' : 'na','total_val': project_name,'units': 'na'}
-    #add the new row to the main df
-    df_fields_list = pd.concat([df_fields_list,pd.DataFrame([df_row_project_name])])
-
-    df_new = df_fields_list.T
-    df_new['energy_units']=df_new.iloc[3,0]
-    df_new.drop(labels=['fuel_source','units'],axis=0,inplace=True)
-    df_new.reset_index(inplace=True,drop=True)
-    new_header = df_new.iloc[0] #grab the first row for the header
-    df_new = df_new[1:] #take the data less the header row
-    df_new.columns = new_header #set the header row as the df header
-    df_new["area_units"]='sf'
-    df_new["weather_station"]=weather_info['city_name']
-    df_new["climate_zone"]=weather_info['climate_zone']
-    df_new['weather_string']=weather_string
-    df_new['zip_code']=weather_info['zip_code']
-    df_new['egrid_subregion']=weather_info['egrid_subregion']
-    df_new = df_new.rename(columns={energy_units:'energy_units'})
-
-    return df_new
+  #the eeu record is built from the first set of totals: report units when they are uncommon, otherwise mbtu
+  report_row = report_rows[0]
+  if(report_row=='report_values'):
+    energy_units = df_cm_output.loc[0]['energy_units_report']
+  else:
+    energy_units = report_row
+
+  df_fields_list = FIELD_LIST.copy()
+  df_fields_list['total_val'] = field_totals[report_row].values
+  df_fields_list['units'] = energy_units
+
+  #sum up the total energy for each fuel source, in the order the fuel sources appear in field_list
+  fuel_source_totals = df_fields_list.groupby('fuel_source', sort=False)['total_val'].sum()
+  total_energy=0
+  for fuel_source_total in fuel_source_totals.values:
+    total_energy=total_energy+fuel_source_total
+
+  #fuel source totals, area, total energy, report type and project name rows added to the main df in one go
+  extra_fields = ['total_'+fuel_source for fuel_source in fuel_source_totals.index] + ['use_type_total_area', 'total_energy', 'report_type', 'project_name']
+  df_extra_rows = pd.DataFrame({
+    'field': extra_fields,
+    'fuel_source': list(fuel_source_totals.index) + ['na']*4,
+    'total_val': list(fuel_source_totals.values) + [conditioned_sf, total_energy, report_type, project_name],
+    'units': [energy_units]*len(fuel_source_totals) + ['sf', 'na', 'na', 'na'],
+  })
+  df_fields_list = pd.concat([df_fields_list, df_extra_rows], ignore_index=True)
+
+  df_new = df_fields_list.T
+  df_new['energy_units']=df_new.iloc[3,0]
+  df_new.drop(labels=['fuel_source','units'],axis=0,inplace=True)
+  df_new.reset_index(inplace=True,drop=True)
+  new_header = df_new.iloc[0] #grab the first row for the header
+  df_new = df_new[1:] #take the data less the header row
+  df_new.columns = new_header #set the header row as the df header
+  df_new["area_units"]='sf'
+  df_new["weather_station"]=weather_info['city_name']
+  df_new["climate_zone"]=weather_info['climate_zone']
+  df_new['weather_string']=weather_string
+  df_new['zip_code']=weather_info['zip_code']
+  df_new['egrid_subregion']=weather_info['egrid_subregion']
+  df_new = df_new.rename(columns={energy_units:'energy_units'})
+
+  return df_new
 
 
 
@@ -212,6 +193,8 @@ def run_script_master(url, **kwargs):
   report_type = kwargs.get('report_type', None)
   area = kwargs.get('conditioned_area', None)
   baseline_design = kwargs.get('baseline_design', None)
+  #workbook already opened by the caller, e.g. parse_upload after multi-project detection
+  workbook = kwargs.get('workbook', None)
   errors=[]
   warnings=[]
   
@@ -231,54 +214,104 @@ def run_script_master(url, **kwargs):
 
   warnings = []
   df_output = None
-
-  if report_type is None:
-    report_types_to_try = report_parsers.keys()
-  else:
-    report_types_to_try = [report_type]
+  timings = {}
 
   total_start_time = time.time()
-  for report_type in report_types_to_try:
-    start_time = time.time()
-    parser_function = report_parsers.get(report_type)
-    print(f"Trying to parse {report_type}...")
-    if parser_function is not None:
+
+  #download the file once and share the bytes with the detection stage and the parser
+  stage_start_time = time.time()
+  try:
+    content = workbook.content if workbook is not None else fetch_report_bytes(url)
+  except Exception as err:
+    printer(f"Error downloading report {url}: {err}")
+    errors.append("There was an error processing your file.")
+    return ["ERROR",errors,warnings]
+  timings['download'] = time.time() - stage_start_time
+
+  #open PDFs once, page text is cached and shared by detection and the parser
+  pdf_index = None
+  if sniff_container(content) == 'pdf':
+    try:
+      pdf_index = PdfDocumentIndex(content, max_workers=PDF_TEXT_WORKERS)
+    except Exception as err:
+      printer(f"Error opening PDF: {err}")
+
+  #workbooks are opened and parsed once, shared by detection and the xlsx parsers
+  own_workbook = workbook is None and sniff_container(content) == 'xlsx'
+  if own_workbook:
+    workbook = WorkbookSource(content, url)
+
+  try:
+    if report_type is None:
+      stage_start_time = time.time()
       try:
-        if parser_function.__name__ == 'parse_report_iesve_prm':
-          output = parser_function(url, baseline_design)
-        else:
-          output = parser_function(url)
-        df_output = output['df']
-        warnings_new = output['warnings']
-        warnings.append(warnings_new)
-        
-        # Check if this is a multi-project Excel file (report type 9)
-        if report_type == 9 and 'projects' in output:
-          # Return the raw multi-project result without post-processing
-          return {
-            "status": "success",
-            "df": df_output,
-            "errors": errors,
-            "warnings": warnings,
-            "report_type": 9,
-            "projects": output['projects'],
-            "validation_errors": output.get('validation_errors', [])
-          }
-        
-        break
+        detected_type, container = detect_report_type(content, pdf_index=pdf_index, workbook=workbook)
       except Exception as err:
-        print(f"Error parsing {report_type}: {err}")
-        logging_start.logger.info(f"Error parsing {report_type}: {err}")
-    end_time = time.time()
-    print(f"Time taken for {report_type}: {end_time - start_time} seconds")
-
-  total_end_time = time.time()
-  print(f"Total time taken: {total_end_time - total_start_time} seconds")
+        printer(f"Error detecting report type: {err}")
+        detected_type, container = None, None
+      timings['detect'] = time.time() - stage_start_time
+      printer(f"Detected report type {detected_type} (container: {container})")
+
+      if detected_type is not None:
+        report_types_to_try = [detected_type]
+      else:
+        #no marker matched, only try the parsers that can read this kind of file
+        report_types_to_try = FALLBACK_REPORT_TYPES.get(container, [])
+    else:
+      report_types_to_try = [report_type]
+
+    stage_start_time = time.time()
+    for report_type in report_types_to_try:
+      parser_function = report_parsers.get(report_type)
+      print(f"Trying to parse {report_type}...")
+      if parser_function is not None:
+        parser_kwargs = {'content': content}
+        if report_type in PDF_INDEX_REPORT_TYPES and pdf_index is not None:
+          parser_kwargs['pdf_index'] = pdf_index
+        if report_type in WORKBOOK_REPORT_TYPES and workbook is not None:
+          parser_kwargs['workbook'] = workbook
+        try:
+          if parser_function.__name__ == 'parse_report_iesve_prm':
+            output = parser_function(url, baseline_design, **parser_kwargs)
+          else:
+            output = parser_function(url, **parser_kwargs)
+          df_output = output['df']
+          warnings_new = output['warnings']
+          warnings.append(warnings_new)
+          
+          # Check if this is a multi-project Excel file (report type 9)
+          if report_type == 9 and 'projects' in output:
+            timings['parse'] = time.time() - stage_start_time
+            printer(f"Report timings (seconds): {timings}")
+            # Return the raw multi-project result without post-processing
+            return {
+              "status": "success",
+              "df": df_output,
+              "errors": errors,
+              "warnings": warnings,
+              "report_type": 9,
+              "projects": output['projects'],
+              "validation_errors": output.get('validation_errors', []),
+              "parse_result": output.get('parse_result')
+            }
+          
+          break
+        except Exception as err:
+          print(f"Error parsing {report_type}: {err}")
+          logging_start.logger.info(f"Error parsing {report_type}: {err}")
+    timings['parse'] = time.time() - stage_start_time
+  finally:
+    if pdf_index is not None:
+      pdf_index.close()
+    if own_workbook:
+      workbook.close()
 
   if df_output is None:
+    printer(f"Report timings (seconds): {timings}")
     errors = ['Unsupported file type.']
     return ["pending", errors, warnings]
 
+  stage_start_time = time.time()
   try:
     post_process_result = post_process(df_output)
   except ValueError as err:
@@ -287,9 +320,13 @@ def run_script_master(url, **kwargs):
     errors.append("There was an error processing your file.")
     traceback.print_exc()
     return ["ERROR",errors,warnings]
+  timings['post_process'] = time.time() - stage_start_time
+  timings['total'] = time.time() - total_start_time
+  printer(f"Report timings (seconds): {timings}")
   
   return {"status":"success",
       "df":post_process_result,
       "errors":errors,
       "warnings":warnings,
-      "report_type":report_type}
\ No newline at end of file
+      "report_type":report_type,
+      "timings":timings}
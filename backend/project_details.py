@@ -3,13 +3,27 @@ import pandas as pd
 from functools import lru_cache
 from pandas import json_normalize
 from gcs_upload import get_signed_url_from_url
-from utils import sanitize_filename, enum_list, return_enum_value
+from utils import sanitize_filename, enum_list, enum_cache
 from conversions import convert_units_in_table, convert_mbtu_to_kbtu_per_sf, convert_mbtu_to_kbtu_df, convert_mbtu_to_gj_df, convert_gj_to_mbtu
 import json
 import uuid
+import asyncio
+from starlette.concurrency import run_in_threadpool
+from end_use_cache import EndUseCache
+from eeu_loader import eeu_loader
+from project_summary import encode_cursor, decode_cursor, quote_value
+import logging_start
 
 list_energy_types = ['electricity', 'fossil_fuels', 'district','other']
 list_onsite_renewables = ['SolarPV_On-SiteRenewables','SolarDHW_On-SiteRenewables','Wind_On-SiteRenewables','Other_On-SiteRenewables']
+
+end_use_cache = EndUseCache()
+
+# upload ids per in_() filter, keeps the request URL short
+EEU_UPLOAD_CHUNK_SIZE = 200
+# PostgREST returns at most max-rows (1000 by default) per request
+EEU_PAGE_SIZE = 1000
+
 def get_uploads_for_project(project_id):
     query = supabase.table('uploads')\
                         .select('id')\
@@ -24,20 +38,78 @@ def get_upload_data(upload_id):
     data, count = query.execute()
     return data[1][0]
 
+def _upload_id_key(upload_id):
+    try:
+        return int(upload_id)
+    except (TypeError, ValueError):
+        return upload_id
+
+
+def get_eeu_data_by_upload(upload_ids, baseline_design=None, columns='id,upload_id,baseline_design,created_at'):
+    """
+    eeu_data rows of any number of uploads, read with in_() filters of EEU_UPLOAD_CHUNK_SIZE upload ids
+
+    Args:
+        upload_ids: upload id or list of upload ids
+        baseline_design: 'baseline', 'design' or a list of both to keep only those rows
+        columns: select string, id and upload_id are always included
+
+    Returns:
+        dict: int upload id -> list of its rows ordered by id, uploads without rows are left out
+    """
+    if not isinstance(upload_ids, (list, tuple, set)):
+        upload_ids = [upload_ids]
+    # ids may arrive as strings (e.g. the change history); rows come back with int upload_id
+    upload_ids = list(dict.fromkeys(_upload_id_key(upload_id) for upload_id in upload_ids if upload_id is not None))
+    selected = [column.strip() for column in columns.split(',')]
+    columns = ','.join(selected + [column for column in ('id', 'upload_id') if column not in selected])
+
+    rows_by_upload = {}
+    for start in range(0, len(upload_ids), EEU_UPLOAD_CHUNK_SIZE):
+        chunk = upload_ids[start:start + EEU_UPLOAD_CHUNK_SIZE]
+        last_id = None
+        while True:
+            query = supabase.table('eeu_data')\
+                                .select(columns)\
+                                .in_('upload_id', chunk)
+            if isinstance(baseline_design, str):
+                query = query.eq('baseline_design', baseline_design)
+            elif baseline_design:
+                query = query.in_('baseline_design', list(baseline_design))
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            rows = query.order('id').limit(EEU_PAGE_SIZE).execute().data or []
+            for row in rows:
+                rows_by_upload.setdefault(_upload_id_key(row['upload_id']), []).append(row)
+            if len(rows) < EEU_PAGE_SIZE:
+                break
+            last_id = rows[-1]['id']
+
+    # keys follow the order of upload_ids, so callers can rely on it
+    return {upload_id: rows_by_upload[upload_id] for upload_id in upload_ids if upload_id in rows_by_upload}
+
+
 def get_eeu_data_ids_for_uploads(upload_ids):
-    if not isinstance(upload_ids, list):
-        upload_ids = [upload_ids]  # Ensure it's a list
+    """eeu_data ids of the uploads, upload by upload"""
+    return [row['id'] for rows in get_eeu_data_by_upload(upload_ids, columns='id').values() for row in rows]
+
 
-    all_data = []
-    for upload_id in upload_ids:
-        query = supabase.table('eeu_data')\
-                            .select('id')\
-                            .eq('upload_id', upload_id)
-        data, count = query.execute()
-        # Extract 'id' from each entry and add to all_data
-        all_data.extend([entry['id'] for entry in data[1]])
+def get_upload_ids_by_type(project_id, baseline_design=('baseline', 'design')):
+    """
+    Upload ids of a project that hold eeu_data of each type, newest upload first
 
-    return all_data
+    Returns:
+        dict: baseline_design -> list of upload ids
+    """
+    types = [baseline_design] if isinstance(baseline_design, str) else list(baseline_design)
+    uploads = supabase.table('uploads')\
+                        .select('id,created_at')\
+                        .eq('project_id', project_id)\
+                        .order('created_at', desc=True)\
+                        .execute().data or []
+    rows_by_upload = get_eeu_data_by_upload([upload['id'] for upload in uploads], types, columns='baseline_design')
+    return {bd: [upload_id for upload_id, rows in rows_by_upload.items() if any(row['baseline_design'] == bd for row in rows)]
+            for bd in types}
 
 def get_latest_upload_id(project_id):
     query = supabase.table('uploads')\
@@ -104,15 +176,12 @@ def get_latest_eeu_data(project_id, **kwargs):
                 return default_response(project_name=project_name)
 
             # Fetch eeu_data rows for those uploads
-            eeu_resp, eeu_count = supabase.table('eeu_data')\
-                                        .select('id,created_at,baseline_design,upload_id')\
-                                        .in_('upload_id', upload_ids)\
-                                        .execute()
+            rows_by_upload = get_eeu_data_by_upload(upload_ids)
 
-            if eeu_count == 0 or not eeu_resp[1]:
+            if not rows_by_upload:
                 return default_response(project_name=project_name)
 
-            df = pd.DataFrame(eeu_resp[1])
+            df = pd.DataFrame([row for rows in rows_by_upload.values() for row in rows])
             # Align with expected column names
             df = df.rename(columns={'id': 'eeu_id'})
             df['created_at'] = pd.to_datetime(df['created_at'])
@@ -244,6 +313,20 @@ def get_use_types():
 
 
 def get_energy_end_uses_data(project_id, baseline_design, **kwargs):
+    output_units = kwargs.get('output_units', 'kbtu/sf')
+
+    # project pages ask for the same pivots several times, serve repeats from the cache
+    cached = end_use_cache.get(project_id, baseline_design, output_units)
+    if cached is not None:
+        return cached
+
+    result = compute_energy_end_uses_data(project_id, baseline_design, output_units=output_units)
+    if result['status'] == 'success':
+        end_use_cache.set(project_id, baseline_design, output_units, result)
+    return result
+
+
+def compute_energy_end_uses_data(project_id, baseline_design, **kwargs):
     
     output_units = kwargs.get('output_units', 'kbtu/sf')
     
@@ -259,17 +342,13 @@ def get_energy_end_uses_data(project_id, baseline_design, **kwargs):
         status = "No latest project available"
         return {"status":status,"baseline_design":baseline_design}
     
-    eeu_query = supabase.table('eeu_data')\
-                        .select('*')\
-                        .eq('id', latest_eeu_data)
-    eeu_data, eeu_count = eeu_query.execute()
+    # the pivot reads every energy field; location and unit checks later in the request reuse this row
+    eeu_data = eeu_loader(supabase).load(latest_eeu_data)
     
-    if eeu_count == 0 or not eeu_data[1]:
+    if eeu_data is None:
         return {"status": "No EEU data found", "baseline_design": baseline_design}
-
-    eeu_data = eeu_data[1][0]
     
-    df_eeu = pd.DataFrame(eeu_data, index=[0])
+    df_eeu = pd.DataFrame(dict(eeu_data), index=[0])
     #df_eeu = df_eeu.T
     energy_units = df_eeu['energy_units'][0]
     
@@ -340,30 +419,15 @@ def get_energy_end_uses_data(project_id, baseline_design, **kwargs):
 
         # Pivot the DataFrame
         df_pivot = df_grouped.pivot(index='use_type', columns=cols_to_pivot, values='energy_value').fillna(0)
-        df_pivot_vals = None
         if export_type == 'end_uses':
-            df_pivot_vals = pd.DataFrame(index=df_pivot.index, columns=df_pivot.columns)
-
-            for row in df_pivot.index:
-                for col in df_pivot.columns:
-                    value = df_pivot.at[row, col]
-                    # Filter df_grouped to ensure lengths match
-                    matches = df_grouped[
-                        (df_grouped['fuel_category'] == col) & 
-                        (df_grouped['use_type'] == row)
-                    ]
-                    editable = not matches.empty  # Check if there are any matches
-                    df_pivot_vals.at[row, col] = {'value': value, 'editable': editable, 'edited': False}
+            # a cell is editable when the use type has an eeu field for that fuel category
+            grouped_cells = pd.MultiIndex.from_frame(df_grouped[['use_type', cols_to_pivot]])
+            pivot_cells = pd.MultiIndex.from_product([df_pivot.index, df_pivot.columns])
+            editable = pivot_cells.isin(grouped_cells).reshape(df_pivot.shape)
         else:
-            df_pivot_vals = pd.DataFrame(index=df_pivot.index, columns=df_pivot.columns)
-
-            for row in df_pivot.index:
-                for col in df_pivot.columns:
-                    value = df_pivot.at[row, col]
-                    # Filter df_grouped to ensure lengths match
+            editable = True
+        df_editable = pd.DataFrame(editable, index=df_pivot.index, columns=df_pivot.columns)
 
- 
-                    df_pivot_vals.at[row, col] = {'value': value, 'editable': True, 'edited': False}
         # Ensure all columns are present, even if they are empty
         for energy_type in energy_type_cols:
             if energy_type not in df_pivot.columns:
@@ -375,7 +439,7 @@ def get_energy_end_uses_data(project_id, baseline_design, **kwargs):
         # Order the columns
         df_pivot = df_pivot[energy_type_cols]
 
-        return {"pivot_table":df_pivot, "pivot_details":df_pivot_vals}
+        return {"pivot_table":df_pivot, "pivot_editable":df_editable}
     
 
     df_renewables = df.loc[df['fuel_category'] == 'onsite_renewables']
@@ -389,15 +453,26 @@ def get_energy_end_uses_data(project_id, baseline_design, **kwargs):
 
     return {"status":status,
             "eeu_data":df_pivot['pivot_table'],
-            "eeu_data_edit_details":df_pivot['pivot_details'],
+            "eeu_data_editable":df_pivot['pivot_editable'],
             "renewables":df_renewables['pivot_table'],
-            "renewables_edit_details":df_renewables['pivot_details'],
+            "renewables_editable":df_renewables['pivot_editable'],
             "use_type_total_area":use_type_total_area,
             "zip_code":zip_code,
             "egrid_subregion":egrid_subregion,
             "eeu_id":eeu_id}
 
-def combine_end_uses_data(project_id, output_units):
+async def fetch_end_uses_sides(project_id, **kwargs):
+    """Baseline and design results of get_energy_end_uses_data, read concurrently on the threadpool"""
+    baseline, design = await asyncio.gather(
+        run_in_threadpool(get_energy_end_uses_data, project_id, 'baseline', **kwargs),
+        run_in_threadpool(get_energy_end_uses_data, project_id, 'design', **kwargs),
+    )
+    return {'baseline': baseline, 'design': design}
+
+
+def combine_end_uses_data(project_id, output_units, sides=None):
+    # sides: baseline/design results already fetched by fetch_end_uses_sides, read here when not given
+    sides = sides or {}
     df_baseline_empty = False
     df_design_empty = False
     
@@ -412,34 +487,33 @@ def combine_end_uses_data(project_id, output_units):
         print(f"Error getting location data: {e}")
         location_data = None
     def append_col_name_baseline_design(df, baseline_design):  
-        df.columns = [f'{col}_{baseline_design}' for col in df.columns]
-        return df
+        return df.set_axis([f'{col}_{baseline_design}' for col in df.columns], axis=1)
     
-    def add_total_row(df, edit_details=False):
-        if edit_details:
-            total = df.applymap(lambda x: x['value'] if isinstance(x, dict) else x).sum(numeric_only=True)
-            total = total.apply(lambda x: {'value': x, 'editable': False, 'edited': False})
-        else:
-            total = df.sum(numeric_only=True)
-        
+    def add_total_row(df):
+        total = df.sum(numeric_only=True)
         total[df.columns[0]] = 'Total'
         df_total = pd.DataFrame(total).T
         df = pd.concat([df, df_total], ignore_index=True)
         return df
-    def check_energy_type_cols(df, energy_type, edit_details):
+    def check_energy_type_cols(df, energy_type):
         energy_type_cols = [f'{energy_type}_baseline', f'{energy_type}_design']
         energy_type_cols = [col for col in energy_type_cols if col in df.columns]
         
-        if edit_details:
-            total_sum = df[energy_type_cols].applymap(lambda x: x['value'] if isinstance(x, dict) else x).sum().sum()
-        else:
-            total_sum = df[energy_type_cols].sum().sum()
+        total_sum = df[energy_type_cols].sum().sum()
 
         if total_sum == 0:
             return True
         else:
             return False
 
+    def edit_detail_cells(df_values, df_editable):
+        # cells with an editable flag become {'value', 'editable', 'edited'}, cells without one keep the plain value
+        df_cells = df_values.astype(object)
+        for col in df_values.columns[1:]:
+            df_cells[col] = [{'value': value, 'editable': bool(flag), 'edited': False} if has_flag else value
+                             for value, flag, has_flag in zip(df_values[col], df_editable[col], df_editable[col].notna())]
+        return df_cells
+
     def create_empty_df(baseline_design,export_type):
         if export_type == 'end_uses':
             col_energy_types = list_energy_types
@@ -464,29 +538,43 @@ def combine_end_uses_data(project_id, output_units):
         return df_blank
 
 
-    def process_eeu_data(df_baseline,df_design,export_type, edit_details=False):
+    def process_eeu_data(df_baseline,df_design,export_type, editable_baseline=None, editable_design=None, edit_details=False):
+        # with edit_details, an editable mask goes through the same merge/total/column steps as the values;
+        # sides without a mask (missing data, baseline renewables) are output as plain values
 
         if export_type == 'end_uses':
             energy_type_cols  = list_energy_types
         elif export_type == 'renewables':
             energy_type_cols = list_onsite_renewables
         
-        def process_df(df, df_type):
+        def process_df(df, df_type, df_editable):
             if isinstance(df, pd.DataFrame):
+                if df_editable is not None:
+                    df = df.reindex(columns=df_editable.columns)
+                    df_editable = df_editable.astype(object)
+                else:
+                    df_editable = pd.DataFrame(None, index=df.index, columns=df.columns, dtype=object)
                 df = append_col_name_baseline_design(df, df_type)
                 df = df.reset_index()
+                df_editable = append_col_name_baseline_design(df_editable, df_type).reset_index()
             else:
                 df = create_empty_df(df_type,export_type)
-            return df
+                df_editable = pd.DataFrame(None, index=df.index, columns=df.columns, dtype=object)
+                df_editable['use_type'] = df['use_type']
+            return df, df_editable
         
-        df_baseline = process_df(df_baseline, 'baseline')
-        df_design = process_df(df_design, 'design')
+        df_baseline, editable_baseline = process_df(df_baseline, 'baseline', editable_baseline)
+        df_design, editable_design = process_df(df_design, 'design', editable_design)
 
 
         df_combined = pd.merge(df_baseline, df_design, on='use_type', how='outer')
         df_output = df_combined
+        # both merges see the same use_type keys, so their rows line up
+        df_editable = pd.merge(editable_baseline, editable_design, on='use_type', how='outer')
         if export_type == 'end_uses':
-            df_output = add_total_row(df_output, edit_details=edit_details)
+            df_output = add_total_row(df_output)
+            total_flags = {col: False for col in df_editable.columns if col != 'use_type'}
+            df_editable = pd.concat([df_editable, pd.DataFrame([{'use_type': 'Total', **total_flags}])], ignore_index=True)
         
         col_order = [f'{energy_type}_{suffix}' for energy_type in energy_type_cols for suffix in ['design', 'baseline']]
         col_order.insert(0, 'use_type')
@@ -496,26 +584,32 @@ def combine_end_uses_data(project_id, output_units):
 
         # Reorder df_output based on the filtered col_order
         df_output = df_output[col_order]
+        df_editable = df_editable[col_order]
 
         if export_type == 'end_uses':
             # Iterate over each energy type in the list of energy types
             for energy_type in energy_type_cols:
                 # Check if the columns for the current energy type are empty (sum to zero)
-                if check_energy_type_cols(df_output, energy_type, edit_details):
+                if check_energy_type_cols(df_output, energy_type):
                     # Create a list of column names to drop for the current energy type
                     cols_to_drop = [f'{energy_type}_baseline', f'{energy_type}_design']
                     # Filter the list to only include columns that actually exist in the DataFrame
                     cols_to_drop = [col for col in cols_to_drop if col in df_output.columns]
                     # Drop the specified columns from the DataFrame
                     df_output = df_output.drop(columns=cols_to_drop)
+                    df_editable = df_editable.drop(columns=cols_to_drop)
         elif export_type == 'renewables':
             #rename 'SolarPV_On-SiteRenewables','SolarDHW_On-SiteRenewables', columns to Solar PV and Solar DHW
             #renewables only have design data, drop baseline data
             cols_to_drop = [col for col in df_output.columns if col.endswith('_baseline')]
             df_output = df_output.drop(columns=cols_to_drop)
+            df_editable = df_editable.drop(columns=cols_to_drop)
             df_output = df_output.rename(columns={'SolarPV_On-SiteRenewables_design':'Solar PV_design',
                                                     'SolarDHW_On-SiteRenewables_design':'Solar DHW_design'})
-            
+            df_editable = df_editable.set_axis(df_output.columns, axis=1)
+
+        if edit_details:
+            df_output = edit_detail_cells(df_output, df_editable)
 
         json_output = df_output.to_json(orient='records')
 
@@ -523,36 +617,38 @@ def combine_end_uses_data(project_id, output_units):
         
 
     
-    baseline = get_energy_end_uses_data(project_id, 'baseline', output_units=output_units)
+    baseline = sides.get('baseline') or get_energy_end_uses_data(project_id, 'baseline', output_units=output_units)
 
+    editable_baseline = None
     if baseline['status'] != "success":
         df_baseline_renewables = baseline['status']
         df_baseline = baseline['status']
-        df_baseline_edit_details = baseline['status']
     else:
         df_baseline_renewables = baseline['renewables']
         df_baseline = baseline['eeu_data']
-        df_baseline_edit_details = baseline['eeu_data_edit_details']
+        editable_baseline = baseline['eeu_data_editable']
 
-    design = get_energy_end_uses_data(project_id, 'design', output_units=output_units)
-    df_design_renewables_edit_details = None
+    design = sides.get('design') or get_energy_end_uses_data(project_id, 'design', output_units=output_units)
+    editable_design = None
+    editable_design_renewables = None
     if design['status'] != "success":
         df_design_renewables = design['status']
         df_design = design['status']
-        df_design_edit_details = design['status']
     else:
         df_design_renewables = design['renewables']
         df_design = design['eeu_data']
-        df_design_edit_details = design['eeu_data_edit_details']
-        df_design_renewables_edit_details = design['renewables_edit_details']
+        editable_design = design['eeu_data_editable']
+        editable_design_renewables = design['renewables_editable']
 
 
 
 
     eeu_data_output = process_eeu_data(df_baseline,df_design,'end_uses')
     renewables_output = process_eeu_data(df_baseline_renewables,df_design_renewables,'renewables')
-    eeu_data_edit_details = process_eeu_data(df_baseline_edit_details,df_design_edit_details,'end_uses', edit_details=True)
-    renewables_edit_details = process_eeu_data(df_baseline_renewables,df_design_renewables_edit_details,'renewables', edit_details=True)
+    eeu_data_edit_details = process_eeu_data(df_baseline,df_design,'end_uses',
+                                             editable_baseline, editable_design, edit_details=True)
+    renewables_edit_details = process_eeu_data(df_baseline_renewables,df_design_renewables,'renewables',
+                                               None, editable_design_renewables, edit_details=True)
     
     # Prepare response with location data
     response = {
@@ -578,7 +674,8 @@ def combine_end_uses_data(project_id, output_units):
 
 
 
-def get_energy_end_uses_chart_data(project_id):
+def get_energy_end_uses_chart_data(project_id, sides=None):
+    sides = sides or {}
     def remove_empty_energy_types(df):
         # Remove any columns that sum to zero
         filtered_df = df.loc[:, (df.sum() != 0)]
@@ -603,8 +700,8 @@ def get_energy_end_uses_chart_data(project_id):
         result = {"series": series, "categories": categories}
         return result
 
-    baseline = get_energy_end_uses_data(project_id, 'baseline')
-    design = get_energy_end_uses_data(project_id, 'design')
+    baseline = sides.get('baseline') or get_energy_end_uses_data(project_id, 'baseline')
+    design = sides.get('design') or get_energy_end_uses_data(project_id, 'design')
     
     baseline_result = process_data(baseline, "baseline")
     design_result = process_data(design, "design")
@@ -617,90 +714,106 @@ def get_energy_end_uses_chart_data(project_id):
     return final_response
 
     
-def get_change_history(project_id):
-    uploads = get_uploads_for_project(project_id)
-    upload_ids = [upload['id'] for upload in uploads]
-    eeu_data_ids = get_eeu_data_ids_for_uploads(upload_ids)
-    
-
-    @lru_cache(maxsize=128)
-    def fetch_user_email(id):
-        query = supabase.from_('profiles')\
-                            .select('email')\
-                            .eq('id', id)
-        data, count = query.execute()
-        return data[1][0]['email']
-    
-    def return_enum_field_clean(field_name):
-        #from enum_list, find the display_name for the field_name
-        for item in enum_list:
-            if item['id'] == field_name:
-                return item['display_name']
-        return field_name
-    
-    def return_enum_list_name(field_name):
-        for item in enum_list:
-            if item['id'] == field_name:
-                return item['list_name']
-        return field_name
-
-    def fetch_event_history(table_name, ref_ids):
-        query = supabase.table('event_history')\
-                            .select('field_name,previous_value,new_value,updated_at,updated_by')\
-                            .eq('table_name', table_name)\
-                            .in_('ref_id', ref_ids)
-        data, count = query.execute()
-        df = pd.DataFrame(data[1])
-
-        # Map updated_by to email
-        try:
-            df['updated_by'] = df['updated_by'].apply(fetch_user_email)
-        except:
-            print("Error fetching user email")
-        try:
-            df['enum_list_name'] = df['field_name'].apply(return_enum_list_name)
-            df['field_name'] = df['field_name'].apply(return_enum_field_clean)
-           
-        except:
-            print("Error cleaning field name")
-        try:
-            if table_name == 'uploads':
-                df['previous_value'] = df.apply(lambda row: return_enum_value(row['enum_list_name'], enum_id=row['previous_value']), axis=1)
-            else:
-                df['previous_value'] = df['previous_value'].astype(str)
-        except:
-            print("Error cleaning previous value")
-        try:
-            if table_name == 'uploads':
-                df['new_value'] = df.apply(lambda row: return_enum_value(row['enum_list_name'], enum_id=row['new_value']), axis=1)
-            else:
-                df['new_value'] = df['new_value'].astype(str)
-        except:
-            print("Error cleaning new value")
-        
-        return df
-    # Fetch event history for each table
-    uploads_history = fetch_event_history('uploads', upload_ids)
-    eeu_data_history = fetch_event_history('eeu_data', eeu_data_ids)
-    projects_history = fetch_event_history('projects', [project_id])
-
-    # Combine all dataframes
-    combined_history = pd.concat([uploads_history, eeu_data_history, projects_history])
-
-    # Check if combined_history is empty or 'updated_at' column is missing
-    if combined_history.empty or 'updated_at' not in combined_history.columns:
-        return json.dumps([])  # Return an empty JSON array
-
-    # Sort by 'updated_at' in descending order
-    combined_history = combined_history.sort_values(by='updated_at', ascending=False)
-
-    # Convert the DataFrame to a list of dictionaries
-    history_list = combined_history.to_dict(orient='records')
-
-    # Convert the list of dictionaries to JSON
-    history_json = json.dumps(history_list)
+CHANGE_HISTORY_MAX_PAGE_SIZE = 1000
+# event_history field names of enum ids -> enum_list entry
+enum_fields = {item['id']: item for item in enum_list}
+
+
+def _fetch_change_history_rows(project_id, since=None):
+    """
+    Every event_history row of the project, its uploads and their eeu_data rows with updated_by as the editor's email,
+    for databases without get_project_change_history. One query per table instead of one per upload and per editor
+    """
+    upload_ids = [str(upload['id']) for upload in get_uploads_for_project(project_id)]
+    eeu_data_ids = [str(eeu_id) for eeu_id in get_eeu_data_ids_for_uploads(upload_ids)] if upload_ids else []
+    refs = [f'and(table_name.eq.projects,ref_id.eq.{quote_value(project_id)})']
+    for table_name, ref_ids in (('uploads', upload_ids), ('eeu_data', eeu_data_ids)):
+        if ref_ids:
+            refs.append(f"and(table_name.eq.{table_name},ref_id.in.({','.join(ref_ids)}))")
+
+    query = supabase.table('event_history')\
+                        .select('id,table_name,field_name,previous_value,new_value,updated_at,updated_by')\
+                        .or_(','.join(refs))
+    if since is not None:
+        query = query.gt('updated_at', since)
+    rows = query.execute().data or []
+
+    user_ids = list({row['updated_by'] for row in rows if row.get('updated_by')})
+    emails = {}
+    if user_ids:
+        profiles = supabase.table('profiles').select('id,email').in_('id', user_ids).execute().data or []
+        emails = {profile['id']: profile['email'] for profile in profiles if profile.get('email')}
+    for row in rows:
+        row['updated_by'] = emails.get(row.get('updated_by'), row.get('updated_by'))
+    return sorted(rows, key=lambda row: (row.get('updated_at') or '', row['id']), reverse=True)
+
+
+def _change_history_record(row):
+    """Display form of an event_history row: enum field names and, for uploads, enum ids as names"""
+    enum_field = enum_fields.get(row.get('field_name'))
+    record = {
+        'field_name': enum_field['display_name'] if enum_field else row.get('field_name'),
+        'previous_value': row.get('previous_value'),
+        'new_value': row.get('new_value'),
+        'updated_at': row.get('updated_at'),
+        'updated_by': row.get('updated_by'),
+        'enum_list_name': enum_field['list_name'] if enum_field else row.get('field_name'),
+    }
+    for value_field in ('previous_value', 'new_value'):
+        if row.get('table_name') != 'uploads':
+            record[value_field] = str(record[value_field])
+        elif enum_field:
+            name = enum_cache.name_for_id(enum_field['list_name'], record[value_field])
+            record[value_field] = record[value_field] if name is None else name
+    return record
+
+
+def get_change_history(project_id, limit=None, cursor=None, since=None):
+    """
+    Edits of a project, its uploads and their end use rows, newest first
+
+    Args:
+        limit: rows per page. Without a limit every row is returned as a JSON list
+        cursor: next_cursor of the previous page
+        since: ISO timestamp, only edits made after it are returned
+
+    Returns:
+        JSON string: the list of edits, or {"rows": [...], "next_cursor": ...} when a limit is given
+    """
+    before = None
+    if cursor:
+        before = decode_cursor(cursor)
+        if len(before) != 2:
+            raise ValueError(f"Invalid cursor: {cursor}")
+    if limit is not None:
+        limit = max(1, min(int(limit), CHANGE_HISTORY_MAX_PAGE_SIZE))
 
-    return history_json
+    try:
+        response = supabase.rpc('get_project_change_history', {
+            'p_project_id': str(project_id),
+            'p_since': since,
+            # one extra row tells whether there is a next page
+            'p_limit': limit + 1 if limit else None,
+            'p_before_updated_at': before[0] if before else None,
+            'p_before_id': before[1] if before else None,
+        }).execute()
+        rows = response.data or []
+    except Exception as e:
+        logging_start.logger.warning(f"get_project_change_history failed, reading event_history directly: {str(e)}")
+        rows = _fetch_change_history_rows(project_id, since)
+        if before:
+            position = (before[0] or '', before[1])
+            rows = [row for row in rows if (row.get('updated_at') or '', row['id']) < position]
+        if limit:
+            rows = rows[:limit + 1]
+
+    if limit is None:
+        return json.dumps([_change_history_record(row) for row in rows])
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor([last.get('updated_at'), last['id']])
+    return json.dumps({'rows': [_change_history_record(row) for row in rows[:limit]], 'next_cursor': next_cursor})
 
 def get_project_energy_summary_data(project_id):
     query = supabase.table('project_energy_summary')\
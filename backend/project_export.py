@@ -0,0 +1,366 @@
+import io
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
+from utils import supabase
+from conversions import convert_sf_to_m2
+from eeu_loader import EEURowLoader
+from weather_location import process_weather_locations
+
+##Bulk project export
+##Builds the multi-project Excel template rows for a whole portfolio with a handful of chunked queries
+##instead of several round trips per project, and streams them out as CSV, Parquet or XLSX one batch of projects at a time.
+
+# ids per in_() filter, keeps the PostgREST query string well under URL length limits
+IN_CHUNK_SIZE = 200
+# projects fetched and encoded per batch
+EXPORT_BATCH_SIZE = 500
+XLSX_READ_CHUNK_SIZE = 64 * 1024
+
+EEU_ENERGY_FIELDS = [
+    'Heating_Electricity', 'Heating_NaturalGas', 'Heating_DistrictHeating', 'Heating_Other',
+    'Cooling_Electricity', 'Cooling_DistrictHeating', 'Cooling_Other',
+    'DHW_Electricity', 'DHW_NaturalGas', 'DHW_DistrictHeating', 'DHW_Other',
+    'Interior Lighting_Electricity', 'Exterior Lighting_Electricity', 'Plug Loads_Electricity',
+    'Process Refrigeration_Electricity', 'Fans_Electricity', 'Pumps_Electricity', 'Pumps_NaturalGas',
+    'Heat Rejection_Electricity', 'Humidification_Electricity', 'HeatRecovery_Electricity', 'HeatRecovery_Other',
+    'ExteriorUsage_Electricity', 'ExteriorUsage_NaturalGas', 'OtherEndUse_Electricity', 'OtherEndUse_NaturalGas', 'OtherEndUse_Other',
+    'SolarDHW_On-SiteRenewables', 'SolarPV_On-SiteRenewables', 'Wind_On-SiteRenewables', 'Other_On-SiteRenewables'
+]
+
+EXPORT_SHARED_FIELDS = [
+    'project_id', 'project_name', 'conditioned_area_sf', 'zip_code', 'city', 'state', 'country',
+    'project_use_type', 'project_construction_category', 'project_phase', 'energy_code', 'report_type',
+    'reporting_year', 'estimated_occupancy_year', 'area_units', 'climate_zone', 'energy_units',
+    'baseline_eui', 'predicted_eui'
+]
+
+EXPORT_COLUMNS = EXPORT_SHARED_FIELDS \
+    + [f'{field}_baseline' for field in EEU_ENERGY_FIELDS] \
+    + [f'{field}_design' for field in EEU_ENERGY_FIELDS]
+
+NUMERIC_EXPORT_COLUMNS = set(['conditioned_area_sf', 'baseline_eui', 'predicted_eui'] + EXPORT_COLUMNS[len(EXPORT_SHARED_FIELDS):])
+PARQUET_SCHEMA = pa.schema([(column, pa.float64() if column in NUMERIC_EXPORT_COLUMNS else pa.string()) for column in EXPORT_COLUMNS])
+
+XLSX_INSTRUCTIONS = [
+    'Multi-Project Upload Template - Fill one row per project',
+    'Include energy data in MBTU. Enter baseline values in blue columns, design values in green columns.',
+    'Enter 0.0 for energy types that do not apply to your project.',
+]
+
+UPLOAD_COLUMNS = ['id', 'project_id', 'created_at', 'year', 'reporting_year', 'custom_project_id']
+LOCATION_COLUMNS = ['zip_code', 'city', 'state']
+EXPORT_EEU_COLUMNS = ['id', 'energy_units', 'weather_string', 'report_type'] + LOCATION_COLUMNS + EEU_ENERGY_FIELDS
+
+# (multiplier, divisor) that bring each energy unit to MBtu, anything not listed is already MBtu
+# the gj factor is the scalar convert_gj_to_mbtu, which conversions.py shadows with its DataFrame version
+MBTU_FACTORS = {'gj': (0.947817, 1.0), 'kbtu': (1.0, 1000.0), 'kbtu/sf': (1.0, 1000.0)}
+
+
+def fetch_in_chunks(table, columns, column, values, chunk_size=IN_CHUNK_SIZE, order=None):
+    """
+    Select rows whose column is in values, one in_() query per chunk of values
+
+    Returns:
+        list: rows from every chunk, in chunk order
+    """
+    values = list(dict.fromkeys(v for v in values if v is not None))
+    rows = []
+    for start in range(0, len(values), chunk_size):
+        query = supabase.table(table).select(columns).in_(column, values[start:start + chunk_size])
+        if order:
+            query = query.order(order)
+        data, count = query.execute()
+        rows.extend(data[1] or [])
+    return rows
+
+
+def _frame(rows, columns):
+    # object dtype keeps ints (years, ids) from being turned into floats when some rows are null
+    return _nulls_to_none(pd.DataFrame(rows, columns=columns, dtype=object))
+
+
+def _nulls_to_none(df):
+    df = df.astype(object)
+    return df.where(df.notna(), None)
+
+
+def get_project_uploads(project_ids):
+    """Every upload for the projects, oldest first"""
+    return _frame(fetch_in_chunks('uploads', ','.join(UPLOAD_COLUMNS), 'project_id', project_ids, order='created_at'), UPLOAD_COLUMNS)
+
+
+def get_latest_eeu_ids(df_uploads):
+    """
+    Latest baseline and design eeu_data ids per project, the bulk form of project_details.get_latest_eeu_data
+
+    Returns:
+        DataFrame: project_id, baseline_id, design_id
+    """
+    eeu_rows = fetch_in_chunks('eeu_data', 'id,upload_id,created_at,baseline_design', 'upload_id', df_uploads['id'])
+    df_eeu = pd.DataFrame(eeu_rows, columns=['id', 'upload_id', 'created_at', 'baseline_design'])
+    if df_eeu.empty:
+        return pd.DataFrame(columns=['project_id', 'baseline_id', 'design_id'])
+
+    df_eeu = df_eeu.merge(df_uploads[['id', 'project_id']].rename(columns={'id': 'upload_id'}), on='upload_id')
+    df_eeu['created_at'] = pd.to_datetime(df_eeu['created_at'], utc=True, format='ISO8601')
+    df_eeu = df_eeu[df_eeu['baseline_design'].isin(['baseline', 'design'])]
+    # first row with the latest created_at wins, matching idxmax
+    df_eeu = df_eeu.sort_values('created_at', ascending=False, kind='stable')
+    latest = df_eeu.drop_duplicates(['project_id', 'baseline_design'])
+    df_latest = latest.pivot(index='project_id', columns='baseline_design', values='id')
+    df_latest = df_latest.reindex(columns=['baseline', 'design']).rename(columns={'baseline': 'baseline_id', 'design': 'design_id'})
+    return _nulls_to_none(df_latest.reset_index())
+
+
+def get_eeu_rows(eeu_ids):
+    """eeu_data rows keyed by id, with the columns the export and the location processing read"""
+    # a loader per batch rather than the request's, so a streamed export keeps one batch of rows in memory
+    return EEURowLoader(supabase).load_many(eeu_ids, EXPORT_EEU_COLUMNS)
+
+
+def get_locations(eeu_rows):
+    """
+    zip code, city and state per eeu id. Rows missing any of them get their weather location processed
+    (and saved) in one batch, as get_location_data does for a single row.
+    """
+    locations = {}
+    missing = []
+    for eeu_id, row in eeu_rows.items():
+        if any(row.get(column) is None for column in LOCATION_COLUMNS):
+            missing.append(row)
+        else:
+            locations[eeu_id] = {column: row.get(column) for column in LOCATION_COLUMNS}
+    if missing:
+        locations.update(process_weather_locations(missing))
+    return locations
+
+
+def _column(df, column):
+    if column in df:
+        return df[column]
+    return pd.Series(None, index=df.index, dtype=object)
+
+
+def _energy_values(df_eeu, multipliers, divisors):
+    """Energy fields converted to MBtu, nulls and values that are not numbers become 0.0"""
+    df_eeu = df_eeu.reindex(columns=EEU_ENERGY_FIELDS)
+    values = df_eeu.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return np.nan_to_num(values * multipliers[:, None] / divisors[:, None], nan=0.0)
+
+
+def exportable_rows(summary_rows):
+    """project_energy_summary rows that can be exported (the ones with a project_id)"""
+    return [row for row in summary_rows if row.get('project_id')]
+
+
+def iter_export_frames(summary_rows, is_metric=False, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Template rows for the project_energy_summary rows, batch_size projects at a time
+
+    Each batch is fetched and assembled only when the previous frame has been consumed, so a streamed
+    export holds one batch in memory instead of the whole portfolio.
+    """
+    summary_rows = exportable_rows(summary_rows)
+    for start in range(0, len(summary_rows), batch_size):
+        yield _build_batch(summary_rows[start:start + batch_size], is_metric)
+
+
+def build_export_frame(summary_rows, is_metric=False):
+    """
+    All template rows for the project_energy_summary rows, in EXPORT_COLUMNS order
+
+    Returns an empty frame if none of the rows have a project_id.
+    """
+    frames = list(iter_export_frames(summary_rows, is_metric))
+    if not frames:
+        return pd.DataFrame(columns=EXPORT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _build_batch(summary_rows, is_metric):
+    df = _frame(summary_rows, None)
+    project_ids = df['project_id'].tolist()
+
+    df_uploads = get_project_uploads(project_ids)
+    df_latest = get_latest_eeu_ids(df_uploads)
+    df = _nulls_to_none(df.merge(df_latest, on='project_id', how='left'))
+
+    eeu_rows = get_eeu_rows(df['baseline_id'].tolist() + df['design_id'].tolist())
+    baseline = _nulls_to_none(pd.DataFrame([eeu_rows.get(eeu_id, {}) for eeu_id in df['baseline_id']], index=df.index))
+    design = _nulls_to_none(pd.DataFrame([eeu_rows.get(eeu_id, {}) for eeu_id in df['design_id']], index=df.index))
+
+    # location comes from the design row, or the baseline row when there is no design
+    location_ids = df['design_id'].where(df['design_id'].notna(), df['baseline_id'])
+    locations = get_locations({eeu_id: eeu_rows[eeu_id] for eeu_id in location_ids.dropna() if eeu_id in eeu_rows})
+    df_location = _frame([locations.get(eeu_id) or {} for eeu_id in location_ids], LOCATION_COLUMNS)
+
+    # the most recent upload supplies the custom id and years
+    df_upload = df_uploads.drop_duplicates('project_id', keep='last').set_index('project_id')
+    df_upload = _nulls_to_none(df_upload.reindex(df['project_id']).reset_index(drop=True))
+
+    out = pd.DataFrame(index=df.index)
+    custom_id = df_upload['custom_project_id']
+    out['project_id'] = custom_id.where(custom_id.map(bool), df['project_id']).map(str)
+    out['project_name'] = _column(df, 'project_name')
+    conditioned_area = pd.to_numeric(_column(df, 'conditioned_area'), errors='coerce')
+    if is_metric:
+        conditioned_area = convert_sf_to_m2(conditioned_area)
+    out['conditioned_area_sf'] = conditioned_area.astype(object).where(conditioned_area.notna(), '')
+    for column in LOCATION_COLUMNS:
+        out[column] = df_location[column].map(lambda value: str(value) if value else '')
+    out['country'] = 'United States'
+    out['project_use_type'] = _column(df, 'project_use_type')
+    out['project_construction_category'] = _column(df, 'project_construction_category_name')
+    out['project_phase'] = _column(df, 'project_phase')
+    out['energy_code'] = _column(df, 'energy_code_name')
+    out['report_type'] = _column(df, 'report_type_name')
+
+    current_year = str(datetime.now().year)
+    year = df_upload['year'].map(lambda value: str(value) if value else None)
+    reporting_year = df_upload['reporting_year'].map(lambda value: str(value) if value else None)
+    out['reporting_year'] = reporting_year.where(reporting_year.notna(), year).fillna(current_year)
+    out['estimated_occupancy_year'] = year.fillna(current_year)
+    out['area_units'] = 'sm' if is_metric else 'sf'
+    out['climate_zone'] = _column(df, 'climate_zone').map(lambda value: value.split(' - ')[0] if value and isinstance(value, str) else '')
+
+    # design units win over baseline units, mbtu if neither has any
+    energy_units = pd.Series('mbtu', index=df.index, dtype=object)
+    for side in [baseline, design]:
+        units = _column(side, 'energy_units')
+        energy_units = units.where(units.map(bool), energy_units)
+    out['energy_units'] = energy_units
+
+    for column, source in [('baseline_eui', 'total_energy_per_unit_area_baseline'), ('predicted_eui', 'total_energy_per_unit_area_design')]:
+        eui = pd.to_numeric(_column(df, source), errors='coerce')
+        out[column] = eui.astype(object).where(eui.notna(), '')
+
+    # baseline values are converted with the project's energy units, as are the design values
+    factors = energy_units.map(lambda units: MBTU_FACTORS.get(units, (1.0, 1.0)))
+    multipliers = np.array([factor[0] for factor in factors], dtype=float)
+    divisors = np.array([factor[1] for factor in factors], dtype=float)
+    energy = pd.DataFrame(
+        np.hstack([_energy_values(baseline, multipliers, divisors), _energy_values(design, multipliers, divisors)]),
+        columns=EXPORT_COLUMNS[len(EXPORT_SHARED_FIELDS):],
+        index=df.index,
+    )
+    return pd.concat([out, energy], axis=1)[EXPORT_COLUMNS]
+
+
+def iter_csv(frames):
+    """Yields UTF-8 CSV, the header first and then one chunk per frame"""
+    yield pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(index=False).encode('utf-8')
+    for df in frames:
+        yield df.to_csv(index=False, header=False).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands back whatever was written since the last drain()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_table(df):
+    # blank numbers become nulls so every column keeps a single type
+    columns = {}
+    for column in EXPORT_COLUMNS:
+        if column in NUMERIC_EXPORT_COLUMNS:
+            columns[column] = pd.to_numeric(df[column].replace('', None), errors='coerce').astype(float)
+        else:
+            columns[column] = df[column].map(lambda value: None if value is None else str(value))
+    return pa.Table.from_pandas(pd.DataFrame(columns), schema=PARQUET_SCHEMA, preserve_index=False)
+
+
+def iter_parquet(frames):
+    """Yields a Parquet file with one row group per frame, each written out as soon as it is built"""
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, PARQUET_SCHEMA) as writer:
+        for df in frames:
+            writer.write_table(_parquet_table(df))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
+
+
+def _xlsx_header_cells(ws):
+    thin = Side(style='thin')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    cells = []
+    for header in EXPORT_COLUMNS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cell.border = border
+        # same colour coding as the downloadable template
+        if header.endswith('_baseline'):
+            color = 'E6F3FF'
+        elif header.endswith('_design'):
+            color = 'E6FFE6'
+        else:
+            color = 'F0F0F0'
+        cell.fill = PatternFill(start_color=color, end_color=color, fill_type='solid')
+        cells.append(cell)
+    return cells
+
+
+def iter_xlsx(frames, chunk_size=XLSX_READ_CHUNK_SIZE):
+    """
+    Yields a workbook laid out like d3p-multi-project-template.xlsx: a 'Projects' sheet with the instruction
+    rows, the header row and then one row per project, so the file can be edited and uploaded again.
+
+    openpyxl's write-only mode spools rows to disk as they are appended, but an xlsx is a zip archive that is
+    only complete once saved, so the file is streamed out after the last frame.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Projects')
+    for line in XLSX_INSTRUCTIONS:
+        ws.append([line])
+    ws.append(_xlsx_header_cells(ws))
+    for df in frames:
+        for row in df.itertuples(index=False, name=None):
+            ws.append(list(row))
+
+    with tempfile.TemporaryFile(suffix='.xlsx') as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+# format -> (media type, file extension, encoder)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv', iter_csv),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', iter_parquet),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', iter_xlsx),
+}
@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import base64
+import binascii
+
+import logging_start
+from utils import supabase
+
+##Materialized portfolio summaries
+##project_energy_summary_store and project_latest_upload_by_type5_store hold the rows of the views of the same name.
+##Every write that changes what a project's summary shows calls refresh_project_summaries with the projects or eeu_data rows
+##it touched; reads page through the stores with opaque keyset cursors, ordered by a sort column with the key as tie-breaker.
+
+SUMMARY_PAGE_SIZE = int(os.getenv('PROJECT_SUMMARY_PAGE_SIZE', '500'))
+# PostgREST returns at most max-rows (1000 by default) per request
+SUMMARY_MAX_PAGE_SIZE = 1000
+
+# source -> table, keyset column and filter name -> column
+SUMMARY_SOURCES = {
+    'projects': {
+        'table': os.getenv('PROJECT_SUMMARY_TABLE', 'project_energy_summary_store'),
+        'key': 'project_id',
+        'filters': {'company_id': 'company_id', 'project_id': 'project_id', 'project_phase': 'project_phase_only',
+                    'project_use_type': 'project_use_type', 'climate_zone': 'climate_zone'},
+        'sort': ['project_id', 'project_name', 'custom_project_id', 'most_recent_updated_at', 'year', 'project_phase',
+                 'project_use_type', 'climate_zone', 'conditioned_area', 'total_energy_per_unit_area_baseline',
+                 'total_energy_per_unit_area_design', 'pct_operational_energy_savings', 'net_operational_energy_total'],
+        # the dashboard search, shared with the project export
+        'search': ['project_name', 'project_use_type', 'project_phase', 'climate_zone'],
+    },
+    'latest_uploads': {
+        'table': os.getenv('LATEST_UPLOAD_SUMMARY_TABLE', 'project_latest_upload_by_type5_store'),
+        'key': 'id',
+        'filters': {'company_id': 'company_id', 'project_id': 'project_id', 'project_phase': 'project_phase',
+                    'project_use_type': 'project_use_type', 'climate_zone': 'climate_zone'},
+        'sort': ['id', 'upload_created_at'],
+        'search': ['proj_name', 'project_use_type', 'project_phase', 'climate_zone'],
+    },
+}
+
+COLUMN_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Values of a cursor from encode_cursor. Raises ValueError for anything else"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def quote_value(value):
+    """A value for a PostgREST or()/and() filter, quoted so commas, dots and parentheses are kept literally"""
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def search_filter(search_term, source='projects'):
+    """or() condition matching search_term anywhere in the source's search columns, None for an empty search"""
+    if not search_term or not search_term.strip():
+        return None
+    pattern = quote_value(f'%{search_term.strip()}%')
+    return ','.join(f'{column}.ilike.{pattern}' for column in SUMMARY_SOURCES[source]['search'])
+
+
+def parse_columns(fields):
+    """Select string for a comma separated fields= list. Raises ValueError for anything but plain column names"""
+    if not fields:
+        return '*'
+    columns = list(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    invalid = [column for column in columns if not COLUMN_NAME.match(column)]
+    if invalid or not columns:
+        raise ValueError(f"Invalid fields: {', '.join(invalid) or fields}")
+    return ','.join(columns)
+
+
+def parse_sort(sort, source='projects'):
+    """(column, descending) for a sort= value such as 'project_name' or '-most_recent_updated_at'"""
+    config = SUMMARY_SOURCES[source]
+    if not sort:
+        return config['key'], False
+    column = sort.lstrip('-+')
+    if column not in config['sort']:
+        raise ValueError(f"Cannot sort {source} summaries by {column}")
+    return column, sort.startswith('-')
+
+
+def _keyset_filter(sort_column, descending, key, sort_value, key_value):
+    """or() condition for the rows after (sort_value, key_value), with nulls sorted last"""
+    if sort_column == key:
+        return f"{key}.{'lt' if descending else 'gt'}.{quote_value(key_value)}"
+    if sort_value is None:
+        return f"and({sort_column}.is.null,{key}.gt.{quote_value(key_value)})"
+    return (f"{sort_column}.{'lt' if descending else 'gt'}.{quote_value(sort_value)},"
+            f"and({sort_column}.eq.{quote_value(sort_value)},{key}.gt.{quote_value(key_value)}),"
+            f"{sort_column}.is.null")
+
+
+def refresh_project_summaries(project_ids=None, eeu_ids=None, client=None):
+    """
+    Recompute the stored summary rows of the changed projects
+
+    Args:
+        project_ids: projects whose uploads, eeu_data or project row changed
+        eeu_ids: eeu_data rows that changed, for writes that only know the row id
+
+    Returns:
+        number of projects refreshed, None when there was nothing to do or the refresh failed.
+        Failures are logged and not raised, the write that triggered the refresh has already succeeded.
+    """
+    project_ids = list(dict.fromkeys(str(project_id) for project_id in (project_ids or []) if project_id))
+    eeu_ids = list(dict.fromkeys(int(eeu_id) for eeu_id in (eeu_ids or []) if eeu_id is not None))
+    if not project_ids and not eeu_ids:
+        return None
+    try:
+        response = (client or supabase).rpc('refresh_project_summaries', {'p_project_ids': project_ids or None,
+                                                                         'p_eeu_ids': eeu_ids or None}).execute()
+        return response.data
+    except Exception as e:
+        logging_start.logger.error(f"Error refreshing project summaries for projects {project_ids} eeu_data {eeu_ids}: {str(e)}")
+        return None
+
+
+def rebuild_project_summaries(client=None):
+    """Recompute every stored summary row, e.g. after editing an enum table"""
+    return (client or supabase).rpc('refresh_project_summaries', {}).execute().data
+
+
+def read_project_summaries(source='projects', columns='*', limit=SUMMARY_PAGE_SIZE, cursor=None, client=None,
+                           sort=None, search=None, **filters):
+    """
+    One page of stored summary rows
+
+    Args:
+        source: key of SUMMARY_SOURCES
+        columns: select string, the key and sort columns are always included
+        cursor: next_cursor of the previous page, only valid with the same sort, search and filters
+        sort: column of the source's sort list, '-' prefix for descending. Defaults to the key
+        search: dashboard search term, see search_filter
+        filters: filter names of the source, each a value or a list of values. None is ignored
+
+    Returns:
+        dict: rows, next_cursor (None on the last page) and offset, the number of rows before this page
+    """
+    config = SUMMARY_SOURCES[source]
+    key = config['key']
+    sort_column, descending = parse_sort(sort, source)
+    limit = max(1, min(int(limit), SUMMARY_MAX_PAGE_SIZE))
+    if columns != '*':
+        selected = [column.strip() for column in columns.split(',')]
+        columns = ','.join(selected + [column for column in dict.fromkeys([key, sort_column]) if column not in selected])
+
+    query = (client or supabase).table(config['table']).select(columns)
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in config['filters']:
+            raise ValueError(f"Unknown {source} summary filter: {name}")
+        column = config['filters'][name]
+        query = query.in_(column, list(value)) if isinstance(value, (list, tuple, set)) else query.eq(column, value)
+
+    conditions = [condition for condition in [search_filter(search, source)] if condition]
+    offset = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 3:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        sort_value, key_value, offset = values
+        conditions.append(_keyset_filter(sort_column, descending, key, sort_value, key_value))
+    if len(conditions) == 1:
+        query = query.or_(conditions[0])
+    elif conditions:
+        # PostgREST takes one or= parameter, both conditions have to hold
+        query = query.or_('and(' + ','.join(f'or({condition})' for condition in conditions) + ')')
+
+    if sort_column != key:
+        query = query.order(sort_column, desc=descending, nullsfirst=False)
+    query = query.order(key, desc=descending and sort_column == key)
+
+    # one extra row tells whether there is a next page
+    data, count = query.limit(limit + 1).execute()
+    rows = data[1]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor([last.get(sort_column), last[key], offset + limit])
+    return {'rows': rows[:limit], 'next_cursor': next_cursor, 'offset': offset}
+
+
+def iter_project_summaries(source='projects', columns='*', page_size=SUMMARY_MAX_PAGE_SIZE, client=None,
+                           sort=None, search=None, **filters):
+    """Every matching row, read page by page"""
+    cursor = None
+    while True:
+        page = read_project_summaries(source, columns, page_size, cursor, client, sort, search, **filters)
+        yield from page['rows']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return
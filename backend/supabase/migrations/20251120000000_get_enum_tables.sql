@@ -0,0 +1,19 @@
+-- All enum lookup tables in one round-trip, keyed by list name (table name without the enum_ prefix).
+-- Rows are full table rows ordered by "order"; used by the backend enum cache.
+create or replace function public.get_enum_tables()
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'project_use_types', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_project_use_types t), '[]'::jsonb),
+        'project_phases', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_project_phases t), '[]'::jsonb),
+        'project_construction_categories', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_project_construction_categories t), '[]'::jsonb),
+        'report_types', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_report_types t), '[]'::jsonb),
+        'energy_codes', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_energy_codes t), '[]'::jsonb),
+        'use_type_subtypes', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_use_type_subtypes t), '[]'::jsonb),
+        'climate_zones', coalesce((select jsonb_agg(to_jsonb(t) order by t."order") from public.enum_climate_zones t), '[]'::jsonb)
+    );
+$$;
+
+grant execute on function public.get_enum_tables() to service_role;
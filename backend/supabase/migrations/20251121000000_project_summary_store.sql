@@ -0,0 +1,86 @@
+-- Materialized copies of the portfolio summary views.
+-- project_energy_summary and project_latest_upload_by_type5 rank every upload of every project on each read;
+-- the *_store tables hold their rows and are refreshed per project by the backend after uploads and edits
+-- (refresh_project_summaries), so dashboard reads are indexed lookups with keyset pagination.
+-- The tables copy the views' columns: a migration that changes either view must recreate its store table.
+
+create table if not exists public.project_energy_summary_store as
+    select * from public.project_energy_summary with no data;
+
+alter table public.project_energy_summary_store
+    add constraint project_energy_summary_store_pkey primary key (project_id);
+
+create index if not exists project_energy_summary_store_company_idx
+    on public.project_energy_summary_store (company_id, project_id);
+create index if not exists project_energy_summary_store_phase_idx
+    on public.project_energy_summary_store (company_id, project_phase_only, project_id);
+create index if not exists project_energy_summary_store_use_type_idx
+    on public.project_energy_summary_store (company_id, project_use_type, project_id);
+create index if not exists project_energy_summary_store_climate_zone_idx
+    on public.project_energy_summary_store (company_id, climate_zone, project_id);
+
+create table if not exists public.project_latest_upload_by_type5_store as
+    select * from public.project_latest_upload_by_type5 with no data;
+
+alter table public.project_latest_upload_by_type5_store
+    add constraint project_latest_upload_by_type5_store_pkey primary key (id);
+
+create index if not exists project_latest_upload_by_type5_store_company_idx
+    on public.project_latest_upload_by_type5_store (company_id, id);
+create index if not exists project_latest_upload_by_type5_store_project_idx
+    on public.project_latest_upload_by_type5_store (project_id);
+
+-- both apps read with the service role, which bypasses RLS
+alter table public.project_energy_summary_store enable row level security;
+alter table public.project_latest_upload_by_type5_store enable row level security;
+
+-- Recomputes the stored rows of the given projects (and of the projects owning the given eeu_data rows).
+-- With no arguments every row is rebuilt. Returns the number of projects refreshed, -1 for a full rebuild.
+create or replace function public.refresh_project_summaries(p_project_ids uuid[] default null, p_eeu_ids integer[] default null)
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_project_ids uuid[];
+begin
+    if p_project_ids is null and p_eeu_ids is null then
+        delete from public.project_energy_summary_store;
+        insert into public.project_energy_summary_store select * from public.project_energy_summary;
+        delete from public.project_latest_upload_by_type5_store;
+        insert into public.project_latest_upload_by_type5_store select * from public.project_latest_upload_by_type5;
+        return -1;
+    end if;
+
+    select coalesce(array_agg(distinct project_id), '{}') into v_project_ids
+    from (
+        select unnest(coalesce(p_project_ids, '{}')) as project_id
+        union
+        select u.project_id
+        from public.eeu_data ud
+        join public.uploads u on u.id = ud.upload_id
+        where ud.id = any(coalesce(p_eeu_ids, '{}'))
+    ) ids
+    where project_id is not null;
+
+    -- serialize refreshes of the same projects so concurrent edits cannot interleave delete/insert
+    perform pg_advisory_xact_lock(hashtext(t.id::text)) from unnest(v_project_ids) as t(id) order by t.id;
+
+    delete from public.project_energy_summary_store where project_id = any(v_project_ids);
+    insert into public.project_energy_summary_store
+        select * from public.project_energy_summary where project_id = any(v_project_ids);
+
+    delete from public.project_latest_upload_by_type5_store where project_id = any(v_project_ids);
+    insert into public.project_latest_upload_by_type5_store
+        select * from public.project_latest_upload_by_type5 where project_id = any(v_project_ids);
+
+    return coalesce(array_length(v_project_ids, 1), 0);
+end;
+$$;
+
+-- security definer: only the backend may call it, never the anon or authenticated roles of the browser
+revoke execute on function public.refresh_project_summaries(uuid[], integer[]) from public, anon, authenticated;
+grant execute on function public.refresh_project_summaries(uuid[], integer[]) to service_role;
+
+select public.refresh_project_summaries();
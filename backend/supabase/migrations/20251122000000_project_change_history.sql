@@ -0,0 +1,52 @@
+-- Change history of a project in one query: the event_history rows of the project, its uploads and their eeu_data rows,
+-- with updated_by resolved to the editor's email (the user id when there is no profile).
+-- Rows are ordered newest first by (updated_at, id); p_before_updated_at/p_before_id continue after the last row of a page
+-- and p_since keeps only rows updated after that time.
+
+create index if not exists event_history_table_ref_idx
+    on public.event_history (table_name, ref_id);
+
+create or replace function public.get_project_change_history(
+    p_project_id uuid,
+    p_since timestamptz default null,
+    p_limit integer default null,
+    p_before_updated_at timestamptz default null,
+    p_before_id bigint default null
+)
+returns table (
+    id bigint,
+    table_name text,
+    field_name text,
+    previous_value text,
+    new_value text,
+    updated_at timestamptz,
+    updated_by text
+)
+language sql
+stable
+security definer
+set search_path = public
+as $$
+    select e.id, e.table_name, e.field_name, e.previous_value, e.new_value, e.updated_at,
+           coalesce(p.email, e.updated_by::text) as updated_by
+    from public.event_history e
+    left join public.profiles p on p.id = e.updated_by
+    where (
+            (e.table_name = 'projects' and e.ref_id = p_project_id::text)
+            or (e.table_name = 'uploads' and e.ref_id in (
+                select u.id::text from public.uploads u where u.project_id = p_project_id))
+            or (e.table_name = 'eeu_data' and e.ref_id in (
+                select d.id::text from public.eeu_data d
+                join public.uploads u on u.id = d.upload_id
+                where u.project_id = p_project_id))
+          )
+      and (p_since is null or e.updated_at > p_since)
+      and (p_before_id is null
+           or (coalesce(e.updated_at, '-infinity'), e.id) < (coalesce(p_before_updated_at, '-infinity'), p_before_id))
+    order by coalesce(e.updated_at, '-infinity') desc, e.id desc
+    limit p_limit;
+$$;
+
+-- security definer: only the backend may call it, never the anon or authenticated roles of the browser
+revoke execute on function public.get_project_change_history(uuid, timestamptz, integer, timestamptz, bigint) from public, anon, authenticated;
+grant execute on function public.get_project_change_history(uuid, timestamptz, integer, timestamptz, bigint) to service_role;
@@ -0,0 +1,87 @@
+-- Bulk write path of the multi-project Excel import (MultiProjectService).
+-- The backend builds every project, upload and eeu_data record in memory and sends them in one call per batch;
+-- each row is written in its own subtransaction, so a failing row is rolled back on its own and reported
+-- while the other rows of the batch are kept. A row never leaves a project without its upload or eeu_data.
+
+-- Inserts one record given as jsonb, only the keys present are written so column defaults still apply.
+-- Returns the id of the new row as text.
+create or replace function public.insert_jsonb_row(p_table regclass, p_record jsonb)
+returns text
+language plpgsql
+set search_path = public
+as $$
+declare
+    v_columns text;
+    v_id text;
+begin
+    select string_agg(quote_ident(key), ',') into v_columns from jsonb_object_keys(p_record) as key;
+    execute format('insert into %1$s (%2$s) select %2$s from jsonb_populate_record(null::%1$s, $1) returning id::text',
+                   p_table, v_columns)
+        into v_id using p_record;
+    return v_id;
+end;
+$$;
+
+revoke execute on function public.insert_jsonb_row(regclass, jsonb) from public, anon, authenticated;
+
+-- p_rows: [{"row": n, "project": {...}, "upload": {...}, "eeu_data": [{...}, ...]}, ...]
+-- project.id names the project: an existing project gets the non-null fields of "project", otherwise it is created.
+-- The upload is linked to the project and every eeu_data record to the upload.
+create or replace function public.ingest_multi_project_rows(p_rows jsonb)
+returns table (
+    row_index integer,
+    project_id uuid,
+    upload_id bigint,
+    eeu_ids bigint[],
+    error text
+)
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_row jsonb;
+    v_eeu jsonb;
+    v_project public.projects;
+begin
+    for v_row in select value from jsonb_array_elements(p_rows) loop
+        row_index := (v_row->>'row')::integer;
+        project_id := (v_row->'project'->>'id')::uuid;
+        upload_id := null;
+        eeu_ids := '{}';
+        error := null;
+        begin
+            select * into v_project from public.projects p where p.id = project_id for update;
+            if found then
+                v_project := jsonb_populate_record(v_project, jsonb_strip_nulls(v_row->'project'));
+                update public.projects p
+                   set conditioned_area_sf = v_project.conditioned_area_sf,
+                       climate_zone_id = v_project.climate_zone_id,
+                       project_construction_category_id = v_project.project_construction_category_id,
+                       project_use_type_id = v_project.project_use_type_id
+                 where p.id = project_id;
+            else
+                perform public.insert_jsonb_row('public.projects', v_row->'project');
+            end if;
+
+            upload_id := public.insert_jsonb_row('public.uploads',
+                v_row->'upload' || jsonb_build_object('project_id', project_id))::bigint;
+
+            for v_eeu in select value from jsonb_array_elements(coalesce(v_row->'eeu_data', '[]')) loop
+                eeu_ids := eeu_ids || public.insert_jsonb_row('public.eeu_data',
+                    v_eeu || jsonb_build_object('upload_id', upload_id))::bigint;
+            end loop;
+        exception when others then
+            -- everything this row wrote is rolled back with the subtransaction
+            upload_id := null;
+            eeu_ids := '{}';
+            error := sqlerrm;
+        end;
+        return next;
+    end loop;
+end;
+$$;
+
+-- security definer: only the backend may call it, never the anon or authenticated roles of the browser
+revoke execute on function public.ingest_multi_project_rows(jsonb) from public, anon, authenticated;
+grant execute on function public.ingest_multi_project_rows(jsonb) to service_role;
@@ -0,0 +1,8 @@
+-- Idempotency key of every DDX export attempt: a hash of the project id and the payload sent.
+-- The batch export (external/ddx_batch_export.py) does not send a project again when its payload already
+-- has a successful (200) attempt with the same key.
+alter table "public"."integrations_sync" add column if not exists "idempotency_key" text;
+
+create index if not exists integrations_sync_idempotency_key_idx
+    on public.integrations_sync using btree (idempotency_key)
+    where response_code = '200';
@@ -33,3 +33,8 @@ def test_create_company():
     response = client.post("/create_company/", json=valid_data)
     assert response.status_code == 200
     assert response.json() == "not authorized"
+
+def test_export_projects_to_ddx():
+    response = client.post("/export_projects_to_ddx/", json={"project_ids": ["550e8400-e29b-41d4-a716-446655440010"]})
+    assert response.status_code == 200
+    assert response.json() == "not authorized"
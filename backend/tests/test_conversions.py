@@ -6,7 +6,8 @@ from conversions import (
     convert_kbtu_per_ft2_to_kwh_per_m2, convert_mbtu_to_kwh, convert_sf_to_m2,
     convert_gj_to_mbtu, convert_mbtu_to_gj, convert_mbtu_to_kbtu,
     check_units_eeu_field, get_columns_for_conversion, convert_units_in_table,
-    convert_mbtu_to_kbtu_df, convert_mbtu_to_gj_df, convert_mbtu_to_kbtu_per_sf
+    convert_mbtu_to_kbtu_df, convert_mbtu_to_gj_df, convert_mbtu_to_kbtu_per_sf,
+    UnitConverter, get_unit_converter
 )
 
 
@@ -340,6 +341,61 @@ class TestDataFrameConversions:
         assert pd.isna(result['total_energy'].iloc[2])
 
 
+    @patch('conversions.get_columns_for_conversion')
+    def test_none_cells_stay_none(self, mock_get_columns):
+        """None in an object column is not turned into NaN"""
+        mock_get_columns.return_value = ([], ['total_energy', 'heating'], [])
+
+        df = pd.DataFrame({'total_energy': [1.0, None, '2'], 'heating': [1.0, float('nan'), 3.0]}, dtype=object)
+        df['heating'] = df['heating'].astype(float)
+        result = convert_mbtu_to_kbtu_df(df, Mock())
+
+        assert result['total_energy'].tolist() == [1000.0, None, 2000.0]
+        assert result['heating'].iloc[0] == 1000.0 and pd.isna(result['heating'].iloc[1])
+
+
+class TestUnitConverter:
+    """Test the column_metadata cache and block conversions of UnitConverter"""
+
+    @patch('conversions.get_columns_for_conversion')
+    def test_columns_are_cached_per_table(self, mock_get_columns):
+        mock_get_columns.return_value = ([], ['total_energy'], [])
+        converter = UnitConverter(Mock())
+
+        converter.columns('eeu_data')
+        converter.columns('eeu_data')
+        converter.columns('project_energy_summary')
+        assert mock_get_columns.call_count == 2
+
+        converter.invalidate()
+        converter.columns('eeu_data')
+        assert mock_get_columns.call_count == 3
+
+    @patch('conversions.get_columns_for_conversion')
+    def test_ttl_zero_reloads(self, mock_get_columns):
+        mock_get_columns.return_value = None
+        converter = UnitConverter(Mock(), ttl=0)
+
+        assert converter.columns('eeu_data') == ([], [], [])
+        converter.columns('eeu_data')
+        assert mock_get_columns.call_count == 2
+
+    def test_one_converter_per_client(self):
+        client = Mock()
+        assert get_unit_converter(client) is get_unit_converter(client)
+        assert get_unit_converter(client) is not get_unit_converter(Mock())
+
+    @patch('conversions.get_columns_for_conversion')
+    def test_column_in_several_unit_types(self, mock_get_columns):
+        """A column listed as energy and area is converted by both, in that order"""
+        mock_get_columns.return_value = ([], ['shared'], ['shared'])
+
+        result = convert_units_in_table([{'shared': 2.0}, {'shared': '3'}], 'test_table', 'metric', Mock())
+
+        assert result[0]['shared'] == convert_sf_to_m2(convert_mbtu_to_kwh(2.0))
+        assert result[1]['shared'] == convert_sf_to_m2(convert_mbtu_to_kwh(3.0))
+
+
 class TestConversionEdgeCases:
     """Test edge cases and error handling"""
     
@@ -0,0 +1,211 @@
+import pytest
+import requests
+from unittest.mock import patch
+
+from external import ddx_api
+from external import ddx_batch_export
+from external.ddx_api import DDXMappings, idempotency_key
+from external.ddx_batch_export import export_projects_to_ddx, submit_with_retries
+
+MAPPINGS = DDXMappings({
+    'ddx_use_types': {10: {'id': 10, 'ddx_use_type': 'Office', 'baseline_eui': 52.6}, 11: {'id': 11, 'ddx_use_type': 'Lab'}},
+    'ddx_phase_types': {1: {'id': 1, 'ddx_phase_type': 'Design Development'}},
+    'ddx_energy_codes': {},
+})
+
+DATA = {'projectName': 'P', 'projectId': 'p', 'projectPhase': 'Design Development', 'reportingYear': 2024,
+        'estimatedOccupancyYear': 2025, 'country': 'United States', 'state': 'NY', 'zipcode': '10001', 'city': 'New York',
+        'climateZone': '4A', 'useType1': 'Office', 'useType1Area': 1000, 'designEnergyCode': 'ASHRAE 90.1-2019',
+        'baselineEUI': '53', 'predictedEUI': 40.5, 'energyModelingTool': 'eQuest', 'districtChilledWater': 0,
+        'districtHotWater': 0, 'districtSteam': 0, 'naturalGasCombustedOnSite': 0, 'electricityProducedOffSite': 0,
+        'diesel': 0, 'electricityFromRenewablesOnSite': 0, '_original_useType1': 'Office'}
+
+
+def ok(project_id):
+    return {'status': 'success', 'response': {'id': f'ddx-{project_id}'}}
+
+
+def failed(code, message='error'):
+    return {'status': 'error', 'response_code': code, 'message': message}
+
+
+class UniformKeysTable:
+    """integrations_sync stand-in that rejects a bulk insert as PostgREST does when its rows have different keys"""
+
+    def __init__(self):
+        self.rows = []
+
+    def insert(self, rows):
+        if len({frozenset(row) for row in rows}) > 1:
+            raise Exception("All object keys must match")
+        self.rows.extend(rows)
+        return self
+
+    def execute(self):
+        return ('data', self.rows), ('count', None)
+
+
+class FakeSupabase:
+    def __init__(self, table):
+        self._table = table
+
+    def table(self, name):
+        return self._table
+
+
+class TestDDXMappings:
+    """Test that the prefetched tables give the answers of the per-project queries"""
+
+    @pytest.fixture(autouse=True)
+    def enum_rows(self):
+        rows = {1: {'id': 1, 'ddx_use_type_id': 10}, 2: {'id': 2, 'ddx_use_type_id': 11}, 3: {'id': 3, 'ddx_use_type_id': None}}
+        with patch.object(ddx_api.enum_cache, 'row_by_id', side_effect=lambda table, enum_id: rows.get(enum_id)):
+            yield
+
+    def test_values(self):
+        assert MAPPINGS.value(1, 'ddx_phase_types', 'ddx_phase_type') == 'Design Development'
+        assert MAPPINGS.value(2, 'ddx_phase_types', 'ddx_phase_type') is None
+        assert MAPPINGS.value(None, 'ddx_phase_types', 'ddx_phase_type') is None
+
+    def test_enum_id_lookup_skips_the_database(self):
+        with patch.object(ddx_api, 'get_ddx_value_by_id') as mock_lookup:
+            assert ddx_api.get_ddx_mapping_from_enum_id('enum_project_use_types', 2, 'ddx_use_type_id', 'ddx_use_types',
+                                                        'ddx_use_type', mappings=MAPPINGS) == 'Lab'
+            assert ddx_api.get_ddx_mapping_from_enum_id('enum_project_use_types', 3, 'ddx_use_type_id', 'ddx_use_types',
+                                                        'ddx_use_type', mappings=MAPPINGS) is None
+        mock_lookup.assert_not_called()
+
+    def test_baseline_eui(self):
+        assert MAPPINGS.baseline_eui(1) == 53
+        # no baseline_eui, no linked DDX use type and no enum row all give 0
+        assert [MAPPINGS.baseline_eui(use_type_id) for use_type_id in (2, 3, 4)] == [0, 0, 0]
+
+
+class TestSubmitWithRetries:
+    """Test the retries of one project"""
+
+    def test_retries_with_backoff_and_one_key(self):
+        waits = []
+        key = idempotency_key('a', {'projectId': 'a'})
+        with patch.object(ddx_batch_export, 'import_project',
+                          side_effect=[failed(503), requests.exceptions.ConnectionError('reset'), ok('a')]) as mock_import:
+            result, records = submit_with_retries('a', object(), {'projectId': 'a'}, key, retries=3, backoff=0.5, sleep=waits.append)
+
+        assert result['status'] == 'success' and result['ddx_project_id'] == 'ddx-a' and result['attempts'] == 3
+        assert waits == [0.5, 1.0]
+        assert {call.kwargs['idempotency_key'] for call in mock_import.call_args_list} == {key}
+        assert [record['response_code'] for record in records] == [503, None, '200']
+        assert all(record['idempotency_key'] == key for record in records)
+        assert records[-1]['external_id'] == 'ddx-a' and records[0]['external_id'] is None
+
+    def test_client_errors_are_not_retried(self):
+        with patch.object(ddx_batch_export, 'import_project', return_value=failed(400, 'bad zipcode')) as mock_import:
+            result, records = submit_with_retries('a', object(), {}, 'key', retries=3, sleep=lambda seconds: None)
+        assert mock_import.call_count == 1
+        assert result == {'project_id': 'a', 'status': 'error', 'message': 'bad zipcode', 'attempts': 1}
+        assert len(records) == 1
+
+    @pytest.mark.parametrize('outcome', [failed(500), failed(502), requests.exceptions.ReadTimeout('slow')])
+    def test_failures_after_ddx_got_the_request_are_not_retried(self, outcome):
+        # DDX may have created the project, a retry could create it twice
+        with patch.object(ddx_batch_export, 'import_project', side_effect=[outcome]) as mock_import:
+            result, records = submit_with_retries('a', object(), {}, 'key', retries=3, sleep=lambda seconds: None)
+        assert mock_import.call_count == 1 and result['status'] == 'error' and len(records) == 1
+
+    def test_gives_up_after_retries(self):
+        with patch.object(ddx_batch_export, 'import_project', return_value=failed(429)) as mock_import:
+            result, records = submit_with_retries('a', object(), {}, 'key', retries=2, sleep=lambda seconds: None)
+        assert mock_import.call_count == 3 and result['attempts'] == 3 and len(records) == 3
+
+    def test_key_follows_the_payload(self):
+        assert idempotency_key('a', {'x': 1, 'y': 2}) == idempotency_key('a', {'y': 2, 'x': 1})
+        assert idempotency_key('a', {'x': 1}) != idempotency_key('a', {'x': 2})
+        assert idempotency_key('a', {'x': 1}) != idempotency_key('b', {'x': 1})
+
+
+class TestExportProjectsToDDX:
+    """Test the batch export"""
+
+    @pytest.fixture
+    def ddx(self):
+        def data_for(project_id, mappings=None):
+            if project_id == 'missing':
+                return {'status': 'error', 'message': 'No design EEU data found.'}
+            return {'status': 'success', 'data': dict(DATA, projectId=project_id)}
+
+        def send(project, idempotency_key=None):
+            return failed(400, 'rejected') if project.projectId == 'rejected' else ok(project.projectId)
+
+        with patch.object(ddx_batch_export, 'get_keys', return_value={'firm_key': 'f', 'user_key': 'u'}), \
+             patch.object(ddx_batch_export, 'authenticate', return_value={'authToken': 'token'}) as mock_auth, \
+             patch.object(DDXMappings, 'load', return_value=MAPPINGS) as mock_load, \
+             patch.object(ddx_batch_export, 'get_data_for_ddx', side_effect=data_for) as mock_data, \
+             patch.object(ddx_batch_export, 'import_project', side_effect=send) as mock_import, \
+             patch.object(ddx_batch_export, 'exported_keys', return_value={}) as mock_exported, \
+             patch.object(ddx_batch_export, 'insert_api_calls_db') as mock_insert:
+            yield {'auth': mock_auth, 'load': mock_load, 'data': mock_data, 'import': mock_import,
+                   'exported': mock_exported, 'insert': mock_insert}
+
+    def test_results_in_request_order(self, ddx):
+        result = export_projects_to_ddx(['c', 'missing', 'a', 'rejected', 'c'], 'user',
+                                        edited_values={'a': {'City': 'Albany'}})
+
+        assert [(r['project_id'], r['status']) for r in result['results']] == \
+            [('c', 'success'), ('missing', 'error'), ('a', 'success'), ('rejected', 'error')]
+        assert result['exported'] == 2 and result['failed'] == 2 and result['status'] == 'success'
+        ddx['auth'].assert_called_once()
+        ddx['load'].assert_called_once()
+        assert all(call.kwargs['mappings'] is MAPPINGS for call in ddx['data'].call_args_list)
+
+    def test_attempts_recorded_in_bulk_per_chunk_of_projects(self, ddx):
+        with patch.object(ddx_batch_export, 'DDX_SYNC_FLUSH_PROJECTS', 2):
+            export_projects_to_ddx(['a', 'rejected', 'missing', 'b'], 'user', edited_values={'a': {'City': 'Albany'}})
+
+        # three projects are sent: one insert for the first two finished, one for the last
+        assert [len(call.args[0]) for call in ddx['insert'].call_args_list] == [2, 1]
+        records = {record['project_id']: record for call in ddx['insert'].call_args_list for record in call.args[0]}
+        assert {project_id: record['response_code'] for project_id, record in records.items()} == \
+            {'a': '200', 'rejected': 400, 'b': '200'}
+        assert '"city": "Albany"' in records['a']['outbound_request']
+        assert 'token' not in records['a']['outbound_request']
+        assert records['a']['idempotency_key'].startswith('a:') and records['a']['external_id'] == 'ddx-a'
+
+    def test_mixed_chunk_has_uniform_keys(self, ddx):
+        # postgrest sends bulk inserts without a columns param, PostgREST then needs every row to have the same keys
+        table = UniformKeysTable()
+        with patch.object(ddx_batch_export, 'insert_api_calls_db', ddx_api.insert_api_calls_db), \
+             patch.object(ddx_api, 'supabase', FakeSupabase(table)), \
+             patch.object(ddx_batch_export, 'import_project', side_effect=[failed(429), ok('a')]), \
+             patch.object(ddx_batch_export, 'DDX_RETRY_BACKOFF', 0):
+            result = export_projects_to_ddx(['a'], 'user')
+
+        assert result['exported'] == 1
+        assert [row['response_code'] for row in table.rows] == [429, '200']
+
+    def test_already_exported_payload_is_not_sent_again(self, ddx):
+        ddx['exported'].side_effect = lambda keys: {key: 'ddx-earlier' for key in keys if key.startswith('a:')}
+        result = export_projects_to_ddx(['a', 'b'], 'user')
+
+        assert result['results'][0] == {'project_id': 'a', 'status': 'success', 'message': 'Project already exported',
+                                        'ddx_project_id': 'ddx-earlier', 'attempts': 0}
+        assert result['exported'] == 2
+        assert [call.args[0].projectId for call in ddx['import'].call_args_list] == ['b']
+
+    def test_other_companies_projects_are_not_exported(self, ddx):
+        with patch.object(ddx_batch_export, 'company_project_ids', return_value={'a'}) as mock_owned:
+            result = export_projects_to_ddx(['a', 'foreign'], 'user', company_id=7)
+
+        mock_owned.assert_called_once_with(['a', 'foreign'], 7)
+        assert result['results'][1] == {'project_id': 'foreign', 'status': 'error', 'message': 'Project not found', 'attempts': 0}
+        assert [call.args[0] for call in ddx['data'].call_args_list] == ['a']
+
+    def test_missing_keys(self, ddx):
+        with patch.object(ddx_batch_export, 'get_keys', return_value=None):
+            result = export_projects_to_ddx(['a'], 'user')
+        assert result['status'] == 'error'
+        ddx['insert'].assert_not_called()
+
+    def test_too_many_projects(self, ddx):
+        with patch.object(ddx_batch_export, 'DDX_EXPORT_MAX_PROJECTS', 2):
+            result = export_projects_to_ddx(['a', 'b', 'c'], 'user')
+        assert result == {'status': 'error', 'message': 'At most 2 projects can be exported at once'}
@@ -0,0 +1,126 @@
+import pytest
+
+import eeu_loader
+from eeu_loader import EEURowLoader, eeu_loader_scope
+
+
+class FakeQuery:
+    """Applies the select/eq/in_ calls of EEURowLoader to a dict of rows"""
+
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+        self.columns = '*'
+        self.ids = []
+
+    def select(self, columns):
+        self.columns = columns
+        return self
+
+    def eq(self, column, value):
+        self.ids = [value]
+        return self
+
+    def in_(self, column, values):
+        self.ids = list(values)
+        return self
+
+    def execute(self):
+        self.calls.append((self.columns, self.ids))
+        rows = [self.rows[eeu_id] for eeu_id in self.ids if eeu_id in self.rows]
+        if self.columns != '*':
+            rows = [{column: row.get(column) for column in self.columns.split(',')} for row in rows]
+        return ('data', rows), ('count', None)
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def table(self, name):
+        assert name == 'eeu_data'
+        return FakeQuery(self.rows, self.calls)
+
+
+def make_rows(count):
+    return {i: {'id': i, 'energy_units': 'kbtu', 'zip_code': f'{10000 + i}', 'city': f'City {i}',
+                'Heating_Electricity': str(i)} for i in range(1, count + 1)}
+
+
+class TestEEURowLoader:
+    """Test batching, dedupe and column handling of the loader"""
+
+    def test_same_row_for_every_consumer(self):
+        client = FakeClient(make_rows(3))
+        loader = EEURowLoader(client)
+        first = loader.load(2, ['energy_units'])
+        second = loader.load('2', ['energy_units'])
+        assert first is second
+        assert first['energy_units'] == 'kbtu'
+        assert len(client.calls) == 1
+
+    def test_rows_are_read_only(self):
+        loader = EEURowLoader(FakeClient(make_rows(1)))
+        row = loader.load(1)
+        with pytest.raises(TypeError):
+            row['energy_units'] = 'kwh'
+
+    def test_missing_row_is_not_read_again(self):
+        client = FakeClient(make_rows(1))
+        loader = EEURowLoader(client)
+        assert loader.load(5, ['city']) is None
+        assert loader.load(5, ['city']) is None
+        assert loader.load(None) is None
+        assert len(client.calls) == 1
+
+    def test_more_columns_read_the_difference(self):
+        client = FakeClient(make_rows(2))
+        loader = EEURowLoader(client)
+        loader.load(1, ['energy_units'])
+        row = loader.load(1, ['city'])
+        assert row['energy_units'] == 'kbtu' and row['city'] == 'City 1'
+        assert client.calls[-1][0] == 'city,energy_units,id'
+        # a subset of what was read needs no query
+        loader.load(1, 'energy_units, city')
+        assert len(client.calls) == 2
+
+    def test_primed_ids_are_read_in_one_query(self):
+        client = FakeClient(make_rows(5))
+        loader = EEURowLoader(client).prime([1, 2, 3], ['zip_code'])
+        loader.load(1, ['energy_units'])
+        assert loader.load_many([2, 3], ['zip_code']).keys() == {2, 3}
+        assert len(client.calls) == 1
+        columns, ids = client.calls[0]
+        assert columns == 'energy_units,id,zip_code' and sorted(ids) == [1, 2, 3]
+
+    def test_chunks(self):
+        client = FakeClient(make_rows(7))
+        rows = EEURowLoader(client, chunk_size=3).load_many(range(1, 8), ['city'])
+        assert sorted(rows) == list(range(1, 8))
+        assert [len(ids) for _, ids in client.calls] == [3, 3, 1]
+
+    def test_forget_reads_again(self):
+        client = FakeClient(make_rows(1))
+        loader = EEURowLoader(client)
+        loader.load(1, ['city'])
+        client.rows[1]['city'] = 'Renamed'
+        loader.forget('1')
+        assert loader.load(1, ['city'])['city'] == 'Renamed'
+        assert len(client.calls) == 2
+
+
+class TestLoaderScope:
+    """Test that loaders are shared within a scope only"""
+
+    def test_scope_shares_one_loader(self):
+        client = FakeClient(make_rows(1))
+        with eeu_loader_scope(client) as loader:
+            assert eeu_loader.eeu_loader(client) is loader
+            # another client gets its own loader
+            assert eeu_loader.eeu_loader(FakeClient({})) is not loader
+        assert eeu_loader.eeu_loader(client) is not loader
+
+    def test_no_scope_gives_new_loaders(self):
+        client = FakeClient(make_rows(1))
+        assert eeu_loader.eeu_loader(client) is not eeu_loader.eeu_loader(client)
@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+from unittest.mock import patch, MagicMock
+
+import models
+import project_details
+import update_routes
+from end_use_cache import EndUseCache
+
+
+def make_result(eeu_id=7):
+    index = pd.Index(['Heating', 'Cooling'], name='use_type')
+    eeu_data = pd.DataFrame({'electricity': [1.5, 2.0], 'fossil_fuels': [3.0, 0.0]}, index=index)
+    eeu_data.columns.name = 'fuel_category'
+    eeu_data['district'] = 0
+    editable = pd.DataFrame({'electricity': [True, True], 'fossil_fuels': [True, False]}, index=index)
+    editable.columns.name = 'fuel_category'
+    return {'status': 'success', 'eeu_data': eeu_data, 'eeu_data_editable': editable,
+            'use_type_total_area': 1000.0, 'zip_code': '60601', 'eeu_id': eeu_id}
+
+
+class TestEndUseCache:
+    """Test storage, isolation, invalidation and metrics of the end-use cache"""
+
+    def test_round_trip(self):
+        cache = EndUseCache()
+        result = make_result()
+        cache.set('p1', 'design', 'mbtu', result)
+        cached = cache.get('p1', 'design', 'mbtu')
+
+        pd.testing.assert_frame_equal(cached['eeu_data'], result['eeu_data'])
+        pd.testing.assert_frame_equal(cached['eeu_data_editable'], result['eeu_data_editable'])
+        assert cached['eeu_data'].index.name == 'use_type'
+        assert cached['eeu_data'].columns.name == 'fuel_category'
+        assert cached['eeu_id'] == 7
+        assert cache.get('p1', 'design', 'kbtu/sf') is None
+
+    def test_results_are_not_shared(self):
+        cache = EndUseCache()
+        result = make_result()
+        cache.set('p1', 'design', 'mbtu', result)
+        # changes to the original or to a returned copy never reach the cache
+        result['eeu_data'].iloc[0, 0] = 99
+        first = cache.get('p1', 'design', 'mbtu')
+        first['eeu_data'].columns = ['a', 'b', 'c']
+        first['eeu_data_editable'].iloc[0, 0] = False
+
+        second = cache.get('p1', 'design', 'mbtu')
+        assert list(second['eeu_data'].columns) == ['electricity', 'fossil_fuels', 'district']
+        assert second['eeu_data'].iloc[0, 0] == 1.5
+        assert bool(second['eeu_data_editable'].iloc[0, 0]) is True
+
+    def test_invalidation_and_metrics(self):
+        cache = EndUseCache()
+        cache.set('p1', 'baseline', 'mbtu', make_result(eeu_id=1))
+        cache.set('p1', 'design', 'mbtu', make_result(eeu_id=2))
+        cache.set('p2', 'design', 'mbtu', make_result(eeu_id=3))
+
+        assert cache.invalidate_eeu(2) == 1
+        assert cache.get('p1', 'design', 'mbtu') is None
+        assert cache.get('p1', 'baseline', 'mbtu') is not None
+        assert cache.invalidate_project('p1') == 1
+        assert cache.get('p2', 'design', 'mbtu') is not None
+
+        metrics = cache.metrics()
+        assert metrics['hits'] == 2
+        assert metrics['misses'] == 1
+        assert metrics['invalidations'] == 2
+        assert metrics['size'] == 1
+
+    def test_ttl(self):
+        cache = EndUseCache(ttl=0)
+        cache.set('p1', 'design', 'mbtu', make_result())
+        assert cache.get('p1', 'design', 'mbtu') is None
+
+
+class TestEndUseCacheWiring:
+    """Test that reads go through the cache and writes invalidate it"""
+
+    def setup_method(self):
+        self.cache = EndUseCache()
+        self.patcher = patch('project_details.end_use_cache', self.cache)
+        self.patcher.start()
+        update_routes.end_use_cache = self.cache
+
+    def teardown_method(self):
+        self.patcher.stop()
+        update_routes.end_use_cache = project_details.end_use_cache
+
+    def test_repeat_reads_are_served_from_cache(self):
+        with patch('project_details.compute_energy_end_uses_data', side_effect=lambda *a, **k: make_result()) as mock_compute:
+            first = project_details.get_energy_end_uses_data('p1', 'design', output_units='mbtu')
+            second = project_details.get_energy_end_uses_data('p1', 'design', output_units='mbtu')
+            project_details.get_energy_end_uses_data('p1', 'design')
+        assert mock_compute.call_count == 2
+        pd.testing.assert_frame_equal(first['eeu_data'], second['eeu_data'])
+        assert first['eeu_data'] is not second['eeu_data']
+
+    def test_failures_are_not_cached(self):
+        missing = {'status': 'No latest project available', 'baseline_design': 'design'}
+        with patch('project_details.compute_energy_end_uses_data', return_value=missing) as mock_compute:
+            project_details.get_energy_end_uses_data('p1', 'design')
+            project_details.get_energy_end_uses_data('p1', 'design')
+        assert mock_compute.call_count == 2
+
+    @patch('update_routes.refresh_project_summaries')
+    @patch('update_routes.add_event_history')
+    @patch('update_routes.supabase')
+    def test_eeu_update_invalidates(self, mock_supabase, mock_history, mock_refresh):
+        mock_supabase.table.return_value = MagicMock()
+        self.cache.set('p1', 'design', 'mbtu', make_result(eeu_id=7))
+        self.cache.set('p1', 'baseline', 'mbtu', make_result(eeu_id=6))
+
+        assert update_routes.update_eeu_record(models.EEUUpdate(eeu_id=7, use_type_total_area='500'), 'user-1') == 'success'
+        assert self.cache.get('p1', 'design', 'mbtu') is None
+        assert self.cache.get('p1', 'baseline', 'mbtu') is not None
+        mock_refresh.assert_called_once_with(eeu_ids=[7])
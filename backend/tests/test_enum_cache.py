@@ -0,0 +1,96 @@
+import pytest
+from unittest.mock import MagicMock, Mock
+
+from enum_cache import EnumCache
+
+LIST_NAMES = ['project_use_types', 'climate_zones']
+
+TABLES = {
+    'project_use_types': [
+        {'id': 1, 'name': 'Office', 'order': 1, 'ddx_use_type_id': 10},
+        {'id': 2, 'name': 'Retail', 'order': 2, 'ddx_use_type_id': None},
+    ],
+    'climate_zones': [
+        {'id': 3, 'name': '4A', 'order': 1, 'description': 'Mixed Humid'},
+    ],
+}
+
+
+def make_client(data=TABLES):
+    client = MagicMock()
+    client.rpc.return_value.execute.return_value = Mock(data=data)
+    return client
+
+
+class TestEnumCache:
+    """Test loading, lookups, expiry and invalidation of the enum cache"""
+
+    def test_loads_all_tables_in_one_call(self):
+        client = make_client()
+        cache = EnumCache(client, LIST_NAMES, ttl=60)
+
+        assert cache.name_for_id('project_use_types', 2) == 'Retail'
+        assert cache.id_for_name('climate_zones', '4A') == 3
+        assert cache.names('project_use_types') == ['Office', 'Retail']
+        assert cache.name_set('project_use_types') == {'Office', 'Retail'}
+        assert cache.row_by_id('project_use_types', 1)['ddx_use_type_id'] == 10
+        client.rpc.assert_called_once_with('get_enum_tables')
+        client.table.assert_not_called()
+
+    def test_lookups_by_string_id_and_misses(self):
+        cache = EnumCache(make_client(), LIST_NAMES, ttl=60)
+
+        assert cache.name_for_id('project_use_types', '1') == 'Office'
+        assert cache.name_for_id('project_use_types', '1.0') == 'Office'
+        assert cache.name_for_id('project_use_types', 'None') is None
+        assert cache.name_for_id('project_use_types', 99) is None
+        assert cache.id_for_name('project_use_types', 'Hospital') is None
+        assert cache.name_for_id('not_an_enum', 1) is None
+        assert cache.rows('not_an_enum') == []
+
+    def test_rows_are_copies(self):
+        cache = EnumCache(make_client(), LIST_NAMES, ttl=60)
+        cache.rows('climate_zones')[0]['name'] = 'changed'
+        cache.row_by_name('climate_zones', '4A')['name'] = 'changed'
+        assert cache.names('climate_zones') == ['4A']
+
+    def test_ttl_and_invalidate(self):
+        client = make_client()
+        cache = EnumCache(client, LIST_NAMES, ttl=60)
+        cache.names('project_use_types')
+        cache.names('climate_zones')
+        assert client.rpc.call_count == 1
+
+        cache.invalidate()
+        cache.names('project_use_types')
+        assert client.rpc.call_count == 2
+
+        cache.ttl = 0
+        cache.names('project_use_types')
+        assert client.rpc.call_count == 3
+
+    def test_falls_back_to_table_queries(self):
+        client = make_client()
+        client.rpc.return_value.execute.side_effect = Exception("function get_enum_tables does not exist")
+        client.table.return_value.select.return_value.order.return_value.execute.return_value = Mock(data=TABLES['climate_zones'])
+        cache = EnumCache(client, LIST_NAMES, ttl=60)
+
+        assert cache.id_for_name('climate_zones', '4A') == 3
+        assert client.table.call_count == len(LIST_NAMES)
+        client.table.assert_any_call('enum_project_use_types')
+
+    def test_keeps_previous_tables_when_reload_fails(self):
+        client = make_client()
+        cache = EnumCache(client, LIST_NAMES, ttl=0)
+        assert cache.id_for_name('project_use_types', 'Office') == 1
+
+        client.rpc.return_value.execute.side_effect = Exception("timeout")
+        client.table.side_effect = Exception("timeout")
+        assert cache.id_for_name('project_use_types', 'Office') == 1
+
+    def test_first_load_failure_raises(self):
+        client = make_client()
+        client.rpc.side_effect = Exception("timeout")
+        client.table.side_effect = Exception("timeout")
+        with pytest.raises(Exception):
+            EnumCache(client, LIST_NAMES).rows('project_use_types')
@@ -376,6 +376,56 @@ class TestProjectEndpoints:
             app.dependency_overrides.clear()
 
 
+class TestProjectList:
+    """Test paging, filters and ETags of /projects/"""
+
+    def setup_method(self):
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': True, 'role': 'admin', 'company_id': 'company_123'}
+
+    def teardown_method(self):
+        app.dependency_overrides.clear()
+
+    @patch('main.read_project_summaries')
+    def test_page(self, mock_read):
+        mock_read.return_value = {'rows': [{'project_id': 'p3'}, {'project_id': 'p4'}], 'next_cursor': 'next', 'offset': 2}
+
+        response = client.get("/projects/?measurement_system=Imperial&limit=2&cursor=abc&sort=-project_name&search=office"
+                              "&project_use_type=Office&project_use_type=School&fields=project_name")
+
+        assert response.status_code == 200
+        assert response.json() == {'rows': [{'id': 3, 'project_id': 'p3'}, {'id': 4, 'project_id': 'p4'}], 'next_cursor': 'next'}
+        args, kwargs = mock_read.call_args
+        assert args == ('projects', 'project_name', 2, 'abc')
+        assert kwargs['sort'] == '-project_name' and kwargs['search'] == 'office'
+        assert kwargs['project_use_type'] == ['Office', 'School']
+        # company comes from the token for non superadmins
+        assert kwargs['company_id'] == 'company_123'
+
+    @patch('main.iter_project_summaries')
+    def test_unpaged_list_and_etag(self, mock_iter):
+        mock_iter.side_effect = lambda *args, **kwargs: iter([{'project_id': 'p1'}])
+
+        first = client.get("/projects/?measurement_system=Imperial")
+        assert first.json() == [{'id': 1, 'project_id': 'p1'}]
+        etag = first.headers['ETag']
+
+        unchanged = client.get("/projects/?measurement_system=Imperial", headers={'If-None-Match': etag})
+        assert unchanged.status_code == 304
+        assert unchanged.headers['ETag'] == etag
+
+        mock_iter.side_effect = lambda *args, **kwargs: iter([{'project_id': 'p1'}, {'project_id': 'p2'}])
+        changed = client.get("/projects/?measurement_system=Imperial", headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != etag
+
+    @patch('main.read_project_summaries')
+    def test_invalid_parameters(self, mock_read):
+        mock_read.side_effect = ValueError('Cannot sort projects summaries by company_id')
+        assert client.get("/projects/?limit=10&sort=company_id").status_code == 400
+        assert client.get("/projects/?fields=uploads(*)").status_code == 400
+        assert client.get("/projects/?limit=0").status_code == 422
+
+
 class TestValidationHandling:
     """Test request validation and error handling"""
 
@@ -406,4 +456,36 @@ class TestValidationHandling:
             with pytest.raises(Exception):
                 response = client.get("/enums/project_use_types/")
         finally:
-            app.dependency_overrides.clear() 
\ No newline at end of file
+            app.dependency_overrides.clear() 
+
+class TestHandlersOffEventLoop:
+    """Test that handlers calling supabase run on the threadpool"""
+
+    # handlers that stay on the event loop: no database calls, or they hand their blocking work to the threadpool
+    ASYNC_ROUTES = {'/wake-up/', '/log-auth-event/', '/callback', '/login', '/cache_metrics/', '/project_details/',
+                    '/project_energy_end_uses/', '/uploadfile/', '/upload_jobs/{job_id}'}
+
+    def test_database_handlers_are_sync(self):
+        import inspect
+        from update_routes import router as update_router
+        from upload_routes import router as upload_router
+        routes = [route for route in app.routes + update_router.routes + upload_router.routes
+                  if hasattr(route, 'endpoint') and route.path not in ('/openapi.json', '/docs', '/docs/oauth2-redirect', '/redoc')]
+        assert '/update_eeu_data/' in {route.path for route in routes}
+        assert {route.path for route in routes if inspect.iscoroutinefunction(route.endpoint)} == self.ASYNC_ROUTES
+
+    def test_end_uses_sides_passed_through(self):
+        def mock_verify_token():
+            return {'is_authorized': True, 'role': 'user', 'company_id': 'c1'}
+
+        app.dependency_overrides[verify_token] = mock_verify_token
+        sides = {'baseline': {'status': 'success'}, 'design': {'status': 'error'}}
+        try:
+            with patch('main.fetch_end_uses_sides', AsyncMock(return_value=sides)) as mock_fetch, \
+                 patch('main.get_energy_end_uses_chart_data', return_value={'baseline': {}}) as mock_chart:
+                response = client.get("/project_energy_end_uses/?project_id=p1")
+            assert response.json() == {'baseline': {}}
+            mock_fetch.assert_awaited_once_with('p1')
+            mock_chart.assert_called_once_with('p1', sides)
+        finally:
+            app.dependency_overrides.clear()
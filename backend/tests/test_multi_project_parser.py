@@ -0,0 +1,156 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+from parse_reports.parse_multi_project_xlsx import MultiProjectExcelParser
+
+REQUIRED = {'project_name': 'P', 'conditioned_area_sf': 1000, 'zip_code': 10001, 'project_use_type': 'Office',
+            'project_construction_category': 'New', 'project_phase': 'Design', 'energy_code': 'ASHRAE 90.1-2019',
+            'report_type': 'Generic .XLSX', 'reporting_year': 2024}
+
+
+def parse_project_row(parser, row, row_number):
+    """Reference for _parse_project_rows: the row-by-row parse the parser used before, as (project, errors)"""
+    project = {}
+    errors = []
+    for col in parser.required_columns:
+        if col not in row.index or pd.isna(row[col]) or str(row[col]).strip() == '':
+            errors.append(f"Row {row_number}: Missing required field '{col}'")
+        else:
+            project[col] = str(row[col]).strip()
+
+    for col, default in parser.optional_columns.items():
+        if col in row.index and not pd.isna(row[col]) and str(row[col]).strip() != '':
+            project[col] = str(row[col]).strip()
+        else:
+            project[col] = default
+
+    baseline_energy_data = {}
+    design_energy_data = {}
+    for col in row.index:
+        if col in parser.required_columns or col in parser.optional_columns:
+            continue
+        if pd.notna(row[col]) and str(row[col]).strip() != '':
+            try:
+                energy_value = float(row[col])
+            except (ValueError, TypeError):
+                project[col] = str(row[col]).strip()
+                continue
+            if col.endswith('_baseline'):
+                baseline_energy_data[col[:-9]] = energy_value
+            elif col.endswith('_design'):
+                design_energy_data[col[:-7]] = energy_value
+            else:
+                project[col] = energy_value
+    if baseline_energy_data:
+        project['baseline_energy_data'] = baseline_energy_data
+    if design_energy_data:
+        project['design_energy_data'] = design_energy_data
+
+    for field in ['conditioned_area_sf', 'year', 'reporting_year']:
+        if field in project and project[field] is not None:
+            try:
+                if field in ['year', 'reporting_year']:
+                    project[field] = int(float(project[field]))
+                else:
+                    project[field] = float(project[field])
+            except (ValueError, TypeError):
+                errors.append(f"Row {row_number}: Invalid numeric value for field '{field}': {project[field]}")
+    return project, errors
+
+
+def row_by_row(parser, df):
+    """The projects and errors of parse_project_row on each row"""
+    projects, errors = [], []
+    for index, row in df.iterrows():
+        project, row_errors = parse_project_row(parser, row, index + 1)
+        if row_errors:
+            errors.extend(row_errors)
+        else:
+            projects.append(project)
+    return projects, errors
+
+
+def edge_case_frame():
+    rows = [
+        {},
+        {'project_name': ' Spaced ', 'conditioned_area_sf': ' 1500 ', 'reporting_year': '2023.0', 'year': 1999.7},
+        {'project_name': np.nan, 'conditioned_area_sf': '2,000', 'reporting_year': 'abc'},
+        {'project_name': '   ', 'reporting_year': 'nan', 'zip_code': None},
+        {'conditioned_area_sf': 'nan', 'energy_units': ' GJ ', 'climate_zone': '', 'area_units': 'sm'},
+        {'year': 'later', 'energy_code': None},
+    ]
+    extra = [
+        {'Heating_Electricity_baseline': 1.5, 'Cooling_NaturalGas_design': 2, 'notes': 'hello', 'Fans_Electricity': ' 3 '},
+        {'Heating_Electricity_baseline': '2.5', 'notes': '5', 'Fans_Electricity': 'n/a'},
+        {'Heating_Electricity_baseline': 'n/a', 'notes': '', 'Cooling_NaturalGas_design': np.nan},
+        {'notes': '1_000', 'Fans_Electricity': 'nan'},
+        {'Heating_Electricity_baseline': None, 'when': datetime.datetime(2024, 1, 2)},
+        {'Cooling_NaturalGas_design': 0.0},
+    ]
+    return pd.DataFrame([{**REQUIRED, **row, **more} for row, more in zip(rows, extra)])
+
+
+class TestColumnarParsing:
+    """Test that the columnar parse matches the row-by-row parse"""
+
+    @pytest.mark.parametrize('drop', [None, 'energy_code', 'reporting_year'])
+    def test_matches_row_by_row(self, drop):
+        parser = MultiProjectExcelParser()
+        df = edge_case_frame()
+        if drop:
+            df = df.drop(columns=[drop])
+        projects, errors = parser._parse_project_rows(df)
+        expected_projects, expected_errors = row_by_row(parser, df)
+        assert errors == expected_errors
+        # repr, NaN values never compare equal
+        assert repr(projects) == repr(expected_projects)
+
+    def test_messages(self):
+        projects, errors = MultiProjectExcelParser()._parse_project_rows(edge_case_frame())
+        assert "Row 3: Missing required field 'project_name'" in errors
+        assert "Row 3: Invalid numeric value for field 'conditioned_area_sf': 2,000" in errors
+        assert "Row 6: Invalid numeric value for field 'year': later" in errors
+        assert projects[1]['baseline_energy_data'] == {'Heating_Electricity': 2.5}
+        assert projects[1]['year'] == 1999
+
+    def test_empty_sheet(self):
+        assert MultiProjectExcelParser()._parse_project_rows(pd.DataFrame(columns=list(REQUIRED))) == ([], [])
+
+
+class FakeEnumCache:
+    def __init__(self, names):
+        self._names = names
+
+    def names(self, list_name):
+        return list(self._names.get(list_name, []))
+
+    def name_set(self, list_name):
+        return frozenset(self._names.get(list_name, []))
+
+
+class TestBatchedValidation:
+    """Test the enum and energy unit checks over all projects at once"""
+
+    def test_enum_messages(self):
+        cache = FakeEnumCache({'project_use_types': ['Office'] + [f'Use {i}' for i in range(12)],
+                               'project_construction_categories': ['New'], 'project_phases': ['Design'],
+                               'energy_codes': ['ASHRAE 90.1-2019'], 'report_types': ['Generic .XLSX'], 'climate_zones': ['4A']})
+        projects = [dict(REQUIRED, climate_zone=None), dict(REQUIRED, project_use_type='Lab', climate_zone='9Z'),
+                    dict(REQUIRED, project_phase='')]
+        del projects[1]['project_name']
+        valid, errors = MultiProjectExcelParser().validate_against_database_enums(projects, cache)
+        assert valid == [projects[0], projects[2]]
+        assert errors == [
+            "Project 'Row 2': Invalid project_use_type: 'Lab'. Valid options: Office, Use 0, Use 1, Use 2, Use 3, Use 4, Use 5, Use 6, Use 7, Use 8...",
+            "Project 'Row 2': Invalid climate_zone: '9Z'. Valid options: 4A",
+        ]
+
+    def test_energy_units(self):
+        projects = [{'project_name': 'A', 'energy_units': None}, {'project_name': 'B', 'energy_units': ' GJ '},
+                    {'project_name': 'C', 'energy_units': 'kWh'}, {'energy_units': float('nan')}]
+        valid, errors = MultiProjectExcelParser().validate_energy_units(projects)
+        assert valid == projects[:2]
+        assert errors == ["Project 'C': Invalid energy_units: 'kWh'. Allowed: mbtu, gj",
+                          "Project 'Unknown': Invalid energy_units: 'nan'. Allowed: mbtu, gj"]
@@ -0,0 +1,266 @@
+import time
+import pytest
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from postgrest.exceptions import APIError
+
+import multi_project_service
+from multi_project_service import MultiProjectService, CompanyRateLimiter
+
+WEATHER = {'city_name': 'Station', 'ratio_match': '', 'climate_zone': '4A', 'zip_code': '10001',
+           'egrid_subregion': 'NYCW', 'city': 'New York', 'state': 'NY'}
+
+
+class FakeQuery:
+    """Records the calls of the existing project lookup"""
+
+    def __init__(self, client):
+        self.client = client
+        self.filters = {}
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def in_(self, column, values):
+        self.filters[column] = list(values)
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def execute(self):
+        self.client.lookups.append(self.filters)
+        names = self.filters.get('project_name', [])
+        return SimpleNamespace(data=[project for project in self.client.projects if project['project_name'] in names])
+
+
+class FakeClient:
+    """Answers ingest_multi_project_rows like the database function, failing the rows named in fail"""
+
+    def __init__(self, projects=(), fail=(), rpc_error=None):
+        self.projects = list(projects)
+        self.fail = set(fail)
+        self.rpc_error = rpc_error
+        self.delays = {}
+        self.lookups = []
+        self.batches = []
+        self.refreshed = []
+
+    def table(self, name):
+        assert name == 'projects'
+        return FakeQuery(self)
+
+    def rpc(self, name, params):
+        if name == 'refresh_project_summaries':
+            self.refreshed.append(params)
+            return SimpleNamespace(execute=lambda: SimpleNamespace(data=1))
+        assert name == 'ingest_multi_project_rows'
+        return SimpleNamespace(execute=lambda: self._ingest(params['p_rows']))
+
+    def _ingest(self, rows):
+        if self.rpc_error:
+            raise self.rpc_error
+        time.sleep(self.delays.get(rows[0]['project'].get('project_name'), 0))
+        self.batches.append(rows)
+        results = []
+        for row in rows:
+            if row['project'].get('project_name') in self.fail:
+                results.append({'row_index': row['row'], 'project_id': row['project']['id'], 'upload_id': None,
+                                'eeu_ids': [], 'error': 'null value in column "area" violates not-null constraint'})
+            else:
+                results.append({'row_index': row['row'], 'project_id': row['project']['id'], 'upload_id': row['row'] + 1,
+                                'eeu_ids': [1, 2], 'error': None})
+        return SimpleNamespace(data=results)
+
+
+def make_project(name, **kwargs):
+    project = {'project_name': name, 'conditioned_area_sf': 1000.0, 'zip_code': '10001', 'energy_units': 'mbtu',
+               'climate_zone': '4A', 'report_type': 'Generic', 'year': 2024,
+               'baseline_energy_data': {'Heating_Electricity': 10.0, 'Cooling_NaturalGas': 5.0},
+               'design_energy_data': {'Heating_Electricity': 8.0}}
+    project.update(kwargs)
+    return project
+
+
+@pytest.fixture
+def make_service():
+    def make(client, **kwargs):
+        kwargs.setdefault('rate_limiter', CompanyRateLimiter(None))
+        service = MultiProjectService(client, **kwargs)
+        service._weather_cache = {'10001': WEATHER}
+        return service
+
+    with patch.object(MultiProjectService, '_get_enum_mappings', return_value={'climate_zone_id': 3, 'project_use_type_id': 7}), \
+         patch.object(MultiProjectService, '_get_report_type_identifier', return_value='generic_xlsx'):
+        yield make
+
+
+class TestIngestProjects:
+    """Test the bulk write path of the multi-project import"""
+
+    def test_one_lookup_and_one_call_per_batch(self, make_service):
+        client = FakeClient(projects=[{'id': 'existing-id', 'project_name': 'B'}])
+        projects = [make_project(name) for name in 'ABC']
+        with patch.object(multi_project_service, 'INGEST_BATCH_SIZE', 2):
+            created, failed = make_service(client, max_workers=1)._ingest_projects(projects, 'company', 'file.xlsx')
+
+        assert failed == []
+        assert [project['project_name'] for _, project in created] == ['A', 'B', 'C']
+        assert created[1][0] == 'existing-id'
+        assert client.lookups == [{'company_id': 'company', 'project_name': ['A', 'B', 'C']}]
+        assert [len(batch) for batch in client.batches] == [2, 1]
+
+    def test_records_are_built_in_memory(self, make_service):
+        client = FakeClient()
+        make_service(client)._ingest_projects([make_project('A')], 'company', 'file.xlsx')
+        row = client.batches[0][0]
+        assert row['project']['company_id'] == 'company' and row['project']['climate_zone_id'] == 3
+        assert row['upload']['project_id'] == row['project']['id']
+        assert [record['baseline_design'] for record in row['eeu_data']] == ['baseline', 'design']
+        assert all('upload_id' not in record for record in row['eeu_data'])
+        assert row['eeu_data'][0]['total_energy'] == 15.0
+        assert row['eeu_data'][0]['city'] == 'New York'
+
+    def test_repeated_name_reuses_the_project(self, make_service):
+        client = FakeClient()
+        created, _ = make_service(client)._ingest_projects([make_project('A'), make_project('A')], 'company', 'file.xlsx')
+        assert created[0][0] == created[1][0]
+
+    def test_row_errors_are_reported(self, make_service):
+        client = FakeClient(fail={'B'})
+        projects = [make_project('A'), make_project('B'), make_project('C', energy_units='kwh')]
+        created, failed = make_service(client)._ingest_projects(projects, 'company', 'file.xlsx')
+        assert [project['project_name'] for _, project in created] == ['A']
+        assert [(project['project_name'], 'not-null' in error or 'energy_units' in error) for project, error in failed] == \
+            [('B', True), ('C', True)]
+
+    def test_failed_call_fails_its_batch(self, make_service):
+        client = FakeClient(rpc_error=APIError({'code': '57014', 'message': 'canceling statement due to statement timeout'}))
+        created, failed = make_service(client)._ingest_projects([make_project('A')], 'company', 'file.xlsx')
+        assert created == []
+        assert 'statement timeout' in failed[0][1]
+
+    def test_row_by_row_when_function_is_missing(self, make_service):
+        client = FakeClient(rpc_error=APIError({'code': 'PGRST202', 'message': 'Could not find the function'}))
+        service = make_service(client)
+        with patch.object(service, '_create_project_and_upload', side_effect=['p1', None]) as mock_create:
+            created, failed = service._ingest_projects([make_project('A'), make_project('B')], 'company', 'file.xlsx')
+        assert mock_create.call_count == 2
+        assert created[0][0] == 'p1'
+        assert failed[0][0]['project_name'] == 'B'
+
+    def test_row_by_row_is_not_rate_limited(self, make_service):
+        client = FakeClient(rpc_error=APIError({'code': 'PGRST202', 'message': 'Could not find the function'}))
+        limiter = CompanyRateLimiter(None)
+        service = make_service(client, rate_limiter=limiter)
+        with patch.object(service, '_create_project_and_upload', side_effect=['p1', 'p2']), \
+             patch.object(limiter, 'acquire') as mock_acquire:
+            service._ingest_projects([make_project('A'), make_project('B')], 'company', 'file.xlsx')
+        # only the ingest_multi_project_rows call waits on the limit
+        assert mock_acquire.call_count == 1
+
+    def test_row_by_row_exception_fails_only_its_row(self, make_service):
+        client = FakeClient(rpc_error=APIError({'code': 'PGRST202', 'message': 'Could not find the function'}))
+        service = make_service(client)
+        with patch.object(service, '_create_project_and_upload', side_effect=[RuntimeError('insert failed'), 'p2']):
+            created, failed = service._ingest_projects([make_project('A'), make_project('B')], 'company', 'file.xlsx')
+        assert [(project['project_name'], error) for project, error in failed] == [('A', 'insert failed')]
+        assert created == [('p2', created[0][1])] and created[0][1]['project_name'] == 'B'
+
+    def test_process_reports_row_errors(self, make_service):
+        client = FakeClient(fail={'B'})
+        service = make_service(client)
+        parsed = {'status': 'success', 'projects': [make_project('A'), make_project('B')], 'validation_errors': []}
+        with patch.object(service.parser, 'parse_multi_project_excel', return_value=parsed), \
+             patch.object(service.parser, 'validate_against_database_enums', side_effect=lambda projects, cache: (projects, [])), \
+             patch.object(service, '_prefetch_weather_info'), \
+             patch.object(multi_project_service.end_use_cache, 'invalidate_project') as mock_invalidate:
+            result = service.process_multi_project_excel('file.xlsx', 'company')
+
+        assert result['successful_projects'] == 1 and result['failed_projects'] == 1
+        assert result['validation_errors'][0].startswith('Failed to create project B:')
+        assert client.refreshed[0]['p_project_ids'] == result['created_project_ids']
+        assert [call.args[0] for call in mock_invalidate.call_args_list] == result['created_project_ids']
+
+
+class TestConcurrentIngest:
+    """Test writing the batches of one import at the same time"""
+
+    def test_results_keep_spreadsheet_order(self, make_service):
+        client = FakeClient(fail={'B'})
+        # the first batch finishes last
+        client.delays = {'A': 0.05}
+        projects = [make_project(name) for name in 'ABCDEF']
+        progress = []
+        with patch.object(multi_project_service, 'INGEST_BATCH_SIZE', 2):
+            created, failed = make_service(client, max_workers=3)._ingest_projects(
+                projects, 'company', 'file.xlsx', progress=lambda done, total: progress.append((done, total)))
+
+        assert [batch[0]['project']['project_name'] for batch in client.batches][-1] == 'A'
+        assert [project['project_name'] for _, project in created] == ['A', 'C', 'D', 'E', 'F']
+        assert [project['project_name'] for project, _ in failed] == ['B']
+        assert progress == [(0, 6), (2, 6), (4, 6), (6, 6)]
+
+    def test_rows_of_a_project_share_a_batch(self, make_service):
+        client = FakeClient()
+        projects = [make_project(name) for name in 'ABAC']
+        with patch.object(multi_project_service, 'INGEST_BATCH_SIZE', 2):
+            make_service(client, max_workers=2)._ingest_projects(projects, 'company', 'file.xlsx')
+
+        batches = sorted([[row['row'] for row in batch] for batch in client.batches])
+        assert batches == [[0, 2], [1, 3]]
+
+    def test_build_errors_count_as_done(self, make_service):
+        client = FakeClient()
+        progress = []
+        projects = [make_project('A'), make_project('B', energy_units='kwh')]
+        make_service(client)._ingest_projects(projects, 'company', 'file.xlsx',
+                                              progress=lambda done, total: progress.append((done, total)))
+        assert progress == [(1, 2), (2, 2)]
+
+
+class TestCompanyRateLimiter:
+    """Test the per-company token bucket"""
+
+    def make_limiter(self, rate, burst=None):
+        clock = {'now': 0.0}
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+
+        return CompanyRateLimiter(rate, burst, clock=lambda: clock['now'], sleep=sleep), clock, waits
+
+    def test_burst_then_rate(self):
+        limiter, clock, waits = self.make_limiter(2, burst=2)
+        for _ in range(4):
+            limiter.acquire('a')
+        assert waits == [0.5, 1.0]
+
+    def test_tokens_refill(self):
+        limiter, clock, waits = self.make_limiter(2, burst=1)
+        limiter.acquire('a')
+        clock['now'] = 0.5
+        limiter.acquire('a')
+        assert waits == []
+
+    def test_companies_are_limited_separately(self):
+        limiter, clock, waits = self.make_limiter(1)
+        limiter.acquire('a')
+        limiter.acquire('b')
+        assert waits == []
+
+    def test_no_limit(self):
+        limiter = CompanyRateLimiter(0)
+        threads = [threading.Thread(target=limiter.acquire, args=('a',)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=1)
+        assert not any(thread.is_alive() for thread in threads)
@@ -0,0 +1,104 @@
+import pytest
+from unittest.mock import patch
+
+from parse_reports.pdf_index import PdfDocumentIndex, open_pdf_index
+from parse_reports.report_detection import detect_report_type
+
+
+def make_pdf(page_texts):
+    """Build a minimal PDF with one line of Helvetica text per page"""
+    n = len(page_texts)
+    kids = ' '.join(f'{4 + 2 * i} 0 R' for i in range(n))
+    objs = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        f'<< /Type /Pages /Kids [{kids}] /Count {n} >>'.encode(),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    for i, text in enumerate(page_texts):
+        stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'.encode()
+        objs.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>'.encode())
+        objs.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % (i + 1) + obj + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objs) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objs) + 1, xref)
+    return out
+
+
+PRM_PAGES = [
+    'Project cover',
+    'Space Summary Building Use',
+    'Weather file Chicago',
+    'Performance Rating Table - PRM Compliance',
+    'Energy Cost & Consumption by energy Type',
+    'Performance Rating Table - PRM Compliance',
+]
+
+
+class TestPdfDocumentIndex:
+    """Test the cached page text and marker index"""
+
+    def test_page_text_is_cached(self):
+        with PdfDocumentIndex(make_pdf(PRM_PAGES)) as index:
+            assert len(index) == 6
+            assert index.page_text(1) == 'Space Summary Building Use'
+            with patch.object(index.pages[1], 'extract_text') as mock_extract:
+                assert index.page_text(1) == 'Space Summary Building Use'
+                mock_extract.assert_not_called()
+
+    def test_marker_lookups(self):
+        with PdfDocumentIndex(make_pdf(PRM_PAGES)) as index:
+            assert index.pages_with('Performance Rating Table - PRM Compliance') == [3, 5]
+            assert index.first_page_with('Space Summary', 'Building Use') == 1
+            assert index.first_page_with('Performance Rating Table - PRM Compliance', start=4) == 5
+            assert index.last_page_with('Performance Rating Table - PRM Compliance') == 5
+            assert index.first_page_with('not in the report') is None
+            assert index.last_page_with('not in the report') is None
+
+    def test_first_page_with_stops_at_match(self):
+        with PdfDocumentIndex(make_pdf(PRM_PAGES)) as index:
+            assert index.first_page_with('Weather file') == 2
+            assert set(index._page_text) == {0, 1, 2}
+
+    def test_thread_pool_extraction(self):
+        with PdfDocumentIndex(make_pdf(PRM_PAGES), max_workers=3) as index:
+            index.extract_all()
+            assert [index.page_text(i) for i in range(len(index))] == PRM_PAGES
+
+    def test_open_pdf_index_reuses_shared_index(self):
+        with PdfDocumentIndex(make_pdf(PRM_PAGES)) as index:
+            assert open_pdf_index('https://example.com/report.pdf', pdf_index=index) is index
+
+    def test_parser_closes_only_the_index_it_built(self):
+        from parse_reports.parse_iesve import parse_report_iesve
+        content = make_pdf(['cover'])
+        with patch.object(PdfDocumentIndex, 'close', autospec=True, side_effect=lambda index: index.pdf.close()) as mock_close:
+            parse_report_iesve(None, content=content)
+            assert mock_close.call_count == 1
+            with PdfDocumentIndex(content) as shared:
+                parse_report_iesve(None, pdf_index=shared)
+                assert mock_close.call_count == 1
+
+
+class TestPdfReportDetection:
+    """Test report type detection for PDF reports"""
+
+    def test_prm_report(self):
+        assert detect_report_type(make_pdf(PRM_PAGES)) == (8, 'pdf')
+
+    def test_beps_report(self):
+        content = make_pdf(['cover', 'REPORT- BEPS Building Energy Performance'])
+        with PdfDocumentIndex(content) as index:
+            assert detect_report_type(content, pdf_index=index) == (5, 'pdf')
+
+    def test_iesve_report(self):
+        assert detect_report_type(make_pdf(['Energy End Use Site Energy'])) == (1, 'pdf')
+
+    def test_unknown_pdf(self):
+        assert detect_report_type(make_pdf(['nothing to see'])) == (None, 'pdf')
@@ -0,0 +1,76 @@
+import pytest
+import pandas as pd
+from unittest.mock import patch
+
+import post_processing
+from post_processing import post_process, FIELD_NAMES
+
+WEATHER_INFO = {'city_name': 'CHICAGO', 'climate_zone': '5A', 'zip_code': '60601', 'egrid_subregion': 'RFCW'}
+
+
+def make_iesve_output(energy_units='mbtu'):
+    """Parser output for a small IES-VE report"""
+    return pd.DataFrame({
+        'report_field': ['Heating Fossil Fuel', 'Heating Electricity', 'Space Cooling', 'Not a mapped field'],
+        'energy_value': [100.0, 50.0, 25.0, 999.0],
+        'energy_units': energy_units,
+        'conditioned_area_sf': 10000.0,
+        'report': 'iesve',
+        'project_name': 'Test Project',
+        'weather_string': 'CHICAGO IL',
+    })
+
+
+class TestPostProcess:
+    """Test the field aggregation in post_process"""
+
+    @patch('post_processing.weather_check', return_value=WEATHER_INFO)
+    def test_output_layout(self, mock_weather):
+        df_new = post_process(make_iesve_output())
+
+        fuel_totals = ['total_Electricity', 'total_NaturalGas', 'total_DistrictHeating', 'total_Other', 'total_On-SiteRenewables']
+        expected_columns = list(FIELD_NAMES) + fuel_totals + ['use_type_total_area', 'total_energy', 'report_type', 'project_name']
+        assert list(df_new.columns[:len(expected_columns)]) == expected_columns
+        assert list(df_new.columns[-6:]) == ['area_units', 'weather_station', 'climate_zone', 'weather_string', 'zip_code', 'egrid_subregion']
+        assert df_new.shape == (2, len(expected_columns) + 7)
+        # upload_report inserts the second record
+        assert list(df_new.index) == [1, 2]
+        assert df_new.iloc[0]['Heating_NaturalGas'] == 'Heating'
+
+    @patch('post_processing.weather_check', return_value=WEATHER_INFO)
+    def test_field_and_fuel_totals(self, mock_weather):
+        record = post_process(make_iesve_output()).iloc[1]
+
+        assert record['Heating_NaturalGas'] == 100.0
+        assert record['Heating_Electricity'] == 50.0
+        assert record['Cooling_Electricity'] == 25.0
+        assert record['DHW_Electricity'] == 0.0
+        assert record['total_Electricity'] == 75.0
+        assert record['total_NaturalGas'] == 100.0
+        assert record['total_energy'] == 175.0
+        assert record['use_type_total_area'] == 10000.0
+        assert record['report_type'] == 'iesve'
+        assert record['project_name'] == 'Test Project'
+        assert record['climate_zone'] == '5A'
+        assert record['zip_code'] == '60601'
+
+    @patch('post_processing.weather_check', return_value=WEATHER_INFO)
+    def test_uncommon_units_keep_report_values(self, mock_weather):
+        record = post_process(make_iesve_output('gj')).iloc[1]
+
+        # uncommon units are reported in the units of the uploaded report
+        assert record['Heating_NaturalGas'] == 100.0
+        assert record['total_energy'] == 175.0
+
+    @patch('post_processing.weather_check', side_effect=Exception('no weather'))
+    def test_weather_failure(self, mock_weather):
+        record = post_process(make_iesve_output()).iloc[1]
+        assert record['climate_zone'] == ''
+        assert record['weather_station'] == ''
+
+    def test_unknown_report_has_zero_totals(self):
+        df = make_iesve_output()
+        df['report'] = 'not_a_report'
+        with patch('post_processing.weather_check', return_value=WEATHER_INFO):
+            record = post_process(df).iloc[1]
+        assert record['total_energy'] == 0.0
@@ -0,0 +1,266 @@
+import json
+import pytest
+import threading
+import pandas as pd
+from unittest.mock import patch, MagicMock
+
+import project_details
+
+
+def make_side(values, editable):
+    """get_energy_end_uses_data result for a side with the given end-use values and editable mask"""
+    index = pd.Index(list(values), name='use_type')
+    columns = pd.Index(project_details.list_energy_types, name='fuel_category')
+    eeu_data = pd.DataFrame([values[use_type] for use_type in index], index=index, columns=columns, dtype=float)
+    eeu_editable = pd.DataFrame([editable[use_type] for use_type in index], index=index, columns=columns)
+    renewables_index = pd.Index(['On-Site Renewables'], name='use_type')
+    renewables_columns = pd.Index(project_details.list_onsite_renewables, name='field_name')
+    renewables = pd.DataFrame([[5.0] * len(renewables_columns)], index=renewables_index, columns=renewables_columns)
+    renewables_editable = pd.DataFrame(True, index=renewables_index, columns=renewables_columns)
+    return {'status': 'success', 'eeu_data': eeu_data, 'eeu_data_editable': eeu_editable,
+            'renewables': renewables, 'renewables_editable': renewables_editable,
+            'use_type_total_area': 1000.0, 'zip_code': None, 'egrid_subregion': None, 'eeu_id': 1}
+
+
+def combine(baseline, design):
+    sides = {'baseline': baseline, 'design': design}
+    with patch.object(project_details, 'get_energy_end_uses_data', side_effect=lambda project_id, baseline_design, **kwargs: sides[baseline_design]), \
+         patch.object(project_details, 'get_latest_eeu_data', return_value={'status': 'error'}), \
+         patch.object(project_details, 'get_use_types', return_value=pd.DataFrame({'use_type': ['Cooling', 'Heating']})):
+        return project_details.combine_end_uses_data('p1', 'mbtu')
+
+
+class TestCombineEndUsesData:
+    """Test the values and edit details output of the project end uses"""
+
+    def setup_method(self):
+        n_types = len(project_details.list_energy_types)
+        self.values = {'Cooling': [10.0] + [0.0] * (n_types - 1), 'Heating': [1.0, 2.0] + [0.0] * (n_types - 2)}
+        self.editable = {'Cooling': [True] + [False] * (n_types - 1), 'Heating': [True, True] + [False] * (n_types - 2)}
+
+    def test_edit_details_match_values(self):
+        side = make_side(self.values, self.editable)
+        output = combine(side, make_side(self.values, self.editable))
+        values = json.loads(output['eeu_data'])
+        details = json.loads(output['eeu_data_edit_details'])
+
+        assert [row['use_type'] for row in details] == ['Cooling', 'Heating', 'Total']
+        for value_row, detail_row in zip(values, details):
+            assert value_row.keys() == detail_row.keys()
+            for col, cell in detail_row.items():
+                if col != 'use_type':
+                    assert cell['value'] == value_row[col]
+                    assert cell['edited'] is False
+
+        electricity, fossil_fuels = project_details.list_energy_types[:2]
+        assert details[0][f'{electricity}_design']['editable'] is True
+        assert details[0][f'{fossil_fuels}_baseline']['editable'] is False
+        assert details[1][f'{fossil_fuels}_baseline']['editable'] is True
+        # totals are computed, never editable
+        assert details[2][f'{electricity}_design'] == {'value': 11.0, 'editable': False, 'edited': False}
+
+    def test_missing_side_is_plain_values(self):
+        output = combine({'status': 'No data', 'baseline_design': 'baseline'}, make_side(self.values, self.editable))
+        details = json.loads(output['eeu_data_edit_details'])
+        electricity = project_details.list_energy_types[0]
+
+        assert details[0][f'{electricity}_baseline'] == 0
+        assert details[0][f'{electricity}_design']['editable'] is True
+
+        renewables = json.loads(output['renewables_edit_details'])
+        assert len(renewables) == 1
+        assert renewables[0].pop('use_type') == 'On-Site Renewables'
+        assert 'Solar PV_design' in renewables[0]
+        assert all(cell == {'value': 5.0, 'editable': True, 'edited': False} for cell in renewables[0].values())
+
+
+def history_rows():
+    return [
+        {'id': 3, 'table_name': 'uploads', 'field_name': 'project_phase_id', 'previous_value': '1', 'new_value': '2',
+         'updated_at': '2025-03-02T10:00:00+00:00', 'updated_by': 'a@example.com'},
+        {'id': 2, 'table_name': 'eeu_data', 'field_name': 'Cooling_electricity', 'previous_value': None, 'new_value': '4.5',
+         'updated_at': '2025-03-01T10:00:00+00:00', 'updated_by': 'b@example.com'},
+        {'id': 1, 'table_name': 'projects', 'field_name': 'project_name', 'previous_value': 'Old', 'new_value': 'New',
+         'updated_at': '2025-03-01T10:00:00+00:00', 'updated_by': 'a@example.com'},
+    ]
+
+
+class FakeEnumCache:
+    def name_for_id(self, list_name, enum_id):
+        return {('project_phases', '1'): 'Design', ('project_phases', '2'): 'Construction'}.get((list_name, enum_id))
+
+
+class TestChangeHistory:
+    """Test the project change history read through get_project_change_history"""
+
+    def setup_method(self):
+        self.enum_patch = patch.object(project_details, 'enum_cache', FakeEnumCache())
+        self.enum_patch.start()
+
+    def teardown_method(self):
+        self.enum_patch.stop()
+
+    def test_single_query(self):
+        with patch.object(project_details, 'supabase') as mock_supabase:
+            mock_supabase.rpc.return_value.execute.return_value.data = history_rows()
+            history = json.loads(project_details.get_change_history('p1'))
+
+        mock_supabase.rpc.assert_called_once()
+        mock_supabase.table.assert_not_called()
+        assert history[0] == {'field_name': 'Project Phase', 'previous_value': 'Design', 'new_value': 'Construction',
+                              'updated_at': '2025-03-02T10:00:00+00:00', 'updated_by': 'a@example.com',
+                              'enum_list_name': 'project_phases'}
+        assert history[1]['previous_value'] == 'None'
+        assert history[1]['field_name'] == history[1]['enum_list_name'] == 'Cooling_electricity'
+        assert [row['new_value'] for row in history] == ['Construction', '4.5', 'New']
+
+    def test_pages(self):
+        with patch.object(project_details, 'supabase') as mock_supabase:
+            mock_supabase.rpc.return_value.execute.return_value.data = history_rows()
+            page = json.loads(project_details.get_change_history('p1', limit=2, since='2025-01-01T00:00:00'))
+            params = mock_supabase.rpc.call_args[0][1]
+            assert params['p_limit'] == 3 and params['p_since'] == '2025-01-01T00:00:00'
+            assert len(page['rows']) == 2
+
+            mock_supabase.rpc.return_value.execute.return_value.data = history_rows()[2:]
+            last = json.loads(project_details.get_change_history('p1', limit=2, cursor=page['next_cursor']))
+            params = mock_supabase.rpc.call_args[0][1]
+
+        assert (params['p_before_updated_at'], params['p_before_id']) == ('2025-03-01T10:00:00+00:00', 2)
+        assert [row['new_value'] for row in last['rows']] == ['New']
+        assert last['next_cursor'] is None
+
+    def test_fallback_without_function(self):
+        rows = history_rows()
+        for row in rows:
+            row['updated_by'] = {'a@example.com': 'user-a', 'b@example.com': 'user-b'}[row['updated_by']]
+        with patch.object(project_details, 'supabase') as mock_supabase, \
+             patch.object(project_details, 'get_uploads_for_project', return_value=[{'id': 7}]), \
+             patch.object(project_details, 'get_eeu_data_ids_for_uploads', return_value=[11, 12]), \
+             patch.object(project_details.logging_start, 'logger'):
+            mock_supabase.rpc.side_effect = Exception('function not found')
+            tables = {'event_history': MagicMock(), 'profiles': MagicMock()}
+            tables['event_history'].select.return_value.or_.return_value.execute.return_value.data = list(reversed(rows))
+            tables['profiles'].select.return_value.in_.return_value.execute.return_value.data = [
+                {'id': 'user-a', 'email': 'a@example.com'}, {'id': 'user-b', 'email': 'b@example.com'}]
+            mock_supabase.table.side_effect = lambda name: tables[name]
+            page = json.loads(project_details.get_change_history('p1', limit=1))
+            rest = json.loads(project_details.get_change_history('p1', cursor=page['next_cursor'], limit=5))
+
+        refs = tables['event_history'].select.return_value.or_.call_args[0][0]
+        assert 'and(table_name.eq.uploads,ref_id.in.(7))' in refs and 'ref_id.in.(11,12)' in refs
+        assert [row['new_value'] for row in page['rows'] + rest['rows']] == ['Construction', '4.5', 'New']
+        assert {row['updated_by'] for row in rest['rows']} == {'a@example.com', 'b@example.com'}
+        assert rest['next_cursor'] is None
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError):
+            project_details.get_change_history('p1', cursor='not a cursor')
+
+
+class FakeTableQuery:
+    """Applies the eq/in_/gt/order/limit calls of the eeu_data lookups to a list of rows"""
+
+    def __init__(self, rows, log):
+        self.rows = rows
+        self.log = log
+        self.count = None
+
+    def select(self, columns):
+        self.columns = columns
+        return self
+
+    def eq(self, column, value):
+        self.rows = [row for row in self.rows if row[column] == value]
+        return self
+
+    def in_(self, column, values):
+        self.log.append((column, len(values)))
+        self.rows = [row for row in self.rows if row[column] in values]
+        return self
+
+    def gt(self, column, value):
+        self.rows = [row for row in self.rows if row[column] > value]
+        return self
+
+    def order(self, column, desc=False):
+        self.rows = sorted(self.rows, key=lambda row: row[column], reverse=desc)
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        self.log.append('execute')
+        return MagicMock(data=self.rows[:self.count] if self.count else self.rows)
+
+
+class TestEEUDataByUpload:
+    """Test the chunked upload -> eeu_data lookups"""
+
+    def setup_method(self):
+        self.uploads = [{'id': i, 'project_id': 'p1', 'created_at': f'2025-01-{1 + i % 28:02d}T{i % 24:02d}:00:00'}
+                        for i in range(1, 451)]
+        # every upload has a baseline row, every third one a design row as well
+        self.eeu_rows = [{'id': i * 10 + offset, 'upload_id': i, 'baseline_design': baseline_design, 'created_at': '2025'}
+                         for i in range(1, 451) for offset, baseline_design in ((0, 'baseline'), (1, 'design'))
+                         if baseline_design == 'baseline' or i % 3 == 0]
+        self.log = []
+        tables = {'uploads': self.uploads, 'eeu_data': self.eeu_rows}
+        self.client = MagicMock()
+        self.client.table.side_effect = lambda name: FakeTableQuery(list(tables[name]), self.log)
+
+    def test_chunks_and_pages(self):
+        upload_ids = list(range(450, 0, -1))
+        with patch.object(project_details, 'supabase', self.client), patch.object(project_details, 'EEU_PAGE_SIZE', 150):
+            rows_by_upload = project_details.get_eeu_data_by_upload(upload_ids)
+            executes = self.log.count('execute')
+            ids = project_details.get_eeu_data_ids_for_uploads(upload_ids)
+
+        assert list(rows_by_upload) == upload_ids
+        assert sum(len(rows) for rows in rows_by_upload.values()) == len(self.eeu_rows)
+        assert ids[:3] == [4500, 4501, 4490]
+        # 450 uploads in chunks of 200, 200 and 50; the 267 rows of each full chunk take two pages of 150
+        assert [entry for entry in self.log if entry != 'execute'][:5] == [('upload_id', 200)] * 4 + [('upload_id', 50)]
+        assert executes == 5
+
+    def test_filter_and_empty(self):
+        with patch.object(project_details, 'supabase', self.client):
+            design = project_details.get_eeu_data_by_upload([3, 4, 6, None], 'design')
+            assert project_details.get_eeu_data_by_upload([]) == {}
+        assert {upload_id: [row['id'] for row in rows] for upload_id, rows in design.items()} == {3: [31], 6: [61]}
+        assert self.log == [('upload_id', 3), 'execute']
+
+    def test_string_upload_ids(self):
+        with patch.object(project_details, 'supabase', self.client):
+            assert project_details.get_eeu_data_ids_for_uploads(['3', '4']) == [30, 31, 40]
+            assert list(project_details.get_eeu_data_by_upload(['6', 6])) == [6]
+
+    def test_upload_ids_by_type(self):
+        with patch.object(project_details, 'supabase', self.client):
+            by_type = project_details.get_upload_ids_by_type('p1')
+        newest_first = [upload['id'] for upload in sorted(self.uploads, key=lambda upload: upload['created_at'], reverse=True)]
+        assert by_type['baseline'] == newest_first
+        assert by_type['design'] == [upload_id for upload_id in newest_first if upload_id % 3 == 0]
+        # one uploads query and one eeu_data query per chunk, instead of one per upload and type
+        assert self.log.count('execute') == 1 + 3
+
+
+class TestFetchEndUsesSides:
+    """Test that baseline and design are read concurrently"""
+
+    @pytest.mark.asyncio
+    async def test_sides_read_concurrently(self):
+        # each side waits for the other one, reading them one after the other would time out
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fetch(project_id, baseline_design, **kwargs):
+            barrier.wait()
+            return {'status': 'success', 'side': baseline_design, **kwargs}
+
+        with patch.object(project_details, 'get_energy_end_uses_data', side_effect=fetch):
+            sides = await project_details.fetch_end_uses_sides('p1', output_units='mbtu')
+
+        assert sides == {'baseline': {'status': 'success', 'side': 'baseline', 'output_units': 'mbtu'},
+                         'design': {'status': 'success', 'side': 'design', 'output_units': 'mbtu'}}
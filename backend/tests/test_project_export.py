@@ -0,0 +1,209 @@
+import io
+import copy
+import pytest
+import pandas as pd
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from unittest.mock import patch
+
+import project_export
+from project_export import (build_export_frame, iter_export_frames, get_latest_eeu_ids, fetch_in_chunks,
+                            iter_csv, iter_parquet, iter_xlsx, EXPORT_COLUMNS)
+
+
+class FakeQuery:
+    """Just enough of the supabase query builder for select/in_/eq/order/update"""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filters = []
+        self.order_by = None
+        self.update_data = None
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def order(self, column):
+        self.order_by = column
+        return self
+
+    def update(self, data):
+        self.update_data = data
+        return self
+
+    def execute(self):
+        self.db.queries.append(self.table)
+        rows = [row for row in self.db.tables[self.table] if all(f(row) for f in self.filters)]
+        if self.update_data is not None:
+            for row in rows:
+                row.update(self.update_data)
+        if self.order_by:
+            rows = sorted(rows, key=lambda row: row[self.order_by])
+        return ('data', copy.deepcopy(rows)), ('count', None)
+
+
+class FakeSupabase:
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def make_tables():
+    eeu_row = {'energy_units': 'mbtu', 'zip_code': '60601', 'city': 'CHICAGO', 'state': 'IL', 'Heating_Electricity': 10.0}
+    return {
+        'uploads': [
+            {'id': 1, 'project_id': 'p1', 'created_at': '2024-01-01T00:00:00+00:00', 'year': 2023, 'reporting_year': None, 'custom_project_id': None},
+            {'id': 2, 'project_id': 'p1', 'created_at': '2024-02-01T00:00:00+00:00', 'year': 2025, 'reporting_year': 2024, 'custom_project_id': 'CUSTOM-1'},
+            {'id': 3, 'project_id': 'p2', 'created_at': '2024-01-01T00:00:00+00:00', 'year': None, 'reporting_year': None, 'custom_project_id': ''},
+        ],
+        'eeu_data': [
+            dict(eeu_row, id=10, upload_id=1, created_at='2024-01-01T00:00:00+00:00', baseline_design='baseline'),
+            dict(eeu_row, id=11, upload_id=2, created_at='2024-02-01T00:00:00+00:00', baseline_design='baseline', Heating_Electricity=20.0),
+            dict(eeu_row, id=12, upload_id=1, created_at='2024-01-02T00:00:00+00:00', baseline_design='design', energy_units='gj', Heating_Electricity=100.0),
+            dict(eeu_row, id=13, upload_id=3, created_at='2024-01-01T00:00:00+00:00', baseline_design='design', energy_units='kbtu',
+                 zip_code=None, weather_string='BOSTON MA', report_type='iesve', Heating_Electricity=5000.0),
+        ],
+    }
+
+
+SUMMARY = [
+    {'project_id': 'p1', 'project_name': 'One', 'conditioned_area': 1000, 'climate_zone': '5A - Cool Humid', 'total_energy_per_unit_area_baseline': 55.5},
+    {'project_id': 'p2', 'project_name': 'Two', 'conditioned_area': None, 'climate_zone': None},
+    {'project_id': 'p3', 'project_name': 'No uploads'},
+    {'project_id': None, 'project_name': 'Skipped'},
+]
+
+BOSTON = {'zip_code': '2134', 'egrid_subregion': 'NEWE', 'city': 'BOSTON', 'state': 'MA'}
+
+
+@pytest.fixture
+def fake_supabase():
+    fake = FakeSupabase(make_tables())
+    with patch('project_export.supabase', fake), patch('weather_location.supabase', fake):
+        yield fake
+
+
+class TestProjectExport:
+    """Test the bulk export engine"""
+
+    def test_fetch_in_chunks(self, fake_supabase):
+        rows = fetch_in_chunks('eeu_data', '*', 'id', [10, 11, 12, 13, 10, None], chunk_size=2)
+        assert [row['id'] for row in rows] == [10, 11, 12, 13]
+        assert fake_supabase.queries == ['eeu_data', 'eeu_data']
+
+    def test_latest_eeu_ids(self, fake_supabase):
+        df_latest = get_latest_eeu_ids(project_export.get_project_uploads(['p1', 'p2'])).set_index('project_id')
+        assert df_latest.loc['p1', 'baseline_id'] == 11
+        assert df_latest.loc['p1', 'design_id'] == 12
+        assert df_latest.loc['p2', 'baseline_id'] is None
+        assert df_latest.loc['p2', 'design_id'] == 13
+
+    @patch('weather_location.weather_check', return_value=BOSTON)
+    def test_build_export_frame(self, mock_weather, fake_supabase):
+        df = build_export_frame(SUMMARY)
+        assert list(df.columns) == EXPORT_COLUMNS
+        df = df.set_index('project_name')
+        assert list(df.index) == ['One', 'Two', 'No uploads']
+        one, two, none = df.loc['One'], df.loc['Two'], df.loc['No uploads']
+
+        # custom id, years and location come from the latest upload and design row
+        assert one['project_id'] == 'CUSTOM-1'
+        assert one['reporting_year'] == '2024'
+        assert one['estimated_occupancy_year'] == '2025'
+        assert one['climate_zone'] == '5A'
+        assert one['zip_code'] == '60601'
+        assert one['conditioned_area_sf'] == 1000.0
+        assert one['baseline_eui'] == 55.5
+        assert one['predicted_eui'] == ''
+        # design units are used for both sides
+        assert one['energy_units'] == 'gj'
+        assert one['Heating_Electricity_design'] == pytest.approx(94.7817)
+        assert one['Heating_Electricity_baseline'] == pytest.approx(18.95634)
+
+        assert two['project_id'] == 'p2'
+        assert two['conditioned_area_sf'] == ''
+        assert two['Heating_Electricity_design'] == 5.0
+        assert two['Heating_Electricity_baseline'] == 0.0
+        # missing locations are processed in a batch and saved
+        assert two['zip_code'] == '02134'
+        assert fake_supabase.tables['eeu_data'][3]['zip_code'] == '02134'
+
+        assert none['project_id'] == 'p3'
+        assert none['energy_units'] == 'mbtu'
+        assert none['zip_code'] == ''
+
+    def test_metric_area(self, fake_supabase):
+        df = build_export_frame(SUMMARY[:1], is_metric=True)
+        assert df.loc[0, 'conditioned_area_sf'] == pytest.approx(92.903)
+        assert df.loc[0, 'area_units'] == 'sm'
+
+    def test_query_count_does_not_grow_with_projects(self, fake_supabase):
+        build_export_frame(SUMMARY[:1])
+        single = len(fake_supabase.queries)
+        fake_supabase.queries.clear()
+        build_export_frame(SUMMARY)
+        assert len(fake_supabase.queries) <= single + 1
+
+    def test_no_projects(self, fake_supabase):
+        df = build_export_frame([{'project_id': None}])
+        assert df.empty
+        assert list(df.columns) == EXPORT_COLUMNS
+
+    def test_frames_are_built_lazily(self, fake_supabase):
+        frames = iter_export_frames(SUMMARY, batch_size=2)
+        assert fake_supabase.queries == []
+        first = next(frames)
+        assert list(first['project_name']) == ['One', 'Two']
+        queries = len(fake_supabase.queries)
+        assert list(next(frames)['project_name']) == ['No uploads']
+        assert len(fake_supabase.queries) > queries
+
+
+class TestExportEncoders:
+    """Test the streamed CSV, Parquet and XLSX encoders"""
+
+    def setup_method(self):
+        row = {column: 0.0 for column in EXPORT_COLUMNS}
+        row.update({'project_id': 'p1', 'project_name': 'One', 'conditioned_area_sf': '', 'zip_code': '02134', 'reporting_year': '2024'})
+        self.frames = [pd.DataFrame([row, dict(row, project_id='p2', conditioned_area_sf=1000.0)], columns=EXPORT_COLUMNS),
+                       pd.DataFrame([dict(row, project_id='p3', Heating_Electricity_design=12.5)], columns=EXPORT_COLUMNS)]
+
+    def test_csv(self):
+        chunks = list(iter_csv(iter(self.frames)))
+        assert len(chunks) == 3
+        expected = pd.concat(self.frames).to_csv(index=False)
+        assert b''.join(chunks).decode('utf-8') == expected
+
+    def test_parquet_row_groups(self):
+        data = b''.join(iter_parquet(iter(self.frames)))
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        assert parquet.num_row_groups == 2
+        df = parquet.read().to_pandas()
+        assert list(df.columns) == EXPORT_COLUMNS
+        assert list(df['project_id']) == ['p1', 'p2', 'p3']
+        assert df['zip_code'].iloc[0] == '02134'
+        assert pd.isna(df['conditioned_area_sf'].iloc[0])
+        assert df['conditioned_area_sf'].iloc[1] == 1000.0
+        assert df['Heating_Electricity_design'].iloc[2] == 12.5
+
+    def test_xlsx_matches_template_layout(self):
+        data = b''.join(iter_xlsx(iter(self.frames), chunk_size=1024))
+        ws = load_workbook(io.BytesIO(data))['Projects']
+        rows = list(ws.iter_rows(values_only=True))
+        assert rows[0][0] == 'Multi-Project Upload Template - Fill one row per project'
+        assert list(rows[3]) == EXPORT_COLUMNS
+        assert [row[0] for row in rows[4:]] == ['p1', 'p2', 'p3']
+        assert ws.cell(row=4, column=1).font.bold
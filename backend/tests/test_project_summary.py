@@ -0,0 +1,250 @@
+import re
+import pytest
+from unittest.mock import patch, MagicMock
+
+import project_summary
+from project_summary import (
+    encode_cursor, decode_cursor, quote_value, search_filter, parse_columns, parse_sort,
+    read_project_summaries, iter_project_summaries, refresh_project_summaries
+)
+
+
+def split_top_level(text):
+    """Splits a PostgREST logic tree body on the commas outside parentheses and quotes"""
+    parts, depth, quoted, escaped, current = [], 0, False, False, ''
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    return parts + [current]
+
+
+def unquote(value):
+    if value.startswith('"') and value.endswith('"'):
+        return re.sub(r'\\(.)', r'\1', value[1:-1])
+    return value
+
+
+def matches(row, condition):
+    """Evaluates one condition of a PostgREST or()/and() tree against a row"""
+    for operator, combine in (('or', any), ('and', all)):
+        if condition.startswith(operator + '('):
+            return combine(matches(row, part) for part in split_top_level(condition[len(operator) + 1:-1]))
+    column, op, value = condition.split('.', 2)
+    value = unquote(value)
+    cell = row.get(column)
+    if op == 'is':
+        return cell is None
+    if cell is None:
+        return False
+    if op == 'ilike':
+        return re.fullmatch(re.escape(value).replace('%', '.*'), str(cell), re.IGNORECASE) is not None
+    if isinstance(cell, (int, float)):
+        value = float(value)
+    return {'eq': cell == value, 'gt': cell > value, 'lt': cell < value}[op]
+
+
+class FakeQuery:
+    """Applies the select/eq/in_/or_/order/limit calls of read_project_summaries to a list of rows"""
+
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+        self.orders = []
+
+    def select(self, columns):
+        self.calls.append(('select', columns))
+        return self
+
+    def eq(self, column, value):
+        self.calls.append(('eq', column, value))
+        self.rows = [row for row in self.rows if row[column] == value]
+        return self
+
+    def in_(self, column, values):
+        self.calls.append(('in_', column, values))
+        self.rows = [row for row in self.rows if row[column] in values]
+        return self
+
+    def or_(self, condition):
+        self.calls.append(('or_', condition))
+        self.rows = [row for row in self.rows if matches(row, f'or({condition})')]
+        return self
+
+    def order(self, column, desc=False, nullsfirst=None):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        # stable sorts from the last order key to the first, nulls last
+        for column, desc in reversed(self.orders):
+            present = sorted([row for row in self.rows if row[column] is not None], key=lambda row: row[column], reverse=desc)
+            self.rows = present + [row for row in self.rows if row[column] is None]
+        self.rows = self.rows[:count]
+        return self
+
+    def execute(self):
+        return ('data', list(self.rows)), ('count', None)
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+        self.tables = []
+
+    def table(self, name):
+        self.tables.append(name)
+        return FakeQuery(self.rows, self.calls)
+
+
+def make_rows(count):
+    names = ['Alpha, North', 'beta', None, 'Gamma (old)', 'alpha "x"']
+    return [{'project_id': f'p{i:03d}', 'company_id': 'c1' if i % 2 else 'c2',
+             'project_use_type': 'Office' if i % 3 else 'School', 'project_phase': 'Design',
+             'climate_zone': '4A - Mixed Humid', 'project_name': names[i % len(names)],
+             'conditioned_area': float(i % 4) * 1000 if i % 7 else None} for i in range(count)]
+
+
+def read_all(client, limit, **kwargs):
+    rows, offsets, cursor = [], [], None
+    while True:
+        page = read_project_summaries(limit=limit, cursor=cursor, client=client, **kwargs)
+        rows.extend(page['rows'])
+        offsets.append(page['offset'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return rows, offsets
+
+
+def expected_order(rows, column, desc):
+    # sorted() stays stable with reverse=True, so ties keep project_id ascending in both directions
+    present = sorted(sorted([row for row in rows if row[column] is not None], key=lambda row: row['project_id']),
+                     key=lambda row: row[column], reverse=desc)
+    return present + sorted([row for row in rows if row[column] is None], key=lambda row: row['project_id'])
+
+
+class TestCursors:
+    """Test the opaque keyset cursors"""
+
+    def test_round_trip(self):
+        assert decode_cursor(encode_cursor(['p001', 'p002', 10])) == ['p001', 'p002', 10]
+
+    @pytest.mark.parametrize('cursor', ['not a cursor', encode_cursor([]), 'e30'])
+    def test_invalid(self, cursor):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+    def test_cursor_needs_position(self):
+        with pytest.raises(ValueError):
+            read_project_summaries(cursor=encode_cursor(['p001']), client=FakeClient([]))
+
+
+class TestRequestParsing:
+    """Test fields=, sort= and search= parsing"""
+
+    def test_fields(self):
+        assert parse_columns(None) == '*'
+        assert parse_columns('project_name, project_id,project_name') == 'project_name,project_id'
+
+    @pytest.mark.parametrize('fields', ['project_name,owner:company_id', 'uploads(*)', ' , '])
+    def test_invalid_fields(self, fields):
+        with pytest.raises(ValueError):
+            parse_columns(fields)
+
+    def test_sort(self):
+        assert parse_sort(None) == ('project_id', False)
+        assert parse_sort('-most_recent_updated_at') == ('most_recent_updated_at', True)
+        with pytest.raises(ValueError):
+            parse_sort('company_id')
+
+    def test_search_quotes_reserved_characters(self):
+        assert quote_value('a "b", c\\d') == '"a \\"b\\", c\\\\d"'
+        assert search_filter('  ') is None
+        assert search_filter('North, (x)').startswith('project_name.ilike."%North, (x)%",')
+
+
+class TestReadProjectSummaries:
+    """Test paging, sorting and filtering of the stored summaries"""
+
+    def test_pages_cover_every_row_once(self):
+        client = FakeClient(make_rows(25))
+        rows, offsets = read_all(client, 10)
+        assert [row['project_id'] for row in rows] == [f'p{i:03d}' for i in range(25)]
+        assert offsets == [0, 10, 20]
+        assert client.tables[0] == project_summary.SUMMARY_SOURCES['projects']['table']
+
+    @pytest.mark.parametrize('sort', ['project_name', '-project_name', 'conditioned_area', '-conditioned_area', '-project_id'])
+    def test_sorted_pages_with_nulls_and_ties(self, sort):
+        data = make_rows(37)
+        rows, _ = read_all(FakeClient(data), 4, sort=sort)
+        column, desc = parse_sort(sort)
+        if column == 'project_id':
+            expected = sorted(data, key=lambda row: row['project_id'], reverse=desc)
+        else:
+            expected = expected_order(data, column, desc)
+        assert [row['project_id'] for row in rows] == [row['project_id'] for row in expected]
+
+    def test_search_with_cursor(self):
+        data = make_rows(40)
+        rows, _ = read_all(FakeClient(data), 3, search='alpha', sort='project_name')
+        expected = [row for row in data if row['project_name'] and 'alpha' in row['project_name'].lower()]
+        assert sorted(row['project_id'] for row in rows) == sorted(row['project_id'] for row in expected)
+        assert len(rows) == len(expected)
+
+    def test_last_full_page_has_no_cursor(self):
+        page = read_project_summaries(limit=5, client=FakeClient(make_rows(5)))
+        assert len(page['rows']) == 5
+        assert page['next_cursor'] is None
+
+    def test_filters(self):
+        client = FakeClient(make_rows(30))
+        rows = list(iter_project_summaries(client=client, page_size=4, company_id='c1',
+                                           project_use_type=['School'], project_phase=None))
+        assert rows and all(row['company_id'] == 'c1' and row['project_use_type'] == 'School' for row in rows)
+        assert ('in_', 'project_use_type', ['School']) in client.calls
+
+    def test_projection_keeps_key_and_sort_column(self):
+        client = FakeClient(make_rows(3))
+        read_project_summaries(columns='project_name', client=client)
+        read_project_summaries(columns='project_name', client=client, sort='conditioned_area')
+        assert ('select', 'project_name,project_id') in client.calls
+        assert ('select', 'project_name,project_id,conditioned_area') in client.calls
+
+    def test_unknown_filter(self):
+        with pytest.raises(ValueError):
+            read_project_summaries(client=FakeClient([]), owner='someone')
+
+
+class TestRefreshProjectSummaries:
+    """Test the incremental refresh calls"""
+
+    def test_refresh_ids(self):
+        client = MagicMock()
+        client.rpc.return_value.execute.return_value.data = 1
+        assert refresh_project_summaries(['p1', 'p1', None], eeu_ids=['7'], client=client) == 1
+        client.rpc.assert_called_once_with('refresh_project_summaries', {'p_project_ids': ['p1'], 'p_eeu_ids': [7]})
+
+    def test_nothing_to_refresh(self):
+        client = MagicMock()
+        assert refresh_project_summaries([], client=client) is None
+        client.rpc.assert_not_called()
+
+    def test_failures_are_logged(self):
+        client = MagicMock()
+        client.rpc.side_effect = Exception('connection reset')
+        with patch('project_summary.logging_start.logger') as mock_logger:
+            assert refresh_project_summaries(['p1'], client=client) is None
+        mock_logger.error.assert_called_once()
@@ -0,0 +1,82 @@
+import pytest
+import os
+import pandas as pd
+from unittest.mock import patch, Mock
+
+from parse_reports.report_detection import sniff_container, detect_report_type
+import post_processing
+
+
+class TestSniffContainer:
+    """Test container detection from leading bytes"""
+
+    def test_pdf_magic(self):
+        assert sniff_container(b'%PDF-1.7\n...') == 'pdf'
+
+    def test_xlsx_magic(self):
+        assert sniff_container(b'PK\x03\x04rest-of-zip') == 'xlsx'
+
+    def test_html(self):
+        assert sniff_container(b'  <!DOCTYPE html><html><body></body></html>') == 'html'
+        assert sniff_container(b'<HTML><body>EnergyPlus</body></HTML>') == 'html'
+
+    def test_text(self):
+        assert sniff_container(b'1REPORT- BEPS Building Energy Performance') == 'text'
+
+    def test_empty_and_binary(self):
+        assert sniff_container(b'') is None
+        assert sniff_container(b'\x00\x01\x02binary') is None
+
+
+class TestDetectReportType:
+    """Test report type detection from marker strings"""
+
+    def test_sim_text_report(self):
+        content = b'REPORT- BEPS Building Energy Performance   WEATHER FILE- CZ03RV2\n'
+        assert detect_report_type(content) == (3, 'text')
+
+    def test_eplus_html_report(self):
+        content = b'<html><body><p>Building: Office</p><p>Environment: RUN PERIOD 1</p></body></html>'
+        assert detect_report_type(content) == (2, 'html')
+
+    def test_unknown_text(self):
+        assert detect_report_type(b'just some notes') == (None, 'text')
+
+    def test_multi_project_workbook(self):
+        template = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dependencies', 'd3p-multi-project-template.xlsx')
+        with open(template, 'rb') as f:
+            content = f.read()
+        report_type, container = detect_report_type(content)
+        assert container == 'xlsx'
+        assert report_type in (4, 9)
+
+
+class TestRunScriptMasterDispatch:
+    """Test that run_script_master downloads once and dispatches to a single parser"""
+
+    @patch('post_processing.post_process')
+    @patch('post_processing.parse_report_eplus')
+    @patch('post_processing.parse_report_sim')
+    @patch('post_processing.fetch_report_bytes')
+    def test_single_download_single_parser(self, mock_fetch, mock_sim, mock_eplus, mock_post_process):
+        content = b'REPORT- BEPS Building Energy Performance\n'
+        mock_fetch.return_value = content
+        mock_sim.__name__ = 'parse_report_sim'
+        mock_sim.return_value = {'df': pd.DataFrame(), 'warnings': []}
+        mock_post_process.return_value = pd.DataFrame()
+
+        result = post_processing.run_script_master('https://example.com/report.sim')
+
+        mock_fetch.assert_called_once()
+        mock_sim.assert_called_once_with('https://example.com/report.sim', content=content)
+        mock_eplus.assert_not_called()
+        assert result['status'] == 'success'
+        assert result['report_type'] == 3
+        assert set(['download', 'detect', 'parse', 'post_process', 'total']).issubset(result['timings'])
+
+    @patch('post_processing.fetch_report_bytes')
+    def test_unsupported_file(self, mock_fetch):
+        mock_fetch.return_value = b'\x00\x01\x02'
+        result = post_processing.run_script_master('https://example.com/file.bin')
+        assert result[0] == 'pending'
+        assert result[1] == ['Unsupported file type.']
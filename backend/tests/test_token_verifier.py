@@ -0,0 +1,98 @@
+import time
+import jwt
+import pytest
+from unittest.mock import Mock, patch
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from token_verifier import TokenVerifier
+
+SECRET = 'test-jwt-secret-test-jwt-secret-0123'
+
+
+def make_token(key=SECRET, algorithm='HS256', headers=None, **claims):
+    payload = {'sub': 'user-1', 'aud': 'authenticated', 'exp': int(time.time()) + 3600,
+               'user_metadata': {'company_id': 'company-1', 'role': 'superadmin'}}
+    payload.update(claims)
+    return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+def remote_client(user_id='user-1', company_id='company-1'):
+    client = Mock()
+    client.auth.get_user.return_value.user.id = user_id
+    client.auth.get_user.return_value.user.user_metadata = {'company_id': company_id}
+    return client
+
+
+class TestTokenVerifier:
+    """Test in-process verification, the verified-token cache and the revocation check"""
+
+    def test_valid_token(self):
+        client = Mock()
+        verifier = TokenVerifier(client, jwt_secret=SECRET)
+        assert verifier.verify(make_token()) == {'is_authorized': True, 'company_id': 'company-1',
+                                                 'role': 'superadmin', 'user_id': 'user-1'}
+        client.auth.get_user.assert_not_called()
+
+    @pytest.mark.parametrize('token', [
+        make_token(exp=int(time.time()) - 10),
+        make_token(aud='anon'),
+        make_token(key='wrong-secret-wrong-secret-wrong-secret'),
+        make_token(user_metadata={'role': 'admin'}),
+        make_token(exp=None),
+    ])
+    def test_rejected_tokens(self, token):
+        verifier = TokenVerifier(Mock(), jwt_secret=SECRET)
+        assert verifier.verify(token) == {'is_authorized': False}
+
+    def test_cache_hit_skips_verification(self):
+        verifier = TokenVerifier(Mock(), jwt_secret=SECRET)
+        token = make_token()
+        verifier.verify(token)
+        with patch('token_verifier.jwt.decode') as mock_decode:
+            assert verifier.verify(token)['is_authorized']
+            mock_decode.assert_not_called()
+
+    def test_cache_never_outlives_the_token(self):
+        verifier = TokenVerifier(Mock(), jwt_secret=SECRET, cache_ttl=3600)
+        token = make_token(exp=int(time.time()) + 1)
+        assert verifier.verify(token)['is_authorized']
+        time.sleep(2.1)
+        assert verifier.verify(token) == {'is_authorized': False}
+
+    def test_invalidate(self):
+        verifier = TokenVerifier(Mock(), jwt_secret=SECRET)
+        token = make_token()
+        verifier.verify(token)
+        verifier.invalidate(token)
+        with patch('token_verifier.jwt.decode', side_effect=jwt.InvalidTokenError()):
+            assert verifier.verify(token) == {'is_authorized': False}
+
+    def test_hs256_without_secret_uses_remote(self):
+        client = remote_client()
+        verifier = TokenVerifier(client, jwt_secret=None)
+        assert verifier.verify(make_token())['user_id'] == 'user-1'
+        client.auth.get_user.assert_called_once()
+
+    def test_revocation_check(self):
+        client = remote_client()
+        verifier = TokenVerifier(client, jwt_secret=SECRET, revocation_check='remote')
+        token = make_token()
+        assert verifier.verify(token)['is_authorized']
+        assert verifier.verify(token)['is_authorized']
+        # checked once, then served from the cache
+        assert client.auth.get_user.call_count == 1
+
+        client.auth.get_user.side_effect = Exception("Session not found")
+        assert verifier.verify(make_token(sub='user-1', iat=1)) == {'is_authorized': False}
+
+    def test_jwks_token(self):
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        verifier = TokenVerifier(Mock(), supabase_url='https://example.supabase.co', jwt_secret=None)
+        assert verifier.jwks_url == 'https://example.supabase.co/auth/v1/.well-known/jwks.json'
+
+        jwks_client = Mock()
+        jwks_client.get_signing_key_from_jwt.return_value.key = private_key.public_key()
+        with patch.object(verifier, '_get_jwks_client', return_value=jwks_client):
+            assert verifier.verify(make_token(private_key, 'ES256', headers={'kid': 'k1'}))['is_authorized']
+            other_key = ec.generate_private_key(ec.SECP256R1())
+            assert not verifier.verify(make_token(other_key, 'ES256', headers={'kid': 'k1'}))['is_authorized']
@@ -0,0 +1,355 @@
+import time
+import asyncio
+import threading
+import pytest
+from unittest.mock import ANY, MagicMock, patch
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.testclient import TestClient
+
+import upload_jobs
+import upload_routes
+from upload_jobs import UploadJobQueue, UploadQueueFull, UploadJobExists, UploadJobTimeout, _call_with_timeout
+from main import app
+from utils import verify_token
+
+
+def add(a, b):
+    return a + b
+
+
+async def wait_until_finished(queue, job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return job
+
+
+def make_queue(**kwargs):
+    kwargs.setdefault('max_workers', 1)
+    return UploadJobQueue(executor=ThreadPoolExecutor(max_workers=kwargs['max_workers']), **kwargs)
+
+
+class TestUploadJobQueue:
+    """Test job status, timeouts and cancellation"""
+
+    @pytest.mark.asyncio
+    async def test_job_succeeds(self):
+        queue = make_queue()
+        saved = []
+
+        async def handler(context, a, b):
+            context.set_stage('parsing', 0, 2)
+            total = await context.run_in_worker(add, a, b)
+            context.set_stage('saving', 1, 2)
+            await context.run_in_thread(saved.append, total)
+            return {'total': total}
+
+        job = queue.submit(handler, 2, 3, owner_company_id='7')
+        assert job.status == 'queued'
+        await wait_until_finished(queue, job)
+
+        status = queue.get(job.id).to_dict()
+        assert status['status'] == 'succeeded'
+        assert status['stage'] == 'done'
+        assert status['result'] == {'total': 5}
+        assert status['progress'] == {'steps_done': 1, 'steps_total': 2}
+        assert saved == [5]
+        assert job.company_id == '7'
+
+    @pytest.mark.asyncio
+    async def test_handler_error_fails_job(self):
+        queue = make_queue()
+
+        async def handler(context):
+            return await context.run_in_worker(add, 1, 'a')
+
+        job = await wait_until_finished(queue, queue.submit(handler))
+        assert job.status == 'failed'
+        assert 'unsupported operand' in job.error
+
+    @pytest.mark.asyncio
+    async def test_timeout(self):
+        queue = make_queue(timeout=0.05)
+
+        async def handler(context):
+            return await context.run_in_worker(time.sleep, 0.5)
+
+        with patch.object(upload_jobs, 'TIMEOUT_GRACE', 0):
+            job = await wait_until_finished(queue, queue.submit(handler))
+        assert job.status == 'timed_out'
+        assert job.result is None
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_job(self):
+        queue = make_queue(max_workers=1)
+        release = threading.Event()
+        saved = []
+
+        async def handler(context, name):
+            await context.run_in_worker(release.wait, 5)
+            saved.append(name)
+            return name
+
+        first = queue.submit(handler, 'first')
+        second = queue.submit(handler, 'second')
+        await asyncio.sleep(0.05)
+        # the second job is still waiting for the only worker slot
+        assert second.status == 'queued'
+        assert queue.cancel(second.id)
+        release.set()
+        await wait_until_finished(queue, first)
+        await wait_until_finished(queue, second)
+
+        assert first.status == 'succeeded'
+        assert second.status == 'cancelled'
+        assert saved == ['first']
+        assert not queue.cancel(first.id)
+        assert not queue.cancel('unknown')
+
+    @pytest.mark.asyncio
+    async def test_queue_full(self):
+        queue = make_queue(max_pending=1)
+        release = threading.Event()
+
+        async def handler(context):
+            return await context.run_in_worker(release.wait, 5)
+
+        job = queue.submit(handler)
+        with pytest.raises(UploadQueueFull):
+            queue.submit(handler)
+        release.set()
+        await wait_until_finished(queue, job)
+
+    @pytest.mark.asyncio
+    async def test_job_id_from_caller(self):
+        queue = make_queue()
+
+        async def handler(context):
+            return 'done'
+
+        job = queue.submit(handler, job_id='chosen')
+        assert queue.get('chosen') is job
+        with pytest.raises(UploadJobExists):
+            queue.submit(handler, job_id='chosen')
+        await wait_until_finished(queue, job)
+
+    @pytest.mark.asyncio
+    async def test_prune_finished_jobs(self):
+        queue = make_queue(job_ttl=0)
+
+        async def handler(context):
+            return 'done'
+
+        job = await wait_until_finished(queue, queue.submit(handler))
+        await asyncio.sleep(0.01)
+        queue.prune()
+        assert queue.get(job.id) is None
+
+    def test_worker_alarm(self):
+        with pytest.raises(UploadJobTimeout):
+            _call_with_timeout(0.05, time.sleep, (1,), {})
+        assert _call_with_timeout(0.05, add, (1, 2), {}) == 3
+
+
+PARSED = {'status': 'success', 'report_type': 1, 'df': None, 'errors': [], 'warnings': []}
+PARSED_PRM = dict(PARSED, report_type=8)
+PARSED_MULTI = {'status': 'success', 'report_type': 9, 'is_multi_project': True}
+
+
+class FakeContext:
+    """Runs job steps inline and records the stages"""
+
+    def __init__(self):
+        self.stages = []
+        self.steps = []
+
+    def set_stage(self, stage, steps_done=None, steps_total=None):
+        self.stages.append(stage)
+        self.steps.append((steps_done, steps_total))
+
+    async def run_in_worker(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    async def run_in_thread(self, fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+
+class TestParseUpload:
+    """Test that parse_upload closes the workbook it opened for multi-project detection"""
+
+    @pytest.mark.parametrize('multi_project', [True, False])
+    def test_workbook_closed(self, multi_project):
+        workbook = MagicMock()
+        with patch('parse_reports.workbook_source.WorkbookSource.from_url', return_value=workbook), \
+             patch('parse_reports.parse_multi_project_xlsx.is_multi_project_excel', return_value=multi_project), \
+             patch('parse_reports.parse_multi_project_xlsx.MultiProjectExcelParser.parse_multi_project_excel', return_value={}), \
+             patch('upload_routes.run_script_master', return_value=PARSED) as mock_master:
+            result = upload_routes.parse_upload('url', 'design', file_extension='.xlsx')
+
+        assert result['report_type'] == (9 if multi_project else 1)
+        assert mock_master.called != multi_project
+        workbook.close.assert_called_once()
+
+
+class TestProcessUploadJob:
+    """Test the upload job handler"""
+
+    @pytest.mark.asyncio
+    @patch('upload_routes.save_upload', return_value={'status': 'success', 'eeu_id': 1})
+    @patch('upload_routes.parse_upload', return_value=PARSED)
+    async def test_single_report(self, mock_parse, mock_save):
+        context = FakeContext()
+        result = await upload_routes.process_upload_job(context, 'url', 'design', file_extension='.pdf', file_name='a.pdf')
+
+        assert result == {'status': 'success', 'eeu_id': 1}
+        mock_parse.assert_called_once_with('url', 'design', None, None, '.pdf')
+        mock_save.assert_called_once_with(PARSED, 'url', 'design', '.pdf', 'a.pdf')
+        assert context.stages == ['parsing', 'saving']
+
+    @pytest.mark.asyncio
+    @patch('upload_routes.save_upload', side_effect=lambda results, url, side, *args: {'side': side})
+    @patch('upload_routes.parse_upload', return_value=PARSED_PRM)
+    async def test_detected_prm_parses_other_side(self, mock_parse, mock_save):
+        result = await upload_routes.process_upload_job(FakeContext(), 'url', 'design', file_extension='.pdf')
+
+        assert result == {'report_type': 8, 'baseline': {'side': 'baseline'}, 'design': {'side': 'design'}}
+        assert [c.args[1] for c in mock_parse.call_args_list] == ['design', 'baseline']
+        assert mock_save.call_count == 2
+
+    @pytest.mark.asyncio
+    @patch('upload_routes.process_multi_project_upload', return_value={'status': 'success', 'report_type': 9})
+    @patch('upload_routes.save_upload')
+    @patch('upload_routes.parse_upload', return_value=PARSED_MULTI)
+    async def test_multi_project_excel(self, mock_parse, mock_save, mock_multi):
+        result = await upload_routes.process_upload_job(FakeContext(), 'url', 'design', file_extension='.xlsx', company_id='3')
+
+        assert result['report_type'] == 9
+        mock_multi.assert_called_once_with('url', '3', None, ANY)
+        mock_save.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch('upload_routes.parse_upload', return_value=PARSED_MULTI)
+    async def test_multi_project_progress(self, mock_parse):
+        context = FakeContext()
+
+        def process(url, company_id, parse_result, progress):
+            progress(0, 3)
+            progress(3, 3)
+            return {'status': 'success', 'report_type': 9}
+
+        with patch('upload_routes.process_multi_project_upload', side_effect=process):
+            await upload_routes.process_upload_job(context, 'url', 'design', file_extension='.xlsx', company_id='3')
+        assert context.steps == [(0, 2), (1, 2), (0, 3), (3, 3)]
+
+
+class TestUploadJobRoutes:
+    """Test the upload and job status endpoints"""
+
+    def setup_method(self):
+        self.client = TestClient(app)
+        self.queue = make_queue()
+
+    def teardown_method(self):
+        app.dependency_overrides.clear()
+
+    def test_upload_returns_result(self, monkeypatch):
+        monkeypatch.setenv('BUCKET_NAME', 'bucket')
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': True, 'company_id': '1'}
+
+        async def fake_job(context, *args, **kwargs):
+            return {'status': 'success', 'eeu_id': 5}
+
+        with patch('upload_routes.upload_blob', return_value='https://storage/report.pdf'), \
+             patch('upload_routes.process_upload_job', fake_job), \
+             patch('upload_routes.upload_job_queue', self.queue):
+            response = self.client.post(
+                "/uploadfile/",
+                data={'baseline_design': 'design', 'company_id': '1'},
+                files={'file': ('report.pdf', b'%PDF-1.4', 'application/pdf')},
+            )
+        assert response.status_code == 200
+        assert response.json() == {'status': 'success', 'eeu_id': 5}
+
+    def test_upload_progress_pollable_under_caller_job_id(self, monkeypatch):
+        monkeypatch.setenv('BUCKET_NAME', 'bucket')
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': True, 'company_id': '1'}
+        job_id = '0b6f1a52-3c1e-4a7e-9d55-6d7a0c1f2e3b'
+
+        async def fake_job(context, *args, **kwargs):
+            context.set_stage('creating projects', 3, 3)
+            return {'status': 'success', 'report_type': 9}
+
+        with patch('upload_routes.upload_blob', return_value='https://storage/report.xlsx'), \
+             patch('upload_routes.process_upload_job', fake_job), \
+             patch('upload_routes.upload_job_queue', self.queue):
+            response = self.client.post(
+                "/uploadfile/",
+                data={'baseline_design': 'design', 'company_id': '1', 'job_id': job_id},
+                files={'file': ('projects.xlsx', b'PK', 'application/octet-stream')},
+            )
+            assert response.json() == {'status': 'success', 'report_type': 9}
+            status = self.client.get(f"/upload_jobs/{job_id}").json()
+            assert status['stage'] == 'done' and status['progress'] == {'steps_done': 3, 'steps_total': 3}
+
+            invalid = self.client.post(
+                "/uploadfile/",
+                data={'baseline_design': 'design', 'company_id': '1', 'job_id': 'not-a-uuid'},
+                files={'file': ('projects.xlsx', b'PK', 'application/octet-stream')},
+            )
+            assert invalid.status_code == 400
+
+    def test_upload_returns_job_error(self, monkeypatch):
+        monkeypatch.setenv('BUCKET_NAME', 'bucket')
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': True, 'company_id': '1'}
+
+        async def failing_job(context, *args, **kwargs):
+            raise ValueError('unreadable report')
+
+        with patch('upload_routes.upload_blob', return_value='https://storage/report.pdf'), \
+             patch('upload_routes.process_upload_job', failing_job), \
+             patch('upload_routes.upload_job_queue', self.queue):
+            response = self.client.post(
+                "/uploadfile/",
+                data={'baseline_design': 'design', 'company_id': '1'},
+                files={'file': ('report.pdf', b'%PDF-1.4', 'application/pdf')},
+            )
+        assert response.json() == {'status': 'error', 'message': 'unreadable report'}
+
+    def test_upload_returns_job_id(self, monkeypatch):
+        monkeypatch.setenv('BUCKET_NAME', 'bucket')
+        monkeypatch.setattr(upload_routes, 'UPLOAD_ASYNC', True)
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': True, 'company_id': '1'}
+
+        async def fake_job(context, *args, **kwargs):
+            return {'status': 'success', 'eeu_id': 5}
+
+        with patch('upload_routes.upload_blob', return_value='https://storage/report.pdf'), \
+             patch('upload_routes.process_upload_job', fake_job), \
+             patch('upload_routes.upload_job_queue', self.queue):
+            response = self.client.post(
+                "/uploadfile/",
+                data={'baseline_design': 'design', 'company_id': '1'},
+                files={'file': ('report.pdf', b'%PDF-1.4', 'application/pdf')},
+            )
+            assert response.status_code == 200
+            body = response.json()
+            assert body['status'] == 'queued'
+            assert body['file_name'] == 'report.pdf'
+
+            status = self.client.get(f"/upload_jobs/{body['job_id']}").json()
+            assert status['job_id'] == body['job_id']
+            assert status['status'] in ('queued', 'running', 'succeeded')
+
+    def test_job_hidden_from_other_companies(self):
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': True, 'company_id': '2'}
+        job = upload_jobs.UploadJob(id='abc', company_id='1')
+        self.queue._jobs[job.id] = job
+
+        with patch('upload_routes.upload_job_queue', self.queue):
+            assert self.client.get("/upload_jobs/abc").status_code == 404
+            assert self.client.delete("/upload_jobs/abc").status_code == 404
+            assert self.client.get("/upload_jobs/missing").status_code == 404
+
+    def test_unauthorized(self):
+        app.dependency_overrides[verify_token] = lambda: {'is_authorized': False}
+        assert self.client.get("/upload_jobs/abc").json() == "not authorized"
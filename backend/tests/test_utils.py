@@ -1,14 +1,17 @@
 import pytest
 import pandas as pd
 import os
+import time
+import jwt
 from unittest.mock import patch, Mock, MagicMock, AsyncMock
 from fastapi import Request
 
 from utils import (
-    encrypt_value, decrypt_value, return_enum_vals, get_enum_id, 
+    encrypt_value, decrypt_value, return_enum_vals, return_enum_value, get_enum_id, 
     add_event_history, sanitize_filename, get_field_name_from_use_type,
     fuel_category_override, verify_token, create_app
 )
+from token_verifier import TokenVerifier
 
 class TestEncryption:
     """Test encryption and decryption functions"""
@@ -43,48 +46,53 @@ class TestEncryption:
 class TestEnumFunctions:
     """Test enum-related utility functions"""
     
-    @patch('utils.supabase')
-    def test_return_enum_vals_success(self, mock_supabase):
+    def setup_method(self):
+        self.tables = {
+            'project_use_types': [
+                {'id': 1, 'name': 'Office', 'order': 1},
+                {'id': 2, 'name': 'Retail', 'order': 2}
+            ],
+            'use_type_subtypes': [
+                {'id': 5, 'name': 'Open Office', 'use_type_id': 1, 'order': 1},
+                {'id': 6, 'name': 'Mall', 'use_type_id': 2, 'order': 2}
+            ]
+        }
+    
+    def _patch_tables(self, tables):
+        return patch('utils.enum_cache._fetch', return_value=tables)
+    
+    def teardown_method(self):
+        from utils import enum_cache
+        enum_cache.invalidate()
+    
+    def test_return_enum_vals_success(self):
         """Test successful enum value retrieval"""
-        mock_data = [
-            {'id': 1, 'name': 'Office', 'order': 1},
-            {'id': 2, 'name': 'Retail', 'order': 2}
-        ]
-        # Supabase execute() returns (data, count) where data is (None, actual_results)
-        mock_response = ((None, mock_data), None)  # (data, count) where data[1] = mock_data
-        mock_supabase.table.return_value.select.return_value.order.return_value.execute.return_value = mock_response
-        
-        result = return_enum_vals('project_use_types')
-        assert result == mock_data
-        mock_supabase.table.assert_called_with('enum_project_use_types')
+        with self._patch_tables(self.tables):
+            result = return_enum_vals('project_use_types')
+        assert result == self.tables['project_use_types']
     
-    @patch('utils.supabase')
-    def test_return_enum_vals_with_filter(self, mock_supabase):
+    def test_return_enum_vals_with_filter(self):
         """Test enum value retrieval with use_type_id filter"""
-        mock_data = [{'id': 1, 'name': 'Office', 'order': 1}]
-        mock_query = mock_supabase.table.return_value.select.return_value.order.return_value
-        mock_response = ((None, mock_data), None)  # (data, count) where data[1] = mock_data
-        mock_query.eq.return_value.execute.return_value = mock_response
-        
-        result = return_enum_vals('project_use_types', use_type_id=1)
-        assert result == mock_data
-        mock_query.eq.assert_called_with('use_type_id', 1)
+        with self._patch_tables(self.tables):
+            result = return_enum_vals('use_type_subtypes', use_type_id=1)
+        assert result == [self.tables['use_type_subtypes'][0]]
     
-    @patch('utils.supabase')
-    def test_return_enum_vals_no_results(self, mock_supabase):
+    def test_return_enum_vals_by_id(self):
+        """Test enum value retrieval by id, including ids stored as strings"""
+        with self._patch_tables(self.tables):
+            assert return_enum_vals('project_use_types', id_value='2') == [self.tables['project_use_types'][1]]
+            assert return_enum_value('project_use_types', 1) == 'Office'
+    
+    def test_return_enum_vals_no_results(self):
         """Test enum value retrieval with no results"""
-        mock_response = ((None, []), None)  # (data, count) where data[1] = []
-        mock_supabase.table.return_value.select.return_value.order.return_value.execute.return_value = mock_response
-        
-        result = return_enum_vals('project_use_types')
+        with self._patch_tables({'project_use_types': []}):
+            result = return_enum_vals('project_use_types')
         assert result == "no results"
     
-    @patch('utils.supabase')
-    def test_return_enum_vals_error(self, mock_supabase):
+    def test_return_enum_vals_error(self):
         """Test enum value retrieval with database error"""
-        mock_supabase.table.return_value.select.return_value.order.return_value.execute.side_effect = Exception("DB Error")
-        
-        result = return_enum_vals('project_use_types')
+        with patch('utils.enum_cache._fetch', side_effect=Exception("DB Error")):
+            result = return_enum_vals('project_use_types')
         assert result == "error"
     
     def test_return_enum_vals_invalid_type(self):
@@ -92,26 +100,16 @@ class TestEnumFunctions:
         result = return_enum_vals('invalid_enum_type')
         assert result == "error"
     
-    @patch('utils.return_enum_vals')
-    def test_get_enum_id_success(self, mock_return_enum_vals):
+    def test_get_enum_id_success(self):
         """Test successful enum ID retrieval"""
-        mock_return_enum_vals.return_value = [
-            {'id': 1, 'name': 'Office'},
-            {'id': 2, 'name': 'Retail'}
-        ]
-        
-        result = get_enum_id('project_use_types', 'Office')
+        with self._patch_tables(self.tables):
+            result = get_enum_id('project_use_types', 'Office')
         assert result == 1
     
-    @patch('utils.return_enum_vals')
-    def test_get_enum_id_not_found(self, mock_return_enum_vals):
+    def test_get_enum_id_not_found(self):
         """Test enum ID retrieval when value not found"""
-        mock_return_enum_vals.return_value = [
-            {'id': 1, 'name': 'Office'},
-            {'id': 2, 'name': 'Retail'}
-        ]
-        
-        result = get_enum_id('project_use_types', 'NonExistent')
+        with self._patch_tables(self.tables):
+            result = get_enum_id('project_use_types', 'NonExistent')
         assert result is None
 
 
@@ -177,25 +175,20 @@ class TestUtilityFunctions:
 class TestAuthentication:
     """Test authentication and authorization"""
     
-    @pytest.mark.asyncio
-    @patch('utils.supabase')
-    async def test_verify_token_success(self, mock_supabase):
-        """Test successful token verification"""
+    def _request(self, token):
         mock_request = Mock(spec=Request)
-        mock_request.headers = {'Authorization': 'Bearer valid_token'}
-        
-        mock_user = Mock()
-        mock_user.user_metadata = {
-            'company_id': 'company_123',
-            'role': 'admin'
-        }
-        mock_user.id = 'user_123'
-        
-        mock_auth_response = Mock()
-        mock_auth_response.user = mock_user
-        mock_supabase.auth.get_user.return_value = mock_auth_response
+        mock_request.headers = {'Authorization': f'Bearer {token}'}
+        return mock_request
+    
+    @pytest.mark.asyncio
+    async def test_verify_token_success(self):
+        """Test successful token verification from the token claims"""
+        token = jwt.encode({'sub': 'user_123', 'aud': 'authenticated', 'exp': int(time.time()) + 3600,
+                            'user_metadata': {'company_id': 'company_123', 'role': 'admin'}}, 'test-jwt-secret-test-jwt-secret-0123', algorithm='HS256')
+        mock_supabase = Mock()
         
-        result = await verify_token(mock_request)
+        with patch('utils.token_verifier', TokenVerifier(mock_supabase, jwt_secret='test-jwt-secret-test-jwt-secret-0123')):
+            result = await verify_token(self._request(token))
         
         expected = {
             'is_authorized': True,
@@ -204,24 +197,22 @@ class TestAuthentication:
             'user_id': 'user_123'
         }
         assert result == expected
+        mock_supabase.auth.get_user.assert_not_called()
     
     @pytest.mark.asyncio
-    @patch('utils.supabase')
-    async def test_verify_token_no_role(self, mock_supabase):
-        """Test token verification with no role in metadata"""
-        mock_request = Mock(spec=Request)
-        mock_request.headers = {'Authorization': 'Bearer valid_token'}
-        
+    async def test_verify_token_remote_no_role(self):
+        """Test remote token verification with no role in metadata"""
         mock_user = Mock()
         mock_user.user_metadata = {'company_id': 'company_123'}
         mock_user.id = 'user_123'
         
-        mock_auth_response = Mock()
-        mock_auth_response.user = mock_user
-        mock_supabase.auth.get_user.return_value = mock_auth_response
+        mock_supabase = Mock()
+        mock_supabase.auth.get_user.return_value.user = mock_user
         
-        result = await verify_token(mock_request)
+        with patch('utils.token_verifier', TokenVerifier(mock_supabase, mode='remote')):
+            result = await verify_token(self._request('valid_token'))
         assert result['role'] == 'NA'
+        assert result['user_id'] == 'user_123'
     
     @pytest.mark.asyncio
     async def test_verify_token_no_bearer(self):
@@ -242,16 +233,24 @@ class TestAuthentication:
         assert result == {'is_authorized': False}
     
     @pytest.mark.asyncio
-    @patch('utils.supabase')
-    async def test_verify_token_auth_error(self, mock_supabase):
+    async def test_verify_token_auth_error(self):
         """Test token verification with authentication error"""
-        mock_request = Mock(spec=Request)
-        mock_request.headers = {'Authorization': 'Bearer invalid_token'}
-        
+        mock_supabase = Mock()
         mock_supabase.auth.get_user.side_effect = Exception("Invalid token")
         
-        result = await verify_token(mock_request)
+        with patch('utils.token_verifier', TokenVerifier(mock_supabase, mode='remote')):
+            result = await verify_token(self._request('invalid_token'))
+        assert result == {'is_authorized': False}
+    
+    @pytest.mark.asyncio
+    async def test_verify_token_malformed(self):
+        """Test that a malformed token is rejected without calling Supabase Auth"""
+        mock_supabase = Mock()
+        
+        with patch('utils.token_verifier', TokenVerifier(mock_supabase, jwt_secret='test-jwt-secret-test-jwt-secret-0123')):
+            result = await verify_token(self._request('not_a_jwt'))
         assert result == {'is_authorized': False}
+        mock_supabase.auth.get_user.assert_not_called()
 
 
 class TestAppCreation:
@@ -4,7 +4,11 @@ import os
 from unittest.mock import patch, Mock, MagicMock
 import logging_start
 
-from weather_location import weather_check, format_as_zip_code, get_subregion_by_zip, latlong_to_zip
+import weather_location
+from weather_location import (
+    weather_check, format_as_zip_code, get_subregion_by_zip, latlong_to_zip,
+    haversine, WeatherStationIndex, ReverseGeocoder, LocationMatcher, get_climate_zones_by_zip, weather_check_many
+)
 
 # Mock data for testing
 MOCK_WEATHER_OUTPUT = pd.DataFrame({
@@ -30,6 +34,16 @@ def mock_logger():
         mock.error = MagicMock()
         yield mock
 
+@pytest.fixture(autouse=True)
+def clear_location_caches():
+    """The station index and city table are loaded once, reload them from the mocked CSVs in each test"""
+    caches = [weather_location.get_weather_station_index, weather_location.get_cities, weather_location.get_reverse_geocoder, weather_location.get_location_matcher]
+    for cache in caches:
+        cache.cache_clear()
+    yield
+    for cache in caches:
+        cache.cache_clear()
+
 @pytest.fixture(autouse=True)
 def mock_rapidfuzz():
     with patch('weather_location.process') as mock_process:
@@ -47,24 +61,19 @@ def mock_csv_reads(monkeypatch):
     
     monkeypatch.setattr(pd, "read_csv", mock_read_csv)
 
-@pytest.fixture
-def mock_latlong_to_zip():
-    with patch('weather_location.latlong_to_zip') as mock:
-        mock.return_value = '10001'
-        yield mock
-
 @pytest.fixture
 def mock_get_subregion():
     with patch('weather_location.get_subregion_by_zip') as mock:
         mock.return_value = 'NYCW'
         yield mock
 
-def test_weather_check_iesve(mock_csv_reads, mock_latlong_to_zip, mock_get_subregion):
-    """Test weather_check with IESVE report type"""
+def test_weather_check_iesve(mock_csv_reads, mock_get_subregion):
+    """Test weather_check with IESVE report type, the station location is reverse geocoded offline"""
     result = weather_check('USA_NY_123456', 'iesve')
     
     assert result['climate_zone'] == '4A'
     assert result['zip_code'] == '10001'
+    assert result['city'] == 'New York'
     assert result['state'] == 'New York'
     assert result['egrid_subregion'] == 'NYCW'
 
@@ -119,4 +128,152 @@ def test_weather_check_missing_data(mock_csv_reads):
         
         assert result['city_name'] == ''
         assert result['zip_code'] == ''
-        assert result['state'] == '' 
\ No newline at end of file
+        assert result['state'] == '' 
+
+STATIONS = pd.DataFrame({
+    'wmo_code': [725300, 744860, 722950, 727930, 722780],
+    'climate_zone': ['5A', '4A', '3B', '4C', '2B'],
+    'lat': [41.98, 40.64, 33.94, 47.45, 33.43],
+    'long': [-87.90, -73.78, -118.41, -122.31, -112.02]
+})
+
+class TestWeatherStationIndex:
+    """Test nearest station lookups"""
+
+    def test_nearest_matches_haversine_scan(self):
+        index = WeatherStationIndex(STATIONS)
+        for lat, lon in [(41.88, -87.63), (40.71, -74.00), (34.05, -118.24), (47.61, -122.33), (33.45, -112.07), (39.74, -104.99)]:
+            expected = min(range(len(STATIONS)), key=lambda j: haversine(lon, lat, STATIONS.long[j], STATIONS.lat[j]))
+            assert index.nearest(lat, lon) == expected
+
+    def test_distances(self):
+        index = WeatherStationIndex(STATIONS)
+        distances = index.distances(41.88, -87.63)
+        assert distances[0] == pytest.approx(haversine(-87.63, 41.88, -87.90, 41.98))
+
+    def test_nearest_many_matches_single_lookups(self):
+        index = WeatherStationIndex(STATIONS)
+        lats = [41.88, 40.71, 34.05, 47.61, 33.45, 39.74]
+        lons = [-87.63, -74.00, -118.24, -122.33, -112.07, -104.99]
+        positions = index.nearest_many(lats, lons, chunk_size=4)
+        assert list(positions) == [index.nearest(lat, lon) for lat, lon in zip(lats, lons)]
+
+    def test_station_by_wmo_code(self):
+        index = WeatherStationIndex(STATIONS)
+        assert index.station_by_wmo_code(744860)['climate_zone'] == '4A'
+        assert index.station_by_wmo_code(111111) is None
+
+    def test_empty_index(self):
+        index = WeatherStationIndex(STATIONS.iloc[0:0])
+        assert index.nearest(41.88, -87.63) is None
+        assert index.nearest_station(41.88, -87.63) is None
+
+
+def test_get_climate_zones_by_zip_batch(mock_csv_reads, mock_rapidfuzz):
+    """Batch climate zone lookup returns one entry per distinct zip, exact zips skip fuzzy matching"""
+    result = get_climate_zones_by_zip(['10001', '10001', '10002'])
+
+    assert set(result) == {'10001', '10002'}
+    assert result['10001']['climate_zone'] == '4A'
+    assert result['10001']['city_name'] == 'New York, NY'
+    assert result['10001']['ratio_match'] == 100
+    mock_rapidfuzz.extractOne.assert_not_called()
+
+def test_weather_check_many(mock_csv_reads, mock_get_subregion):
+    """Batch weather check for zip based reports"""
+    result = weather_check_many(['10001', '10001'], 'generic_xlsx')
+
+    assert list(result) == ['10001']
+    assert result['10001']['climate_zone'] == '4A'
+    assert result['10001']['state'] == 'New York'
+    assert result['10001']['egrid_subregion'] == 'NYCW'
+
+
+CITIES = pd.DataFrame({
+    'city_ascii': ['Chicago', 'New York', 'Seattle'],
+    'state_id': ['IL', 'NY', 'WA'],
+    'state_name': ['Illinois', 'New York', 'Washington'],
+    'zips': ['60601 60602', '10001 10002', '99999 98101'],
+    'lat': [41.88, 40.71, 47.61],
+    'lng': [-87.63, -74.00, -122.33]
+})
+
+class TestReverseGeocoder:
+    """Test offline reverse geocoding"""
+
+    def test_lookup_nearest_city(self):
+        location = ReverseGeocoder(CITIES).lookup(41.98, -87.90)
+        assert location['zip_code'] == '60601'
+        assert location['city'] == 'Chicago'
+        assert location['state'] == 'Illinois'
+        assert location['state_id'] == 'IL'
+        assert location['egrid_subregion'] == get_subregion_by_zip('60601')
+
+    def test_zip_with_subregion_is_preferred(self):
+        with patch.dict(weather_location.zip_subregions, {'98101': 'NWPP'}):
+            weather_location.zip_subregions.pop('99999', None)
+            location = ReverseGeocoder(CITIES).lookup(47.45, -122.31)
+        assert location['zip_code'] == '98101'
+        assert location['egrid_subregion'] == 'NWPP'
+
+    def test_lookup_many(self):
+        locations = ReverseGeocoder(CITIES).lookup_many([40.64, 47.45], [-73.78, -122.31])
+        assert [location['city'] for location in locations] == ['New York', 'Seattle']
+
+    def test_no_cities(self):
+        assert ReverseGeocoder(CITIES.iloc[0:0]).lookup(41.98, -87.90) is None
+
+    def test_latlong_to_zip_is_offline(self, mock_csv_reads):
+        assert latlong_to_zip(40.7128, -74.0060) == '10001'
+
+
+def test_get_subregion_by_zip():
+    """eGRID subregion lookup by zip code"""
+    assert get_subregion_by_zip('00001') == 'AKMS'
+    assert get_subregion_by_zip(1) == 'AKMS'
+    assert get_subregion_by_zip('not a zip') == 'no zip code found'
+
+
+@pytest.fixture
+def real_rapidfuzz():
+    from rapidfuzz import process as rapidfuzz_process
+    with patch('weather_location.process', rapidfuzz_process):
+        yield
+
+class TestLocationMatcher:
+    """Test exact and blocked fuzzy city/zip matching"""
+
+    def test_exact_zip(self):
+        city, score = LocationMatcher(CITIES).match_zip('98101')
+        assert city['city_ascii'] == 'Seattle'
+        assert score == 100
+
+    def test_exact_city_state_is_normalized(self):
+        matcher = LocationMatcher(CITIES)
+        for text in ['Chicago IL', 'CHICAGO, IL', '  chicago   il ']:
+            city, score = matcher.match_city_state(text)
+            assert city['city_ascii'] == 'Chicago'
+            assert score == 100
+
+    def test_fuzzy_city_state(self, real_rapidfuzz):
+        city, score = LocationMatcher(CITIES).match_city_state('SEATTLE-TACOMA WA')
+        assert city['city_ascii'] == 'Seattle'
+        assert score < 100
+
+    def test_fuzzy_zip_uses_prefix_block(self, real_rapidfuzz):
+        city, score = LocationMatcher(CITIES).match_zip('60699')
+        assert city['city_ascii'] == 'Chicago'
+        assert score < 100
+
+    def test_city_for_zip(self):
+        matcher = LocationMatcher(CITIES)
+        assert matcher.city_for_zip('10002')['city_ascii'] == 'New York'
+        assert matcher.city_for_zip('1000') is None
+
+    def test_match_many(self, real_rapidfuzz):
+        matches = LocationMatcher(CITIES).match_many(['10001', 'New York NY', 'SEATTLE-TACOMA WA', '10001'])
+        assert [city['city_ascii'] for city, _ in matches] == ['New York', 'New York', 'Seattle', 'New York']
+
+    def test_no_candidates(self):
+        assert LocationMatcher(CITIES).match_city_state('!!!') is None
+        assert LocationMatcher(CITIES.iloc[0:0]).match_zip('10001') is None
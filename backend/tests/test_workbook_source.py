@@ -0,0 +1,97 @@
+import io
+import os
+import pytest
+import pandas as pd
+from unittest.mock import patch
+from openpyxl import Workbook
+
+import post_processing
+from parse_reports import workbook_source as workbook_module
+from parse_reports.workbook_source import WorkbookSource
+from parse_reports.parse_multi_project_xlsx import is_multi_project_excel, MultiProjectExcelParser, parse_multi_project_excel_report
+from parse_reports.parse_xlsx import parse_xlsx_report
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'dependencies', 'd3p-multi-project-template.xlsx')
+
+
+def workbook_bytes(rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def template_content():
+    with open(TEMPLATE, 'rb') as f:
+        return f.read()
+
+
+class TestWorkbookSource:
+    """Test header detection and the cached sheet reads"""
+
+    def test_header_row_below_instruction_rows(self, template_content):
+        source = WorkbookSource(template_content)
+        header_row = source.find_header_row(['project_name', 'conditioned_area_sf', 'project_use_type'])
+        assert header_row == 3
+        expected = pd.read_excel(io.BytesIO(template_content), sheet_name=0, header=header_row)
+        pd.testing.assert_frame_equal(source.frame(header_row), expected)
+
+    def test_no_header_row(self):
+        source = WorkbookSource(workbook_bytes([['conditioned_area', 'zip_code'], [1000, '10001']]))
+        assert source.find_header_row(['project_name']) is None
+
+    def test_each_header_row_is_parsed_once(self, template_content):
+        source = WorkbookSource(template_content)
+        with patch.object(workbook_module.pd, 'read_excel', wraps=pd.read_excel) as mock_read:
+            assert source.frame(3) is source.frame(3)
+            source.frame(0)
+        assert mock_read.call_count == 2
+
+    def test_from_url_downloads_once(self, template_content):
+        with patch.object(workbook_module, 'fetch_report_bytes', return_value=template_content) as mock_fetch, \
+             patch.object(workbook_module.pd, 'read_excel', wraps=pd.read_excel) as mock_read:
+            source = WorkbookSource.from_url('https://storage/projects.xlsx')
+            assert is_multi_project_excel(source.url, workbook=source)
+            parsed = MultiProjectExcelParser().parse_multi_project_excel(source.url, workbook=source)
+            assert parse_multi_project_excel_report(source.url, workbook=source)['parse_result'] == parsed
+        mock_fetch.assert_called_once_with('https://storage/projects.xlsx')
+        assert mock_read.call_count == 1
+
+
+class TestSharedWorkbookParsers:
+    """Test that the xlsx parsers read the shared workbook"""
+
+    def test_multi_project_parse_matches_content(self):
+        rows = [['Instructions'], ['project_name', 'conditioned_area_sf', 'project_use_type', 'Heating_Electricity_baseline'],
+                ['A', 1000, 'Office', 5.5], [None, None, None, None], ['B', 2000, 'School', 1]]
+        content = workbook_bytes(rows)
+        source = WorkbookSource(content)
+        assert is_multi_project_excel('', workbook=source)
+        shared = MultiProjectExcelParser().parse_multi_project_excel('', workbook=source)
+        from_bytes = MultiProjectExcelParser().parse_multi_project_excel('', content=content)
+        assert shared == from_bytes
+        assert [error for error in shared['validation_errors'] if 'Row 2' in error]
+
+    def test_generic_xlsx_does_not_change_shared_frame(self):
+        content = workbook_bytes([['conditioned_area', 'area_units', 'energy_units', 'zip_code', 'Heating_Electricity'],
+                                  [1000, 'sf', 'mbtu', '10001', 12.5]])
+        source = WorkbookSource(content)
+        result = parse_xlsx_report('', workbook=source)
+        assert list(result['df']['report_field']) == ['Heating_Electricity']
+        assert str(result['df']['weather_string'].iloc[0]) == '10001'
+        assert list(source.frame(0).columns) == ['conditioned_area', 'area_units', 'energy_units', 'zip_code', 'Heating_Electricity']
+
+    @patch('post_processing.post_process', return_value=pd.DataFrame())
+    @patch('post_processing.fetch_report_bytes')
+    def test_run_script_master_parses_once(self, mock_fetch, mock_post_process):
+        mock_fetch.return_value = workbook_bytes([['conditioned_area', 'area_units', 'energy_units', 'zip_code', 'Heating_Electricity'],
+                                                  [1000, 'sf', 'mbtu', '10001', 12.5]])
+        with patch.object(workbook_module.pd, 'read_excel', wraps=pd.read_excel) as mock_read:
+            result = post_processing.run_script_master('https://storage/report.xlsx')
+        assert result['report_type'] == 4
+        mock_fetch.assert_called_once()
+        assert mock_read.call_count == 1
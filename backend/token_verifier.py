@@ -0,0 +1,136 @@
+import os
+import time
+import hashlib
+import threading
+
+import jwt
+from cachetools import TLRUCache
+
+import logging_start
+
+##Verification of Supabase access tokens for verify_token
+##Tokens are checked in process: HS256 tokens against SUPABASE_JWT_SECRET, asymmetric tokens against the project's JWKS.
+##Verified tokens are kept in a small LRU for AUTH_TOKEN_CACHE_TTL seconds (never past their exp).
+##AUTH_REVOCATION_CHECK=remote additionally asks Supabase Auth whether the session is still valid, once per cached token.
+
+JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+JWT_AUDIENCE = os.getenv('SUPABASE_JWT_AUDIENCE', 'authenticated')
+JWKS_URL = os.getenv('SUPABASE_JWKS_URL')
+JWKS_CACHE_TTL = int(os.getenv('SUPABASE_JWKS_CACHE_TTL', '600'))
+AUTH_VERIFY = os.getenv('AUTH_VERIFY', 'local').lower()
+AUTH_REVOCATION_CHECK = os.getenv('AUTH_REVOCATION_CHECK', 'none').lower()
+AUTH_TOKEN_CACHE_TTL = float(os.getenv('AUTH_TOKEN_CACHE_TTL', '60'))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', '1024'))
+
+ASYMMETRIC_ALGORITHMS = ['RS256', 'ES256', 'EdDSA']
+UNAUTHORIZED = {'is_authorized': False}
+
+
+def _token_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _authorized(company_id, role, user_id):
+    return {'is_authorized': True,
+            'company_id': company_id,
+            'role': role,
+            'user_id': user_id}
+
+
+class TokenVerifier:
+    """
+    Checks bearer tokens and returns the verify_token result for them
+
+    Args:
+        client: supabase client, used for AUTH_VERIFY=remote, AUTH_REVOCATION_CHECK=remote
+            and HS256 tokens when no JWT secret is configured
+        supabase_url: project url, the JWKS is read from its /auth/v1/.well-known/jwks.json
+        mode: 'local' to verify signatures in process, 'remote' to ask Supabase Auth for every uncached token
+        revocation_check: 'none' or 'remote'
+    """
+
+    def __init__(self, client, supabase_url=None, jwt_secret=JWT_SECRET, audience=JWT_AUDIENCE, jwks_url=JWKS_URL,
+                 mode=AUTH_VERIFY, revocation_check=AUTH_REVOCATION_CHECK,
+                 cache_ttl=AUTH_TOKEN_CACHE_TTL, cache_size=AUTH_TOKEN_CACHE_SIZE):
+        self.client = client
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.jwks_url = jwks_url or (f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json" if supabase_url else None)
+        self.mode = mode
+        self.revocation_check = revocation_check
+        self.cache_ttl = cache_ttl
+        self._cache = TLRUCache(maxsize=cache_size, ttu=self._expires_at)
+        self._lock = threading.Lock()
+        self._jwks_client = None
+        if mode == 'local' and not jwt_secret:
+            logging_start.logger.warning("SUPABASE_JWT_SECRET is not set, HS256 access tokens are verified by Supabase Auth")
+
+    def _expires_at(self, key, value, now):
+        result, exp = value
+        ttl = self.cache_ttl
+        if exp is not None:
+            ttl = min(ttl, exp - time.time())
+        return now + ttl
+
+    def _get_jwks_client(self):
+        if self._jwks_client is None:
+            self._jwks_client = jwt.PyJWKClient(self.jwks_url, cache_jwk_set=True, lifespan=JWKS_CACHE_TTL, timeout=5)
+        return self._jwks_client
+
+    def _signing_key(self, token):
+        """Key and algorithms for the token, None when it can only be checked by Supabase Auth"""
+        algorithm = jwt.get_unverified_header(token).get('alg')
+        if algorithm == 'HS256':
+            return (self.jwt_secret, ['HS256']) if self.jwt_secret else None
+        if algorithm in ASYMMETRIC_ALGORITHMS and self.jwks_url:
+            return self._get_jwks_client().get_signing_key_from_jwt(token).key, [algorithm]
+        raise jwt.InvalidTokenError(f"Unsupported token algorithm {algorithm}")
+
+    def _verify_remote(self, token):
+        data = self.client.auth.get_user(token)
+        user_metadata = data.user.user_metadata
+        return _authorized(user_metadata['company_id'], user_metadata.get('role', 'NA'), data.user.id)
+
+    def _verify_local(self, token):
+        """Returns (result, exp), or None to defer to Supabase Auth"""
+        signing_key = self._signing_key(token)
+        if signing_key is None:
+            return None
+        key, algorithms = signing_key
+        claims = jwt.decode(token, key, algorithms=algorithms, audience=self.audience,
+                            options={'require': ['exp', 'sub']})
+        user_metadata = claims.get('user_metadata') or {}
+        result = _authorized(user_metadata['company_id'], user_metadata.get('role', 'NA'), claims['sub'])
+        return result, claims['exp']
+
+    def verify(self, token):
+        key = _token_key(token)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            return dict(cached[0])
+
+        try:
+            verified = self._verify_local(token) if self.mode == 'local' else None
+            if verified is None:
+                verified = (self._verify_remote(token), None)
+            elif self.revocation_check == 'remote':
+                #signature and expiry are fine, make sure the session was not signed out or the user removed
+                remote = self._verify_remote(token)
+                if remote['user_id'] != verified[0]['user_id']:
+                    return dict(UNAUTHORIZED)
+        except Exception as e:
+            logging_start.logger.info(f"Token verification failed: {type(e).__name__}")
+            return dict(UNAUTHORIZED)
+
+        with self._lock:
+            self._cache[key] = verified
+        return dict(verified[0])
+
+    def invalidate(self, token=None):
+        """Forget one verified token, or all of them"""
+        with self._lock:
+            if token is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(_token_key(token), None)
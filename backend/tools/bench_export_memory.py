@@ -0,0 +1,126 @@
+## This script measures peak Python memory of the portfolio export for a synthetic 10k-project portfolio
+## It compares materializing the whole export (full DataFrame -> CSV string -> BytesIO, as the endpoint used to)
+## with the streamed generator pipeline for CSV, Parquet and XLSX. Queries run against an in-memory stand-in for supabase.
+## Run from the backend directory: python tools/bench_export_memory.py [--projects 10000] [--formats csv parquet xlsx]
+
+import io
+import sys
+import time
+import argparse
+import tracemalloc
+from unittest.mock import patch
+
+import numpy as np
+
+sys.path.append('.')
+
+import project_export
+from project_export import EEU_ENERGY_FIELDS, EXPORT_FORMATS, build_export_frame, iter_export_frames
+
+
+class InMemoryQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.filters = []
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, values))
+        return self
+
+    def order(self, column):
+        return self
+
+    def execute(self):
+        rows = self.db.tables[self.table]
+        for column, values in self.filters:
+            index = self.db.index(self.table, column)
+            rows = [row for value in values for row in index.get(value, [])]
+        return ('data', [dict(row) for row in rows]), ('count', None)
+
+
+class InMemorySupabase:
+    """Answers in_() lookups from per-column indexes, so query cost does not skew the memory numbers"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self._indexes = {}
+
+    def index(self, table, column):
+        if (table, column) not in self._indexes:
+            index = {}
+            for row in self.tables[table]:
+                index.setdefault(row[column], []).append(row)
+            self._indexes[(table, column)] = index
+        return self._indexes[(table, column)]
+
+    def table(self, name):
+        return InMemoryQuery(self, name)
+
+
+def build_portfolio(n_projects, seed=0):
+    rng = np.random.default_rng(seed)
+    summary, uploads, eeu = [], [], []
+    for i in range(n_projects):
+        project_id = f'project-{i:06d}'
+        summary.append({'project_id': project_id, 'project_name': f'Project {i}', 'conditioned_area': float(rng.integers(5000, 500000)),
+                        'project_use_type': 'Office', 'project_construction_category_name': 'New', 'project_phase': 'Construction Documents',
+                        'energy_code_name': 'ASHRAE 90.1-2019', 'report_type_name': 'IES-VE', 'climate_zone': '4A - Mixed Humid',
+                        'total_energy_per_unit_area_baseline': float(rng.uniform(40, 120)), 'total_energy_per_unit_area_design': float(rng.uniform(20, 90))})
+        upload_id = len(uploads) + 1
+        uploads.append({'id': upload_id, 'project_id': project_id, 'created_at': '2024-01-01T00:00:00+00:00', 'year': 2025,
+                        'reporting_year': 2024, 'custom_project_id': None})
+        for side in ['baseline', 'design']:
+            row = {'id': len(eeu) + 1, 'upload_id': upload_id, 'created_at': '2024-01-02T00:00:00+00:00', 'baseline_design': side,
+                   'energy_units': 'mbtu', 'zip_code': '60601', 'city': 'CHICAGO', 'state': 'IL'}
+            row.update(zip(EEU_ENERGY_FIELDS, rng.uniform(0, 500, len(EEU_ENERGY_FIELDS)).tolist()))
+            eeu.append(row)
+    return summary, {'uploads': uploads, 'eeu_data': eeu}
+
+
+def materialized_csv(summary):
+    """What the endpoint used to hold at once: the full frame, the CSV string and a BytesIO copy"""
+    df = build_export_frame(summary)
+    output = io.StringIO()
+    df.to_csv(output, index=False)
+    body = io.BytesIO(output.getvalue().encode('utf-8'))
+    return len(body.getvalue())
+
+
+def streamed(summary, export_format):
+    encoder = EXPORT_FORMATS[export_format][2]
+    return sum(len(chunk) for chunk in encoder(iter_export_frames(summary)))
+
+
+def measure(label, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>22}: peak {peak / 2**20:8.1f} MiB  output {size / 2**20:7.1f} MiB  {elapsed:6.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--projects', type=int, default=10000)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'parquet', 'xlsx'])
+    args = parser.parse_args()
+
+    summary, tables = build_portfolio(args.projects)
+    db = InMemorySupabase(tables)
+    # build the lookup indexes outside the measured runs
+    db.index('uploads', 'project_id'), db.index('eeu_data', 'upload_id'), db.index('eeu_data', 'id')
+    with patch.object(project_export, 'supabase', db):
+        print(f"projects: {args.projects}  batch size: {project_export.EXPORT_BATCH_SIZE}")
+        measure('materialized csv', lambda: materialized_csv(summary))
+        for export_format in args.formats:
+            measure(f'streamed {export_format}', lambda: streamed(summary, export_format))
+
+
+if __name__ == "__main__":
+    main()
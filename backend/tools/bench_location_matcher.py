@@ -0,0 +1,78 @@
+## This script benchmarks LocationMatcher.match_many against the previous rapidfuzz extractOne scan over every city
+## It builds 10k weather strings from uscities.csv: exact "City ST" strings, eQUEST style station names and zip codes
+## Run from the backend directory: python tools/bench_location_matcher.py [--cities dependencies/uscities.csv]
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import process, fuzz
+
+sys.path.append('.')
+
+from weather_location import LocationMatcher
+
+
+def build_weather_strings(df_cities, n, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = rng.integers(0, len(df_cities), n)
+    rows = df_cities.iloc[positions]
+    strings = []
+    for kind, (_, city) in zip(rng.integers(0, 3, n), rows.iterrows()):
+        if kind == 0:
+            strings.append(f"{city['city_ascii']} {city['state_id']}")
+        elif kind == 1:
+            strings.append(f"{city['city_ascii'].upper()}-INTL AP {city['state_id']}")
+        else:
+            strings.append(str(city['zips']).split()[0])
+    return strings, positions
+
+
+def legacy_match(df_cities, text):
+    """The per-call lookup weather_location used before LocationMatcher"""
+    column = 'zips' if text.isdigit() else 'city_state'
+    best_match = process.extractOne(text, df_cities[column], scorer=fuzz.token_sort_ratio)
+    return df_cities.loc[df_cities[column] == best_match[0]].iloc[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', default='dependencies/uscities.csv')
+    parser.add_argument('--n', type=int, default=10000)
+    parser.add_argument('--legacy-sample', type=int, default=200, help='strings timed with the old scan, extrapolated to --n')
+    args = parser.parse_args()
+
+    df_cities = pd.read_csv(args.cities).reset_index(drop=True)
+    df_cities['city_state'] = df_cities['city_ascii'] + " " + df_cities['state_id']
+    strings, truth = build_weather_strings(df_cities, args.n)
+
+    start = time.perf_counter()
+    matcher = LocationMatcher(df_cities)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = matcher.match_many(strings)
+    match_time = time.perf_counter() - start
+
+    sample = strings[:args.legacy_sample]
+    start = time.perf_counter()
+    legacy = [legacy_match(df_cities, text) for text in sample]
+    legacy_time = (time.perf_counter() - start) / len(sample) * len(strings)
+
+    # a string counts as correct when it resolves to the city it was built from (or a city with the same name and state)
+    def correct(row, position):
+        return row is not None and row['city_state'] == df_cities.loc[position, 'city_state']
+    matcher_accuracy = np.mean([correct(match[0] if match else None, position) for match, position in zip(matches[:len(sample)], truth)])
+    legacy_accuracy = np.mean([correct(row, position) for row, position in zip(legacy, truth)])
+
+    print(f"cities: {len(df_cities)}  weather strings: {len(strings)}")
+    print(f"LocationMatcher build: {build_time*1000:.0f} ms")
+    print(f"LocationMatcher.match_many: {match_time*1000:.0f} ms ({match_time/len(strings)*1e6:.0f} us per string)")
+    print(f"extractOne scan (extrapolated from {len(sample)}): {legacy_time:.1f} s ({legacy_time/len(strings)*1e6:.0f} us per string)")
+    print(f"resolved to the source city: LocationMatcher {matcher_accuracy:.0%}, extractOne scan {legacy_accuracy:.0%} (on the sample)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+## This script compares the row-by-row multi-project import with the bulk ingestion path
+## Both run against a fake client that sleeps for a fixed latency per database round trip, so the numbers show
+## how the number of round trips decides the import time of a portfolio spreadsheet.
+## The concurrent run writes --workers batches at once, held to --rate calls per second for the company.
+## Run from the backend directory: python tools/bench_multi_project_ingest.py [--projects 300] [--latency-ms 20] [--workers 4]
+
+import sys
+import time
+import argparse
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.append('.')
+
+import multi_project_service
+from multi_project_service import MultiProjectService, CompanyRateLimiter
+
+ENERGY_FIELDS = [f'{use}_{fuel}' for use in ['Heating', 'Cooling', 'DHW', 'Interior Lighting', 'Plug Loads', 'Fans', 'Pumps']
+                 for fuel in ['Electricity', 'NaturalGas', 'DistrictHeating']]
+WEATHER = {'city_name': 'Station', 'ratio_match': '', 'climate_zone': '4A', 'zip_code': '10001',
+           'egrid_subregion': 'NYCW', 'city': 'New York', 'state': 'NY'}
+
+
+class LatencyClient:
+    """Counts round trips and sleeps latency seconds for each; every chained query call returns the query itself"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.round_trips = 0
+        self.next_id = 0
+
+    def _execute(self, rows=None):
+        self.round_trips += 1
+        time.sleep(self.latency)
+        return SimpleNamespace(data=rows if rows is not None else [])
+
+    def table(self, name):
+        client = self
+        inserted = []
+
+        class Query:
+            def __getattr__(self, attribute):
+                def chain(*args, **kwargs):
+                    if attribute == 'insert':
+                        client.next_id += 1
+                        inserted.append(dict(args[0], id=client.next_id))
+                    return self
+                return chain
+
+            def execute(self):
+                return client._execute(list(inserted))
+
+        return Query()
+
+    def rpc(self, name, params):
+        rows = params.get('p_rows', [])
+        results = [{'row_index': row['row'], 'project_id': row['project']['id'], 'upload_id': row['row'],
+                    'eeu_ids': [], 'error': None} for row in rows]
+        return SimpleNamespace(execute=lambda: self._execute(results))
+
+
+def make_projects(count):
+    energy = {field: 10.0 for field in ENERGY_FIELDS}
+    return [{'project_name': f'Project {i:04d}', 'conditioned_area_sf': 50000.0, 'zip_code': '10001',
+             'energy_units': 'mbtu', 'climate_zone': '4A', 'report_type': 'Generic', 'year': 2024,
+             'baseline_energy_data': dict(energy), 'design_energy_data': dict(energy)} for i in range(count)]
+
+
+def run(label, projects, latency, ingest, workers=1, rate=None):
+    client = LatencyClient(latency)
+    service = MultiProjectService(client, max_workers=workers, rate_limiter=CompanyRateLimiter(rate))
+    service._weather_cache = {'10001': WEATHER}
+    start = time.perf_counter()
+    ingest(service)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>12}: {elapsed:8.2f} s  {len(projects) / elapsed:9.1f} projects/s  {client.round_trips:6d} round trips")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--projects', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--batch-size', type=int, default=multi_project_service.INGEST_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help='write calls per second for the company, 0 for no limit')
+    args = parser.parse_args()
+
+    projects = make_projects(args.projects)
+    latency = args.latency_ms / 1000
+    print(f"projects: {args.projects}  latency per round trip: {args.latency_ms} ms  batch size: {args.batch_size}")
+    with patch.object(MultiProjectService, '_get_enum_mappings', return_value={'climate_zone_id': 3, 'project_use_type_id': 7}), \
+         patch.object(MultiProjectService, '_get_report_type_identifier', return_value='generic_xlsx'), \
+         patch.object(multi_project_service, 'INGEST_BATCH_SIZE', args.batch_size):
+        run('row by row', projects, latency,
+            lambda service: [service._create_project_and_upload(project, 'bench', 'bench.xlsx') for project in projects])
+        run('bulk', projects, latency, lambda service: service._ingest_projects(projects, 'bench', 'bench.xlsx'))
+        run('concurrent', projects, latency, lambda service: service._ingest_projects(projects, 'bench', 'bench.xlsx'),
+            workers=args.workers, rate=args.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+## This script times the validation of a multi-project spreadsheet
+## It compares the row-by-row reference parse of the tests with the columnar _parse_project_rows on a synthetic sheet,
+## checks that both give the same projects and messages, then times the enum and energy unit checks.
+## Run from the backend directory: python tools/bench_multi_project_parse.py [--rows 10000] [--energy-columns 40]
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('.')
+
+from parse_reports.parse_multi_project_xlsx import MultiProjectExcelParser
+# the row-by-row reference parse lives with the equivalence tests
+from tests.test_multi_project_parser import row_by_row
+
+USE_TYPES = ['Office', 'School', 'Retail', 'Multifamily']
+
+
+class BenchEnumCache:
+    """Enum names for validate_against_database_enums, without a database"""
+
+    def __init__(self):
+        self._names = {'project_use_types': USE_TYPES, 'project_construction_categories': ['New', 'Existing'],
+                       'project_phases': ['Design', 'Concept'], 'energy_codes': ['ASHRAE 90.1-2019'],
+                       'report_types': ['Generic .XLSX'], 'climate_zones': ['4A', '5A']}
+
+    def names(self, list_name):
+        return list(self._names.get(list_name, []))
+
+    def name_set(self, list_name):
+        return frozenset(self._names.get(list_name, []))
+
+
+def build_sheet(rows, energy_columns, seed=0):
+    """A sheet like the multi-project template, with a few invalid cells mixed in"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'project_name': [f'Project {i}' for i in range(rows)],
+        'conditioned_area_sf': rng.uniform(1000, 200000, rows).round(1),
+        'zip_code': rng.integers(10000, 99999, rows),
+        'project_use_type': rng.choice(USE_TYPES + ['Lab'], rows),
+        'project_construction_category': 'New',
+        'project_phase': 'Design',
+        'energy_code': 'ASHRAE 90.1-2019',
+        'report_type': 'Generic .XLSX',
+        'reporting_year': 2024,
+        'energy_units': rng.choice(['mbtu', 'gj', 'kwh'], rows, p=[0.6, 0.35, 0.05]),
+    })
+    df = df.astype({'conditioned_area_sf': object})
+    df.loc[rng.random(rows) < 0.02, 'conditioned_area_sf'] = 'n/a'
+    df.loc[rng.random(rows) < 0.02, 'project_name'] = np.nan
+    fuels = ['Electricity', 'NaturalGas', 'DistrictHeating', 'Other']
+    for i in range(energy_columns):
+        side = 'baseline' if i % 2 else 'design'
+        values = rng.uniform(0, 500, rows)
+        values[rng.random(rows) < 0.3] = np.nan
+        df[f'Use{i // 8}_{fuels[i % 4]}_{side}'] = values
+    return df
+
+
+def measure(label, fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{label:>28}: best {min(timings):9.1f} ms  ({iterations} runs)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--energy-columns', type=int, default=40)
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    df = build_sheet(args.rows, args.energy_columns)
+    excel_parser = MultiProjectExcelParser()
+    print(f"rows: {args.rows}  columns: {len(df.columns)}")
+    expected = measure('row by row', lambda: row_by_row(excel_parser, df), args.iterations)
+    projects, errors = measure('columnar', lambda: excel_parser._parse_project_rows(df), args.iterations)
+    print(f"same projects and messages: {repr((projects, errors)) == repr(expected)}  "
+          f"({len(projects)} projects, {len(errors)} messages)")
+
+    cache = BenchEnumCache()
+    validated, _ = measure('enum validation', lambda: excel_parser.validate_against_database_enums(projects, cache), args.iterations)
+    measure('energy unit validation', lambda: excel_parser.validate_energy_units(validated), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+## This script times post_processing.post_process on synthetic uploads for every report type in column_mapping.csv
+## Pass --baseline-rev <git revision> to time the post_process from that revision on the same inputs (before/after)
+## Run from the backend directory: python tools/bench_post_process.py --baseline-rev HEAD~1
+
+import os
+import sys
+import time
+import types
+import argparse
+import subprocess
+import statistics
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('.')
+
+import post_processing
+
+WEATHER_INFO = {'city_name': 'CHICAGO', 'climate_zone': '5A', 'zip_code': '60601', 'egrid_subregion': 'RFCW'}
+
+
+def build_uploads():
+    """One parsed report per report type and energy unit, shaped like the parser output"""
+    rng = np.random.default_rng(0)
+    uploads = []
+    for report, df_report in post_processing.COLUMN_MAPPING.groupby('report'):
+        fields = df_report['report_field'].tolist()
+        for units in ['mbtu', 'gj', 'kbtu', 'mwh']:
+            df = pd.DataFrame({'report_field': fields, 'energy_value': rng.uniform(0, 500, len(fields))})
+            df['energy_units'] = units
+            df['conditioned_area_sf'] = 52000.0
+            df['report'] = report
+            df['project_name'] = 'Benchmark ' + report
+            df['weather_string'] = 'CHICAGO IL'
+            uploads.append(df)
+    return uploads
+
+
+def load_post_process(rev):
+    """post_process as it was at a git revision, loaded into its own module"""
+    source = subprocess.check_output(['git', 'show', f'{rev}:backend/post_processing.py'], text=True)
+    module = types.ModuleType(f'post_processing_{rev}')
+    module.__file__ = os.path.abspath('post_processing.py')
+    exec(compile(source, f'post_processing@{rev}', 'exec'), module.__dict__)
+    return module
+
+
+def time_post_process(module, uploads, repeat):
+    timings = []
+    with patch.object(module, 'weather_check', return_value=WEATHER_INFO):
+        for _ in range(repeat):
+            for df in uploads:
+                start = time.perf_counter()
+                module.post_process(df.copy())
+                timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    print(f"{label:>10}: mean {statistics.mean(timings)*1000:8.2f} ms  median {statistics.median(timings)*1000:8.2f} ms  per upload ({len(timings)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baseline-rev', default=None)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    uploads = build_uploads()
+    current = time_post_process(post_processing, uploads, args.repeat)
+    if args.baseline_rev:
+        baseline = time_post_process(load_post_process(args.baseline_rev), uploads, args.repeat)
+        report('before', baseline)
+        report('after', current)
+        print(f"speedup: {statistics.mean(baseline)/statistics.mean(current):.1f}x")
+    else:
+        report('current', current)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+## This script times the pivot_details work behind the project end uses endpoint (combine_end_uses_data)
+## It compares the old cell-by-cell editable lookup with the vectorized mask export_pivot builds now,
+## then times combine_end_uses_data end to end with the database reads replaced by synthetic pivots.
+## Run from the backend directory: python tools/bench_project_details.py [--use-types 30] [--iterations 200]
+
+import sys
+import time
+import argparse
+import statistics
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+sys.path.append('.')
+
+import project_details
+from project_details import list_energy_types, list_onsite_renewables
+
+
+def build_grouped(n_use_types, seed=0):
+    """df_grouped as export_pivot sees it: one row per (use_type, fuel_category) that has an eeu field"""
+    rng = np.random.default_rng(seed)
+    rows = [{'use_type': f'Use type {i:02d}', 'fuel_category': fuel, 'energy_value': float(rng.uniform(0, 500))}
+            for i in range(n_use_types) for fuel in list_energy_types if rng.random() < 0.7]
+    return pd.DataFrame(rows)
+
+
+def cell_loop_details(df_grouped, df_pivot):
+    """The previous construction: one filter of df_grouped per pivot cell"""
+    df_pivot_vals = pd.DataFrame(index=df_pivot.index, columns=df_pivot.columns)
+    for row in df_pivot.index:
+        for col in df_pivot.columns:
+            value = df_pivot.at[row, col]
+            matches = df_grouped[(df_grouped['fuel_category'] == col) & (df_grouped['use_type'] == row)]
+            df_pivot_vals.at[row, col] = {'value': value, 'editable': not matches.empty, 'edited': False}
+    return df_pivot_vals
+
+
+def vectorized_editable(df_grouped, df_pivot):
+    grouped_cells = pd.MultiIndex.from_frame(df_grouped[['use_type', 'fuel_category']])
+    pivot_cells = pd.MultiIndex.from_product([df_pivot.index, df_pivot.columns])
+    return pd.DataFrame(pivot_cells.isin(grouped_cells).reshape(df_pivot.shape), index=df_pivot.index, columns=df_pivot.columns)
+
+
+def build_side(df_grouped):
+    df_pivot = df_grouped.pivot(index='use_type', columns='fuel_category', values='energy_value').fillna(0)
+    editable = vectorized_editable(df_grouped, df_pivot)
+    for energy_type in list_energy_types:
+        if energy_type not in df_pivot.columns:
+            df_pivot[energy_type] = 0
+    renewables_columns = pd.Index(list_onsite_renewables, name='field_name')
+    renewables = pd.DataFrame([[1.0] * len(renewables_columns)], index=pd.Index(['On-Site Renewables'], name='use_type'),
+                              columns=renewables_columns)
+    return {'status': 'success', 'eeu_data': df_pivot[list_energy_types], 'eeu_data_editable': editable,
+            'renewables': renewables, 'renewables_editable': pd.DataFrame(True, index=renewables.index, columns=renewables.columns),
+            'use_type_total_area': 1000.0, 'zip_code': None, 'egrid_subregion': None, 'eeu_id': 1}
+
+
+def measure(label, fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+    print(f"{label:>26}: p50 {statistics.median(timings):9.3f} ms  p95 {p95:9.3f} ms  ({iterations} calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--use-types', type=int, default=30)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    df_grouped = build_grouped(args.use_types)
+    df_pivot = df_grouped.pivot(index='use_type', columns='fuel_category', values='energy_value').fillna(0)
+    print(f"use types: {args.use_types}  pivot cells: {df_pivot.size}")
+    measure('cell loop edit details', lambda: cell_loop_details(df_grouped, df_pivot), args.iterations)
+    measure('vectorized editable mask', lambda: vectorized_editable(df_grouped, df_pivot), args.iterations)
+
+    sides = {'baseline': build_side(build_grouped(args.use_types, seed=1)), 'design': build_side(df_grouped)}
+    with patch.object(project_details, 'get_energy_end_uses_data',
+                      side_effect=lambda project_id, baseline_design, **kwargs: sides[baseline_design]), \
+         patch.object(project_details, 'get_latest_eeu_data', return_value={'status': 'error'}):
+        measure('combine_end_uses_data', lambda: project_details.combine_end_uses_data('bench', 'mbtu'), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+## This script compares the latency of verify_token's paths: the Supabase Auth round-trip,
+## in-process signature checks and hits on the verified-token cache.
+## Local numbers use a freshly signed HS256 token; the remote numbers need a real access token.
+## Run from the backend directory: python tools/bench_verify_token.py [--iterations 2000] [--token <access token> --remote-iterations 20]
+
+import sys
+import time
+import argparse
+import statistics
+
+import jwt
+
+sys.path.append('.')
+
+from token_verifier import TokenVerifier
+
+
+def make_token(secret, sub='bench-user'):
+    claims = {'sub': sub, 'aud': 'authenticated', 'exp': int(time.time()) + 3600,
+              'user_metadata': {'company_id': 'bench-company', 'role': 'admin'}}
+    return jwt.encode(claims, secret, algorithm='HS256')
+
+
+def measure(label, fn, iterations):
+    timings = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+    print(f"{label:>22}: p50 {statistics.median(timings):9.3f} ms  p95 {p95:9.3f} ms  ({iterations} calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--token', help='real access token, enables the Supabase Auth measurement')
+    parser.add_argument('--remote-iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    secret = 'bench-secret-bench-secret-bench-secret'
+    # distinct tokens so every call misses the cache
+    tokens = [make_token(secret, sub=f'user-{i}') for i in range(args.iterations)]
+    verifier = TokenVerifier(client=None, jwt_secret=secret, cache_size=args.iterations + 1)
+    measure('local, uncached', lambda i: verifier.verify(tokens[i]), args.iterations)
+    measure('local, cached', lambda i: verifier.verify(tokens[i]), args.iterations)
+
+    if args.token:
+        from utils import supabase
+        remote = TokenVerifier(supabase, mode='remote', cache_ttl=0)
+        measure('supabase auth', lambda i: remote.verify(args.token), args.remote_iterations)
+    else:
+        print("pass --token to measure the Supabase Auth round-trip")
+
+
+if __name__ == "__main__":
+    main()
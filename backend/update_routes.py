@@ -2,10 +2,12 @@ from fastapi import APIRouter, Depends
 import models
 from utils import verify_token, add_event_history, supabase
 from typing import Optional, Dict, Union
-from project_details import get_latest_upload_id, get_latest_eeu_data, get_eeu_fields_data
+from project_details import get_latest_upload_id, get_latest_eeu_data, get_eeu_fields_data, get_upload_ids_by_type, end_use_cache
 from weather_location import get_climate_zone_by_zip
-from utils import get_enum_id, get_field_name_from_use_type, fuel_category_override
+from utils import get_field_name_from_use_type, fuel_category_override
 from conversions import check_units_eeu_field
+from project_summary import refresh_project_summaries
+from eeu_loader import eeu_loader
 router = APIRouter()
 
 def check_custom_project_id_uniqueness(custom_project_id: str, project_id: str, company_id: str) -> bool:
@@ -156,6 +158,9 @@ def update_eeu_record(item, user_id,**kwargs):
             .update(item_data)\
             .eq('id', eeu_id)\
             .execute()
+        eeu_loader(supabase).forget(eeu_id)
+        # every eeu_data write goes through here, drop the end-use pivots computed from this row
+        end_use_cache.invalidate_eeu(eeu_id)
         
         try:
             for key, value in item_data.items():
@@ -172,21 +177,21 @@ def update_eeu_record(item, user_id,**kwargs):
         try:
             first_key_value = next(iter(item_data.keys()))
             run_calcs_eeu(first_key_value, eeu_id)
+            end_use_cache.invalidate_eeu(eeu_id)
         except Exception as e:
             print(e)
+            refresh_project_summaries(eeu_ids=[eeu_id])
             return "error"
     
+    refresh_project_summaries(eeu_ids=[eeu_id])
     return "success"
 
 def calculate_total_sum(fields_to_sum,eeu_id):
     try:
-        sum_query = supabase.table('eeu_data')\
-        .select(','.join(fields_to_sum))\
-        .eq('id', eeu_id)\
-        .execute()
+        row = eeu_loader(supabase).load(eeu_id, fields_to_sum)
     
         total_sum = 0
-        for record in sum_query.data:
+        for record in [row] if row else []:
             total_sum += sum(float(record[field]) for field in fields_to_sum if record[field] is not None)
         return {'status': 'success', 'total_sum': total_sum}
     except Exception as e:
@@ -210,6 +215,7 @@ def update_total_value(eeu_id, new_value, **kwargs):
             .update({field_to_update: new_value})\
             .eq('id', eeu_id)\
             .execute()
+        eeu_loader(supabase).forget(eeu_id)
         return {'status': 'success'}
     except Exception as e:
         print(f"Error updating total for fuel_category {fuel_category_value}: {e}")
@@ -264,49 +270,15 @@ def update_upload_record_baseline_and_design(item, user_id):
     print(f"User ID: {user_id}")
     
     # Get all upload IDs for both baseline and design (update all, not just latest)
-    def get_upload_ids_by_type(project_id, baseline_design):
-        try:
-            print(f"  Searching for {baseline_design} uploads for project {project_id}")
-            # First get all uploads for the project
-            uploads_query = supabase.table('uploads')\
-                .select('id, created_at')\
-                .eq('project_id', project_id)\
-                .order('created_at', desc=True)
-            uploads_response = uploads_query.execute()
-            
-            print(f"  Total uploads found: {len(uploads_response.data) if uploads_response.data else 0}")
-            
-            if not uploads_response.data:
-                print(f"  No uploads found for project {project_id}")
-                return []
-            
-            upload_ids = []
-            # For each upload, check if it has the corresponding baseline_design type
-            for upload in uploads_response.data:
-                upload_id = upload['id']
-                eeu_query = supabase.table('eeu_data')\
-                    .select('baseline_design')\
-                    .eq('upload_id', upload_id)\
-                    .eq('baseline_design', baseline_design)\
-                    .limit(1)
-                eeu_response = eeu_query.execute()
-                
-                print(f"    Upload {upload_id}: EEU data for {baseline_design}? {bool(eeu_response.data and len(eeu_response.data) > 0)}")
-                
-                if eeu_response.data and len(eeu_response.data) > 0:
-                    upload_ids.append(upload_id)
-            
-            print(f"  Found {len(upload_ids)} {baseline_design} upload(s): {upload_ids}")
-            return upload_ids
-            
-        except Exception as e:
-            print(f"  ERROR finding {baseline_design} uploads: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
-
-    baseline_upload_ids = get_upload_ids_by_type(project_id, 'baseline')
-    design_upload_ids = get_upload_ids_by_type(project_id, 'design')
+    try:
+        upload_ids_by_type = get_upload_ids_by_type(project_id)
+    except Exception as e:
+        print(f"  ERROR finding baseline/design uploads: {e}")
+        import traceback
+        traceback.print_exc()
+        upload_ids_by_type = {}
+    baseline_upload_ids = upload_ids_by_type.get('baseline', [])
+    design_upload_ids = upload_ids_by_type.get('design', [])
     
     print(f"Baseline upload IDs: {baseline_upload_ids}, Design upload IDs: {design_upload_ids}")
     
@@ -594,12 +566,14 @@ def process_eeu_update(item, user_id):
         export_data = models.FlexibleModel(**export_data)       
     return export_data
 @router.post("/update_project/")
-async def create_upload_file(item: models.ProjectUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def create_upload_file(item: models.ProjectUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
         user_id = authorized['user_id']
-        return update_project_record(item,user_id)
+        result = update_project_record(item,user_id)
+        refresh_project_summaries([item.project_id])
+        return result
 
 @router.post("/update_upload/")
-async def create_upload_file(item: models.UploadUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def create_upload_file(item: models.UploadUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     user_id = authorized['user_id']
     print("here is the uploaded data", item)
     
@@ -638,14 +612,17 @@ async def create_upload_file(item: models.UploadUpdate, authorized: Dict[str, Un
                 other_item = models.UploadUpdate(project_id=item_data['project_id'], **other_fields)
                 update_upload_record(other_item, user_id)
             
+            refresh_project_summaries([item.project_id])
             return result
     
     print("Using regular single upload update function")
     # Use the regular single upload update function
-    return update_upload_record(item, user_id)
+    result = update_upload_record(item, user_id)
+    refresh_project_summaries([item.project_id])
+    return result
 
 @router.post("/update_eeu_data/")
-async def create_upload_file(item: models.EEUUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def create_upload_file(item: models.EEUUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     user_id = authorized['user_id']
 
     # Check if this is a direct field update (has fields other than new_value and cell_key)
@@ -687,7 +664,7 @@ async def create_upload_file(item: models.EEUUpdate, authorized: Dict[str, Union
         return update_eeu_record(item, user_id, energy_field=True)
 
 @router.post("/update_climate_zone_by_zip/")
-async def get_climate_zone_by_zip_api(item: models.ZipUpdate,
+def get_climate_zone_by_zip_api(item: models.ZipUpdate,
                                       authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
     if authorized['is_authorized']:
@@ -726,7 +703,7 @@ async def get_climate_zone_by_zip_api(item: models.ZipUpdate,
         return "not authorized"
 
 @router.post("/update_gsf/")
-async def update_gsf_api(item: models.GSFUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def update_gsf_api(item: models.GSFUpdate, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     user_id = authorized['user_id']
     return update_gsf_record(item, user_id)
 
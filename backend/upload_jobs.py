@@ -0,0 +1,276 @@
+import os
+import signal
+import asyncio
+import threading
+import multiprocessing
+from uuid import uuid4
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from typing import Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import logging_start
+
+##Background job queue for report uploads
+##Parsing runs in a bounded process pool so pdfplumber/tabula/pandas work never blocks the event loop.
+##Jobs live in memory on the instance that accepted the upload and are dropped UPLOAD_JOB_TTL seconds after they finish.
+##So /uploadfile/ waits for its job and returns the result unless UPLOAD_ASYNC is set: a poll routed to another instance
+##would not find the job, and with request-based CPU a parse running after the response is throttled. Only set
+##UPLOAD_ASYNC on a deploy with always-allocated CPU whose polls reach the accepting instance (a single instance).
+
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))
+UPLOAD_JOB_TIMEOUT = float(os.getenv('UPLOAD_JOB_TIMEOUT', '300'))
+UPLOAD_QUEUE_SIZE = int(os.getenv('UPLOAD_QUEUE_SIZE', '50'))
+UPLOAD_JOB_TTL = float(os.getenv('UPLOAD_JOB_TTL', '3600'))
+UPLOAD_ASYNC = os.getenv('UPLOAD_ASYNC', 'false').lower() in ('1', 'true', 'yes')
+
+#seconds the parent waits past the timeout for the worker's own alarm to fire
+TIMEOUT_GRACE = 5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+
+class UploadJobTimeout(Exception):
+    pass
+
+
+class UploadQueueFull(Exception):
+    pass
+
+
+class UploadJobExists(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise UploadJobTimeout()
+
+
+def _call_with_timeout(timeout, fn, args, kwargs):
+    """Runs in the worker process. SIGALRM stops a runaway parse so the worker is freed for the next job"""
+    use_alarm = timeout and hasattr(signal, 'SIGALRM') and threading.current_thread() is threading.main_thread()
+    if not use_alarm:
+        return fn(*args, **kwargs)
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class UploadJob:
+    id: str
+    company_id: Optional[str] = None
+    status: str = QUEUED
+    stage: str = QUEUED
+    steps_done: int = 0
+    steps_total: int = 0
+    result: Any = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=_now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def start(self):
+        if self.status == QUEUED:
+            self.status = RUNNING
+            self.started_at = _now()
+
+    def set_stage(self, stage, steps_done=None, steps_total=None):
+        self.stage = stage
+        if steps_done is not None:
+            self.steps_done = steps_done
+        if steps_total is not None:
+            self.steps_total = steps_total
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': {'steps_done': self.steps_done, 'steps_total': self.steps_total},
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobContext:
+    """Handed to a job's handler so it can run work in the pool and report progress"""
+
+    def __init__(self, queue, job):
+        self._queue = queue
+        self.job = job
+
+    def set_stage(self, stage, steps_done=None, steps_total=None):
+        self.job.set_stage(stage, steps_done, steps_total)
+
+    async def run_in_worker(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the process pool, holding one of the queue's worker slots"""
+        return await self._queue._run_in_worker(self.job, fn, args, kwargs)
+
+    async def run_in_thread(self, fn, *args, **kwargs):
+        """Run blocking I/O (database writes) off the event loop"""
+        self.job.start()
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+class UploadJobQueue:
+    """
+    Bounded process pool plus an in-memory registry of upload jobs
+
+    Args:
+        max_workers: parses that may run at once
+        timeout: seconds a single parse may run before the job is marked timed_out
+        max_pending: unfinished jobs allowed before submit() raises UploadQueueFull
+        executor: executor to run work in, a ProcessPoolExecutor of max_workers is created on first use if not given
+    """
+
+    def __init__(self, max_workers=UPLOAD_WORKERS, timeout=UPLOAD_JOB_TIMEOUT, max_pending=UPLOAD_QUEUE_SIZE, job_ttl=UPLOAD_JOB_TTL, executor=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self._executor = executor
+        self._slots = None
+        self._jobs = {}
+        self._tasks = {}
+
+    def _get_executor(self):
+        if self._executor is None:
+            #spawn so workers never inherit locks held by the server's threads at fork time
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _get_slots(self):
+        #created lazily so the semaphore binds to the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        return self._slots
+
+    async def _run_in_worker(self, job, fn, args, kwargs):
+        slots = self._get_slots()
+        await slots.acquire()
+        job.start()
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._get_executor(), _call_with_timeout, self.timeout, fn, args, kwargs)
+        except Exception:
+            slots.release()
+            raise
+        #the slot is held until the worker is actually free, even if the job is cancelled or times out first
+        future.add_done_callback(lambda _: slots.release())
+        timeout = self.timeout + TIMEOUT_GRACE if self.timeout else None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise UploadJobTimeout()
+        except BrokenProcessPool:
+            #a worker died (e.g. out of memory), start a fresh pool for the next job
+            self._executor = None
+            raise
+
+    def pending_count(self):
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def submit(self, handler, *args, owner_company_id=None, job_id=None, **kwargs):
+        """
+        Queue handler(context, *args, **kwargs) as a new job and return it right away
+
+        handler is a coroutine function; whatever it returns becomes the job's result.
+        owner_company_id is the company allowed to see the job.
+        job_id is the id to register the job under, a new uuid if not given. Raises UploadJobExists if it is taken.
+        """
+        self.prune()
+        if job_id is not None and job_id in self._jobs:
+            raise UploadJobExists(f"Upload job {job_id} already exists")
+        if self.pending_count() >= self.max_pending:
+            raise UploadQueueFull(f"Upload queue is full ({self.max_pending} jobs pending)")
+        job = UploadJob(id=job_id or str(uuid4()), company_id=owner_company_id)
+        self._jobs[job.id] = job
+        self._tasks[job.id] = asyncio.get_running_loop().create_task(self._run(job, handler, args, kwargs))
+        return job
+
+    async def _run(self, job, handler, args, kwargs):
+        context = JobContext(self, job)
+        try:
+            job.result = await handler(context, *args, **kwargs)
+            job.status = SUCCEEDED
+            job.set_stage('done')
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+            job.set_stage(CANCELLED)
+        except UploadJobTimeout:
+            job.status = TIMED_OUT
+            job.error = f"Processing took longer than {self.timeout:g} seconds"
+            job.set_stage(TIMED_OUT)
+        except Exception as e:
+            logging_start.logger.error(f"Upload job {job.id} failed: {str(e)}")
+            job.status = FAILED
+            job.error = str(e)
+            job.set_stage(FAILED)
+        finally:
+            job.finished_at = _now()
+            self._tasks.pop(job.id, None)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id):
+        """Wait for a job to finish and return it. The job keeps running if the waiting request goes away"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that has not finished. Returns False if the job is unknown or already finished
+
+        A job waiting for a worker slot never starts. A parse that is already running cannot be
+        interrupted; its result is discarded and nothing is written to eeu_data.
+        """
+        job = self._jobs.get(job_id)
+        task = self._tasks.get(job_id)
+        if job is None or job.finished or task is None:
+            return False
+        task.cancel()
+        return True
+
+    def prune(self):
+        """Forget finished jobs older than job_ttl"""
+        now = _now()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and (now - job.finished_at).total_seconds() > self.job_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+upload_job_queue = UploadJobQueue()
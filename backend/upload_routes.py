@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 import models
-from utils import verify_token, add_event_history, supabase
+from utils import verify_token, add_event_history, supabase, enum_cache
 from typing import Optional, Dict, Union
-from uuid import uuid4
+from uuid import uuid4, UUID
 from gcs_upload import upload_blob
 import os
 from multi_upload import process_multi_upload
@@ -15,6 +16,9 @@ from openpyxl.utils import get_column_letter
 import tempfile
 
 from post_processing import run_script_master
+from project_details import end_use_cache
+from project_summary import refresh_project_summaries
+from upload_jobs import upload_job_queue, UploadQueueFull, UploadJobExists, SUCCEEDED, UPLOAD_ASYNC
 
 
 router = APIRouter()
@@ -36,36 +40,64 @@ def update_eeu_record(eeu_id, upload_id):
 
 def upload_report(url, baseline_design, report_type=None, conditioned_area=None, file_extension=None, file_name=None):
     print(f"DEBUG: upload_report called with url={url}, baseline_design={baseline_design}, report_type={report_type}, file_extension={file_extension}")
+    results = parse_upload(url, baseline_design, report_type, conditioned_area, file_extension)
+    return save_upload(results, url, baseline_design, file_extension, file_name)
+
+def parse_upload(url, baseline_design, report_type=None, conditioned_area=None, file_extension=None):
+    """
+    Parses an uploaded report without writing anything to the database
+
+    Runs in an upload worker process, so the return value must be picklable. Pass it to save_upload to insert the eeu_data record.
+    """
     
     # Check if this is a multi-project Excel file BEFORE running script master
-    if file_extension and file_extension.lower() in ['.xlsx', '.xls']:
-        try:
-            from parse_reports.parse_multi_project_xlsx import is_multi_project_excel
-            if is_multi_project_excel(url):
-                logging_start.logger.info(f"Multi-project Excel file detected, skipping report type detection")
-                # Return special indicator for multi-project files
-                return {
-                    'status': 'success',
-                    'report_type': 9,
-                    'is_multi_project': True,
-                    'file_url': url,
-                    'message': "Multi-project Excel file detected - use multi-project service"
-                }
-        except Exception as e:
-            logging_start.logger.info(f"Multi-project detection failed: {str(e)}, proceeding with normal parsing")
-    
-    args = {
-        'url': url,
-        'conditioned_area': conditioned_area,
-        'baseline_design': baseline_design
-    }
-    if report_type is not None:
-        args['report_type'] = report_type
-
-    print(f"DEBUG: Calling run_script_master with args: {args}")
-    results = run_script_master(**args)
-    print(f"DEBUG: run_script_master returned: {type(results)} - {results}")
+    workbook = None
+    try:
+        if file_extension and file_extension.lower() in ['.xlsx', '.xls']:
+            try:
+                from parse_reports.parse_multi_project_xlsx import is_multi_project_excel, MultiProjectExcelParser
+                from parse_reports.workbook_source import WorkbookSource
+                # downloaded and opened once, shared with the multi-project parser or run_script_master
+                workbook = WorkbookSource.from_url(url)
+                if is_multi_project_excel(url, workbook=workbook):
+                    logging_start.logger.info(f"Multi-project Excel file detected, skipping report type detection")
+                    # Return special indicator for multi-project files, with the parsed projects for the multi-project service
+                    return {
+                        'status': 'success',
+                        'report_type': 9,
+                        'is_multi_project': True,
+                        'file_url': url,
+                        'parse_result': MultiProjectExcelParser().parse_multi_project_excel(url, workbook=workbook),
+                        'message': "Multi-project Excel file detected - use multi-project service"
+                    }
+            except Exception as e:
+                logging_start.logger.info(f"Multi-project detection failed: {str(e)}, proceeding with normal parsing")
     
+        args = {
+            'url': url,
+            'conditioned_area': conditioned_area,
+            'baseline_design': baseline_design
+        }
+        if report_type is not None:
+            args['report_type'] = report_type
+        if workbook is not None:
+            args['workbook'] = workbook
+
+        print(f"DEBUG: Calling run_script_master with args: {args}")
+        results = run_script_master(**args)
+        print(f"DEBUG: run_script_master returned: {type(results)} - {results}")
+        return results
+    finally:
+        # run_script_master only closes a workbook it opened itself
+        if workbook is not None:
+            workbook.close()
+
+def save_upload(results, url, baseline_design, file_extension=None, file_name=None):
+    """Inserts the eeu_data record for parsed report results from parse_upload and returns the upload response"""
+    # Multi-project detection already produced the response
+    if isinstance(results, dict) and results.get('is_multi_project'):
+        return results
+
     # Check if this is a multi-project Excel file (report type 9)
     if (isinstance(results, dict) and 
         results.get('status') == 'success' and 
@@ -186,12 +218,97 @@ def upload_report(url, baseline_design, report_type=None, conditioned_area=None,
             'report_type': results.get('report_type')
             }
     
+def _parsed_as(results, report_type):
+    return isinstance(results, dict) and results.get('status') == 'success' and results.get('report_type') == report_type
+
+def process_multi_project_upload(url, company_id, parse_result=None, progress=None):
+    try:
+        from multi_project_service import create_multi_project_service
+        service = create_multi_project_service()
+        result = service.process_multi_project_excel(url, company_id, parse_result=parse_result, progress=progress)
+
+        return {
+            'status': result['status'],
+            'report_type': 9,
+            'total_projects': result['total_projects'],
+            'successful_projects': result['successful_projects'],
+            'failed_projects': result['failed_projects'],
+            'validation_errors': result['validation_errors'],
+            'created_project_ids': result.get('created_project_ids', []),
+            'created_projects': result.get('created_projects', []),
+            'message': f"Processed {result['successful_projects']} of {result['total_projects']} projects successfully"
+        }
+    except Exception as e:
+        logging_start.logger.error(f"Error processing multi-project Excel: {str(e)}")
+        return {
+            'status': 'error',
+            'message': f"Multi-project processing failed: {str(e)}",
+            'report_type': 9
+        }
+
+async def process_upload_job(context, url, baseline_design, report_type=None, conditioned_area=None, file_extension=None, file_name=None, company_id=None):
+    """
+    Upload job handler. Parsing runs in an upload worker process and the eeu_data insert happens once it completes.
+
+    Returns the same response /uploadfile/ returned when it processed uploads inline.
+    """
+    if report_type == 8:
+        # PRM reports hold both the baseline and the design results
+        outputs = {}
+        for step, side in enumerate(["baseline", "design"]):
+            context.set_stage(f'parsing {side}', step * 2, 4)
+            results = await context.run_in_worker(parse_upload, url, side, 8, None, file_extension)
+            context.set_stage(f'saving {side}', step * 2 + 1, 4)
+            outputs[side] = await context.run_in_thread(save_upload, results, url, side, file_extension, file_name)
+        return {'report_type': 8, 'baseline': outputs['baseline'], 'design': outputs['design']}
+
+    context.set_stage('parsing', 0, 2)
+    results = await context.run_in_worker(parse_upload, url, baseline_design, report_type, conditioned_area, file_extension)
+
+    if _parsed_as(results, 8):
+        # Detected a PRM report: the first parse is the uploaded side, parse the other side too
+        other_side = "design" if baseline_design == "baseline" else "baseline"
+        context.set_stage(f'saving {baseline_design}', 1, 4)
+        outputs = {baseline_design: await context.run_in_thread(save_upload, results, url, baseline_design, file_extension, file_name)}
+        context.set_stage(f'parsing {other_side}', 2, 4)
+        other_results = await context.run_in_worker(parse_upload, url, other_side, 8, None, file_extension)
+        context.set_stage(f'saving {other_side}', 3, 4)
+        outputs[other_side] = await context.run_in_thread(save_upload, other_results, url, other_side, file_extension, file_name)
+        return {'report_type': 8, 'baseline': outputs.get('baseline'), 'design': outputs.get('design')}
+
+    if _parsed_as(results, 9):
+        context.set_stage('creating projects', 1, 2)
+
+        def report_rows(rows_done, rows_total):
+            # the job's progress counts spreadsheet rows while the projects are written
+            context.set_stage('creating projects', rows_done, rows_total)
+
+        # the projects parsed in the upload worker are created without reading the file again
+        return await context.run_in_thread(process_multi_project_upload, url, company_id, results.get('parse_result'), report_rows)
+
+    context.set_stage('saving', 1, 2)
+    return await context.run_in_thread(save_upload, results, url, baseline_design, file_extension, file_name)
+
 @router.post("/uploadfile/")
 async def create_upload_file(item: models.ReportUpload = Depends(), authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    """
+    Stores the report and parses it in the upload job queue
+
+    Returns the parse result once the job finishes. With UPLOAD_ASYNC set it returns the job id right away instead,
+    poll /upload_jobs/{job_id} for the result. A job_id sent with the upload names the job, so its progress can be
+    polled while this request is still open.
+    """
     print(f"DEBUG: Upload request received. Authorized: {authorized['is_authorized']}")
     if authorized['is_authorized']:
         print(f"DEBUG: File info - filename: {item.file.filename}, baseline_design: {item.baseline_design}")
         
+        job_id = item.job_id
+        if job_id is not None:
+            try:
+                job_id = str(UUID(job_id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail="job_id must be a UUID")
+
         BUCKET_NAME = os.environ.get('BUCKET_NAME')
 
         if BUCKET_NAME is None:
@@ -203,88 +320,64 @@ async def create_upload_file(item: models.ReportUpload = Depends(), authorized:
         file_name = item.file.filename
         file_extension = os.path.splitext(filename_new)[1]
         print(f"DEBUG: Uploading file to GCS - filename: {filename_new}, extension: {file_extension}")
-        url = upload_blob(BUCKET_NAME, filename_new, file_obj = item.file.file,)
+        url = await run_in_threadpool(upload_blob, BUCKET_NAME, filename_new, file_obj = item.file.file,)
         print(f"DEBUG: File uploaded to GCS, URL: {url}")
 
-        
-
-        #if item.report_type == 8:
-        if hasattr(item, 'report_type') and item.report_type == 8:
-            report_type = item.report_type
-            baseline_output = upload_report(url,"baseline",report_type,file_extension=file_extension,file_name = file_name)
-            design_output = upload_report(url,"design",report_type,file_extension=file_extension, file_name = file_name)
-            return {'report_type':report_type,
-                'baseline':baseline_output,
-                    'design':design_output}
-
-        else:
-            args = {
-                'url': url,
-                'baseline_design': item.baseline_design,
-                'conditioned_area': item.conditioned_area,
-                'file_extension': file_extension,
-                'file_name': file_name
-            }
-            if hasattr(item, 'report_type') and item.report_type is not None:
-                args['report_type'] = item.report_type
-
-            report_to_upload = upload_report(**args)
-            print(f"DEBUG: upload_report returned: {report_to_upload}")
-            
-            # Check if the parsed report type is PRM (type 8), and if so, process both baseline and design
-            if (isinstance(report_to_upload, dict) and 
-                'status' in report_to_upload and 
-                report_to_upload['status'] == 'success' and 
-                report_to_upload.get('report_type') == 8):  # PRM report
-                
-                # Process both baseline and design for PRM reports
-                baseline_output = upload_report(url, "baseline", report_type=8, file_extension=file_extension, file_name=file_name)
-                design_output = upload_report(url, "design", report_type=8, file_extension=file_extension, file_name=file_name)
-                return {
-                    'report_type': 8,
-                    'baseline': baseline_output,
-                    'design': design_output
-                }
-            
-            # Check if the parsed report type is Multi-Project Excel (type 9)
-            if (isinstance(report_to_upload, dict) and 
-                'status' in report_to_upload and 
-                report_to_upload['status'] == 'success' and 
-                report_to_upload.get('report_type') == 9):  # Multi-Project Excel
-                
-                # Use multi-project service to process the file
-                try:
-                    from multi_project_service import create_multi_project_service
-                    service = create_multi_project_service()
-                    result = service.process_multi_project_excel(url, item.company_id)
-                    
-                    return {
-                        'status': result['status'],
-                        'report_type': 9,
-                        'total_projects': result['total_projects'],
-                        'successful_projects': result['successful_projects'],
-                        'failed_projects': result['failed_projects'],
-                        'validation_errors': result['validation_errors'],
-                        'created_project_ids': result.get('created_project_ids', []),
-                        'created_projects': result.get('created_projects', []),
-                        'message': f"Processed {result['successful_projects']} of {result['total_projects']} projects successfully"
-                    }
-                except Exception as e:
-                    logging_start.logger.error(f"Error processing multi-project Excel: {str(e)}")
-                    return {
-                        'status': 'error',
-                        'message': f"Multi-project processing failed: {str(e)}",
-                        'report_type': 9
-                    }
-            
-            print(f"DEBUG: Returning final result: {report_to_upload}")
-            return report_to_upload
+        try:
+            job = upload_job_queue.submit(
+                process_upload_job,
+                url,
+                item.baseline_design,
+                report_type=getattr(item, 'report_type', None),
+                conditioned_area=item.conditioned_area,
+                file_extension=file_extension,
+                file_name=file_name,
+                company_id=item.company_id,
+                owner_company_id=authorized.get('company_id'),
+                job_id=job_id,
+            )
+        except UploadJobExists as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except UploadQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+        if UPLOAD_ASYNC:
+            return {'status': job.status, 'job_id': job.id, 'file_name': file_name}
+
+        # parsing still runs in the worker pool, the request is held open until the job finishes
+        job = await upload_job_queue.wait(job.id)
+        if job.status != SUCCEEDED:
+            return {'status': 'error', 'message': job.error or f"Upload {job.status}"}
+        return job.result
 
     else:
         print("ERROR: User not authorized")
         return "not authorized"
+
+def _get_company_job(job_id, authorized):
+    job = upload_job_queue.get(job_id)
+    # jobs are only visible to the company that uploaded them
+    if job is None or (job.company_id is not None and job.company_id != authorized.get('company_id')):
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
+
+@router.get("/upload_jobs/{job_id}")
+async def get_upload_job(job_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    if not authorized['is_authorized']:
+        return "not authorized"
+    return _get_company_job(job_id, authorized).to_dict()
+
+@router.delete("/upload_jobs/{job_id}")
+async def cancel_upload_job(job_id: str, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+    if not authorized['is_authorized']:
+        return "not authorized"
+    job = _get_company_job(job_id, authorized)
+    if not upload_job_queue.cancel(job.id):
+        return {'status': 'error', 'message': f"Upload job is already {job.status}", 'job_id': job.id}
+    return {'status': 'success', 'message': 'Upload job cancelled', 'job_id': job.id}
+
 @router.post("/submit_multi_upload/")
-async def submit_multiupload(item: models.MultiUpload, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def submit_multiupload(item: models.MultiUpload, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     if authorized['is_authorized']:
         company_id = authorized['company_id']
         try:
@@ -298,7 +391,7 @@ async def submit_multiupload(item: models.MultiUpload, authorized: Dict[str, Uni
         return "not authorized"
 
 @router.post("/submit_multi_project_excel/")
-async def submit_multi_project_excel(item: models.MultiProjectExcelUpload, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def submit_multi_project_excel(item: models.MultiProjectExcelUpload, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     """
     Process multi-project Excel file and create multiple projects
     """
@@ -334,7 +427,7 @@ async def submit_multi_project_excel(item: models.MultiProjectExcelUpload, autho
         }
 
 @router.get("/download-multi-project-template/")
-async def download_multi_project_template():
+def download_multi_project_template():
     """
     Download the multi-project Excel template with baseline/design energy field columns
     """
@@ -486,23 +579,21 @@ async def download_multi_project_template():
         for col_idx, header in enumerate(new_headers, start=1):
             headers[header] = get_column_letter(col_idx)
 
-        # Prepare allowed values via database and constants
-        def fetch_enum_names(table_name: str) -> list:
+        # Prepare allowed values via the enum cache and constants
+        def fetch_enum_names(list_name: str) -> list:
             try:
-                data, _ = supabase.table(table_name).select('name').order('order').execute()
-                if data and len(data) > 1:
-                    return [row['name'] for row in data[1] if row.get('name')]
+                return enum_cache.names(list_name)
             except Exception as e:
-                logging_start.logger.warning(f"Failed to fetch {table_name}: {str(e)}")
+                logging_start.logger.warning(f"Failed to fetch enum_{list_name}: {str(e)}")
             return []
 
         allowed_values_map = {
-            'project_use_type': fetch_enum_names('enum_project_use_types'),
-            'project_construction_category': fetch_enum_names('enum_project_construction_categories'),
-            'project_phase': fetch_enum_names('enum_project_phases'),
-            'energy_code': fetch_enum_names('enum_energy_codes'),
-            'report_type': fetch_enum_names('enum_report_types'),
-            'climate_zone': fetch_enum_names('enum_climate_zones'),
+            'project_use_type': fetch_enum_names('project_use_types'),
+            'project_construction_category': fetch_enum_names('project_construction_categories'),
+            'project_phase': fetch_enum_names('project_phases'),
+            'energy_code': fetch_enum_names('energy_codes'),
+            'report_type': fetch_enum_names('report_types'),
+            'climate_zone': fetch_enum_names('climate_zones'),
             'area_units': ['sf', 'sm'],
             'energy_units': ['mbtu', 'gj'],
         }
@@ -555,7 +646,7 @@ async def download_multi_project_template():
         )
 
 @router.post("/submit_project/")
-async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
+def submit_project(item: models.SubmitProject, authorized: Dict[str, Union[bool, Optional[str]]] = Depends(verify_token)):
     
 
     if authorized['is_authorized']:
@@ -582,6 +673,8 @@ async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union
         except Exception as e:
             print(e)
             return "error upload table"
+        # the new upload may now hold the project's latest eeu_data
+        end_use_cache.invalidate_project(item_data['project_id'])
         
         def update_eeu_if_exists(key, extract_dict, upload_id):
             if extract_dict.get(key) is not None:
@@ -594,6 +687,7 @@ async def submit_project(item: models.SubmitProject, authorized: Dict[str, Union
         # Usage
         update_eeu_if_exists('baseline_eeu_id', extract_dict, data[1][0]['id'])
         update_eeu_if_exists('design_eeu_id', extract_dict, data[1][0]['id'])
+        refresh_project_summaries([item_data['project_id']])
 
         return "success"
 
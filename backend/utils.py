@@ -5,12 +5,19 @@ import os
 from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import anyio
+from starlette.concurrency import run_in_threadpool
 import re
+import json
+import hashlib
 from cryptography.fernet import Fernet
 import base64
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from dotenv import load_dotenv
+from enum_cache import EnumCache
+from token_verifier import TokenVerifier
 
 # Only load .env file in local development
 env = os.environ.get('ENV', 'local').lower()
@@ -29,6 +36,12 @@ print(f"url: {url}")
 print(f"key: {key}")
 supabase: Client = create_client(url, key)
 
+#### THREADPOOL SETUP ####
+# Route handlers that call supabase are plain def functions, FastAPI runs them on the anyio threadpool so blocking
+# PostgREST calls never hold the event loop. The postgrest session is shared by every thread and keeps its
+# HTTP/2 connections alive, DB_THREADPOOL_SIZE bounds how many requests an instance serves at once.
+DB_THREADPOOL_SIZE = int(os.getenv('DB_THREADPOOL_SIZE', '64'))
+
 #### ENCRYPTION SETUP ####
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
 SALT = os.getenv('ENCRYPTION_SALT')
@@ -65,8 +78,17 @@ enum_list = [
     {'id': 'climate_zone_id', 'list_name': 'climate_zones', 'display_name': 'Climate Zone'}
 ]
 
+enum_cache = EnumCache(supabase, [enum['list_name'] for enum in enum_list])
+
+token_verifier = TokenVerifier(supabase, url)
+
+@asynccontextmanager
+async def lifespan(app):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADPOOL_SIZE
+    yield
+
 def create_app():
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     # Get CORS origins from environment variable
     allowed_origins = os.getenv('ALLOWED_ORIGINS', '').split(',')
@@ -79,13 +101,13 @@ def create_app():
         allow_credentials=True,
         allow_methods=['*'],
         allow_headers=['*'],
+        expose_headers=['ETag'],
     )
 
     return app
 
 async def verify_token(req: Request):
     access_token = req.headers.get('Authorization')
-    print(req)
 
     if access_token and access_token.startswith('Bearer '):
         access_token = access_token.split('Bearer ')[1]  # Extract the token part after 'Bearer '
@@ -94,22 +116,10 @@ async def verify_token(req: Request):
         # Handle cases where the token format is incorrect or missing
         return {'is_authorized': False}     # Or raise an error or return an appropriate response
 
-    try:
-        data = supabase.auth.get_user(access_token)
-        
-
-        user_company_id = data.user.user_metadata['company_id']
-        user_role = data.user.user_metadata.get('role', 'NA')
-        user_id = data.user.id
-        return {'is_authorized': True, 
-                'company_id': user_company_id, 
-                'role': user_role, 
-                'user_id': user_id}
-    except:
-        print ("error with authentication")
-        return {'is_authorized': False}   
-
-#@lru_cache(maxsize=128)
+    # Signature, expiry and audience are checked in process, see token_verifier; a JWKS refresh or the
+    # remote fallback is a network call, so it runs on the threadpool
+    return await run_in_threadpool(token_verifier.verify, access_token)
+
 def return_enum_vals(enum_type, **args):
     use_type_id = args.get('use_type_id', None)
     id_value = args.get('id_value', None)
@@ -118,19 +128,17 @@ def return_enum_vals(enum_type, **args):
     enum_list_names = [enum['list_name'] for enum in enum_list]
     
     if enum_type in enum_list_names:
-        enum_table_name = "enum_" + enum_type
         try:
-            query = supabase.table(enum_table_name)\
-                .select('*')\
-                .order('order')
-            if use_type_id:
-                query = query.eq('use_type_id', use_type_id)
             if id_value:
-                query = query.eq('id', id_value)
-            data, count = query.execute()
+                row = enum_cache.row_by_id(enum_type, id_value)
+                rows = [row] if row else []
+            else:
+                rows = enum_cache.rows(enum_type)
+            if use_type_id:
+                rows = [row for row in rows if row.get('use_type_id') == use_type_id]
 
-            if data[1] != []:
-                return data[1]
+            if rows != []:
+                return rows
             else:
                 return "no results"
         except Exception as e:
@@ -138,20 +146,13 @@ def return_enum_vals(enum_type, **args):
             return "error"
     else:
         return "error"
+
 def return_enum_value(enum_type,enum_id):
-    output = return_enum_vals(enum_type, id_value=enum_id)
-    return output[0]['name']
+    return enum_cache.name_for_id(enum_type, enum_id)
 
 
 def get_enum_id(enum_type, enum_value):
-
-
-    enum_vals = return_enum_vals(enum_type)
-    df = pd.DataFrame(enum_vals)
-    try:
-        return df[df['name'] == enum_value]['id'].values[0]
-    except Exception as e:
-        return None
+    return enum_cache.id_for_name(enum_type, enum_value)
     
 
 def add_event_history(table_name,field_name,ref_id,new_value,user_id,previous_value):
@@ -178,6 +179,18 @@ def sanitize_filename(filename):
     filename = filename.replace(" ", "_")
     return filename
 
+def json_etag(payload):
+    """Weak ETag of a JSON response body"""
+    body = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+    return 'W/"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check with weak comparison"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
 def get_field_name_from_use_type(use_type, fuel_category):
     query = supabase.table('eeu_fields')\
         .select('field_name')\
@@ -1,10 +1,13 @@
 import pandas as pd
+import numpy as np
 import re
 import os
-from geopy.geocoders import Nominatim
+from functools import lru_cache
 import logging_start
 from math import radians, cos, sin, asin, sqrt
 from utils import supabase
+from project_summary import refresh_project_summaries
+from eeu_loader import eeu_loader
 from rapidfuzz import process, fuzz
 
 
@@ -12,6 +15,7 @@ from rapidfuzz import process, fuzz
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 df_zips = pd.read_csv(os.path.join(current_dir, 'dependencies/operational_carbon/zip_to_subregion.csv'), dtype={'zip': str})
+zip_subregions = dict(df_zips.drop_duplicates('zip')[['zip', 'subregion']].itertuples(index=False, name=None))
 
 
 def format_as_zip_code(zip_code):
@@ -26,49 +30,290 @@ def format_as_zip_code(zip_code):
 
 def get_subregion_by_zip(zip_code):
     zip_code = format_as_zip_code(zip_code)
+    return zip_subregions.get(zip_code, "no zip code found")
+    
+class PointIndex:
+    """
+    Nearest point lookups over preloaded coordinates
 
-    # Filter the DataFrame by the formatted zip_code
-    filtered_df = df_zips[df_zips['zip'] == zip_code]
+    Distances are computed with a vectorized haversine over all points at once, so a lookup is a
+    handful of NumPy operations instead of a Python loop over every row.
+    """
 
-    # Check if the filtered DataFrame is empty
-    if filtered_df.empty:
-        return "no zip code found"
-    else:
-        return filtered_df['subregion'].values[0]
-    
-def get_climate_zone_by_zip(zip_code):
+    def __init__(self, df, lat_column='lat', lon_column='long'):
+        self.df = df.reset_index(drop=True)
+        self._lat = np.radians(self.df[lat_column].to_numpy(dtype=float))
+        self._lon = np.radians(self.df[lon_column].to_numpy(dtype=float))
+        self._cos_lat = np.cos(self._lat)
+
+    def __len__(self):
+        return len(self.df)
+
+    def distances(self, lat, lon):
+        """Great circle distance in km from one point to every station"""
+        lat, lon = radians(lat), radians(lon)
+        a = np.sin((self._lat - lat)/2)**2 + cos(lat) * self._cos_lat * np.sin((self._lon - lon)/2)**2
+        return 6371 * 2 * np.arcsin(np.sqrt(a))
+
+    def nearest(self, lat, lon):
+        """Row position of the closest station, or None if there are no stations"""
+        if len(self) == 0:
+            return None
+        return int(np.argmin(self.distances(lat, lon)))
+
+    def nearest_many(self, lats, lons, chunk_size=1024):
+        """Row positions of the closest station for each point"""
+        lats = np.radians(np.asarray(lats, dtype=float))
+        lons = np.radians(np.asarray(lons, dtype=float))
+        positions = np.empty(len(lats), dtype=int)
+        if len(self) == 0:
+            positions.fill(-1)
+            return positions
+        for start in range(0, len(lats), chunk_size):
+            lat = lats[start:start + chunk_size, None]
+            lon = lons[start:start + chunk_size, None]
+            a = np.sin((self._lat - lat)/2)**2 + np.cos(lat) * self._cos_lat * np.sin((self._lon - lon)/2)**2
+            # arcsin/sqrt are monotonic, so the smallest a is the closest station
+            positions[start:start + chunk_size] = np.argmin(a, axis=1)
+        return positions
+
+
+
+class WeatherStationIndex(PointIndex):
+    """Nearest weather station and WMO code lookups over weather_output_new.csv"""
+
+    def __init__(self, df_weather):
+        super().__init__(df_weather, 'lat', 'long')
+        # first station for each WMO code
+        self._wmo_positions = {}
+        for position, wmo_code in enumerate(self.df['wmo_code']):
+            self._wmo_positions.setdefault(wmo_code, position)
+
+    def station(self, position):
+        return self.df.iloc[position]
+
+    def nearest_station(self, lat, lon):
+        position = self.nearest(lat, lon)
+        return None if position is None else self.station(position)
+
+    def station_by_wmo_code(self, wmo_code):
+        position = self._wmo_positions.get(wmo_code)
+        return None if position is None else self.station(position)
+
+
+@lru_cache(maxsize=None)
+def get_weather_station_index():
+    """Weather station index, loaded from weather_output_new.csv on first use"""
+    return WeatherStationIndex(pd.read_csv(os.path.join(current_dir, 'dependencies/weather_output_new.csv')))
+
+
+class ReverseGeocoder(PointIndex):
+    """
+    Offline reverse geocoding to the nearest city centroid in uscities.csv
+
+    Returns the zip code, city, state and eGRID subregion for a coordinate without a network call.
+    The zip code is the first of the city's zips that has an eGRID subregion, otherwise its first zip.
+    """
+
+    def __init__(self, df_cities):
+        super().__init__(df_cities, 'lat', 'lng')
+
+    def _location(self, position):
+        city = self.df.iloc[position]
+        zips = str(city['zips']).split() if pd.notna(city['zips']) else []
+        zip_code = next((z for z in zips if z in zip_subregions), zips[0] if zips else '')
+        return {
+            'zip_code': zip_code,
+            'city': city['city_ascii'],
+            'state': city['state_name'],
+            'state_id': city['state_id'],
+            'egrid_subregion': zip_subregions.get(zip_code, "no zip code found") if zip_code else ''
+        }
+
+    def lookup(self, lat, lon):
+        """Location of the nearest city, or None if there are no cities"""
+        position = self.nearest(lat, lon)
+        return None if position is None else self._location(position)
+
+    def lookup_many(self, lats, lons):
+        if len(self) == 0:
+            return [None] * len(lats)
+        return [self._location(position) for position in self.nearest_many(lats, lons)]
+
+
+@lru_cache(maxsize=None)
+def get_reverse_geocoder():
+    """Reverse geocoder over the uscities.csv centroids, built on first use"""
+    return ReverseGeocoder(get_cities())
+
+
+@lru_cache(maxsize=None)
+def get_cities():
+    """uscities.csv with a 'City ST' column for matching, loaded on first use"""
     df_cities = pd.read_csv(os.path.join(current_dir, 'dependencies/uscities.csv'))
-    best_match = process.extractOne(zip_code, df_cities['zips'], scorer=fuzz.token_sort_ratio)
-    this_city = df_cities.loc[df_cities['zips'] == best_match[0]]
-    this_city_state_clean = this_city.iloc[0, this_city.columns.get_loc('city_ascii')] + ", " + this_city.iloc[0, this_city.columns.get_loc('state_id')]
-    this_city_selected = this_city.iloc[0, this_city.columns.get_loc('city_ascii')]
-    this_state_selected = this_city.iloc[0, this_city.columns.get_loc('state_name')]
-    lat1 = this_city.iloc[0, this_city.columns.get_loc('lat')]
-    long1 = this_city.iloc[0, this_city.columns.get_loc('lng')]
-
-    df_weather_locs = pd.read_csv(os.path.join(current_dir, 'dependencies/weather_output_new.csv'))
-    df_weather_locs['distance'] = [haversine(long1, lat1, df_weather_locs.long[j], df_weather_locs.lat[j]) for j in range(len(df_weather_locs))]
-    df_weather_locs.reset_index()
-    min_dist_id = df_weather_locs['distance'].idxmin()
-
-    closest_city = df_weather_locs.loc[min_dist_id]
-    weather_info = {
+    df_cities['city_state'] = df_cities['city_ascii'] + " " + df_cities['state_id']
+    return df_cities
+
+
+def _normalize_location(text):
+    """Lowercase, drop punctuation and collapse whitespace so 'Chicago-O'Hare, IL' and 'chicago o hare il' compare equal"""
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', str(text).lower()).split())
+
+
+def _trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LocationMatcher:
+    """
+    Matches zip codes and "City ST" strings to rows of uscities.csv
+
+    Exact zip codes and normalized "city st" keys are dict lookups. Anything else falls back to
+    rapidfuzz, scored only against a block of plausible candidates: cities sharing the zip's
+    3 digit prefix, or the cities sharing the most trigrams with the query string.
+
+    Matches are returned as (city row, score) tuples, score is 100 for exact matches.
+    """
+
+    def __init__(self, df_cities, max_candidates=50):
+        self.df = df_cities.reset_index(drop=True)
+        self.max_candidates = max_candidates
+        self._zips = self.df['zips'].fillna('').astype(str).tolist()
+        self._keys = [_normalize_location(f"{city} {state}") for city, state in zip(self.df['city_ascii'], self.df['state_id'])]
+
+        # exact lookups, the first city listed for a zip or key wins
+        self._by_zip = {}
+        self._by_zip_prefix = {}
+        for position, zips in enumerate(self._zips):
+            for zip_code in zips.split():
+                self._by_zip.setdefault(zip_code, position)
+                self._by_zip_prefix.setdefault(zip_code[:3], set()).add(position)
+        self._by_key = {}
+        for position, key in enumerate(self._keys):
+            self._by_key.setdefault(key, position)
+
+        # trigram -> positions of the keys containing it
+        trigram_positions = {}
+        for position, key in enumerate(self._keys):
+            for trigram in _trigrams(key):
+                trigram_positions.setdefault(trigram, []).append(position)
+        self._trigram_positions = {trigram: np.array(positions) for trigram, positions in trigram_positions.items()}
+
+    def __len__(self):
+        return len(self.df)
+
+    def _row(self, position):
+        return self.df.iloc[position]
+
+    def _best(self, query, choices, positions):
+        best_match = process.extractOne(query, choices, scorer=fuzz.token_sort_ratio)
+        if not best_match:
+            return None
+        return self._row(positions[best_match[2]]), best_match[1]
+
+    def city_for_zip(self, zip_code):
+        """City row listing exactly this zip code, or None"""
+        position = self._by_zip.get(str(zip_code).strip())
+        return None if position is None else self._row(position)
+
+    def match_zip(self, zip_code):
+        zip_code = str(zip_code).strip()
+        position = self._by_zip.get(zip_code)
+        if position is not None:
+            return self._row(position), 100
+        if len(self) == 0:
+            return None
+        positions = sorted(self._by_zip_prefix.get(zip_code[:3], ()))
+        if not positions:
+            positions = range(len(self))
+        positions = list(positions)
+        return self._best(zip_code, [self._zips[p] for p in positions], positions)
+
+    def match_city_state(self, text):
+        key = _normalize_location(text)
+        position = self._by_key.get(key)
+        if position is not None:
+            return self._row(position), 100
+        if len(self) == 0 or not key:
+            return None
+        trigram_hits = [self._trigram_positions[t] for t in _trigrams(key) if t in self._trigram_positions]
+        if not trigram_hits:
+            return None
+        counts = np.bincount(np.concatenate(trigram_hits), minlength=len(self))
+        n_candidates = min(self.max_candidates, int(np.count_nonzero(counts)))
+        positions = np.argpartition(-counts, n_candidates - 1)[:n_candidates].tolist()
+        return self._best(key, [self._keys[p] for p in positions], positions)
+
+    def match(self, text):
+        """Zip codes (all digits) are matched against zips, anything else against "City ST" keys"""
+        text = str(text).strip()
+        if text.isdigit():
+            return self.match_zip(text)
+        return self.match_city_state(text)
+
+    def match_many(self, texts):
+        """Matches for a batch of strings, each distinct string is matched once"""
+        matches = {}
+        results = []
+        for text in texts:
+            if text not in matches:
+                matches[text] = self.match(text)
+            results.append(matches[text])
+        return results
+
+
+@lru_cache(maxsize=None)
+def get_location_matcher():
+    """Location matcher over uscities.csv, built on first use"""
+    return LocationMatcher(get_cities())
+
+
+def _climate_zone_info(zip_code, this_city, ratio_match, closest_city):
+    return {
         'status': 'success',
-        'city_name': this_city_state_clean,
-        'ratio_match': best_match[1],
+        'city_name': this_city['city_ascii'] + ", " + this_city['state_id'],
+        'ratio_match': ratio_match,
         'climate_zone': closest_city['climate_zone'],
         'zip_code': zip_code,
-        'city': this_city_selected,
-        'state': this_state_selected
+        'city': this_city['city_ascii'],
+        'state': this_city['state_name']
     }
-    return weather_info
+
+
+def get_climate_zone_by_zip(zip_code):
+    match = get_location_matcher().match_zip(zip_code)
+    if match is None:
+        return {'status': 'error', 'zip_code': zip_code}
+    this_city, ratio_match = match
+    closest_city = get_weather_station_index().nearest_station(this_city['lat'], this_city['lng'])
+    return _climate_zone_info(zip_code, this_city, ratio_match, closest_city)
+
+
+def get_climate_zones_by_zip(zip_codes):
+    """
+    Batch version of get_climate_zone_by_zip
+
+    Args:
+        zip_codes: iterable of zip codes, duplicates are looked up once
+
+    Returns:
+        dict of zip code -> weather info (same shape as get_climate_zone_by_zip)
+    """
+    unique_zips = list(dict.fromkeys(zip_codes))
+    matched = [(zip_code, match) for zip_code, match in zip(unique_zips, get_location_matcher().match_many(unique_zips)) if match is not None]
+    if not matched:
+        return {}
+    station_index = get_weather_station_index()
+    positions = station_index.nearest_many([city['lat'] for _, (city, _) in matched], [city['lng'] for _, (city, _) in matched])
+    return {zip_code: _climate_zone_info(zip_code, city, ratio_match, station_index.station(position))
+            for (zip_code, (city, ratio_match)), position in zip(matched, positions)}
 
 def latlong_to_zip(lat, lon):
-    geolocator = Nominatim(user_agent="d3p-bem-reports",timeout=20)
-    location = geolocator.reverse((lat, lon), exactly_one=True)
+    location = get_reverse_geocoder().lookup(lat, lon)
     
-    if location and 'postcode' in location.raw['address']:
-        return location.raw['address']['postcode']
+    if location and location['zip_code']:
+        return location['zip_code']
     else:
         return None
     
@@ -106,30 +351,29 @@ def _process_iesve_weather(weather_string):
         # Extract WMO code from weather string
         wmo_code = int(re.findall(r'.(\d{6})', weather_string)[0])
         
-        # Load and filter weather data
-        df_weather = pd.read_csv(os.path.join(current_dir, 'dependencies/weather_output_new.csv'))
-        df_weather_new = df_weather.loc[df_weather['wmo_code'] == wmo_code]
+        # Look up the station
+        station = get_weather_station_index().station_by_wmo_code(wmo_code)
         
-        if df_weather_new.empty:
+        if station is None:
             return None
             
         # Extract location data
-        climate_zone = df_weather_new.iloc[0]['climate_zone']
-        lat = df_weather_new.iloc[0]['lat']
-        long = df_weather_new.iloc[0]['long']
+        climate_zone = station['climate_zone']
+        lat = station['lat']
+        long = station['long']
         
-        # Get zip code and state
-        zip_code = latlong_to_zip(lat, long)
-        df_cities = pd.read_csv(os.path.join(current_dir, 'dependencies/uscities.csv'))
-        state = df_cities.loc[df_cities['zips'].str.contains(str(zip_code), na=False), 'state_name'].iloc[0]
+        # Get zip code and state from the nearest city
+        location = get_reverse_geocoder().lookup(lat, long)
+        if location is None:
+            return None
         
         return {
             'city_name': weather_string,
             'ratio_match': 0,
             'climate_zone': climate_zone,
-            'zip_code': zip_code,
-            'city': '',  # Add missing city field
-            'state': state
+            'zip_code': location['zip_code'],
+            'city': location['city'],
+            'state': location['state']
         }
     except Exception as e:
         logging_start.logger.error(f"IESVE weather processing failed: {str(e)}")
@@ -138,29 +382,22 @@ def _process_iesve_weather(weather_string):
 def _process_equest_beps_weather(weather_string):
     """Process weather data for EQUEST_BEPS report type"""
     try:
-        # Load city data and find best match
-        df_cities = pd.read_csv(os.path.join(current_dir, 'dependencies/uscities.csv'))
-        df_cities['city_state'] = df_cities['city_ascii'] + " " + df_cities['state_id']
-        best_match = process.extractOne(weather_string, df_cities['city_state'], scorer=fuzz.token_sort_ratio)
+        # Find best match among the cities
+        best_match = get_location_matcher().match_city_state(weather_string)
         
         if not best_match:
             return None
             
         # Get city details
-        this_city = df_cities.loc[df_cities['city_state'] == best_match[0]].iloc[0]
+        this_city, ratio_match = best_match
         this_city_state_clean = f"{this_city['city_ascii']}, {this_city['state_id']}"
         
         # Get location data
-        df_weather = pd.read_csv(os.path.join(current_dir, 'dependencies/weather_output_new.csv'))
-        df_weather['distance'] = [haversine(this_city['lng'], this_city['lat'], 
-                                          df_weather.long[j], df_weather.lat[j]) 
-                                for j in range(len(df_weather))]
-        
-        closest_city = df_weather.loc[df_weather['distance'].idxmin()]
+        closest_city = get_weather_station_index().nearest_station(this_city['lat'], this_city['lng'])
         
         return {
             'city_name': this_city_state_clean,
-            'ratio_match': best_match[1],
+            'ratio_match': ratio_match,
             'climate_zone': closest_city['climate_zone'],
             'zip_code': this_city['zips'].split()[0],
             'city': this_city['city_ascii'],
@@ -170,21 +407,24 @@ def _process_equest_beps_weather(weather_string):
         logging_start.logger.error(f"EQUEST BEPS weather processing failed: {str(e)}")
         return None
 
-def _process_equest_standard_weather(weather_string):
+def _process_equest_standard_weather(weather_string, climate_zones=None):
     """Process weather data for EQUEST_STANDARD and GENERIC_XLSX report types"""
     try:
         zip_code = format_as_zip_code(str(weather_string))
-        weather_info = get_climate_zone_by_zip(zip_code)
+        if climate_zones and zip_code in climate_zones:
+            # already looked up in a batch by weather_check_many
+            weather_info = dict(climate_zones[zip_code])
+        else:
+            weather_info = get_climate_zone_by_zip(zip_code)
         
-        if not weather_info:
+        if not weather_info or weather_info.get('status') == 'error':
             return None
             
         # Get state and city from zip code
-        df_cities = pd.read_csv(os.path.join(current_dir, 'dependencies/uscities.csv'))
-        matching_cities = df_cities.loc[df_cities['zips'].str.contains(str(zip_code), na=False)]
-        if not matching_cities.empty:
-            weather_info['state'] = matching_cities.iloc[0]['state_name']
-            weather_info['city'] = matching_cities.iloc[0].get('city_ascii', '')
+        matching_city = get_location_matcher().city_for_zip(zip_code)
+        if matching_city is not None:
+            weather_info['state'] = matching_city['state_name']
+            weather_info['city'] = matching_city.get('city_ascii', '')
         else:
             weather_info['state'] = ''
             weather_info['city'] = ''
@@ -194,13 +434,14 @@ def _process_equest_standard_weather(weather_string):
         logging_start.logger.error(f"EQUEST standard weather processing failed: {str(e)}")
         return None
 
-def weather_check(weather_string, report_type):
+def weather_check(weather_string, report_type, climate_zones=None):
     """
     Process weather data based on report type and return weather information.
     
     Args:
         weather_string: Input weather string to process
         report_type: Type of report ('iesve', 'iesve_prm', 'eplus', 'equest_beps', 'equest_standard', 'generic_xlsx')
+        climate_zones: Optional zip code -> climate zone info from get_climate_zones_by_zip
         
     Returns:
         dict: Weather information including city, climate zone, zip code, and state
@@ -212,7 +453,7 @@ def weather_check(weather_string, report_type):
         elif report_type == 'equest_beps':
             weather_info = _process_equest_beps_weather(weather_string)
         elif report_type in ['equest_standard', 'generic_xlsx']:
-            weather_info = _process_equest_standard_weather(weather_string)
+            weather_info = _process_equest_standard_weather(weather_string, climate_zones)
         else:
             logging_start.logger.error(f"Unknown report type: {report_type}")
             return _get_empty_weather_info()
@@ -232,6 +473,25 @@ def weather_check(weather_string, report_type):
         logging_start.logger.error(f"Weather check failed: {str(e)}")
         return _get_empty_weather_info()
 
+def weather_check_many(weather_strings, report_type):
+    """
+    Batch version of weather_check, each distinct weather string is processed once.
+
+    For zip code based report types ('equest_standard', 'generic_xlsx') the nearest weather stations
+    for all of the zip codes are found in a single index query.
+    
+    Returns:
+        dict: weather string -> weather information
+    """
+    unique_strings = list(dict.fromkeys(weather_strings))
+    climate_zones = None
+    if report_type in ['equest_standard', 'generic_xlsx']:
+        try:
+            climate_zones = get_climate_zones_by_zip([format_as_zip_code(str(s)) for s in unique_strings])
+        except Exception as e:
+            logging_start.logger.error(f"Batch climate zone lookup failed: {str(e)}")
+    return {s: weather_check(s, report_type, climate_zones) for s in unique_strings}
+
 def process_weather_location(eeu_id):
   weather_checker_cache = {}
 
@@ -264,6 +524,8 @@ def process_weather_location(eeu_id):
 
   }
   supabase.table('eeu_data').update(update_data).eq('id', eeu_id).execute()
+  eeu_loader(supabase).forget(eeu_id)
+  refresh_project_summaries(eeu_ids=[eeu_id])
 
   return {'eeu_id': eeu_id,
           'zip_code': zip_code,
@@ -272,22 +534,68 @@ def process_weather_location(eeu_id):
           'state': response.get('state', '')}
 
 
+def process_weather_locations(eeu_rows):
+  """
+  Batch version of process_weather_location for eeu_data rows that were already fetched
+
+  Weather strings are resolved once per report type with weather_check_many, and each row's location is saved.
+
+  Args:
+      eeu_rows: eeu_data rows with id, weather_string and report_type
+  Returns:
+      dict: eeu id -> location, rows whose location could not be processed are left out
+  """
+  locations = {}
+  by_report_type = {}
+  for row in eeu_rows:
+    by_report_type.setdefault(row.get('report_type'), []).append(row)
+
+  for report_type, rows in by_report_type.items():
+    weather_strings = [row.get('weather_string') for row in rows]
+    try:
+      responses = weather_check_many(weather_strings, report_type)
+    except Exception:
+      # one bad weather string should not cost the rest of the batch their locations
+      responses = {}
+      for weather_string in dict.fromkeys(weather_strings):
+        try:
+          responses[weather_string] = weather_check(weather_string, report_type)
+        except Exception as e:
+          logging_start.logger.error(f"Weather location processing failed for {weather_string}: {str(e)}")
+    for row in rows:
+      response = responses.get(row.get('weather_string'))
+      if not response:
+        continue
+      try:
+        update_data = {
+          'zip_code': format_as_zip_code(response['zip_code']),
+          'egrid_subregion': response['egrid_subregion'],
+          'city': response.get('city', ''),
+          'state': response.get('state', '')
+        }
+        supabase.table('eeu_data').update(update_data).eq('id', row['id']).execute()
+        eeu_loader(supabase).forget(row['id'])
+      except Exception as e:
+        logging_start.logger.error(f"Saving weather location for eeu_data {row['id']} failed: {str(e)}")
+        continue
+      locations[row['id']] = dict(update_data, eeu_id=row['id'])
+  refresh_project_summaries(eeu_ids=list(locations))
+  return locations
+
+
 def get_location_data(eeu_id):
-    query = supabase.table('eeu_data')\
-                    .select('zip_code,egrid_subregion,city,state')\
-                    .eq('id', eeu_id)
-    data, count = query.execute()
+    row = eeu_loader(supabase).load(eeu_id, ['zip_code', 'egrid_subregion', 'city', 'state'])
 
     # Check if data is empty or if any required fields are None
-    if (data[1] == [] or 
-        data[1][0]['zip_code'] is None or 
-        data[1][0]['city'] is None or 
-        data[1][0]['state'] is None):
+    if (row is None or 
+        row['zip_code'] is None or 
+        row['city'] is None or 
+        row['state'] is None):
         location_data = process_weather_location(eeu_id)
         return location_data
 
     return {'eeu_id':eeu_id,
-            'zip_code':data[1][0]['zip_code'],
-            'egrid_subregion':data[1][0]['egrid_subregion'],
-            'city':data[1][0]['city'],
-            'state':data[1][0]['state']}
\ No newline at end of file
+            'zip_code':row['zip_code'],
+            'egrid_subregion':row['egrid_subregion'],
+            'city':row['city'],
+            'state':row['state']}
\ No newline at end of file
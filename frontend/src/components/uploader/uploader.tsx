@@ -1,11 +1,19 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { InboxOutlined } from "@ant-design/icons";
 import type { UploadProps } from "antd";
-import { message, Upload } from "antd";
+import { message, Progress, Upload } from "antd";
+import { v4 as uuidv4 } from "uuid";
 import { createClient } from "utils/supabase";
 const { Dragger } = Upload;
 import { RcFile, UploadChangeParam } from "antd/lib/upload";
 
+type UploadJobProgress = {
+  fileName: string;
+  stage: string;
+  stepsDone: number;
+  stepsTotal: number;
+};
+
 type FileDropzoneProps = {
   disabledSetting?: boolean;
   reportType?: number;
@@ -46,6 +54,144 @@ const FileDropzone: React.FC<FileDropzoneProps> = ({
   }, []);
   const FILE_SIZE_LIMIT_MB = 25; // You can change this value as needed
   const [isUploading, setIsUploading] = useState<boolean>(false);
+  const UPLOAD_JOB_POLL_MS = 2000;
+  const [jobProgress, setJobProgress] = useState<Record<string, UploadJobProgress>>({});
+  // file uid -> job id sent with the upload, so the job's progress can be polled while the upload request is open
+  const jobIds = useRef<Record<string, string>>({});
+  const watchedJobs = useRef<Set<string>>(new Set());
+  const answeredJobs = useRef<Set<string>>(new Set());
+
+  const jobIdFor = (uid: string): string => {
+    if (!jobIds.current[uid]) {
+      jobIds.current[uid] = uuidv4();
+    }
+    return jobIds.current[uid];
+  };
+
+  const fetchUploadJob = (jobId: string) =>
+    fetch(`${process.env.NEXT_PUBLIC_API_BASE_URL}/upload_jobs/${jobId}`, {
+      headers: { Authorization: `Bearer ${session?.session?.access_token}` },
+    });
+
+  const showJobProgress = (jobId: string, fileName: string, job: any) => {
+    setJobProgress((prev) => ({
+      ...prev,
+      [jobId]: {
+        fileName,
+        stage: job.stage,
+        stepsDone: job.progress?.steps_done ?? 0,
+        stepsTotal: job.progress?.steps_total ?? 0,
+      },
+    }));
+  };
+
+  const clearJobProgress = (jobId: string) => {
+    setJobProgress((prev) => {
+      const next = { ...prev };
+      delete next[jobId];
+      return next;
+    });
+  };
+
+  // Polls the job's progress until the upload request answers
+  const watchUploadJob = async (jobId: string, fileName: string) => {
+    while (!answeredJobs.current.has(jobId)) {
+      await new Promise((resolve) => setTimeout(resolve, UPLOAD_JOB_POLL_MS));
+      try {
+        const res = await fetchUploadJob(jobId);
+        // 404 until the file is stored and queued, or when the poll reaches another server: keep waiting
+        if (res.ok && !answeredJobs.current.has(jobId)) {
+          showJobProgress(jobId, fileName, await res.json());
+        }
+      } catch (e) {
+        // progress is best effort, the upload response still arrives
+      }
+    }
+  };
+
+  const waitForUploadJob = async (jobId: string, fileName: string): Promise<any> => {
+    try {
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, UPLOAD_JOB_POLL_MS));
+        try {
+          const res = await fetchUploadJob(jobId);
+          if (!res.ok) {
+            return { status: "error", message: `Upload job lookup failed (${res.status})` };
+          }
+          const job = await res.json();
+          if (job.status === "succeeded") {
+            return job.result;
+          }
+          if (["failed", "cancelled", "timed_out"].includes(job.status)) {
+            return { status: "error", message: job.error || `Upload ${job.status}` };
+          }
+          showJobProgress(jobId, fileName, job);
+        } catch (e) {
+          return { status: "error", message: "Upload job lookup failed" };
+        }
+      }
+    } finally {
+      clearJobProgress(jobId);
+    }
+  };
+
+  const finishUpload = (fileName: string, status: string | undefined, response: any) => {
+    if (status === "done" || status === "error") {
+      if (decrementUploadCount) {
+        decrementUploadCount();
+      }
+    }
+    if (status === "done") {
+      // Check if the response contains an error status
+      if (response && typeof response === 'object' && response.status === 'error') {
+        // Extract error message from response
+        let errorMessage = 'Upload failed';
+        if (response.message) {
+          try {
+            // Try to parse the message if it's JSON
+            const parsedMessage = JSON.parse(response.message);
+            if (parsedMessage.error && typeof parsedMessage.error === 'object') {
+              errorMessage = Object.entries(parsedMessage.error)
+                .map(([field, msg]) => `${field}: ${msg}`)
+                .join(', ');
+            } else {
+              errorMessage = response.message;
+            }
+          } catch (e) {
+            // If parsing fails, use the raw message
+            errorMessage = response.message;
+          }
+        }
+        message.error(`${fileName} upload failed: ${errorMessage}`);
+        setIsUploading(false);
+        // Treat this as an error for status purposes
+        setUploadStatus("error");
+        onUploadStatusChange("error", response, isUploading);
+      } else {
+        // Actual success
+        message.success(`${fileName} file uploaded successfully.`);
+        setIsUploading(false);
+        setUploadStatus(status || null);
+        onUploadStatusChange(status || null, response, isUploading);
+      }
+    } else if (status === "error") {
+      if (!isValidSize) {
+        message.error(
+          `${fileName} must be smaller than ${FILE_SIZE_LIMIT_MB}MB.`
+        );
+      } else {
+        message.error(`${fileName} file upload failed.`);
+      }
+      setUploadStatus(status || null);
+      onUploadStatusChange(status || null, response, isUploading);
+    } else {
+      // For uploading status
+      if (!multiUpload) {
+        setUploadStatus(status || null);
+      }
+      onUploadStatusChange(status || null, response, isUploading);
+    }
+  };
   const props: UploadProps = {
     name: "file",
     multiple: multiUpload,
@@ -60,11 +206,12 @@ const FileDropzone: React.FC<FileDropzoneProps> = ({
     showUploadList: {
       showRemoveIcon: true,
     },
-    data: {
+    data: (file) => ({
       //report_type: reportType ? reportType : undefined,
       company_id: companyId,
       baseline_design: baseline_design,
-    },
+      job_id: jobIdFor(file.uid),
+    }),
 
     beforeUpload: (file: RcFile) => {
       const isSizeValid = file.size / 1024 / 1024 < FILE_SIZE_LIMIT_MB;
@@ -85,92 +232,72 @@ const FileDropzone: React.FC<FileDropzoneProps> = ({
 
     onChange: (info: UploadChangeParam) => {
       const { status, response } = info.file;
-      if (status === "done" || status === "error") {
-        if (decrementUploadCount) {
-          decrementUploadCount();
-          
-        }
+      setFileList(info.fileList.map((file) => file as RcFile)); // Update the type of fileList
+
+      const jobId = jobIds.current[info.file.uid];
+      if (status === "uploading" && jobId && !watchedJobs.current.has(jobId)) {
+        watchedJobs.current.add(jobId);
+        watchUploadJob(jobId, info.file.name);
       }
-      if (status === "done") {
-        // Check if the response contains an error status
-        if (response && typeof response === 'object' && response.status === 'error') {
-          // Extract error message from response
-          let errorMessage = 'Upload failed';
-          if (response.message) {
-            try {
-              // Try to parse the message if it's JSON
-              const parsedMessage = JSON.parse(response.message);
-              if (parsedMessage.error && typeof parsedMessage.error === 'object') {
-                errorMessage = Object.entries(parsedMessage.error)
-                  .map(([field, msg]) => `${field}: ${msg}`)
-                  .join(', ');
-              } else {
-                errorMessage = response.message;
-              }
-            } catch (e) {
-              // If parsing fails, use the raw message
-              errorMessage = response.message;
-            }
-          }
-          message.error(`${info.file.name} upload failed: ${errorMessage}`);
-          setIsUploading(false);
-          // Treat this as an error for status purposes
-          setUploadStatus("error");
-          onUploadStatusChange("error", response, isUploading);
-        } else {
-          // Actual success
-          message.success(`${info.file.name} file uploaded successfully.`);
-          setIsUploading(false);
-          setUploadStatus(status || null);
-          onUploadStatusChange(status || null, response, isUploading);
-        }
-      } else if (status === "error") {
-        if (!isValidSize) {
-          message.error(
-            `${info.file.name} must be smaller than ${FILE_SIZE_LIMIT_MB}MB.`
-          );
-        } else {
-          message.error(`${info.file.name} file upload failed.`);
-        }
-        setUploadStatus(status || null);
-        onUploadStatusChange(status || null, response, isUploading);
-      } else {
-        // For uploading status
-        if (!multiUpload) {
-          setUploadStatus(status || null);
-        }
-        onUploadStatusChange(status || null, response, isUploading);
+      if ((status === "done" || status === "error") && jobId) {
+        answeredJobs.current.add(jobId);
       }
 
-      setFileList(info.fileList.map((file) => file as RcFile)); // Update the type of fileList
+      // With UPLOAD_ASYNC the backend returns a job id instead of the result, wait for the job before finishing
+      if (status === "done" && response && typeof response === "object" && response.job_id) {
+        onUploadStatusChange("uploading", response, true);
+        waitForUploadJob(response.job_id, info.file.name).then((jobResponse) =>
+          finishUpload(info.file.name, status, jobResponse)
+        );
+        return;
+      }
+      if (jobId && (status === "done" || status === "error")) {
+        clearJobProgress(jobId);
+      }
+      finishUpload(info.file.name, status, response);
     },
     onDrop(e) {
       
     },
   };
   return (
-    <Dragger
-      {...props}
-      fileList={fileList}
-      style={{ width }}
-      id={`file-upload-${baseline_design}`}
-    >
-      {disabledSetting ? (
-        <p>Select a Report Type before uploading a file</p>
-      ) : (
-        uploadStatus !== "done" && (
-          <>
-            <p className="ant-upload-drag-icon">
-              <InboxOutlined style={{ fontSize: "24px" }} />
-            </p>
-            <p className="ant-upload-text">
-              Click or drag file to this area to upload
-            </p>
-            <p className="ant-upload-hint">PDF, HTML and SIM files Supported</p>
-          </>
-        )
-      )}
-    </Dragger>
+    <>
+      <Dragger
+        {...props}
+        fileList={fileList}
+        style={{ width }}
+        id={`file-upload-${baseline_design}`}
+      >
+        {disabledSetting ? (
+          <p>Select a Report Type before uploading a file</p>
+        ) : (
+          uploadStatus !== "done" && (
+            <>
+              <p className="ant-upload-drag-icon">
+                <InboxOutlined style={{ fontSize: "24px" }} />
+              </p>
+              <p className="ant-upload-text">
+                Click or drag file to this area to upload
+              </p>
+              <p className="ant-upload-hint">PDF, HTML and SIM files Supported</p>
+            </>
+          )
+        )}
+      </Dragger>
+      {Object.entries(jobProgress)
+        .filter(([, progress]) => progress.stepsTotal > 0)
+        .map(([jobId, progress]) => (
+          <div key={jobId} style={{ width }}>
+            <span>
+              {progress.fileName}: {progress.stage}
+            </span>
+            <Progress
+              percent={Math.round((100 * progress.stepsDone) / progress.stepsTotal)}
+              size="small"
+            />
+          </div>
+        ))}
+    </>
   );
 };
 
@@ -1,20 +1,35 @@
+import os
 import pandas as pd
 
+# materialized copy of project_latest_upload_by_type5, kept current by the backend
+EEU_SUMMARY_TABLE = os.getenv('EEU_SUMMARY_TABLE', 'project_latest_upload_by_type5_store')
+# PostgREST returns at most 1000 rows per request, larger portfolios are read in keyset pages
+PAGE_SIZE = 1000
+
 def pull_eeu_data(supabase, **kwargs):
     company_id = kwargs.get('company_id',None)
-    query = supabase.table('project_latest_upload_by_type5')\
-            .select('*')
-    
-    if company_id is not None:
-        query = query.eq('company_id', company_id)
-        
-    data, count = query.execute()
-    
-    if data[1] != []:
-        df = pd.DataFrame(data[1])
+    rows = []
+    last_id = None
+    while True:
+        query = supabase.table(EEU_SUMMARY_TABLE)\
+                .select('*')
+
+        if company_id is not None:
+            query = query.eq('company_id', company_id)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+
+        data, count = query.order('id').limit(PAGE_SIZE).execute()
+        rows.extend(data[1])
+        if len(data[1]) < PAGE_SIZE:
+            break
+        last_id = data[1][-1]['id']
+
+    if rows != []:
+        df = pd.DataFrame(rows)
         return df
     else:
         # Return empty DataFrame with expected columns to avoid errors
-        expected_columns = ['project_id', 'proj_name', 'id', 'climate_zone', 'project_use_type', 
+        expected_columns = ['project_id', 'proj_name', 'id', 'climate_zone', 'project_use_type',
                            'company_id', 'project_phase', 'use_type_total_area', 'total_energy']
-        return pd.DataFrame(columns=expected_columns)
\ No newline at end of file
+        return pd.DataFrame(columns=expected_columns)